@@ -1,3 +1,7 @@
+# Before any other import, so that --profile-startup times all of them
+from glycresoft_sqlalchemy.startup_profile import profile_startup
+profile_startup()
+
 import warnings
 from sqlalchemy import exc as sa_exc
 import logging
@@ -1,10 +1,15 @@
+import os
 import sys
 import logging
 from contextlib import contextmanager
 
 try:
-    import matplotlib
-    matplotlib.use("agg")
+    # Select the non-interactive backend without paying to import matplotlib
+    # for commands which never plot anything
+    if "matplotlib" in sys.modules:
+        sys.modules["matplotlib"].use("agg")
+    else:
+        os.environ.setdefault("MPLBACKEND", "agg")
     logging.basicConfig(level=logging.DEBUG, filename='glycresoft-log', filemode='w',
                         format="%(asctime)s - %(name)s:%(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
                         datefmt="%H:%M:%S")
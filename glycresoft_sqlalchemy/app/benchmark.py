@@ -0,0 +1,81 @@
+import argparse
+import logging
+try:
+    logger = logging.getLogger("benchmark")
+except:
+    pass
+
+from glycresoft_sqlalchemy.app import let, fail
+
+
+def report_comparison(comparisons):
+    regressions = []
+    for comparison in comparisons:
+        print "%-32s %10.3fs %10.3fs %7.2fx%s" % (
+            comparison["name"], comparison["baseline"], comparison["current"], comparison["ratio"],
+            "  REGRESSED" if comparison["regressed"] else "")
+        if comparison["regressed"]:
+            regressions.append(comparison["name"])
+    if regressions:
+        fail("Performance regressed in %s" % ', '.join(regressions))
+
+
+def run(size=1., only=None, seed=0, n_processes=1, output=None, directory=None,
+        profile_directory=None, baseline=None, tolerance=0.25):
+    from glycresoft_sqlalchemy.benchmarks import run_benchmarks, save_report, load_report, compare_results
+    report = run_benchmarks(
+        size=size, names=only, seed=seed, n_processes=n_processes, directory=directory,
+        profile_directory=profile_directory)
+    for result in report["benchmarks"]:
+        print "%-32s %10.3fs %8d items %10.1f items/s" % (
+            result["name"], result["wall_time"], result["items"], result["items_per_second"])
+    if output is not None:
+        save_report(report, output)
+    if baseline is not None:
+        report_comparison(compare_results(load_report(baseline), report, tolerance))
+
+
+def compare(baseline, current, tolerance=0.25):
+    from glycresoft_sqlalchemy.benchmarks import load_report, compare_results
+    report_comparison(compare_results(load_report(baseline), load_report(current), tolerance))
+
+
+app = argparse.ArgumentParser("glycresoft-benchmark")
+
+subparsers = app.add_subparsers()
+
+run_app = subparsers.add_parser("run", help="Run the benchmark suite over synthetic data")
+with let(run_app) as c:
+    c.add_argument("-s", "--size", type=float, default=1., help="Scale of the synthetic data")
+    c.add_argument("--only", nargs="+", default=None, metavar="BENCHMARK",
+                   help="Run only these benchmarks and those they depend on")
+    c.add_argument("--seed", type=int, default=0)
+    c.add_argument("-n", "--n-processes", default=1, required=False, type=int)
+    c.add_argument("-o", "--output", default=None, help="Path to write the JSON report to")
+    c.add_argument("-d", "--directory", default=None,
+                   help="Keep the synthetic data and databases in this directory")
+    c.add_argument("-p", "--profile-directory", default=None,
+                   help="Profile each benchmark, writing cProfile statistics to this directory")
+    c.add_argument("-b", "--baseline", default=None,
+                   help="A previous JSON report to compare against. Exits with an error on regression")
+    c.add_argument("-t", "--tolerance", type=float, default=0.25,
+                   help="Fraction by which wall time may grow before counting as a regression")
+    c.set_defaults(task=run)
+
+compare_app = subparsers.add_parser("compare", help="Compare two JSON benchmark reports")
+with let(compare_app) as c:
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("-t", "--tolerance", type=float, default=0.25)
+    c.set_defaults(task=compare)
+
+
+def main():
+    args = app.parse_args()
+    logger.debug("Arguments %r", args)
+    task = args.task
+    del args.task
+    task(**args.__dict__)
+
+if __name__ == '__main__':
+    main()
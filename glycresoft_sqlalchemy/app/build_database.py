@@ -2,24 +2,17 @@ import argparse
 import os
 from os import path
 
-from glycresoft_sqlalchemy.proteomics import mzid_sa
-from glycresoft_sqlalchemy.search_space_builder import (
-    search_space_builder,
-    make_decoys,
-    exact_search_space_builder,
-    naive_glycopeptide_hypothesis,
-    integrated_omics)
-
-from glycresoft_sqlalchemy.search_space_builder.glycan_builder import (
-    composition_source, constrained_combinatorics, glycomedb_utils
-    )
-
 from glycresoft_sqlalchemy.app import let
 
+# The hypothesis builders are imported inside each task so that a command only
+# pays for the subsystems it uses.
+
 
 def build_naive_ms1_glycopeptide(database_path, protein_file, site_list_file, glycan_file,
                                  glycan_file_type, constant_modifications, variable_modifications,
                                  enzyme, max_missed_cleavages=1, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder import naive_glycopeptide_hypothesis
+
     hypothesis_name = kwargs.pop("hypothesis_name", None)
     if hypothesis_name is None:
         hypothesis_name = "NaiveGlycopeptideHypothesis-%s@%s" % (
@@ -38,25 +31,31 @@ def build_naive_ms1_glycopeptide(database_path, protein_file, site_list_file, gl
 
 def build_informed_ms1_glycopeptide(mzid_path, database_path, site_list_file, glycan_file,
                                     glycan_file_type="txt", protein_name_pattern='.*', hypothesis_id=None,
-                                    protein_selector_type='regex', n_processes=4, **kwargs):
+                                    protein_selector_type='regex', n_processes=4, streaming_proteomics=False,
+                                    **kwargs):
+    from glycresoft_sqlalchemy.proteomics import mzid_sa
+    from glycresoft_sqlalchemy.search_space_builder import integrated_omics
+
     if database_path is None:
         database_path = path.splitext(mzid_path)[0] + '.db'
 
     if protein_selector_type == "regex":
-        protein_ids = list(mzid_sa.protein_names(mzid_path, protein_name_pattern))
+        protein_ids = list(mzid_sa.protein_names(mzid_path, protein_name_pattern, streaming=streaming_proteomics))
     else:
         protein_ids = [name.lstrip().rstrip() for name in protein_name_pattern.split(",")]
 
     job = integrated_omics.IntegratedOmicsMS1SearchSpaceBuilder(
         database_path, mzid_path=mzid_path, protein_ids=protein_ids,
         glycomics_path=glycan_file, glycomics_format=glycan_file_type,
-        n_processes=n_processes, **kwargs)
+        n_processes=n_processes, streaming_proteomics=streaming_proteomics, **kwargs)
 
     job.start()
     print job.hypothesis_id
 
 
 def build_naive_ms2_glycopeptide(database_path, hypothesis_sample_match_id, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder import search_space_builder, make_decoys
+
     kwargs.setdefault("n_processes", 4)
     job = search_space_builder.BatchingTheoreticalSearchSpaceBuilder.from_hypothesis(
         database_path, hypothesis_sample_match_id, **kwargs)
@@ -73,6 +72,8 @@ def build_naive_ms2_glycopeptide(database_path, hypothesis_sample_match_id, **kw
 
 
 def build_informed_ms2_glycopeptide(database_path, hypothesis_sample_match_id, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder import exact_search_space_builder, make_decoys
+
     kwargs.setdefault("n_processes", 4)
     job = exact_search_space_builder.ExactSearchSpaceBuilder.from_hypothesis(
         database_path, hypothesis_sample_match_id, **kwargs)
@@ -92,6 +93,8 @@ def build_glycan_glycome_db(
         database_path, glycomedb_path=None,
         taxonomy_path=None, taxon_id=None, include_descendent_taxa=False, include_structures=True,
         motif_family=None, reduction=None, derivatization=None, *args, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder.glycan_builder import glycomedb_utils
+
     print args, kwargs
     job = glycomedb_utils.GlycomeDBHypothesis(
         database_path, hypothesis_id=None, glycomedb_path=glycomedb_path,
@@ -103,6 +106,8 @@ def build_glycan_glycome_db(
 
 
 def build_glycan_text(database_path, text_file_path, reduction=None, derivatization=None, *args, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder.glycan_builder import composition_source
+
     print args, kwargs
     job = composition_source.TextGlycanCompositionHypothesisBuilder(
         database_path=database_path, text_file_path=text_file_path, reduction=reduction,
@@ -113,6 +118,8 @@ def build_glycan_text(database_path, text_file_path, reduction=None, derivatizat
 
 def build_glycan_other_hypothesis(database_path, source_hypothesis_id=None, reduction=None,
                                   derivatization=None, *args, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder.glycan_builder import composition_source
+
     print args, kwargs
     job = composition_source.OtherGlycanHypothesisGlycanHypothesisBuilder(
         database_path, source_hypothesis_id=source_hypothesis_id, reduction=reduction,
@@ -122,6 +129,8 @@ def build_glycan_other_hypothesis(database_path, source_hypothesis_id=None, redu
 
 
 def build_glycan_rules(database_path, rules_file_path, reduction=None, derivatization=None, *args, **kwargs):
+    from glycresoft_sqlalchemy.search_space_builder.glycan_builder import constrained_combinatorics
+
     print args, kwargs
     job = constrained_combinatorics.ConstrainedCombinatoricsGlycanHypothesisBuilder(
         database_path, rules_file_path, reduction=reduction, derivatization=derivatization)
@@ -222,6 +231,9 @@ with let(subparsers.add_parser("informed-glycopeptide-ms1")) as c:
     c.add_argument("--protein-selector-type", choices=['regex', 'list'], default='regex', required=False,
                    help="Choose how to select proteins from the mzidentML file, using either a name regex or a list"
                         " of names separated by commas")
+    c.add_argument("--streaming-mzid", dest="streaming_proteomics", action="store_true", default=False,
+                   required=False, help="Read the mzidentML file incrementally and bulk insert peptides instead"
+                                        " of loading the whole document into memory. Use for large files.")
     c.set_defaults(task=build_informed_ms1_glycopeptide)
 
 
@@ -1,20 +1,25 @@
 import argparse
 import sys
 import logging
-from glycresoft_sqlalchemy.report import export_csv
-from glycresoft_sqlalchemy.report import plot_glycoforms
-from glycresoft_sqlalchemy.app import summarize
-from glycresoft_sqlalchemy.web_app.serve import main as webmain
-from glycresoft_sqlalchemy.proteomics.mzid_sa import protein_names_taskmain
+from importlib import import_module
 
+
+# Each subcommand is named by "module:function" and only imported when it is
+# selected, so e.g. exporting a CSV does not load matplotlib or the web app.
 task_map = {
-    "export-csv": export_csv.taskmain,
-    "plot-glycoforms": plot_glycoforms.taskmain,
-    "summarize": summarize.taskmain,
-    "web": webmain,
-    "mzid-proteins": protein_names_taskmain
+    "export-csv": "glycresoft_sqlalchemy.report.export_csv:taskmain",
+    "plot-glycoforms": "glycresoft_sqlalchemy.report.plot_glycoforms:taskmain",
+    "summarize": "glycresoft_sqlalchemy.app.summarize:taskmain",
+    "web": "glycresoft_sqlalchemy.web_app.serve:main",
+    "mzid-proteins": "glycresoft_sqlalchemy.proteomics.mzid_sa:protein_names_taskmain"
 }
 
+
+def resolve_task(spec):
+    module_name, function_name = spec.split(":")
+    return getattr(import_module(module_name), function_name)
+
+
 logger = logging.getLogger()
 
 
@@ -40,7 +45,7 @@ def taskmain():
     if hasattr(args, 'help'):
         argv.append("-h")
     sys.argv[1:] = argv
-    task_map[args.action]()
+    resolve_task(task_map[args.action])()
 
 
 if __name__ == '__main__':
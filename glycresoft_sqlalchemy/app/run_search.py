@@ -4,26 +4,11 @@ try:
     logger = logging.getLogger("run_search")
 except:
     pass
-from glycresoft_sqlalchemy.matching import matching, peak_grouping
-from glycresoft_sqlalchemy.matching.glycopeptide.pipeline import GlycopeptideFragmentMatchingPipeline
-
-from glycresoft_sqlalchemy.spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser, process_data_file
-from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms2.search_space_builder import (
-    TheoreticalSearchSpaceBuilder)
-from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms2.make_decoys import (
-    BatchingDecoySearchSpaceBuilder)
-from glycresoft_sqlalchemy.spectra.decon2ls_sa import Decon2LSIsosParser
-from glycresoft_sqlalchemy.data_model import (
-    DatabaseManager, MS2GlycopeptideHypothesisSampleMatch, SampleRun, Hypothesis,
-    MassShift, HypothesisSampleMatch, TheoreticalGlycanComposition,
-    TheoreticalGlycopeptideComposition)
-from glycresoft_sqlalchemy.utils.database_utils import get_or_create
 
 from glycresoft_sqlalchemy.app import let, fail
 
-
-ms1_tolerance_default = matching.ms1_tolerance_default
-ms2_tolerance_default = matching.ms2_tolerance_default
+# The search machinery is imported inside each task so that a command only
+# pays for the subsystems it uses.
 
 
 class ParseMassShiftAction(argparse.Action):
@@ -46,6 +31,9 @@ def index_isos(
         minimum_abundance_ratio=0.01, minimum_mass=1200., maximum_mass=15000.,
         begin_scan=0, end_scan=float('inf'),
         n_processes=4):
+    from glycresoft_sqlalchemy.matching import peak_grouping
+    from glycresoft_sqlalchemy.spectra.decon2ls_sa import Decon2LSIsosParser
+
     parser = Decon2LSIsosParser(file_path, database_path)
     database_path = parser.manager.path
     sample_run_id = parser.sample_run.id
@@ -58,14 +46,29 @@ def index_isos(
 
 
 def index_bupid(file_path, database_path=None):
+    from glycresoft_sqlalchemy.spectra.bupid_topdown_deconvoluter_sa import process_data_file
+
     process_data_file(file_path, database_path)
 
 
 def run_ms2_glycoproteomics_search(
         database_path, observed_ions_path, target_hypothesis_id=None, source_hypothesis_sample_match_id=None,
         decoy_hypothesis_id=None, observed_ions_type='bupid_yaml', sample_run_id=None,
-        ms1_tolerance=ms1_tolerance_default,
-        ms2_tolerance=ms2_tolerance_default, **kwargs):
+        ms1_tolerance=None, ms2_tolerance=None, **kwargs):
+    from glycresoft_sqlalchemy.matching.matching import ms1_tolerance_default, ms2_tolerance_default
+    from glycresoft_sqlalchemy.data_model import DatabaseManager
+    from glycresoft_sqlalchemy.matching.glycopeptide.pipeline import GlycopeptideFragmentMatchingPipeline
+    from glycresoft_sqlalchemy.spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser
+    from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms2.search_space_builder import (
+        TheoreticalSearchSpaceBuilder)
+    from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms2.make_decoys import (
+        BatchingDecoySearchSpaceBuilder)
+
+    if ms1_tolerance is None:
+        ms1_tolerance = ms1_tolerance_default
+    if ms2_tolerance is None:
+        ms2_tolerance = ms2_tolerance_default
+
     manager = DatabaseManager(database_path)
     manager.initialize()
 
@@ -104,6 +107,13 @@ def run_ms1_search(
         match_tolerance=1e-5, mass_shift=None, n_processes=4,
         minimum_mass=1200, maximum_mass=15000,
         **kwargs):
+    from glycresoft_sqlalchemy.matching import peak_grouping
+    from glycresoft_sqlalchemy.spectra.decon2ls_sa import Decon2LSIsosParser
+    from glycresoft_sqlalchemy.data_model import (
+        DatabaseManager, Hypothesis, MassShift, TheoreticalGlycanComposition,
+        TheoreticalGlycopeptideComposition)
+    from glycresoft_sqlalchemy.utils.database_utils import get_or_create
+
     search_type = {
         "glycopeptide": "TheoreticalGlycopeptideComposition",
         "glycan": "TheoreticalGlycanComposition"
@@ -164,9 +174,11 @@ with let(ms2_glycoproteomics_app) as c:
     c.add_argument("-p", "--observed-ions-type", default='bupid_yaml', choices=["bupid_yaml", "db"])
     c.add_argument("-d", "--decoy-hypothesis-id", type=int, default=None, required=False)
     c.add_argument(
-        "-t1", "--ms1-tolerance", default=ms1_tolerance_default, required=False, type=float)
+        "-t1", "--ms1-tolerance", default=None, required=False, type=float,
+        help="Precursor mass error tolerance. Defaults to that of the matching module")
     c.add_argument(
-        "-t2", "--ms2-tolerance", default=ms2_tolerance_default, required=False, type=float)
+        "-t2", "--ms2-tolerance", default=None, required=False, type=float,
+        help="Fragment mass error tolerance. Defaults to that of the matching module")
     c.set_defaults(task=run_ms2_glycoproteomics_search)
 
 
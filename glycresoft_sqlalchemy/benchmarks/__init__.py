@@ -0,0 +1,7 @@
+'''
+A benchmark suite measuring the throughput of each stage of the search pipeline
+over deterministic synthetic data.
+'''
+from .suite import (
+    Benchmark, BenchmarkWorkspace, benchmarks, select_benchmarks, run_benchmarks,
+    compare_results, load_report, save_report)
@@ -0,0 +1,507 @@
+'''
+Throughput benchmarks of each stage of the search pipeline, run in order over
+synthetic data of a chosen size in a scratch directory. Each benchmark's work is
+measured with :class:`~glycresoft_sqlalchemy.utils.instrumentation.Measurement`
+and the results are collected as a JSON-serializable report which can be
+compared against the report of an earlier release with :func:`compare_results`.
+'''
+import os
+import json
+import zlib
+import shutil
+import logging
+import platform
+import datetime
+import tempfile
+
+import numpy as np
+
+from glycresoft_sqlalchemy.version import version
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, Hypothesis, MS2GlycopeptideHypothesis, Protein, TheoreticalGlycopeptide,
+    TheoreticalGlycanComposition, TheoreticalGlycopeptideComposition, TheoreticalCompositionMap,
+    MS1GlycopeptideHypothesisSampleMatch, MS2GlycopeptideHypothesisSampleMatch, MassShift,
+    GlycopeptideSpectrumMatch)
+from glycresoft_sqlalchemy.data_model.observed_ions import Decon2LSPeakGroup, Decon2LSPeak
+from glycresoft_sqlalchemy.structure.sequence import Sequence
+from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.utils import fragments
+from glycresoft_sqlalchemy.utils.database_utils import get_or_create
+from glycresoft_sqlalchemy.utils.instrumentation import Measurement
+
+from . import synthetic
+
+logger = logging.getLogger("benchmarks")
+
+
+class BenchmarkWorkspace(object):
+    '''
+    The scratch directory and shared state of one run of the suite. Benchmarks later in
+    the suite consume the databases and record ids left in :attr:`state` by earlier ones.
+
+    Attributes
+    ----------
+    size: float
+        Scales the amount of synthetic data each benchmark generates
+    seed: int
+    n_processes: int
+    directory: str
+    state: dict
+    '''
+    def __init__(self, size=1., seed=0, n_processes=1, directory=None):
+        self.size = size
+        self.seed = seed
+        self.n_processes = n_processes
+        self.owns_directory = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="glycresoft-benchmark-")
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.state = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def database_path(self):
+        return self.path("hypothesis.db")
+
+    def random_state(self, name):
+        '''
+        A random state seeded by both :attr:`seed` and `name`, so each benchmark's data does
+        not depend on which other benchmarks ran before it
+        '''
+        return np.random.RandomState([self.seed, zlib.crc32(name) & 0xffffffff])
+
+    def scaled(self, count):
+        return max(1, int(round(count * self.size)))
+
+    def session(self):
+        return DatabaseManager(self.database_path).session()
+
+    def cleanup(self):
+        if self.owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Benchmark(object):
+    '''
+    A stage of the pipeline to measure. :meth:`setup` generates its inputs and is not
+    measured. :meth:`run` does the measured work and returns the number of items it
+    processed.
+
+    Attributes
+    ----------
+    name: str
+    requires: tuple of str
+        Names of benchmarks whose results this benchmark consumes
+    '''
+    name = None
+    requires = ()
+
+    def setup(self, workspace):
+        pass
+
+    def run(self, workspace):
+        raise NotImplementedError()
+
+
+class CombinatorialGlycanHypothesisBenchmark(Benchmark):
+    name = "combinatorial_glycan_hypothesis"
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.search_space_builder.glycan_builder.constrained_combinatorics import (
+            ConstrainedCombinatoricsGlycanHypothesisBuilder)
+        rules_table, constraints_list = synthetic.combinatorial_rules(workspace.size)
+        hypothesis_id = ConstrainedCombinatoricsGlycanHypothesisBuilder(
+            workspace.path("glycans.db"), rules_table=rules_table, constraints_list=constraints_list,
+            hypothesis_name="Benchmark Combinatorial Glycans").start()
+        session = DatabaseManager(workspace.path("glycans.db")).session()
+        try:
+            return session.query(TheoreticalGlycanComposition).filter(
+                TheoreticalGlycanComposition.hypothesis_id == hypothesis_id).count()
+        finally:
+            session.close()
+
+
+class GlycopeptideHypothesisBenchmark(Benchmark):
+    name = "glycopeptide_hypothesis"
+
+    def setup(self, workspace):
+        rng = workspace.random_state(self.name)
+        synthetic.write_fasta(
+            workspace.path("proteins.fa"), synthetic.synthetic_proteins(workspace.scaled(4), rng))
+        synthetic.write_glycan_compositions(
+            workspace.path("glycans.txt"), synthetic.synthetic_glycan_compositions(workspace.scaled(15), rng))
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms1.naive_glycopeptide_hypothesis import (
+            NaiveGlycopeptideHypothesisBuilder)
+        hypothesis_id = NaiveGlycopeptideHypothesisBuilder(
+            workspace.database_path, "Benchmark Glycopeptides", workspace.path("proteins.fa"), None,
+            workspace.path("glycans.txt"), "txt", ["Carbamidomethyl (C)"], ["Deamidated (N)"], "trypsin",
+            max_missed_cleavages=1, maximum_glycosylation_sites=1, n_processes=workspace.n_processes).start()
+        workspace.state["glycopeptide_hypothesis_id"] = hypothesis_id
+        session = workspace.session()
+        try:
+            return session.query(TheoreticalGlycopeptideComposition).filter(
+                TheoreticalGlycopeptideComposition.protein_id == Protein.id,
+                Protein.hypothesis_id == hypothesis_id).count()
+        finally:
+            session.close()
+
+
+class Decon2LSImportBenchmark(Benchmark):
+    name = "decon2ls_import"
+    requires = ("glycopeptide_hypothesis",)
+
+    def setup(self, workspace):
+        rng = workspace.random_state(self.name)
+        session = workspace.session()
+        masses = sorted(mass for mass, in session.query(TheoreticalGlycopeptideComposition.calculated_mass).filter(
+            TheoreticalGlycopeptideComposition.protein_id == Protein.id,
+            Protein.hypothesis_id == workspace.state["glycopeptide_hypothesis_id"]))
+        session.close()
+        observed = rng.choice(masses, min(len(masses), workspace.scaled(60)), replace=False)
+        self.n_rows = synthetic.write_decon2ls_isos(
+            workspace.path("sample_isos.csv"), observed, workspace.scaled(500), rng,
+            n_noise=workspace.scaled(1000))
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.spectra.decon2ls_sa import Decon2LSIsosParser
+        parser = Decon2LSIsosParser(workspace.path("sample_isos.csv"), workspace.path("sample_isos.db"))
+        workspace.state["isos_sample_run_id"] = parser.sample_run.id
+        return self.n_rows
+
+
+class PeakGroupingBenchmark(Benchmark):
+    name = "peak_grouping"
+    requires = ("decon2ls_import",)
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.matching.peak_grouping.grouper import Decon2LSPeakGrouper
+        grouper = Decon2LSPeakGrouper(
+            workspace.path("sample_isos.db"), sample_run_id=workspace.state["isos_sample_run_id"],
+            n_processes=workspace.n_processes)
+        grouper.start()
+        session = grouper.manager.session()
+        try:
+            return session.query(Decon2LSPeak).count()
+        finally:
+            session.close()
+
+
+class MassShiftMatchingBenchmark(Benchmark):
+    name = "mass_shift_matching"
+    requires = ("peak_grouping",)
+
+    def setup(self, workspace):
+        session = workspace.session()
+        no_shift, _ = get_or_create(session, MassShift, mass=0.0, name=u"NoShift")
+        ammonium, _ = get_or_create(session, MassShift, mass=synthetic.ammonium_shift, name=u"Ammonium")
+        session.add_all([no_shift, ammonium])
+        hypothesis_sample_match = MS1GlycopeptideHypothesisSampleMatch(
+            target_hypothesis_id=workspace.state["glycopeptide_hypothesis_id"],
+            name=u"Benchmark MS1 Search")
+        session.add(hypothesis_sample_match)
+        session.commit()
+        self.mass_shift_map = {no_shift: 1, ammonium: 2}
+        workspace.state["ms1_hypothesis_sample_match_id"] = hypothesis_sample_match.id
+        session.close()
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.matching.peak_grouping.mass_shift_offset_matching import BatchPeakGroupMatching
+        BatchPeakGroupMatching(
+            workspace.database_path, workspace.path("sample_isos.db"),
+            workspace.state["glycopeptide_hypothesis_id"], workspace.state["isos_sample_run_id"],
+            workspace.state["ms1_hypothesis_sample_match_id"],
+            TheoreticalCompositionMap["TheoreticalGlycopeptideComposition"], 1e-5,
+            self.mass_shift_map, workspace.n_processes).start()
+        session = DatabaseManager(workspace.path("sample_isos.db")).session()
+        try:
+            return session.query(Decon2LSPeakGroup).count()
+        finally:
+            session.close()
+
+
+class FragmentGenerationBenchmark(Benchmark):
+    '''
+    Compute the theoretical fragments of synthetic glycopeptides and store them as
+    :class:`TheoreticalGlycopeptide` records, as the MS2 search space builders do for
+    each glycopeptide matched in MS1.
+    '''
+    name = "fragment_generation"
+
+    def setup(self, workspace):
+        rng = workspace.random_state(self.name)
+        glycans = synthetic.synthetic_glycan_compositions(workspace.scaled(15), rng)
+        self.sequences = synthetic.synthetic_glycopeptides(workspace.scaled(60), glycans, rng)
+        manager = DatabaseManager(workspace.database_path)
+        manager.initialize()
+        session = manager.session()
+        hypothesis = MS2GlycopeptideHypothesis(name=Hypothesis.make_unique_name(session, u"Benchmark MS2"))
+        session.add(hypothesis)
+        session.flush()
+        protein = Protein(name=u"Synthetic", protein_sequence=u"", hypothesis_id=hypothesis.id)
+        session.add(protein)
+        session.commit()
+        self.protein_id = protein.id
+        workspace.state["ms2_hypothesis_id"] = hypothesis.id
+        session.close()
+
+    def run(self, workspace):
+        session = workspace.session()
+        accumulator = []
+        for glycopeptide in self.sequences:
+            sequence = Sequence(glycopeptide)
+            (oxonium_ions, b_ions, y_ions,
+             b_ions_hexnac, y_ions_hexnac,
+             stub_ions) = fragments(sequence)
+            accumulator.append(dict(
+                protein_id=self.protein_id, glycopeptide_sequence=str(sequence),
+                calculated_mass=sequence.mass, sequence_length=len(sequence),
+                oxonium_ions=oxonium_ions, bare_b_ions=b_ions, bare_y_ions=y_ions,
+                glycosylated_b_ions=b_ions_hexnac, glycosylated_y_ions=y_ions_hexnac,
+                stub_ions=stub_ions))
+            if len(accumulator) > 1000:
+                session.bulk_insert_mappings(TheoreticalGlycopeptide, accumulator)
+                accumulator = []
+        session.bulk_insert_mappings(TheoreticalGlycopeptide, accumulator)
+        session.commit()
+        session.close()
+        return len(self.sequences)
+
+
+class DecoyGenerationBenchmark(Benchmark):
+    name = "decoy_generation"
+    requires = ("fragment_generation",)
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms2.make_decoys import (
+            BatchingDecoySearchSpaceBuilder)
+        decoy_hypothesis_id = BatchingDecoySearchSpaceBuilder(
+            workspace.database_path, hypothesis_ids=[workspace.state["ms2_hypothesis_id"]],
+            n_processes=workspace.n_processes).start()[0]
+        workspace.state["ms2_decoy_hypothesis_id"] = decoy_hypothesis_id
+        session = workspace.session()
+        try:
+            return session.query(TheoreticalGlycopeptide).filter(
+                TheoreticalGlycopeptide.protein_id == Protein.id,
+                Protein.hypothesis_id == decoy_hypothesis_id).count()
+        finally:
+            session.close()
+
+
+class MS2MatchingBenchmark(Benchmark):
+    name = "ms2_matching"
+    requires = ("decoy_generation",)
+
+    def setup(self, workspace):
+        rng = workspace.random_state(self.name)
+        session = workspace.session()
+        theoreticals = session.query(TheoreticalGlycopeptide).filter(
+            TheoreticalGlycopeptide.protein_id == Protein.id,
+            Protein.hypothesis_id == workspace.state["ms2_hypothesis_id"]).order_by(
+            TheoreticalGlycopeptide.id).all()
+        workspace.state["tandem_sample_run_id"] = synthetic.write_tandem_scans(
+            workspace.path("tandem.db"), theoreticals, rng)
+        self.n_scans = 2 * len(theoreticals)
+        hypothesis_sample_match = MS2GlycopeptideHypothesisSampleMatch(
+            target_hypothesis_id=workspace.state["ms2_hypothesis_id"],
+            decoy_hypothesis_id=workspace.state["ms2_decoy_hypothesis_id"],
+            name=u"Benchmark MS2 Search")
+        session.add(hypothesis_sample_match)
+        session.commit()
+        workspace.state["ms2_hypothesis_sample_match_id"] = hypothesis_sample_match.id
+        session.close()
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.matching.glycopeptide.fragment_matching import SpectrumMatching
+        # Target and decoy are searched in one pass, as the MS2 pipeline does
+        SpectrumMatching(
+            workspace.database_path, workspace.state["ms2_hypothesis_id"], workspace.path("tandem.db"),
+            observed_ions_type='db', sample_run_id=workspace.state["tandem_sample_run_id"],
+            hypothesis_sample_match_id=workspace.state["ms2_hypothesis_sample_match_id"],
+            n_processes=workspace.n_processes,
+            decoy_hypothesis_id=workspace.state["ms2_decoy_hypothesis_id"]).start()
+        return 2 * self.n_scans
+
+
+class SpectrumScoringBenchmark(Benchmark):
+    name = "spectrum_scoring"
+    requires = ("ms2_matching",)
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.matching.glycopeptide.spectrum_assignment import SpectrumAssigner
+        from glycresoft_sqlalchemy.scoring.simple_scoring_algorithm import SimpleSpectrumScorer
+        scorer = SimpleSpectrumScorer()
+        workspace.state["score_name"] = scorer.score_name
+        for hypothesis_id in (workspace.state["ms2_hypothesis_id"], workspace.state["ms2_decoy_hypothesis_id"]):
+            SpectrumAssigner(
+                workspace.database_path, hypothesis_id,
+                workspace.state["ms2_hypothesis_sample_match_id"], scorer=scorer,
+                n_processes=workspace.n_processes).start()
+        session = workspace.session()
+        try:
+            return session.query(GlycopeptideSpectrumMatch).filter(
+                GlycopeptideSpectrumMatch.hypothesis_sample_match_id == workspace.state[
+                    "ms2_hypothesis_sample_match_id"]).count()
+        finally:
+            session.close()
+
+
+class SpectrumFDRBenchmark(Benchmark):
+    name = "spectrum_fdr"
+    requires = ("spectrum_scoring",)
+
+    def run(self, workspace):
+        from glycresoft_sqlalchemy.scoring.target_decoy import TargetDecoySpectrumMatchAnalyzer
+        TargetDecoySpectrumMatchAnalyzer(
+            workspace.database_path, target_hypothesis_id=workspace.state["ms2_hypothesis_id"],
+            decoy_hypothesis_id=workspace.state["ms2_decoy_hypothesis_id"],
+            hypothesis_sample_match_id=workspace.state["ms2_hypothesis_sample_match_id"],
+            score=workspace.state["score_name"]).start()
+        session = workspace.session()
+        try:
+            return session.query(GlycopeptideSpectrumMatch).filter(
+                GlycopeptideSpectrumMatch.hypothesis_sample_match_id == workspace.state[
+                    "ms2_hypothesis_sample_match_id"]).count()
+        finally:
+            session.close()
+
+
+benchmarks = [
+    CombinatorialGlycanHypothesisBenchmark(),
+    GlycopeptideHypothesisBenchmark(),
+    Decon2LSImportBenchmark(),
+    PeakGroupingBenchmark(),
+    MassShiftMatchingBenchmark(),
+    FragmentGenerationBenchmark(),
+    DecoyGenerationBenchmark(),
+    MS2MatchingBenchmark(),
+    SpectrumScoringBenchmark(),
+    SpectrumFDRBenchmark(),
+]
+
+
+def select_benchmarks(names=None):
+    '''
+    The benchmarks named by `names` and every benchmark they require, in suite order
+
+    Raises
+    ------
+    KeyError
+        If a name does not match any benchmark
+    '''
+    if not names:
+        return list(benchmarks)
+    by_name = {benchmark.name: benchmark for benchmark in benchmarks}
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in needed:
+            continue
+        if name not in by_name:
+            raise KeyError("Unknown benchmark %r" % name)
+        needed.add(name)
+        pending.extend(by_name[name].requires)
+    return [benchmark for benchmark in benchmarks if benchmark.name in needed]
+
+
+def run_benchmarks(size=1., names=None, seed=0, n_processes=1, directory=None, profile_directory=None):
+    '''
+    Run the benchmarks named by `names`, or the whole suite, over synthetic data scaled by `size`.
+
+    Parameters
+    ----------
+    size: float
+    names: list of str, optional
+    seed: int
+    n_processes: int
+    directory: str, optional
+        Where to write the synthetic data and databases. By default a temporary directory
+        is used and removed afterwards
+    profile_directory: str, optional
+        When given, each benchmark is run under :mod:`cProfile` and its statistics are
+        written here
+
+    Returns
+    -------
+    dict
+        The benchmark report, with one entry in ``"benchmarks"`` per benchmark run,
+        including those only run because a requested benchmark required them
+    '''
+    workspace = BenchmarkWorkspace(size, seed, n_processes, directory)
+    report = {
+        "version": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": datetime.datetime.now().isoformat(),
+        "size": size,
+        "seed": seed,
+        "n_processes": n_processes,
+        "benchmarks": []
+    }
+    try:
+        for benchmark in select_benchmarks(names):
+            logger.info("Preparing %s", benchmark.name)
+            benchmark.setup(workspace)
+            with Measurement(benchmark.name, profile_directory) as measurement:
+                items = benchmark.run(workspace)
+            measurement.add(items=items)
+            logger.info("%s", measurement)
+            report["benchmarks"].append(measurement.to_dict())
+    finally:
+        workspace.cleanup()
+    return report
+
+
+def load_report(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def save_report(report, path):
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=2, sort_keys=True)
+
+
+def compare_results(baseline, current, tolerance=0.25, minimum_time=0.1):
+    '''
+    Compare two benchmark reports of the same size and find the benchmarks which slowed down.
+
+    Parameters
+    ----------
+    baseline: dict
+    current: dict
+    tolerance: float
+        The fraction by which a benchmark's wall time may grow before it counts as a regression
+    minimum_time: float
+        Benchmarks which took less than this many seconds in `baseline` are too noisy to compare
+
+    Returns
+    -------
+    list of dict
+        One entry per benchmark present in both reports, with its wall times, their ratio and
+        whether it regressed
+    '''
+    if baseline["size"] != current["size"]:
+        raise ValueError("Cannot compare benchmarks of size %r with size %r" % (
+            baseline["size"], current["size"]))
+    previous = {result["name"]: result for result in baseline["benchmarks"]}
+    comparisons = []
+    for result in current["benchmarks"]:
+        if result["name"] not in previous:
+            continue
+        before = previous[result["name"]]["wall_time"]
+        after = result["wall_time"]
+        ratio = after / before if before > 0 else float('inf')
+        comparisons.append({
+            "name": result["name"],
+            "baseline": before,
+            "current": after,
+            "ratio": ratio,
+            "regressed": before >= minimum_time and ratio > 1 + tolerance
+        })
+    return comparisons
@@ -0,0 +1,253 @@
+'''
+Deterministic generators of synthetic inputs for the benchmark suite: protein
+sequences, glycan compositions, glycopeptide sequences, Decon2LS "_isos.csv"
+LC-MS peak lists and tandem scans. Every generator draws from the
+:class:`numpy.random.RandomState` it is given, so the same seed always produces
+the same data.
+'''
+import csv
+import uuid
+
+import numpy as np
+
+from glycresoft_sqlalchemy.data_model import MSMSSqlDB, SampleRun, TandemScan, Peak
+from glycresoft_sqlalchemy.data_model.observed_ions import PROTON
+from glycresoft_sqlalchemy.matching.glycopeptide.detect_oxonium import SignatureIndexer
+
+
+# Residues which neither create a cleavage site nor a new sequon, so that the
+# sites planted by the generators are the only ones
+filler_residues = list("ADEFGHILMPQSVWY")
+sequon_residues = [residue for residue in filler_residues if residue != "P"]
+
+isos_columns = [
+    "scan_num", "charge", "abundance", "mz", "fit", "average_mw", "monoisotopic_mw",
+    "mostabundant_mw", "fwhm", "signal_noise", "mono_abundance", "mono_plus2_abundance",
+    "flag", "interference_score"]
+
+ammonium_shift = 17.02655
+
+
+def random_state(seed=0):
+    return np.random.RandomState(seed)
+
+
+def sequon(rng):
+    return "N" + rng.choice(sequon_residues) + rng.choice(["S", "T"])
+
+
+def synthetic_proteins(n_proteins, rng, length=300, sites_per_protein=2):
+    '''
+    Generate tryptic protein sequences, each with `sites_per_protein` N-glycosylation
+    sequons planted in different cleavage products.
+
+    Returns
+    -------
+    list of (str, str)
+        Pairs of protein name and sequence
+    '''
+    proteins = []
+    for i in range(n_proteins):
+        segments = []
+        remaining = length
+        while remaining > 0:
+            size = min(remaining, rng.randint(8, 20))
+            segments.append(list(rng.choice(filler_residues, size - 1)) + [rng.choice(["K", "R"])])
+            remaining -= size
+        for segment in rng.choice(len(segments), min(sites_per_protein, len(segments)), replace=False):
+            segment = segments[segment]
+            if len(segment) < 5:
+                continue
+            position = rng.randint(0, len(segment) - 4)
+            segment[position:position + 3] = sequon(rng)
+        proteins.append(("sp|S%05d|SYN%d_HUMAN Synthetic protein %d" % (i, i, i),
+                         "".join("".join(segment) for segment in segments)))
+    return proteins
+
+
+def write_fasta(path, proteins):
+    with open(path, 'w') as handle:
+        for name, sequence in proteins:
+            handle.write(">%s\n" % name)
+            for i in range(0, len(sequence), 60):
+                handle.write(sequence[i:i + 60] + "\n")
+    return path
+
+
+def synthetic_glycan_compositions(n_compositions, rng):
+    '''
+    Sample `n_compositions` distinct N-glycan compositions, formatted as the glycan
+    text files read by :class:`TextGlycanCompositionHypothesisBuilder` expect.
+    '''
+    space = [(hex, hexnac, fuc, neuac)
+             for hex in range(3, 11) for hexnac in range(2, 8)
+             for fuc in range(0, 3) for neuac in range(0, 5)
+             if fuc < hexnac and neuac < hexnac - 1]
+    chosen = rng.choice(len(space), min(n_compositions, len(space)), replace=False)
+    compositions = []
+    for index in sorted(chosen):
+        hex, hexnac, fuc, neuac = space[index]
+        parts = ["Hex:%d" % hex, "HexNAc:%d" % hexnac]
+        if fuc:
+            parts.append("Fuc:%d" % fuc)
+        if neuac:
+            parts.append("NeuAc:%d" % neuac)
+        compositions.append("{%s}" % "; ".join(parts))
+    return compositions
+
+
+def write_glycan_compositions(path, compositions):
+    with open(path, 'w') as handle:
+        for composition in compositions:
+            handle.write(composition + "\n")
+    return path
+
+
+def combinatorial_rules(size):
+    '''
+    A rules table and constraints list for :class:`ConstrainedCombinatoricsGlycanHypothesisBuilder`
+    whose composition space grows with `size`
+    '''
+    extra = int(round(size))
+    rules_table = {
+        "Hex": (3, 6 + 2 * extra),
+        "HexNAc": (2, 4 + 2 * extra),
+        "Fuc": (0, 1 + extra),
+        "NeuAc": (0, 1 + extra)
+    }
+    constraints_list = [
+        ["Fuc", "<", "HexNAc"],
+        ["NeuAc", "<", "HexNAc - 1"]
+    ]
+    return rules_table, constraints_list
+
+
+def synthetic_glycopeptides(n_peptides, glycans, rng, glycoforms=3):
+    '''
+    Generate `n_peptides` tryptic peptides with one occupied N-glycosylation sequon,
+    each combined with `glycoforms` of `glycans`.
+
+    Returns
+    -------
+    list of str
+        Glycopeptide sequences parseable by :class:`~.structure.sequence.Sequence`
+    '''
+    sequences = []
+    for i in range(n_peptides):
+        length = rng.randint(7, 16)
+        residues = list(rng.choice(filler_residues, length - 1)) + [rng.choice(["K", "R"])]
+        position = rng.randint(0, length - 3)
+        residues[position:position + 3] = sequon(rng)
+        residues[position] = "N(NGlycanCoreGlycosylation)"
+        peptide = "".join(residues)
+        for glycan in rng.choice(glycans, min(glycoforms, len(glycans)), replace=False):
+            sequences.append(peptide + glycan)
+    return sequences
+
+
+def write_decon2ls_isos(path, masses, n_scans, rng, n_noise=0, shifted_fraction=0.25):
+    '''
+    Write a Decon2LS "_isos.csv" file in which each of `masses` elutes over a Gaussian
+    chromatographic profile, a fraction of them also observed as ammonium adducts, among
+    `n_noise` single-scan noise peaks.
+
+    Returns
+    -------
+    int
+        Number of rows written
+    '''
+    rows = []
+    for mass in masses:
+        apex = rng.uniform(0, n_scans)
+        width = rng.uniform(2., 8.)
+        height = rng.lognormal(10., 1.)
+        charge = rng.randint(2, 5)
+        species = [mass]
+        if rng.rand() < shifted_fraction:
+            species.append(mass + ammonium_shift)
+        for species_mass in species:
+            for scan in range(max(0, int(apex - 3 * width)), min(n_scans, int(apex + 3 * width) + 1)):
+                abundance = height * np.exp(-0.5 * ((scan - apex) / width) ** 2)
+                rows.append((scan, charge, species_mass * (1 + rng.normal(0, 2e-6)), abundance))
+    for i in range(n_noise):
+        rows.append((rng.randint(0, n_scans), rng.randint(1, 5), rng.uniform(1200., 8000.), rng.lognormal(7., 1.)))
+    rows.sort()
+    with open(path, 'wb') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(isos_columns)
+        for scan, charge, mass, abundance in rows:
+            writer.writerow([
+                scan, charge, int(abundance), (mass + charge * PROTON) / charge, 0.05, mass + 1.5,
+                mass, mass + 1.0034, 0.02, abundance / 50., int(abundance * 0.8), int(abundance * 0.3),
+                "", 0])
+    return len(rows)
+
+
+def write_tandem_scans(path, theoreticals, rng, n_unexplained=None, fraction_observed=0.5,
+                       noise_peaks=30, name=None):
+    '''
+    Write a sample run of tandem scans to the :class:`MSMSSqlDB` at `path`. Each of
+    `theoreticals` produces one scan at its precursor mass holding a random subset of
+    its fragment ions and `noise_peaks` random peaks. Another `n_unexplained` scans,
+    equal in number to `theoreticals` by default, hold only random peaks at precursor
+    masses drawn from `theoreticals`, so decoys win some of the matches.
+
+    Parameters
+    ----------
+    theoreticals: list of :class:`TheoreticalGlycopeptide`
+    rng: :class:`numpy.random.RandomState`
+
+    Returns
+    -------
+    int
+        The id of the new :class:`SampleRun`
+    '''
+    if n_unexplained is None:
+        n_unexplained = len(theoreticals)
+    database = MSMSSqlDB(path)
+    database.initialize()
+    session = database.session()
+    sample_run = SampleRun(name=name or u"synthetic-%d" % len(theoreticals), uuid=uuid.uuid4().hex)
+    session.add(sample_run)
+    session.commit()
+    sample_run_id = sample_run.id
+
+    masses = [theoretical.calculated_mass for theoretical in theoreticals]
+    sources = list(theoreticals) + [None] * n_unexplained
+    order = rng.permutation(len(sources))
+    session.bulk_insert_mappings(TandemScan, [
+        {"time": time, "sample_run_id": sample_run_id, "precursor_charge_state": 3,
+         "precursor_neutral_mass": (
+            sources[i].calculated_mass if sources[i] is not None else rng.choice(masses)) * (
+            1 + rng.normal(0, 2e-6))}
+        for time, i in enumerate(order)])
+    session.commit()
+    scan_ids = [scan_id for scan_id, in session.query(TandemScan.id).filter(
+        TandemScan.sample_run_id == sample_run_id).order_by(TandemScan.time)]
+
+    peaks = []
+    signature_indexer = SignatureIndexer(session)
+    for scan_id, i in zip(scan_ids, order):
+        theoretical = sources[i]
+        fragment_masses = []
+        if theoretical is not None:
+            fragment_masses = [
+                ion["mass"] for ion in (
+                    theoretical.oxonium_ions + theoretical.bare_b_ions +
+                    theoretical.bare_y_ions + theoretical.stub_ions)
+                if rng.rand() < fraction_observed]
+        fragment_masses.extend(rng.uniform(150., 2000., noise_peaks))
+        intensities = rng.lognormal(6., 1., len(fragment_masses))
+        for index, mass in enumerate(fragment_masses):
+            peaks.append({
+                "neutral_mass": mass, "intensity": intensities[index], "charge": 1,
+                "scan_peak_index": index, "scan_id": scan_id})
+        signature_indexer.add(scan_id, sample_run_id, fragment_masses, intensities)
+        if len(peaks) > 50000:
+            session.bulk_insert_mappings(Peak, peaks)
+            peaks = []
+    session.bulk_insert_mappings(Peak, peaks)
+    signature_indexer.flush()
+    session.commit()
+    session.close()
+    return sample_run_id
@@ -7,7 +7,8 @@ Numeric.asdecimal = False
 
 from .base import Hierarchy, Namespace, Base, slurp
 
-from .pipeline_module import PipelineModule, PipelineException
+from .pipeline_module import (
+    PipelineModule, PipelineException, Pipeline, PipelineProgress, StageMetric, progress_listener)
 
 from .generic import (
     MutableList, MutableDict, Taxon, HasTaxonomy,
@@ -49,9 +50,11 @@ from .search_result_model.peak_grouping import (
     PeakGroupMatchBase, PeakGroupMatchType, PeakGroupMatch, JointPeakGroupMatch,
     TempPeakGroupMatch, PeakGroupMatchToJointPeakGroupMatch, TheoreticalCompositionMap)
 
+from .search_result_model.summary import HypothesisSampleMatchProteinSummary
+
 from .observed_ions import (
     SampleRun, BUPIDDeconvolutedLCMSMSSampleRun, Decon2LSLCMSSampleRun,
-    ScanBase, MSScan, TandemScan, Peak, Decon2LSPeak, Decon2LSPeakGroup,
+    ScanBase, MSScan, TandemScan, TandemScanSignature, Peak, Decon2LSPeak, Decon2LSPeakGroup,
     Decon2LSPeakToPeakGroupMap, PeakGroupDatabase, MSMSSqlDB, Decon2LSPeakToPeakGroupMap,
     HasPeakChromatogramData)
 
@@ -7,6 +7,7 @@ from sqlalchemy.pool import NullPool, SingletonThreadPool
 
 from .base import Base, Namespace
 from ..utils import database_utils, get_scale
+from ..utils.instrumentation import instrument_engine
 
 import logging
 
@@ -19,6 +20,9 @@ SCALE = get_scale()
 
 class ConnectionManager(object):
     echo = False
+    #: Whether engines created by :meth:`connect` count the rows they write towards
+    #: active :class:`~glycresoft_sqlalchemy.utils.instrumentation.Measurement` objects
+    instrumented = False
 
     def __init__(self, database_uri, database_uri_prefix="",
                  connect_args=None):
@@ -37,6 +41,8 @@ class ConnectionManager(object):
             connect_args=self.connect_args,
             poolclass=NullPool)
         self._configure_creation(engine)
+        if self.instrumented:
+            instrument_engine(engine)
         return engine
 
     def construct_url(self):
@@ -94,6 +100,8 @@ class SQLiteConnectionManager(ConnectionManager):
     def connect(self):
         if self._is_memory:
             if self._saved_engine is not None:
+                if self.instrumented:
+                    instrument_engine(self._saved_engine)
                 return self._saved_engine
 
         url = self.construct_url()
@@ -107,6 +115,8 @@ class SQLiteConnectionManager(ConnectionManager):
             connect_args=self.connect_args,
             poolclass=pool)
         self._configure_creation(engine)
+        if self.instrumented:
+            instrument_engine(engine)
         if self._is_memory:
             self._saved_engine = engine
         return engine
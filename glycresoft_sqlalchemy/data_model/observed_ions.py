@@ -166,6 +166,42 @@ class TandemScan(ScanBase):
     }
 
 
+class TandemScanSignature(Base):
+    """
+    A per-scan bitmask of the glycan diagnostic features found in a :class:`TandemScan`:
+    oxonium ions, and peak pairs separated by a monosaccharide neutral loss. Lets
+    glycan-bearing scans be selected with one predicate on one row per scan instead
+    of joining :class:`Peak` against itself.
+
+    Signatures depend on the matching parameters, which are stored with them so that
+    an index built with one tolerance is never read with another.
+
+    Attributes
+    ----------
+    signature: int
+        Bits are assigned by :mod:`glycresoft_sqlalchemy.matching.glycopeptide.detect_oxonium`
+    tolerance: float
+        PPM matching tolerance, relative to the feature mass
+    minimum_intensity: float
+        Intensity an oxonium ion, or the heavier peak of a neutral loss pair, must reach
+    """
+    __tablename__ = "TandemScanSignature"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scan_id = Column(Integer, ForeignKey(ScanBase.id), index=True)
+    sample_run_id = Column(Integer, ForeignKey(SampleRun.id), index=True)
+    signature = Column(Integer, index=True)
+    tolerance = Column(Numeric(12, 10, asdecimal=False))
+    minimum_intensity = Column(Numeric(12, 4, asdecimal=False))
+
+    @classmethod
+    def ensure_table(cls, session):
+        cls.__table__.create(session.connection(), checkfirst=True)
+
+    def __repr__(self):
+        return "<TandemScanSignature {} {:b}>".format(self.scan_id, self.signature)
+
+
 class Peak(Base):
     __tablename__ = "Peak"
 
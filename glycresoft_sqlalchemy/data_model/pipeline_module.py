@@ -1,9 +1,12 @@
 import types
+import json
+import uuid
 import logging
 import time
 import datetime
 import pprint
 from functools import partial
+from contextlib import contextmanager
 
 from sqlalchemy import (PickleType, Numeric, Unicode, Table, DateTime, func,
                         Column, Integer, ForeignKey, UnicodeText, Boolean)
@@ -13,12 +16,31 @@ from .connection import DatabaseManager
 from .base import Base
 
 from glycresoft_sqlalchemy.utils.worker_utils import profile_task
+from glycresoft_sqlalchemy.utils.instrumentation import Measurement
 
 logger = logging.getLogger("pipeline_module")
 
 
 DEBUG = True
 
+# Callables receiving the progress reported by pipeline modules run in this process
+_progress_listeners = []
+
+
+@contextmanager
+def progress_listener(listener):
+    '''
+    Pass the progress reported through :meth:`PipelineModule.report_progress` by every
+    module run in this process to `listener` while the block runs. `listener` is called
+    with a dict holding the reporting module's name, the number of items completed and
+    their unit.
+    '''
+    _progress_listeners.append(listener)
+    try:
+        yield listener
+    finally:
+        _progress_listeners.remove(listener)
+
 
 class User(Base):
     __tablename__ = "User"
@@ -50,19 +72,187 @@ class JobState(Base):
     state = Column(Unicode(128))
 
 
+class StageMetric(Base):
+    '''
+    The resources used by one stage of a :class:`PipelineModule`, or by one batch of
+    work a stage dispatched to a worker process, as measured by
+    :class:`~glycresoft_sqlalchemy.utils.instrumentation.Measurement`.
+
+    Attributes
+    ----------
+    run_id: str
+        Shared by every record of one call to :meth:`PipelineModule.start`
+    task_name: str
+    stage: str
+    is_batch: bool
+        Whether this record measures a worker batch rather than a whole stage
+    peak_rss: int
+        Peak resident set size of the measuring process, in kilobytes
+    '''
+    __tablename__ = "StageMetric"
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Unicode(64), index=True)
+    task_name = Column(Unicode(128), index=True)
+    stage = Column(Unicode(128))
+    is_batch = Column(Boolean, default=False)
+    started = Column(DateTime)
+    wall_time = Column(Numeric(12, 4, asdecimal=False))
+    cpu_time = Column(Numeric(12, 4, asdecimal=False))
+    child_cpu_time = Column(Numeric(12, 4, asdecimal=False))
+    peak_rss = Column(Integer)
+    rows_read = Column(Integer)
+    rows_written = Column(Integer)
+    items = Column(Integer)
+    items_per_second = Column(Numeric(14, 4, asdecimal=False))
+    profile_path = Column(Unicode(256))
+
+    @classmethod
+    def ensure_table(cls, session):
+        cls.__table__.create(session.connection(), checkfirst=True)
+
+    @classmethod
+    def record(cls, session, measurement, run_id, task_name, stage, is_batch=False):
+        cls.ensure_table(session)
+        values = measurement.to_dict()
+        values.pop("name")
+        values["started"] = datetime.datetime.fromtimestamp(values["started"])
+        session.add(cls(run_id=run_id, task_name=task_name, stage=stage, is_batch=is_batch, **values))
+
+    def to_json(self):
+        return {
+            "run_id": self.run_id,
+            "task_name": self.task_name,
+            "stage": self.stage,
+            "is_batch": self.is_batch,
+            "started": self.started.isoformat() if self.started is not None else None,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "child_cpu_time": self.child_cpu_time,
+            "peak_rss": self.peak_rss,
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "items": self.items,
+            "items_per_second": self.items_per_second,
+            "profile_path": self.profile_path,
+        }
+
+    @classmethod
+    def export_json(cls, session, run_id=None, task_name=None, include_batches=True):
+        '''
+        Serialize the stored metrics, optionally restricted to one run or task, as a JSON list
+        '''
+        cls.ensure_table(session)
+        query = session.query(cls)
+        if run_id is not None:
+            query = query.filter(cls.run_id == run_id)
+        if task_name is not None:
+            query = query.filter(cls.task_name == task_name)
+        if not include_batches:
+            query = query.filter(~cls.is_batch)
+        return json.dumps([metric.to_json() for metric in query.order_by(cls.id)], indent=2)
+
+    def __repr__(self):
+        return "<StageMetric {s.task_name}.{s.stage} {s.wall_time}s {s.items} items>".format(s=self)
+
+
+class InstrumentedTask(object):
+    '''
+    Wrap a worker task function so that each call is measured and stored as a batch
+    :class:`StageMetric`. Instances pickle to worker processes along with `task_fn`.
+
+    The number of items a batch processed is taken from the task's result when it
+    returns a count, as the matching tasks do, otherwise each call counts as one item.
+    '''
+    def __init__(self, task_fn, database_manager, run_id, task_name, stage):
+        self.task_fn = task_fn
+        self.database_manager = database_manager
+        self.run_id = run_id
+        self.task_name = task_name
+        self.stage = stage
+
+    def __call__(self, *args, **kwargs):
+        with Measurement("%s.%s" % (self.task_name, self.stage)) as measurement:
+            result = self.task_fn(*args, **kwargs)
+        measurement.add(items=result if isinstance(result, (int, long)) else 1)
+        session = self.database_manager.session()
+        try:
+            StageMetric.record(session, measurement, self.run_id, self.task_name, self.stage, is_batch=True)
+            session.commit()
+        except Exception, e:
+            logger.exception("Could not store metrics of %s", self.task_name, exc_info=e)
+        finally:
+            session.close()
+        return result
+
+
+class PipelineProgress(Base):
+    '''
+    A unit of work completed by a checkpointed :class:`PipelineModule`. A task which is
+    restarted after being interrupted reads these records to skip the work it already
+    finished.
+
+    Attributes
+    ----------
+    task_key: str
+        Identifies the task and the inputs it was run over, as given by
+        :meth:`PipelineModule.checkpoint_key`
+    batch_id: int
+        The id of a completed work item, such as a scan, a peak group or a stage index
+    '''
+    __tablename__ = "PipelineProgress"
+
+    id = Column(Integer, primary_key=True)
+    task_key = Column(Unicode(256), index=True)
+    batch_id = Column(Integer)
+    completed = Column(DateTime, default=func.now())
+
+    @classmethod
+    def ensure_table(cls, session):
+        # Databases created before checkpointing existed do not have this table
+        cls.__table__.create(session.connection(), checkfirst=True)
+
+    @classmethod
+    def completed_batches(cls, session, task_key):
+        cls.ensure_table(session)
+        return {batch_id for batch_id, in session.query(cls.batch_id).filter(cls.task_key == task_key)}
+
+    @classmethod
+    def record(cls, session, task_key, batch_ids):
+        '''
+        Add progress records for `batch_ids` to `session` without committing, so they
+        are written in the same transaction as the results of that work
+        '''
+        cls.ensure_table(session)
+        session.bulk_insert_mappings(cls, [
+            {"task_key": task_key, "batch_id": batch_id} for batch_id in batch_ids])
+
+    @classmethod
+    def clear(cls, session, task_keys):
+        cls.ensure_table(session)
+        session.query(cls).filter(cls.task_key.in_(task_keys)).delete(synchronize_session=False)
+
+
 class Pipeline(object):
+    '''
+    Run a sequence of :class:`PipelineModule` steps in order. :attr:`index` tracks the
+    first step which has not completed, so a pipeline which failed may be restarted
+    from the step that failed.
+    '''
     def __init__(self, steps=None, index=0):
         if steps is None:
             steps = []
-        self.steps = []
-        self.index = 0
+        self.steps = list(steps)
+        self.index = index
 
     def start(self, at=None):
         if at is None:
             at = self.index
         for i in range(at, len(self.steps)):
+            self.index = i
             step = self.steps[i]
             step.start()
+        self.index = len(self.steps)
 
 
 class GeneratorWithCallback(object):
@@ -98,15 +288,22 @@ class PipelineModule(object):
         Any Exception that was unhandled by the task and caused it to terminate.
         The exception does not propagate, but is logged, and a status code of -1
         is set.
+    instrument: bool
+        Whether the measurements of each stage and worker batch are stored as
+        :class:`StageMetric` records. Off by default, as each batch writes its own
+        record from its worker process.
     '''
     manager_type = DatabaseManager
     error = None
     raise_on_error = True
+    instrument = False
+    profile_directory = None
 
     def start(self, *args, **kwargs):
         self._begin(*args, **kwargs)
         try:
-            out = self.run()
+            with self.measure("run"):
+                out = self.run()
         except KeyboardInterrupt if DEBUG else Exception, e:
             logger.exception("An error occurred: %r", e, exc_info=e)
             out = self.error = e
@@ -115,6 +312,7 @@ class PipelineModule(object):
                 raise e
         else:
             self.status = 0
+            self.clear_checkpoint()
         if isinstance(out, types.GeneratorType):
             return GeneratorWithCallback(out, lambda: self._end(*args, **kwargs))
         else:
@@ -123,6 +321,7 @@ class PipelineModule(object):
 
     def _begin(self, verbose=True, *args, **kwargs):
         self.start_time = datetime.datetime.now()
+        self._run_id = uuid.uuid4().hex
         if verbose:
             logger.info("Begin %s\n%s\n", self.__class__.__name__, pprint.pformat(
                 {k: v for k, v in self.__dict__.items() if not k.startswith("_")}))
@@ -143,6 +342,21 @@ class PipelineModule(object):
             "%s: %s time elapsed.", self.__class__.__name__, str(now))
         logger.info(*args, **kwargs)
 
+    def report_progress(self, completed, unit="items"):
+        '''
+        Log the number of work items completed so far and send it to any
+        :func:`progress_listener` installed in this process
+        '''
+        logger.info("%d %s", completed, unit)
+        if not _progress_listeners:
+            return
+        progress = {"task": self.__class__.__name__, "completed": completed, "unit": unit}
+        for listener in list(_progress_listeners):
+            try:
+                listener(progress)
+            except Exception, e:
+                logger.exception("Could not report progress of %s", self.__class__.__name__, exc_info=e)
+
     def _end(self, verbose=True, *args, **kwargs):
         self.end_time = datetime.datetime.now()
         if verbose:
@@ -164,6 +378,160 @@ class PipelineModule(object):
     def database_path(self):
         return self.manager.path
 
+    @property
+    def run_id(self):
+        try:
+            return self._run_id
+        except AttributeError:
+            self._run_id = uuid.uuid4().hex
+            return self._run_id
+
+    @contextmanager
+    def measure(self, stage):
+        '''
+        Measure the resources used by `stage` of this task and store them as a :class:`StageMetric`
+        in this task's database when :attr:`instrument` is set. Counts passed to :meth:`count` while
+        the stage runs are attributed to it and to any enclosing stage. Rows written are only counted
+        for instrumented tasks, through the engines of their :attr:`manager`.
+
+        When :attr:`profile_directory` is set, the stage is also run under :mod:`cProfile`.
+        '''
+        measurements = self.__dict__.setdefault("_measurements", [])
+        if self.instrument and getattr(self, "manager", None) is not None:
+            self.manager.connection_manager.instrumented = True
+        measurement = Measurement("%s.%s" % (self.__class__.__name__, stage), self.profile_directory)
+        measurements.append(measurement)
+        try:
+            with measurement:
+                yield measurement
+        finally:
+            measurements.pop()
+            if measurements:
+                measurements[-1].add(items=measurement.items, rows_read=measurement.rows_read)
+            logger.info("%s", measurement)
+            self.store_measurement(measurement, stage)
+
+    def count(self, items=0, rows_read=0):
+        '''Attribute work done to the innermost running stage'''
+        measurements = self.__dict__.get("_measurements")
+        if measurements:
+            measurements[-1].add(items=items, rows_read=rows_read)
+
+    def store_measurement(self, measurement, stage):
+        if not self.instrument or getattr(self, "manager", None) is None:
+            return
+        session = self.manager.session()
+        try:
+            StageMetric.record(session, measurement, self.run_id, self.__class__.__name__, stage)
+            session.commit()
+        except Exception, e:
+            # Instrumentation never interrupts the task it measures
+            logger.exception("Could not store metrics of %s", measurement.name, exc_info=e)
+        finally:
+            session.close()
+
+    def instrument_task(self, task_fn, stage="batch"):
+        '''
+        Wrap a worker task function in an :class:`InstrumentedTask` when :attr:`instrument` is set
+        '''
+        if not self.instrument:
+            return task_fn
+        session = self.manager.session()
+        try:
+            # Create the table before workers race to
+            StageMetric.ensure_table(session)
+            session.commit()
+        finally:
+            session.close()
+        return InstrumentedTask(task_fn, self.manager, self.run_id, self.__class__.__name__, stage)
+
+    def metrics(self, include_batches=True):
+        '''The stored measurements of this task's most recent run, as JSON'''
+        session = self.manager.session()
+        try:
+            return StageMetric.export_json(session, run_id=self.run_id, include_batches=include_batches)
+        finally:
+            session.close()
+
+    def checkpoint_key(self):
+        '''
+        A string identifying this task and the inputs it runs over, under which its
+        progress is recorded in :class:`PipelineProgress`. Tasks which cannot be resumed
+        return None, the default.
+
+        Progress is cleared when the task completes successfully, so only a task which
+        was interrupted resumes.
+        '''
+        return None
+
+    def load_checkpoint(self, key=None):
+        '''
+        The set of batch ids completed under `key`, defaulting to :meth:`checkpoint_key`
+        '''
+        if key is None:
+            key = self.checkpoint_key()
+        if key is None:
+            return set()
+        session = self.manager.session()
+        try:
+            completed = PipelineProgress.completed_batches(session, key)
+            session.commit()
+            return completed
+        finally:
+            session.close()
+
+    def record_checkpoint(self, batch_ids, key=None):
+        if key is None:
+            key = self.checkpoint_key()
+        if key is None:
+            return
+        session = self.manager.session()
+        try:
+            PipelineProgress.record(session, key, batch_ids)
+            session.commit()
+        finally:
+            session.close()
+
+    def checkpoint_keys(self):
+        '''All of the keys this task records progress under'''
+        key = self.checkpoint_key()
+        if key is None:
+            return []
+        return [key, key + ":stages"]
+
+    def clear_checkpoint(self):
+        keys = self.checkpoint_keys()
+        if not keys:
+            return
+        session = self.manager.session()
+        try:
+            PipelineProgress.clear(session, keys)
+            session.commit()
+        finally:
+            session.close()
+
+    def run_stages(self, *stages):
+        '''
+        Call each of `stages` in order, measuring each with :meth:`measure`. When this task
+        is checkpointed, each stage is recorded as it completes and a restarted run skips
+        the stages it finished.
+        '''
+        key = self.checkpoint_key()
+        if key is None:
+            for stage in stages:
+                with self.measure(stage.__name__):
+                    stage()
+            return
+        key += ":stages"
+        completed = self.load_checkpoint(key)
+        for i, stage in enumerate(stages):
+            if i in completed:
+                self.inform("Skipping %s, completed by a previous run", stage.__name__)
+                continue
+            with self.measure(stage.__name__):
+                stage()
+            self.record_checkpoint([i], key)
+
 
 class PipelineException(Exception):
     pass
@@ -2,3 +2,4 @@ from .peak_grouping import PeakGroupMatchType, JointPeakGroupMatch, PeakGroupMat
 from .sequence_identification import (
     GlycopeptideMatch, GlycopeptideSpectrumMatch, GlycopeptideSpectrumMatchScore,
     GlycanStructureMatch, GlycanSpectrumMatch)
+from .summary import HypothesisSampleMatchProteinSummary
@@ -2,7 +2,7 @@ from collections import defaultdict
 
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy import (PickleType, Numeric, Unicode, Table,
+from sqlalchemy import (PickleType, Numeric, Unicode, Table, Index,
                         Column, Integer, ForeignKey, UnicodeText, Boolean)
 from sqlalchemy.orm.session import object_session
 
@@ -28,6 +28,11 @@ class PeakGroupMatchBase(object):
     def hypothesis_sample_match_id(cls):
         return Column(Integer, ForeignKey("HypothesisSampleMatch.id"), index=True)
 
+    @declared_attr
+    def __table_args__(cls):
+        # Serves the result views' keyset pages, which seek on (ms1_score, id) within one match
+        return (Index("ix_%s_score_seek" % cls.__tablename__, "hypothesis_sample_match_id", "ms1_score", "id"),)
+
     ms1_score = Column(Numeric(10, 6, asdecimal=False), index=True)
     matched = Column(Boolean, index=True)
 
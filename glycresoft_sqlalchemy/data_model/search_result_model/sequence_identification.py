@@ -7,7 +7,7 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy import (PickleType, Numeric, Unicode,
+from sqlalchemy import (PickleType, Numeric, Unicode, Index,
                         Column, Integer, ForeignKey, Boolean)
 from sqlalchemy.orm.session import object_session
 
@@ -189,6 +189,8 @@ class GlycopeptideSpectrumMatchScore(Base):
 class GlycopeptideMatch(GlycopeptideBase, Base, HasMS1Information):
     __tablename__ = "GlycopeptideMatch"
     __collection_name__ = "glycopeptide_matches"
+    # Serves the result views' keyset pages, which seek on (ms2_score, id) within one match
+    __table_args__ = (Index("ix_GlycopeptideMatch_score_seek", "hypothesis_sample_match_id", "ms2_score", "id"),)
 
     id = Column(Integer, primary_key=True)
     theoretical_glycopeptide_id = Column(Integer, ForeignKey(
@@ -0,0 +1,195 @@
+from collections import defaultdict
+
+from sqlalchemy.orm import relationship
+from sqlalchemy import Numeric, Column, Integer, ForeignKey, func, inspect
+
+from ..base import Base
+from ..hypothesis_sample_match import HypothesisSampleMatch, MS1GlycopeptideHypothesisSampleMatch
+from ..sequence_model.peptide import Protein, TheoreticalGlycopeptide, TheoreticalGlycopeptideComposition
+
+from .peak_grouping import PeakGroupMatchType
+from .sequence_identification import GlycopeptideMatch
+
+
+def sequence_coverage(spans, length):
+    '''Fraction of a sequence of `length` residues covered by any of the
+    1-indexed, inclusive (start, end) `spans`'''
+    if not length:
+        return 0.
+    covered = 0
+    last_end = 0
+    for start, end in sorted(spans):
+        if start is None or end is None:
+            continue
+        start = max(start, last_end + 1)
+        if end >= start:
+            covered += end - start + 1
+            last_end = end
+    return covered / float(length)
+
+
+class HypothesisSampleMatchProteinSummary(Base):
+    '''
+    Per-protein aggregates over the results of a :class:`HypothesisSampleMatch`,
+    computed once when the search finishes so that result views do not re-count
+    the whole search space on every request.
+
+    Attributes
+    ----------
+    theoretical_count: int
+        The number of theoretical glycopeptides searched for the protein
+    match_count: int
+        The number of matches assigned to the protein, regardless of score
+    best_score: float
+        The highest MS2 score (tandem searches) or MS1 score (peak group searches) of
+        any match assigned to the protein
+    coverage: float
+        The fraction of the protein sequence spanned by matches assigned to it
+    '''
+    __tablename__ = "HypothesisSampleMatchProteinSummary"
+
+    id = Column(Integer, primary_key=True)
+    hypothesis_sample_match_id = Column(Integer, ForeignKey(
+        HypothesisSampleMatch.id, ondelete="CASCADE"), index=True)
+    protein_id = Column(Integer, ForeignKey(Protein.id, ondelete="CASCADE"), index=True)
+    protein = relationship(Protein)
+
+    theoretical_count = Column(Integer)
+    match_count = Column(Integer)
+    best_score = Column(Numeric(10, 6, asdecimal=False))
+    coverage = Column(Numeric(10, 6, asdecimal=False))
+
+    def __repr__(self):
+        return "<HypothesisSampleMatchProteinSummary {} {} {}/{} {}>".format(
+            self.hypothesis_sample_match_id, self.protein_id, self.match_count,
+            self.theoretical_count, self.best_score)
+
+    @classmethod
+    def _tandem_aggregates(cls, session, hypothesis_sample_match):
+        theoretical_counts = session.query(
+            TheoreticalGlycopeptide.protein_id, func.count(TheoreticalGlycopeptide.id)).join(
+            Protein, TheoreticalGlycopeptide.protein_id == Protein.id).filter(
+            Protein.hypothesis_id == hypothesis_sample_match.target_hypothesis_id).group_by(
+            TheoreticalGlycopeptide.protein_id)
+
+        match_filter = (GlycopeptideMatch.hypothesis_sample_match_id == hypothesis_sample_match.id,
+                        GlycopeptideMatch.protein_id == Protein.id,
+                        Protein.hypothesis_id == hypothesis_sample_match.target_hypothesis_id)
+        match_aggregates = session.query(
+            GlycopeptideMatch.protein_id, func.count(GlycopeptideMatch.id),
+            func.max(GlycopeptideMatch.ms2_score)).filter(*match_filter).group_by(
+            GlycopeptideMatch.protein_id)
+        spans = session.query(
+            GlycopeptideMatch.protein_id, GlycopeptideMatch.start_position,
+            GlycopeptideMatch.end_position).filter(*match_filter).distinct()
+        return theoretical_counts, match_aggregates, spans
+
+    @classmethod
+    def _composition_aggregates(cls, session, hypothesis_sample_match):
+        theoretical_counts = session.query(
+            TheoreticalGlycopeptideComposition.protein_id,
+            func.count(TheoreticalGlycopeptideComposition.id)).join(
+            Protein, TheoreticalGlycopeptideComposition.protein_id == Protein.id).filter(
+            Protein.hypothesis_id == hypothesis_sample_match.target_hypothesis_id).group_by(
+            TheoreticalGlycopeptideComposition.protein_id)
+
+        def matches(*columns):
+            return session.query(*columns).join(
+                PeakGroupMatchType,
+                PeakGroupMatchType.theoretical_match_id == TheoreticalGlycopeptideComposition.id).filter(
+                PeakGroupMatchType.hypothesis_sample_match_id == hypothesis_sample_match.id,
+                PeakGroupMatchType.theoretical_match_type == u"TheoreticalGlycopeptideComposition",
+                PeakGroupMatchType.matched)
+
+        match_aggregates = matches(
+            TheoreticalGlycopeptideComposition.protein_id, func.count(PeakGroupMatchType.id),
+            func.max(PeakGroupMatchType.ms1_score)).group_by(TheoreticalGlycopeptideComposition.protein_id)
+        spans = matches(
+            TheoreticalGlycopeptideComposition.protein_id, TheoreticalGlycopeptideComposition.start_position,
+            TheoreticalGlycopeptideComposition.end_position).distinct()
+        return theoretical_counts, match_aggregates, spans
+
+    #: The :attr:`HypothesisSampleMatch.parameters` key marking that the summary has been built,
+    #: so that a search which produced no rows is not summarized again on every request
+    built_parameter = "protein_summary_built"
+
+    @classmethod
+    def create_score_seek_indices(cls, connection):
+        '''
+        Create the (hypothesis_sample_match_id, score, id) indices of the match tables
+        on databases written before they were declared.
+        '''
+        for table in (GlycopeptideMatch.__table__, PeakGroupMatchType.__table__):
+            present = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name.endswith("_score_seek") and index.name not in present:
+                    index.create(connection)
+
+    @classmethod
+    def build(cls, session, hypothesis_sample_match_id):
+        '''
+        (Re)compute the summary rows of `hypothesis_sample_match_id`. Searches
+        against hypotheses without proteins produce no rows.
+        '''
+        hypothesis_sample_match = session.query(HypothesisSampleMatch).get(hypothesis_sample_match_id)
+        cls.__table__.create(session.connection(), checkfirst=True)
+        cls.create_score_seek_indices(session.connection())
+        session.query(cls).filter(cls.hypothesis_sample_match_id == hypothesis_sample_match_id).delete(
+            synchronize_session=False)
+        if hypothesis_sample_match.parameters is None:
+            hypothesis_sample_match.parameters = {}
+        hypothesis_sample_match.parameters[cls.built_parameter] = True
+
+        if hypothesis_sample_match.glycopeptide_matches.first() is not None:
+            aggregates = cls._tandem_aggregates(session, hypothesis_sample_match)
+        elif isinstance(hypothesis_sample_match, MS1GlycopeptideHypothesisSampleMatch):
+            aggregates = cls._composition_aggregates(session, hypothesis_sample_match)
+        else:
+            session.commit()
+            return []
+
+        theoretical_counts, match_aggregates, spans = aggregates
+        protein_lengths = dict(session.query(Protein.id, func.length(Protein.protein_sequence)).filter(
+            Protein.hypothesis_id == hypothesis_sample_match.target_hypothesis_id))
+        protein_spans = defaultdict(list)
+        for protein_id, start, end in spans:
+            protein_spans[protein_id].append((start, end))
+
+        rows = {}
+        for protein_id, theoretical_count in theoretical_counts:
+            if theoretical_count == 0:
+                continue
+            rows[protein_id] = {
+                "hypothesis_sample_match_id": hypothesis_sample_match_id,
+                "protein_id": protein_id,
+                "theoretical_count": theoretical_count,
+                "match_count": 0,
+                "best_score": None,
+                "coverage": 0.
+            }
+        for protein_id, match_count, best_score in match_aggregates:
+            if protein_id not in rows:
+                continue
+            rows[protein_id]["match_count"] = match_count
+            rows[protein_id]["best_score"] = best_score
+            rows[protein_id]["coverage"] = sequence_coverage(
+                protein_spans[protein_id], protein_lengths.get(protein_id))
+
+        rows = rows.values()
+        session.bulk_insert_mappings(cls, rows)
+        session.commit()
+        return rows
+
+    @classmethod
+    def for_hypothesis_sample_match(cls, session, hypothesis_sample_match_id):
+        '''
+        Query the summary rows of `hypothesis_sample_match_id`, building them first
+        for results which were produced before summaries existed.
+        '''
+        cls.__table__.create(session.connection(), checkfirst=True)
+        q = session.query(cls).filter(cls.hypothesis_sample_match_id == hypothesis_sample_match_id)
+        if q.first() is None:
+            parameters = session.query(HypothesisSampleMatch).get(hypothesis_sample_match_id).parameters or {}
+            if not parameters.get(cls.built_parameter):
+                cls.build(session, hypothesis_sample_match_id)
+        return q
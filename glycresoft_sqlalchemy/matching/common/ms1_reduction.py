@@ -6,6 +6,8 @@ except Exception, e:
     logging.exception("Logger could not be initialized", exc_info=e)
     raise e
 
+from sqlalchemy import select
+
 from glycresoft_sqlalchemy.data_model import (
     PipelineModule,
     SampleRun, Decon2LSPeakGroup,
@@ -13,28 +15,96 @@ from glycresoft_sqlalchemy.data_model import (
 )
 
 
+def stream_query(session, query, chunk_size=10000):
+    result = session.execute(query)
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        result.close()
+
+
+def merge_mass_windows(precursor_masses, items, tolerance, key=lambda x: x[0]):
+    """
+    Select the items whose mass lies within the ppm error window of any precursor
+    mass, walking both sequences once in ascending mass order.
+
+    A precursor mass `p` covers masses in `[p - p * tolerance, p + p * tolerance]`.
+    Both bounds grow with `p`, so once a precursor's upper bound falls below the
+    current item it cannot cover any later item and is discarded, and the first
+    remaining precursor is the only one whose window needs to be checked.
+
+    Parameters
+    ----------
+    precursor_masses: iterable of float
+        Sorted in ascending order
+    items: iterable
+        Sorted in ascending order of `key`
+    tolerance: float
+    key: callable
+        Gets the mass of an item
+
+    Yields
+    ------
+    object
+        Each matching item, once
+    """
+    precursor_masses = iter(precursor_masses)
+    lower_factor = 1 - tolerance
+    upper_factor = 1 + tolerance
+    precursor = next(precursor_masses, None)
+    if precursor is None:
+        return
+    for item in items:
+        mass = key(item)
+        while precursor * upper_factor < mass:
+            precursor = next(precursor_masses, None)
+            if precursor is None:
+                return
+        if precursor * lower_factor <= mass:
+            yield item
+
+
 class MS1Reduction(PipelineModule):
-    def __init__(self, ms1_database_path, ms2_database_path, output_path, tolerance=2e-5):
+    def __init__(self, ms1_database_path, ms2_database_path, output_path, tolerance=2e-5, chunk_size=10000):
         self.ms1 = self.manager_type(ms1_database_path)
         self.ms2 = self.manager_type(ms2_database_path)
         self.output = self.manager_type(output_path)
         self.tolerance = tolerance
+        self.chunk_size = chunk_size
+
+    def stream_precursor_masses(self, session):
+        query = select([TandemScan.precursor_neutral_mass]).where(
+            TandemScan.precursor_neutral_mass != None).order_by(  # noqa
+            TandemScan.precursor_neutral_mass)
+        return (row[0] for row in stream_query(session, query, self.chunk_size))
+
+    def stream_peak_groups(self, session):
+        table = Decon2LSPeakGroup.__table__
+        query = select([table]).where(table.c.weighted_monoisotopic_mass != None).order_by(  # noqa
+            table.c.weighted_monoisotopic_mass)
+        return stream_query(session, query, self.chunk_size)
 
     def reduce_peak_groups(self):
-        reduced = set()
-        tolerance = self.tolerance
-        ms1 = self.ms1
-        ms2 = self.ms2
-        for tandem_scan in ms2.query(TandemScan):
-            target_mass = tandem_scan.precursor_neutral_mass
-            window_width = target_mass * tolerance
-            lo = target_mass - window_width
-            hi = target_mass + window_width
-            rel_1_2 = ms1.query(Decon2LSPeakGroup).filter(
-                Decon2LSPeakGroup.weighted_monoisotopic_mass.between(lo, hi)).all()
-            if rel_1_2:
-                reduced.update(rel_1_2)
-        return reduced
+        """
+        Yield the peak groups observed within `tolerance` of a tandem scan's precursor
+        mass, as rows of the `Decon2LSPeakGroup` table, by merging the mass-ordered
+        precursors and peak groups instead of querying once per tandem scan.
+        """
+        ms1_session = self.ms1.session()
+        ms2_session = self.ms2.session()
+        try:
+            for row in merge_mass_windows(
+                    self.stream_precursor_masses(ms2_session), self.stream_peak_groups(ms1_session),
+                    self.tolerance, key=lambda row: row.weighted_monoisotopic_mass):
+                yield row
+        finally:
+            ms1_session.close()
+            ms2_session.close()
 
     def save_extracted(self, sample_run, reduced_peaks):
         self.output.initialize()
@@ -42,16 +112,25 @@ class MS1Reduction(PipelineModule):
         make_transient(sample_run)
         out.add(sample_run)
         out.commit()
-        list(map(make_transient, reduced_peaks))
-        out.add_all(reduced_peaks)
+        sample_run_id = sample_run.id
+        accumulator = []
+        n = 0
+        for row in reduced_peaks:
+            accumulator.append(dict(row))
+            if len(accumulator) >= self.chunk_size:
+                out.bulk_insert_mappings(Decon2LSPeakGroup, accumulator)
+                n += len(accumulator)
+                accumulator = []
+        out.bulk_insert_mappings(Decon2LSPeakGroup, accumulator)
+        n += len(accumulator)
         out.commit()
-        self.inform("Extracted %d peak groups", len(reduced_peaks))
-        return sample_run.id
+        out.close()
+        self.inform("Extracted %d peak groups", n)
+        return sample_run_id
 
     def run(self):
-        peaks = self.reduce_peak_groups()
         sample_run = self.ms1.query(SampleRun).first()
-        return self.save_extracted(sample_run, peaks)
+        return self.save_extracted(sample_run, self.reduce_peak_groups())
 
 
 if __name__ == '__main__':
@@ -11,16 +11,19 @@ except:
 from os.path import splitext
 from collections import defaultdict
 
-from ..spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser
+import numpy as np
 
-from ..data_model import (
+from ...spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser
+
+from ...data_model import (
     MS2GlycanHypothesis, MS2GlycanHypothesisSampleMatch, PipelineModule, MSMSSqlDB,
-    TheoreticalGlycanStructure, GlycanStructureMatch, GlycanSpectrumMatch
+    TheoreticalGlycanStructure, GlycanStructureMatch, GlycanSpectrumMatch, TandemScan
     )
 
-from ..utils.common_math import ppm_error
+from ...utils.common_math import ppm_error
 
 neutral_mass_getter = operator.attrgetter("neutral_mass")
+mass_getter = operator.attrgetter("mass")
 key_getter = operator.itemgetter('key')
 
 decon_format_lookup = {
@@ -33,17 +36,131 @@ PROTON = 1.007276035
 ms1_tolerance_default = 1e-5
 ms2_tolerance_default = 2e-5
 
+# Binary search windows are widened slightly so that rounding never excludes a peak
+# which passes the exact ppm error test
+_window_padding = 1 + 1e-9
 
-def match_fragments(theoretical, msmsdb_path, ms1_tolerance, ms2_tolerance,
-                    database_manager, kinds, hypothesis_sample_match_id, sample_run_id,
-                    hypothesis_id):
+
+class FragmentMassIndex(object):
+    '''
+    The fragments of one glycan structure ordered by mass, so that the fragments
+    which may explain any peak can be found by binary search.
+
+    Attributes
+    ----------
+    names: list of str
+    masses: np.ndarray
+        Fragment masses in ascending order, parallel to :attr:`names`
+    '''
+    def __init__(self, fragments):
+        fragments = sorted(fragments, key=mass_getter)
+        self.names = [f.name for f in fragments]
+        self.masses = np.array([f.mass for f in fragments], dtype=float)
+
+    def __len__(self):
+        return len(self.names)
+
+    def match(self, spectrum, tolerance):
+        '''
+        Find all pairs of fragments and peaks of `spectrum` within `tolerance`
+        ppm of each other.
+
+        Parameters
+        ----------
+        spectrum: SpectrumPeakIndex
+        tolerance: float
+
+        Yields
+        ------
+        tuple of (int, int, float): fragment index, peak index and ppm error
+        '''
+        masses = self.masses
+        width = masses * tolerance * _window_padding
+        lower = np.searchsorted(spectrum.masses, masses - width, 'left')
+        upper = np.searchsorted(spectrum.masses, masses + width, 'right')
+        peak_masses = spectrum.masses
+        lppm_error = ppm_error
+        lfabs = math.fabs
+        for i in np.flatnonzero(upper > lower):
+            query_mass = masses[i]
+            for j in range(lower[i], upper[i]):
+                match_error = lppm_error(peak_masses[j], query_mass)
+                if lfabs(match_error) <= tolerance:
+                    yield i, j, match_error
+
+
+class SpectrumPeakIndex(object):
+    '''
+    The peaks of one tandem scan in ascending mass order, detached from the
+    database session so that they can be reused across structures.
+    '''
+    def __init__(self, spectrum):
+        self.id = spectrum.id
+        self.time = spectrum.time
+        self.precursor_neutral_mass = spectrum.precursor_neutral_mass
+        self.peaks = sorted(spectrum.tandem_data, key=neutral_mass_getter)
+        self.masses = np.array([p.neutral_mass for p in self.peaks], dtype=float)
+
+    def __len__(self):
+        return len(self.peaks)
+
+
+def search_structure(theoretical, spectra, ms2_tolerance, kinds):
+    '''
+    Match the fragments of `theoretical` against each of `spectra`.
+
+    Parameters
+    ----------
+    theoretical: TheoreticalGlycanStructure
+    spectra: list of SpectrumPeakIndex
+        Spectra whose precursor mass matches `theoretical`
+    ms2_tolerance: float
+    kinds: str
+        The fragment types to consider
+
+    Returns
+    -------
+    matches: list of dict
+        Every fragment match across all spectra
+    spectrum_matches: list of tuple
+        (:class:`SpectrumPeakIndex`, peak_match_map) for every spectrum
+        with at least one matched fragment
+    '''
+    fragment_index = None
+    matches = []
+    spectrum_matches = []
+    for spectrum in spectra:
+        if fragment_index is None:
+            fragment_index = FragmentMassIndex(theoretical.fragments(kinds))
+        peak_match_map = defaultdict(list)
+        peaks = spectrum.peaks
+        names = fragment_index.names
+        for i, j, match_error in fragment_index.match(spectrum, ms2_tolerance):
+            peak = peaks[j]
+            match = ({'key': names[i],
+                      "observed_mass": peak.neutral_mass,
+                      "intensity": peak.intensity,
+                      'ppm_error': match_error, "peak_id": peak.id})
+            matches.append(match)
+            peak_match_map[peak.id].append(match)
+        if peak_match_map:
+            spectrum_matches.append((spectrum, peak_match_map))
+    return matches, spectrum_matches
+
+
+def match_structure_batch(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_tolerance,
+                          database_manager, kinds, hypothesis_sample_match_id, sample_run_id,
+                          hypothesis_id):
     '''
     *Task Function*
 
+    Search a batch of glycan structures, sharing loaded spectra between structures
+    with the same precursor mass, and save all of their matches in bulk.
+
     Arguments
     ---------
-    theoretical: int
-        ID value for the theoretical sequence to search
+    theoretical_ids: list of int
+        ID values for the theoretical structures to search
     msmsdb_path: str
         Path to the ion database
     ms1_tolerance: float
@@ -51,103 +168,88 @@ def match_fragments(theoretical, msmsdb_path, ms1_tolerance, ms2_tolerance,
     ms2_tolerance: float
         ppm mass error tolerance for MS2 matching
     hypothesis_sample_match_id: int
-        If set, associate all GlycopeptideMatches with the indicated HypothesisSampleMatch
+        If set, associate all GlycanStructureMatches with the indicated HypothesisSampleMatch
     sample_run_id: int
         If set, only select ions from the indicated SampleRun
 
+    Returns
+    -------
+    int: The number of structures searched
     '''
+    msmsdb = MSMSSqlDB(msmsdb_path)
+    ion_session = msmsdb.session()
+    session = database_manager.session()
     try:
-        msmsdb = MSMSSqlDB(msmsdb_path)
-        session = database_manager.session()
-        theoretical = session.query(TheoreticalGlycanStructure).get(theoretical)
-
-        # Localized global references
-        lppm_error = ppm_error
-        lfabs = math.fabs
-
-        spectrum_matches = []
-        fragments = None
-        ppm_errors = []
-        observed_masses = []
-
-        query = msmsdb.ppm_match_tolerance_search(theoretical.calculated_mass, ms1_tolerance, sample_run_id)
-
-        matches = []
-        collect = matches.append
-
-        for spectrum in query:
-            peak_list = spectrum.tandem_data
-            peak_list = sorted(peak_list, key=neutral_mass_getter)
-            peak_match_map = defaultdict(list)
-
-            ppm_errors.append(ppm_error(theoretical.calculated_mass, spectrum.precursor_neutral_mass))
-            observed_masses.append(spectrum.precursor_neutral_mass)
-
-            c = 0
-            if fragments is None:
-                fragments = list(theoretical.fragments(kinds))
-            for theoretical_ion in fragments:
-                query_mass = theoretical_ion.mass
-                for peak in peak_list:
-                    observed_mass = peak.neutral_mass
-                    match_error = lppm_error(observed_mass, query_mass)
-                    if lfabs(match_error) <= ms2_tolerance:
-                        c += 1
-                        match = ({'key': theoretical_ion.name,
-                                  "observed_mass": observed_mass,
-                                  "intensity": peak.intensity,
-                                  'ppm_error': match_error, "peak_id": peak.id})
-                        collect(match)
-                        peak_match_map[peak.id].append(match)
-
-            if c > 0:
-                spectrum_matches.append((spectrum, peak_match_map))
-
-        if len(spectrum_matches) > 0:
-            scan_ids = []
-            # session = database_manager.session()
-            for spectrum, peak_match_map in spectrum_matches:
-                scan_ids.append(spectrum.time)
-
-            first_scan = min(scan_ids)
-            last_scan = max(scan_ids)
-
-            structure_match = GlycanStructureMatch(
-                theoretical_reference_id=theoretical.id,
-                hypothesis_sample_match_id=hypothesis_sample_match_id,
-                ms1_score=None,
-                ms2_score=None,
-                observed_mass=min(observed_masses),
-                ppm_error=min(ppm_errors),
-                volume=None,
-                fragment_matches=matches,
-                scan_id_range=scan_ids,
-                first_scan=first_scan,
-                last_scan=last_scan
-            )
-
-            session.add(structure_match)
-            session.commit()
-
-            for match in spectrum_matches:
-                sm = GlycanSpectrumMatch(
-                    glycopeptide_match_id=structure_match.id,
-                    scan_time=spectrum.time, peak_match_map=peak_match_map,
-                    peaks_explained=len(peak_match_map),
-                    peaks_unexplained=len(spectrum.tandem_data) - len(peak_match_map),
-                    hypothesis_sample_match_id=hypothesis_sample_match_id,
-                    hypothesis_id=hypothesis_id)
-                session.add(sm)
+        spectrum_cache = {}
+        structure_rows = []
+        spectrum_rows = []
+        structures = session.query(TheoreticalGlycanStructure).filter(
+            TheoreticalGlycanStructure.id.in_(theoretical_ids)).order_by(
+            TheoreticalGlycanStructure.calculated_mass)
+        for theoretical in structures:
+            spectra = []
+            for spectrum in ion_session.query(TandemScan).filter(
+                    TandemScan.ppm_match_tolerance_search(theoretical.calculated_mass, ms1_tolerance),
+                    TandemScan.sample_run_id == sample_run_id):
+                if spectrum.id not in spectrum_cache:
+                    spectrum_cache[spectrum.id] = SpectrumPeakIndex(spectrum)
+                spectra.append(spectrum_cache[spectrum.id])
+
+            matches, spectrum_matches = search_structure(theoretical, spectra, ms2_tolerance, kinds)
+            if len(spectrum_matches) == 0:
+                continue
+
+            scan_ids = [spectrum.time for spectrum, peak_match_map in spectrum_matches]
+            structure_rows.append({
+                "theoretical_reference_id": theoretical.id,
+                "hypothesis_sample_match_id": hypothesis_sample_match_id,
+                "ms1_score": None,
+                "ms2_score": None,
+                "observed_mass": min(s.precursor_neutral_mass for s in spectra),
+                "ppm_error": min(ppm_error(theoretical.calculated_mass, s.precursor_neutral_mass)
+                                 for s in spectra),
+                "volume": None,
+                "fragment_matches": matches,
+                "scan_id_range": scan_ids,
+                "first_scan": min(scan_ids),
+                "last_scan": max(scan_ids)
+            })
+            spectrum_rows.append([{
+                "scan_time": spectrum.time,
+                "peak_match_map": dict(peak_match_map),
+                "peaks_explained": len(peak_match_map),
+                "peaks_unexplained": len(spectrum) - len(peak_match_map),
+                "hypothesis_sample_match_id": hypothesis_sample_match_id,
+                "hypothesis_id": hypothesis_id
+            } for spectrum, peak_match_map in spectrum_matches])
+
+        if structure_rows:
+            session.bulk_insert_mappings(GlycanStructureMatch, structure_rows, return_defaults=True)
+            for structure_row, rows in zip(structure_rows, spectrum_rows):
+                for row in rows:
+                    row["glycan_structure_match_id"] = structure_row["id"]
+            session.bulk_insert_mappings(GlycanSpectrumMatch, itertools.chain.from_iterable(spectrum_rows))
             session.commit()
-            session.close()
-
+        return len(theoretical_ids)
     except Exception, e:
         logger.exception("An error occurred", exc_info=e)
         raise
-
     finally:
         session.close()
-        msmsdb.close()
+        ion_session.close()
+
+
+def match_fragments(theoretical, msmsdb_path, ms1_tolerance, ms2_tolerance,
+                    database_manager, kinds, hypothesis_sample_match_id, sample_run_id,
+                    hypothesis_id):
+    '''
+    *Task Function*
+
+    Search a single glycan structure. See :func:`match_structure_batch`
+    '''
+    return match_structure_batch(
+        [theoretical], msmsdb_path, ms1_tolerance, ms2_tolerance, database_manager,
+        kinds, hypothesis_sample_match_id, sample_run_id, hypothesis_id)
 
 
 class IonMatching(PipelineModule):
@@ -159,7 +261,8 @@ class IonMatching(PipelineModule):
                  ms1_tolerance=ms1_tolerance_default,
                  ms2_tolerance=ms2_tolerance_default,
                  kinds="BY",
-                 n_processes=4):
+                 n_processes=4,
+                 batch_size=200):
         self.manager = self.manager_type(database_path)
         self.session = self.manager.session()
         self.hypothesis_id = hypothesis_id
@@ -173,6 +276,7 @@ class IonMatching(PipelineModule):
         self.hypothesis_sample_match_id = hypothesis_sample_match_id
         self.sample_run_id = sample_run_id
         self.kinds = kinds
+        self.batch_size = batch_size
 
         if isinstance(observed_ions_path, str):
             if observed_ions_type != "db" and splitext(observed_ions_path)[1] != '.db':
@@ -185,7 +289,7 @@ class IonMatching(PipelineModule):
         self.msmsdb = msmsdb
 
         for hypothesis in self.session.query(MS2GlycanHypothesisSampleMatch).filter(
-                MS2GlycanHypothesisSampleMatch.id == MS2GlycanHypothesisSampleMatch):
+                MS2GlycanHypothesisSampleMatch.id == hypothesis_sample_match_id):
             hypothesis.parameters.update({
                     "ms1_ppm_tolerance": ms1_tolerance,
                     "ms2_ppm_tolerance": ms2_tolerance,
@@ -195,7 +299,7 @@ class IonMatching(PipelineModule):
         self.session.commit()
 
     def prepare_task_fn(self):
-        task_fn = functools.partial(match_fragments,
+        task_fn = functools.partial(match_structure_batch,
                                     msmsdb_path=self.msmsdb.path,
                                     ms1_tolerance=self.ms1_tolerance,
                                     ms2_tolerance=self.ms2_tolerance,
@@ -207,14 +311,25 @@ class IonMatching(PipelineModule):
         return task_fn
 
     def stream_theoretical_glycan_structures(self):
+        '''
+        Yield lists of at most :attr:`batch_size` structure ids in order of mass, so that
+        structures sharing precursor spectra are searched by the same task.
+        '''
         session = self.manager.session()
         try:
+            batch = []
             for theoretical_id, in session.query(
                     TheoreticalGlycanStructure.id).filter(
-                    TheoreticalGlycanStructure.hypothesis_id == self.hypothesis_id):
-                yield theoretical_id
+                    TheoreticalGlycanStructure.hypothesis_id == self.hypothesis_id).order_by(
+                    TheoreticalGlycanStructure.calculated_mass):
+                batch.append(theoretical_id)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
         except Exception, e:
-            logger.exception("An error occurred in stream_theoretical_glycopeptides, %r", locals(), exc_info=e)
+            logger.exception("An error occurred in stream_theoretical_glycan_structures, %r", locals(), exc_info=e)
             raise
         finally:
             session.close()
@@ -223,18 +338,21 @@ class IonMatching(PipelineModule):
         session = self.session
         task_fn = self.prepare_task_fn()
         cntr = 0
+        last = 0
         if self.n_processes > 1:
             pool = multiprocessing.Pool(self.n_processes)
-            for res in pool.imap(task_fn, self.stream_theoretical_glycan_structures(), 500):
+            for res in pool.imap_unordered(task_fn, self.stream_theoretical_glycan_structures()):
                 cntr += res
-                if cntr % 1000 == 0:
+                if cntr - last >= 1000:
                     logger.info("%d Searches Complete." % cntr)
+                    last = cntr
             pool.close()
             pool.join()
         else:
-            for theoretical in self.stream_theoretical_glycan_structures():
-                cntr += task_fn(theoretical)
-                if cntr % 1000 == 0:
+            for batch in self.stream_theoretical_glycan_structures():
+                cntr += task_fn(batch)
+                if cntr - last >= 1000:
                     logger.info("%d Searches Complete." % cntr)
+                    last = cntr
         session.commit()
         session.close()
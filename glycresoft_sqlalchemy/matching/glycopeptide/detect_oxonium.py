@@ -1,7 +1,9 @@
+import numpy as np
+
 from sqlalchemy import or_
 from sqlalchemy.orm import aliased
 
-from glycresoft_sqlalchemy.data_model import DatabaseManager, TandemScan, Peak
+from glycresoft_sqlalchemy.data_model import DatabaseManager, TandemScan, TandemScanSignature, Peak
 from glypy import MonosaccharideResidue
 
 
@@ -11,13 +13,168 @@ def ppm_error_expr(expr, value, ppm_tolerance):
 
 oxonium_ions = map(MonosaccharideResidue.from_iupac_lite, ["HexNAc", "Hex", "Fuc", "NeuAc", "NeuGc"])
 
+# Each scan signature has one bit for the oxonium ion of each monosaccharide in
+# `oxonium_ions`, followed by one bit for a neutral loss of each
+oxonium_ion_masses = np.array([m.mass() for m in oxonium_ions])
+oxonium_mask = (1 << len(oxonium_ions)) - 1
+loss_mask = oxonium_mask << len(oxonium_ions)
+
+default_tolerance = 2e-5
+default_minimum_intensity = 1000
+
 
 def expression_filter(tolerance):
     return [ppm_error_expr(Peak.neutral_mass, m.mass(), tolerance) for m in oxonium_ions]
 
 
-def detect_oxonium_ions(session, tolerance=2e-5, minimum_intensity=1000,
+def scan_signature(masses, intensities, tolerance=default_tolerance,
+                   minimum_intensity=default_minimum_intensity):
+    '''
+    Compute the glycan signature of one scan's peaks in a single pass over its sorted masses.
+
+    Parameters
+    ----------
+    masses: array-like
+        Peak neutral masses
+    intensities: array-like
+        Peak intensities, parallel to `masses`
+
+    Returns
+    -------
+    int
+    '''
+    masses = np.asarray(masses, dtype=float)
+    if masses.size == 0:
+        return 0
+    intensities = np.asarray(intensities, dtype=float)
+    order = np.argsort(masses)
+    masses = masses[order]
+    intense = intensities[order] >= minimum_intensity
+    # Prefix counts of intense peaks, so "any intense peak in [lo, hi]" is one subtraction
+    intense_counts = np.concatenate(([0], np.cumsum(intense)))
+    signature = 0
+    n = len(oxonium_ion_masses)
+    for i, mass in enumerate(oxonium_ion_masses):
+        span = mass * tolerance
+        lo = np.searchsorted(masses, mass - span, 'left')
+        hi = np.searchsorted(masses, mass + span, 'right')
+        if intense_counts[hi] > intense_counts[lo]:
+            signature |= 1 << i
+        # A loss pairs an intense heavier peak with any lighter peak
+        lo = np.searchsorted(masses, masses + mass - span, 'left')
+        hi = np.searchsorted(masses, masses + mass + span, 'right')
+        if np.any(intense_counts[hi] > intense_counts[lo]):
+            signature |= 1 << (n + i)
+    return signature
+
+
+def signature_filter(mask, tolerance=default_tolerance, minimum_intensity=default_minimum_intensity):
+    return [TandemScanSignature.tolerance == tolerance,
+            TandemScanSignature.minimum_intensity == minimum_intensity,
+            TandemScanSignature.signature.op('&')(mask) != 0]
+
+
+class SignatureIndexer(object):
+    '''
+    Accumulates :class:`TandemScanSignature` rows for scans as their peaks are loaded,
+    writing them in bulk.
+    '''
+    def __init__(self, session, tolerance=default_tolerance, minimum_intensity=default_minimum_intensity,
+                 chunk_size=5000):
+        self.session = session
+        self.tolerance = tolerance
+        self.minimum_intensity = minimum_intensity
+        self.chunk_size = chunk_size
+        self.accumulator = []
+        TandemScanSignature.ensure_table(session)
+
+    def add(self, scan_id, sample_run_id, masses, intensities):
+        self.accumulator.append({
+            "scan_id": scan_id, "sample_run_id": sample_run_id,
+            "signature": scan_signature(masses, intensities, self.tolerance, self.minimum_intensity),
+            "tolerance": self.tolerance, "minimum_intensity": self.minimum_intensity})
+        if self.chunk_size is not None and len(self.accumulator) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.accumulator:
+            self.session.bulk_insert_mappings(TandemScanSignature, self.accumulator)
+            self.accumulator = []
+
+
+def build_signature_index(session, sample_run_id=None, tolerance=default_tolerance,
+                          minimum_intensity=default_minimum_intensity):
+    '''
+    Compute the signatures of the tandem scans which do not yet have one for these
+    parameters, reading their peaks in one pass ordered by scan.
+
+    Returns
+    -------
+    int
+        The number of scans indexed
+    '''
+    TandemScanSignature.ensure_table(session)
+    indexed = session.query(TandemScanSignature.scan_id).filter(
+        TandemScanSignature.tolerance == tolerance,
+        TandemScanSignature.minimum_intensity == minimum_intensity)
+    scans = session.query(TandemScan.id, TandemScan.sample_run_id).filter(~TandemScan.id.in_(indexed))
+    if sample_run_id is not None:
+        scans = scans.filter(TandemScan.sample_run_id == sample_run_id)
+    sample_runs = dict(scans)
+    if not sample_runs:
+        return 0
+    peaks = session.query(Peak.scan_id, Peak.neutral_mass, Peak.intensity).join(
+        TandemScan, TandemScan.id == Peak.scan_id).filter(~TandemScan.id.in_(indexed))
+    if sample_run_id is not None:
+        peaks = peaks.filter(TandemScan.sample_run_id == sample_run_id)
+    # Signatures are written once the peak query is exhausted, as it reads the table
+    indexer = SignatureIndexer(session, tolerance, minimum_intensity, chunk_size=None)
+    current = None
+    masses = []
+    intensities = []
+    for scan_id, mass, intensity in peaks.order_by(Peak.scan_id).yield_per(10000):
+        if scan_id != current:
+            if current is not None:
+                indexer.add(current, sample_runs.pop(current), masses, intensities)
+            current = scan_id
+            masses = []
+            intensities = []
+        masses.append(mass)
+        intensities.append(intensity)
+    if current is not None:
+        indexer.add(current, sample_runs.pop(current), masses, intensities)
+    # Scans without any peaks
+    for scan_id, scan_sample_run_id in sample_runs.items():
+        indexer.add(scan_id, scan_sample_run_id, [], [])
+    n_indexed = len(indexer.accumulator)
+    indexer.flush()
+    session.commit()
+    return n_indexed
+
+
+def detect_oxonium_ions(session, tolerance=default_tolerance, minimum_intensity=default_minimum_intensity,
                         select=TandemScan, sample_run_id=None):
+    build_signature_index(session, sample_run_id, tolerance, minimum_intensity)
+    q = session.query(select).join(TandemScanSignature, TandemScan.id == TandemScanSignature.scan_id).filter(
+        *signature_filter(oxonium_mask, tolerance, minimum_intensity))
+    if sample_run_id is not None:
+        q = q.filter(TandemScan.sample_run_id == sample_run_id)
+    return q
+
+
+def detect_monosaccharide_losses(session, tolerance=default_tolerance, minimum_intensity=default_minimum_intensity,
+                                 select=TandemScan, sample_run_id=None):
+    build_signature_index(session, sample_run_id, tolerance, minimum_intensity)
+    q = session.query(select).join(TandemScanSignature, TandemScan.id == TandemScanSignature.scan_id).filter(
+        *signature_filter(loss_mask, tolerance, minimum_intensity))
+    if sample_run_id is not None:
+        q = q.filter(TandemScan.sample_run_id == sample_run_id)
+    return q
+
+
+def detect_oxonium_ions_join(session, tolerance=default_tolerance, minimum_intensity=default_minimum_intensity,
+                             select=TandemScan, sample_run_id=None):
+    '''The equivalent of :func:`detect_oxonium_ions` computed directly from the :class:`Peak` table'''
     filter_expression = [ppm_error_expr(Peak.neutral_mass, m.mass(), tolerance) for m in oxonium_ions]
     q = session.query(select).join(Peak, TandemScan.id == Peak.scan_id).filter(
         or_(*filter_expression), Peak.intensity >= minimum_intensity).group_by(TandemScan.id)
@@ -26,8 +183,12 @@ def detect_oxonium_ions(session, tolerance=2e-5, minimum_intensity=1000,
     return q
 
 
-def detect_monosaccharide_losses(session, tolerance=2e-5, minimum_intensity=1000,
-                                 select=TandemScan, sample_run_id=None):
+def detect_monosaccharide_losses_join(session, tolerance=default_tolerance,
+                                      minimum_intensity=default_minimum_intensity,
+                                      select=TandemScan, sample_run_id=None):
+    '''The equivalent of :func:`detect_monosaccharide_losses` computed by joining the :class:`Peak`
+    table against itself within each scan. Quadratic in the number of peaks per scan.
+    '''
     OtherPeak = aliased(Peak)
     expr = (Peak.neutral_mass - OtherPeak.neutral_mass)
     filter_expression = [ppm_error_expr(expr, m.mass(), tolerance) for m in oxonium_ions]
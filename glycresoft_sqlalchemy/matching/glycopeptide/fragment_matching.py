@@ -9,16 +9,21 @@ try:
 except:
     pass
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+import numpy as np
+from sqlalchemy import func
 
 from glycresoft_sqlalchemy.spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser
 
 from glycresoft_sqlalchemy.data_model import (
     PipelineModule, MSMSSqlDB, TandemScan, slurp, HypothesisSampleMatch,
     Protein, TheoreticalGlycopeptide, GlycopeptideSpectrumMatch,
-    GlycopeptideMatch)
+    GlycopeptideMatch, PipelineProgress)
 
 from glycresoft_sqlalchemy.utils.common_math import ppm_error, median
+from glycresoft_sqlalchemy.structure.fragment import get_ion_identifier
+from glycresoft_sqlalchemy.utils.partitioning import window_counts, cost_balanced_batches
 
 
 neutral_mass_getter = operator.attrgetter("neutral_mass")
@@ -35,6 +40,189 @@ ms1_tolerance_default = 1e-5
 ms2_tolerance_default = 2e-5
 
 
+def estimate_fragment_counts(sequence_lengths):
+    '''
+    Approximate the number of theoretical fragments of glycopeptides of the given
+    backbone lengths: bare and glycosylated b and y ions at every cleavage, plus
+    a fixed allowance for oxonium and stub ions.
+    '''
+    return 4 * np.asarray(sequence_lengths, dtype=float) + 20
+
+
+def load_precursor_masses(msmsdb, sample_run_id):
+    '''The precursor masses of all tandem scans of `sample_run_id`, in ascending order'''
+    session = msmsdb.session()
+    try:
+        return np.sort(np.array([mass for mass, in session.query(TandemScan.precursor_neutral_mass).filter(
+            TandemScan.sample_run_id == sample_run_id)], dtype=float))
+    finally:
+        session.close()
+
+
+def searched_hypotheses(hypothesis_id, decoy_hypothesis_id=None):
+    '''The hypotheses searched together by a joint target and decoy search'''
+    if decoy_hypothesis_id is None:
+        return [hypothesis_id]
+    return [hypothesis_id, decoy_hypothesis_id]
+
+
+def load_theoretical_sizes(session, hypothesis_id, decoy_hypothesis_id=None):
+    '''
+    The id, mass and estimated fragment count of every theoretical glycopeptide
+    of `hypothesis_id`, and of `decoy_hypothesis_id` if given, as parallel arrays
+    ordered by mass
+    '''
+    rows = session.query(
+        TheoreticalGlycopeptide.id, TheoreticalGlycopeptide.calculated_mass,
+        func.coalesce(TheoreticalGlycopeptide.sequence_length,
+                      func.length(TheoreticalGlycopeptide.base_peptide_sequence), 0)).join(
+        Protein, TheoreticalGlycopeptide.protein_id == Protein.id).filter(
+        Protein.hypothesis_id.in_(searched_hypotheses(hypothesis_id, decoy_hypothesis_id))).order_by(
+        TheoreticalGlycopeptide.calculated_mass).all()
+    if not rows:
+        return np.array([], dtype=int), np.array([]), np.array([])
+    ids, masses, lengths = zip(*rows)
+    return np.array(ids), np.array(masses, dtype=float), estimate_fragment_counts(lengths)
+
+
+def spectrum_matching_checkpoint_key(hypothesis_id, hypothesis_sample_match_id, decoy_hypothesis_id=None):
+    '''
+    The :class:`PipelineProgress` key of matching the spectra of one sample against one
+    hypothesis, or against a target and decoy hypothesis jointly
+    '''
+    if hypothesis_sample_match_id is None:
+        return None
+    if decoy_hypothesis_id is not None:
+        return u"SpectrumMatching:hypothesis=%d:decoy_hypothesis=%d:hypothesis_sample_match=%d" % (
+            hypothesis_id, decoy_hypothesis_id, hypothesis_sample_match_id)
+    return u"SpectrumMatching:hypothesis=%d:hypothesis_sample_match=%d" % (
+        hypothesis_id, hypothesis_sample_match_id)
+
+
+def skip_completed(scan_ids, costs, completed):
+    '''Drop the scans in `completed` from the parallel `scan_ids` and `costs`'''
+    if not completed:
+        return scan_ids, costs
+    keep = [i for i, scan_id in enumerate(scan_ids) if scan_id[0] not in completed]
+    return [scan_ids[i] for i in keep], costs[keep]
+
+
+class TheoreticalGlycopeptideIndex(object):
+    '''
+    An in-memory index over the masses of a hypothesis' theoretical glycopeptides
+    which serves precursor tolerance searches without querying the database for
+    anything but records it has not seen recently.
+
+    Records are detached from their session once loaded and kept in a bounded
+    least-recently-used cache, so a process searching many sample runs against
+    the same hypothesis loads each glycopeptide's fragments at most once while
+    it stays in the cache.
+
+    Attributes
+    ----------
+    ids : np.ndarray
+    masses : np.ndarray
+        Ascending, parallel to `ids`
+    cache_size : int
+    '''
+    def __init__(self, ids, masses, cache_size=5000):
+        self.ids = np.asarray(ids)
+        self.masses = np.asarray(masses, dtype=float)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_hypothesis(cls, session, hypothesis_id, cache_size=5000):
+        ids, masses, fragment_counts = load_theoretical_sizes(session, hypothesis_id)
+        return cls(ids, masses, cache_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, session, mass, tolerance):
+        '''
+        The theoretical glycopeptides within `tolerance` ppm of `mass`, matching
+        :meth:`TheoreticalGlycopeptide.ppm_error_tolerance_search`
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.Session
+            Used to load records missing from the cache
+        mass : float
+        tolerance : float
+
+        Returns
+        -------
+        list of TheoreticalGlycopeptide
+        '''
+        width = mass * tolerance
+        lower = np.searchsorted(self.masses, mass - width, 'left')
+        upper = np.searchsorted(self.masses, mass + width, 'right')
+        window = self.ids[lower:upper].tolist()
+        cache = self.cache
+        missing = [i for i in window if i not in cache]
+        self.misses += len(missing)
+        self.hits += len(window) - len(missing)
+        if missing:
+            for record in session.query(TheoreticalGlycopeptide).filter(
+                    TheoreticalGlycopeptide.id.in_(missing)):
+                session.expunge(record)
+                cache[record.id] = record
+        results = []
+        for i in window:
+            record = cache.pop(i)
+            cache[i] = record
+            results.append(record)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return results
+
+
+_theoretical_index_cache = {}
+
+
+def theoretical_index_version(session, hypothesis_id):
+    '''
+    The number and largest id of the theoretical glycopeptides of `hypothesis_id`,
+    which change whenever glycopeptides are added to the hypothesis or it is rebuilt
+    '''
+    count, max_id = session.query(
+        func.count(TheoreticalGlycopeptide.id), func.max(TheoreticalGlycopeptide.id)).join(
+        Protein, TheoreticalGlycopeptide.protein_id == Protein.id).filter(
+        Protein.hypothesis_id == hypothesis_id).one()
+    return (count, max_id)
+
+
+def get_theoretical_index(database_manager, hypothesis_id, version=None):
+    '''
+    The :class:`TheoreticalGlycopeptideIndex` of `hypothesis_id`, built once per
+    process and reused by every task that process runs.
+
+    If `version`, from :func:`theoretical_index_version`, differs from the version
+    the cached index was built for, the index is rebuilt.
+    '''
+    key = (database_manager.path, hypothesis_id)
+    try:
+        cached_version, index = _theoretical_index_cache[key]
+        if version is None or cached_version == version:
+            return index
+    except KeyError:
+        pass
+    session = database_manager()
+    try:
+        index = TheoreticalGlycopeptideIndex.from_hypothesis(session, hypothesis_id)
+    finally:
+        session.close()
+    _theoretical_index_cache[key] = (version, index)
+    return index
+
+
+def clear_theoretical_index_cache():
+    _theoretical_index_cache.clear()
+
+
 def _sweep_solution(array, value, lo, hi, tolerance, verbose=False):
     best_index = -1
     best_error = float('inf')
@@ -125,6 +313,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(protonated_mass, query_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": protonated_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -147,6 +336,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "intensity": peak.intensity,
                                       "observed_mass": observed_mass,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -164,6 +354,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -181,6 +372,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -198,6 +390,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -215,6 +408,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -303,10 +497,22 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
 
 def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_tolerance,
                                  database_manager, hypothesis_sample_match_id, sample_run_id,
-                                 hypothesis_id, intensity_threshold=0.0):
+                                 hypothesis_id, intensity_threshold=0.0, use_index=False,
+                                 checkpoint_key=None, decoy_hypothesis_id=None, index_versions=None):
+    '''
+    Match each of `scan_ids` against the theoretical glycopeptides of `hypothesis_id` within
+    its precursor tolerance. If `decoy_hypothesis_id` is given, the decoy glycopeptides of the
+    same precursor window are matched against the spectrum while it is loaded, and each
+    :class:`GlycopeptideSpectrumMatch` is labelled with the hypothesis it came from.
+    '''
     try:
         session = database_manager()
         msmsdb = MSMSSqlDB(msmsdb_path)()
+        hypothesis_ids = searched_hypotheses(hypothesis_id, decoy_hypothesis_id)
+        if use_index:
+            index_versions = index_versions or {}
+            theoretical_indices = [get_theoretical_index(database_manager, i, index_versions.get(i))
+                                   for i in hypothesis_ids]
         # Localized global references
         proton = PROTON
         lppm_error = ppm_error
@@ -335,11 +541,18 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
             peak_list = [p for p in peak_list if p.intensity >= intensity_threshold]
             peak_list = sorted(peak_list, key=neutral_mass_getter)
 
-            query = TheoreticalGlycopeptide.ppm_error_tolerance_search(
-                session, spectrum.precursor_neutral_mass,
-                ms1_tolerance, hypothesis_id).all()
-
-            for theoretical in query:
+            query = []
+            for i, search_hypothesis_id in enumerate(hypothesis_ids):
+                if use_index:
+                    candidates = theoretical_indices[i].search(
+                        session, spectrum.precursor_neutral_mass, ms1_tolerance)
+                else:
+                    candidates = TheoreticalGlycopeptide.ppm_error_tolerance_search(
+                        session, spectrum.precursor_neutral_mass,
+                        ms1_tolerance, search_hypothesis_id).all()
+                query.extend((theoretical, search_hypothesis_id) for theoretical in candidates)
+
+            for theoretical, theoretical_hypothesis_id in query:
                 precursor_ppm_error = lppm_error(theoretical.calculated_mass, spectrum.precursor_neutral_mass)
                 peak_match_map = defaultdict(list)
 
@@ -353,6 +566,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(protonated_mass, query_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": protonated_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -375,6 +589,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "intensity": peak.intensity,
                                       "observed_mass": observed_mass,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -392,6 +607,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -409,6 +625,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -426,6 +643,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -443,6 +661,7 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -451,10 +670,12 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         elif observed_mass > query_mass + 10:
                             break
 
-                spectrum_matches.append((theoretical, peak_match_map, precursor_ppm_error, oxonium_ion_count))
+                spectrum_matches.append((
+                    theoretical, theoretical_hypothesis_id, peak_match_map, precursor_ppm_error, oxonium_ion_count))
 
             if len(spectrum_matches) > 0:
-                for theoretical, peak_match_map, precursor_ppm_error, oxcount in spectrum_matches:
+                for (theoretical, theoretical_hypothesis_id, peak_match_map,
+                     precursor_ppm_error, oxcount) in spectrum_matches:
                     spectrum_match_inst = GlycopeptideSpectrumMatch(
                         scan_time=spectrum.time, peak_match_map=peak_match_map,
                         precursor_charge_state=spectrum.precursor_charge_state,
@@ -463,10 +684,14 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         peaks_unexplained=len(peak_list) - len(peak_match_map),
                         hypothesis_sample_match_id=hypothesis_sample_match_id,
                         theoretical_glycopeptide_id=theoretical.id,
-                        hypothesis_id=hypothesis_id)
+                        hypothesis_id=theoretical_hypothesis_id)
                     glycopeptide_matches_spectrum_matches.append(spectrum_match_inst)
 
         session.bulk_save_objects(glycopeptide_matches_spectrum_matches)
+        if checkpoint_key is not None:
+            # Recorded in the same transaction as the matches, so a batch is never
+            # both skipped on restart and missing its results
+            PipelineProgress.record(session, checkpoint_key, [scan_id[0] for scan_id in scan_ids])
         session.commit()
         return len(scan_ids)
     except Exception, e:
@@ -479,6 +704,20 @@ def batch_match_theoretical_ions(scan_ids, msmsdb_path, ms1_tolerance, ms2_toler
             pass
 
 
+def match_sample_spectra(task, **kwargs):
+    '''
+    Run :func:`batch_match_theoretical_ions` over a `(sample_run_id, hypothesis_sample_match_id, scan_ids)`
+    work item produced by :meth:`BatchSpectrumMatching.stream_tandem_spectra`, searching the
+    process-wide :class:`TheoreticalGlycopeptideIndex`
+    '''
+    sample_run_id, hypothesis_sample_match_id, scan_ids = task
+    return batch_match_theoretical_ions(
+        scan_ids, sample_run_id=sample_run_id, hypothesis_sample_match_id=hypothesis_sample_match_id,
+        use_index=True, checkpoint_key=spectrum_matching_checkpoint_key(
+            kwargs["hypothesis_id"], hypothesis_sample_match_id, kwargs.get("decoy_hypothesis_id")),
+        **kwargs)
+
+
 def search_spectrum(theoretical, spectrum):
     peak_list = spectrum.tandem_data
     peak_list = [p for p in peak_list if p.intensity >= 150.]
@@ -501,6 +740,7 @@ def search_spectrum(theoretical, spectrum):
                 match_error = lppm_error(observed_mass, deprotonated_mass)
                 if lfabs(match_error) <= ms2_tolerance:
                     match = ({'key': theoretical_ion.name,
+                              'ion': theoretical_ion.identifier,
                               "intensity": peak.intensity,
                               "observed_mass": observed_mass,
                               'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -550,7 +790,39 @@ class IonMatching(PipelineModule):
                                     intensity_threshold=self.intensity_threshold)
         return task_fn
 
+    def estimate_theoretical_costs(self):
+        '''
+        Estimate the work of searching each theoretical glycopeptide as the number of
+        spectra within the precursor tolerance times its number of fragments, plus one
+        for the database lookup every theoretical incurs.
+
+        Returns
+        -------
+        ids: np.ndarray
+        costs: np.ndarray
+        '''
+        session = self.manager.session()
+        try:
+            ids, masses, fragment_counts = load_theoretical_sizes(session, self.hypothesis_id)
+        finally:
+            session.close()
+        precursor_masses = load_precursor_masses(self.msmsdb, self.sample_run_id)
+        costs = 1 + window_counts(precursor_masses, masses, self.ms1_tolerance) * fragment_counts
+        return ids, costs
+
     def stream_theoretical_glycopeptides(self, chunksize=500):
+        '''
+        Yield lists of at most `chunksize` theoretical glycopeptide ids. With more than
+        one worker process, batches are balanced by estimated cost using
+        :func:`~glycresoft_sqlalchemy.utils.partitioning.cost_balanced_batches`.
+        '''
+        if self.n_processes > 1:
+            ids, costs = self.estimate_theoretical_costs()
+            logger.info("Partitioning %d theoretical glycopeptides with estimated cost %d",
+                        len(ids), costs.sum())
+            for batch in cost_balanced_batches(ids.tolist(), costs, self.n_processes, chunksize):
+                yield batch
+            return
         session = self.manager.session()
         try:
             for name, protein_id in session.query(
@@ -587,15 +859,15 @@ class IonMatching(PipelineModule):
                 self.session.add(hsm)
         self.session.commit()
         session = self.session
-        task_fn = self.prepare_task_fn()
+        task_fn = self.instrument_task(self.prepare_task_fn())
         cntr = 0
         last = 0
         if self.n_processes > 1:
             pool = multiprocessing.Pool(self.n_processes)
-            for res in pool.imap(task_fn, self.stream_theoretical_glycopeptides(500)):
+            for res in pool.imap_unordered(task_fn, self.stream_theoretical_glycopeptides(500)):
                 cntr += res
                 if (cntr - last) > 1000:
-                    logger.info("%d Searches Complete." % cntr)
+                    self.report_progress(cntr, "searches complete")
                     last = cntr
             pool.close()
             pool.join()
@@ -603,13 +875,22 @@ class IonMatching(PipelineModule):
             for theoretical in self.stream_theoretical_glycopeptides():
                 cntr += task_fn(theoretical)
                 if (cntr - last) > 1000:
-                    logger.info("%d Searches Complete." % cntr)
+                    self.report_progress(cntr, "searches complete")
                     last = cntr
+        self.count(items=cntr)
         session.commit()
         session.close()
 
 
 class SpectrumMatching(PipelineModule):
+    '''
+    Match each tandem spectrum of a sample run against the theoretical glycopeptides
+    within its precursor tolerance.
+
+    If `decoy_hypothesis_id` is given, target and decoy glycopeptides are matched in
+    the same pass, so each spectrum is loaded and preprocessed once rather than once
+    per hypothesis. Matches carry the id of the hypothesis they came from.
+    '''
     def __init__(self, database_path, hypothesis_id,
                  observed_ions_path,
                  observed_ions_type='bupid_yaml',
@@ -618,10 +899,12 @@ class SpectrumMatching(PipelineModule):
                  ms1_tolerance=ms1_tolerance_default,
                  ms2_tolerance=ms2_tolerance_default,
                  intensity_threshold=0.0,
-                 n_processes=4):
+                 n_processes=4,
+                 decoy_hypothesis_id=None):
         self.manager = self.manager_type(database_path)
         self.session = self.manager.session()
         self.hypothesis_id = hypothesis_id
+        self.decoy_hypothesis_id = decoy_hypothesis_id
         self.n_processes = n_processes
 
         self.ms1_tolerance = ms1_tolerance
@@ -644,13 +927,75 @@ class SpectrumMatching(PipelineModule):
                                     hypothesis_sample_match_id=self.hypothesis_sample_match_id,
                                     sample_run_id=self.sample_run_id,
                                     hypothesis_id=self.hypothesis_id,
-                                    intensity_threshold=self.intensity_threshold)
+                                    decoy_hypothesis_id=self.decoy_hypothesis_id,
+                                    intensity_threshold=self.intensity_threshold,
+                                    checkpoint_key=self.checkpoint_key())
         return task_fn
 
+    def checkpoint_key(self):
+        return spectrum_matching_checkpoint_key(
+            self.hypothesis_id, self.hypothesis_sample_match_id, self.decoy_hypothesis_id)
+
+    def estimate_spectrum_costs(self, sample_run_id=None, theoretical_sizes=None):
+        '''
+        Estimate the work of searching each tandem scan as the total number of fragments
+        of the theoretical glycopeptides within its precursor tolerance, plus one for the
+        database lookup every scan incurs.
+
+        Parameters
+        ----------
+        sample_run_id: int, optional
+            Defaults to :attr:`sample_run_id`
+        theoretical_sizes: tuple, optional
+            The result of :func:`load_theoretical_sizes`, loaded if not given
+
+        Returns
+        -------
+        scan_ids: list of tuple
+        costs: np.ndarray
+        '''
+        if sample_run_id is None:
+            sample_run_id = self.sample_run_id
+        if theoretical_sizes is None:
+            session = self.manager.session()
+            try:
+                theoretical_sizes = load_theoretical_sizes(session, self.hypothesis_id, self.decoy_hypothesis_id)
+            finally:
+                session.close()
+        ids, masses, fragment_counts = theoretical_sizes
+        ion_session = self.msmsdb.session()
+        try:
+            scans = ion_session.query(TandemScan.id, TandemScan.precursor_neutral_mass).filter(
+                TandemScan.sample_run_id == sample_run_id).all()
+        finally:
+            ion_session.close()
+        if not scans:
+            return [], np.array([])
+        scan_ids, precursor_masses = zip(*scans)
+        costs = 1 + window_counts(masses, precursor_masses, self.ms1_tolerance, fragment_counts)
+        return [(scan_id,) for scan_id in scan_ids], costs
+
     def stream_tandem_spectra(self, chunksize=100):
+        '''
+        Yield lists of at most `chunksize` one-element tuples of tandem scan ids. With more
+        than one worker process, batches are balanced by estimated cost using
+        :func:`~glycresoft_sqlalchemy.utils.partitioning.cost_balanced_batches`.
+
+        Scans completed by an interrupted previous run are skipped.
+        '''
+        completed = self.load_checkpoint()
+        if completed:
+            logger.info("Resuming after %d completed spectra", len(completed))
+        if self.n_processes > 1:
+            scan_ids, costs = skip_completed(*self.estimate_spectrum_costs(), completed=completed)
+            logger.info("Partitioning %d spectra with estimated cost %d", len(scan_ids), costs.sum())
+            for batch in cost_balanced_batches(scan_ids, costs, self.n_processes, chunksize):
+                yield batch
+            return
         session = self.msmsdb.session()
         try:
             scan_ids = session.query(TandemScan.id).filter(TandemScan.sample_run_id == self.sample_run_id).all()
+            scan_ids = [scan_id for scan_id in scan_ids if scan_id[0] not in completed]
             last = 0
             total = len(scan_ids)
             while last <= total:
@@ -675,7 +1020,7 @@ class SpectrumMatching(PipelineModule):
             self.session.add(hsm)
             self.session.commit()
 
-        task_fn = self.prepare_task_fn()
+        task_fn = self.instrument_task(self.prepare_task_fn())
         cntr = 0
         last = 0
         if self.n_processes > 1:
@@ -683,7 +1028,7 @@ class SpectrumMatching(PipelineModule):
             for res in pool.imap_unordered(task_fn, self.stream_tandem_spectra()):
                 cntr += res
                 if (cntr - last) > 100:
-                    logger.info("%d Searches Complete." % cntr)
+                    self.report_progress(cntr, "searches complete")
                     last = cntr
             pool.close()
             pool.join()
@@ -692,5 +1037,125 @@ class SpectrumMatching(PipelineModule):
             for theoretical in self.stream_tandem_spectra():
                 cntr += task_fn(theoretical)
                 if (cntr - last) > 100:
-                    logger.info("%d Searches Complete." % cntr)
+                    self.report_progress(cntr, "searches complete")
                     last = cntr
+        self.count(items=cntr)
+
+
+class BatchSpectrumMatching(SpectrumMatching):
+    '''
+    Match the tandem spectra of several sample runs against one hypothesis in a single
+    pass, writing each sample's :class:`GlycopeptideSpectrumMatch` records to its own
+    :class:`HypothesisSampleMatch`.
+
+    The hypothesis' masses are read once for all samples, and each worker process keeps
+    a :class:`TheoreticalGlycopeptideIndex` of theoretical glycopeptides for the whole
+    run, so a glycopeptide's fragments are loaded once rather than once per sample.
+
+    Parameters
+    ----------
+    sample_matches: list of tuple
+        Pairs of `(sample_run_id, hypothesis_sample_match_id)`
+    '''
+    def __init__(self, database_path, hypothesis_id,
+                 observed_ions_path, sample_matches,
+                 ms1_tolerance=ms1_tolerance_default,
+                 ms2_tolerance=ms2_tolerance_default,
+                 intensity_threshold=0.0,
+                 n_processes=4,
+                 decoy_hypothesis_id=None):
+        super(BatchSpectrumMatching, self).__init__(
+            database_path, hypothesis_id, observed_ions_path, observed_ions_type='db',
+            ms1_tolerance=ms1_tolerance, ms2_tolerance=ms2_tolerance,
+            intensity_threshold=intensity_threshold, n_processes=n_processes,
+            decoy_hypothesis_id=decoy_hypothesis_id)
+        self.sample_matches = list(sample_matches)
+
+    def prepare_task_fn(self):
+        task_fn = functools.partial(match_sample_spectra,
+                                    msmsdb_path=self.msmsdb.path,
+                                    ms1_tolerance=self.ms1_tolerance,
+                                    ms2_tolerance=self.ms2_tolerance,
+                                    database_manager=self.manager,
+                                    hypothesis_id=self.hypothesis_id,
+                                    decoy_hypothesis_id=self.decoy_hypothesis_id,
+                                    intensity_threshold=self.intensity_threshold,
+                                    index_versions=self.index_versions())
+        return task_fn
+
+    def index_versions(self):
+        session = self.manager.session()
+        try:
+            return {hypothesis_id: theoretical_index_version(session, hypothesis_id)
+                    for hypothesis_id in searched_hypotheses(self.hypothesis_id, self.decoy_hypothesis_id)}
+        finally:
+            session.close()
+
+    def checkpoint_key(self):
+        return None
+
+    def checkpoint_keys(self):
+        return [spectrum_matching_checkpoint_key(
+                self.hypothesis_id, hypothesis_sample_match_id, self.decoy_hypothesis_id)
+                for sample_run_id, hypothesis_sample_match_id in self.sample_matches]
+
+    def stream_tandem_spectra(self, chunksize=100):
+        '''
+        Yield `(sample_run_id, hypothesis_sample_match_id, scan_ids)` work items covering
+        every sample run in turn, each holding at most `chunksize` tandem scan ids.
+        Scans completed by an interrupted previous run are skipped.
+        '''
+        session = self.manager.session()
+        try:
+            theoretical_sizes = load_theoretical_sizes(session, self.hypothesis_id, self.decoy_hypothesis_id)
+        finally:
+            session.close()
+        for sample_run_id, hypothesis_sample_match_id in self.sample_matches:
+            scan_ids, costs = skip_completed(
+                *self.estimate_spectrum_costs(sample_run_id, theoretical_sizes),
+                completed=self.load_checkpoint(spectrum_matching_checkpoint_key(
+                    self.hypothesis_id, hypothesis_sample_match_id, self.decoy_hypothesis_id)))
+            logger.info("Sample Run %d: %d spectra with estimated cost %d", sample_run_id, len(scan_ids), costs.sum())
+            if self.n_processes > 1:
+                batches = cost_balanced_batches(scan_ids, costs, self.n_processes, chunksize)
+            else:
+                batches = (scan_ids[i:(i + chunksize)] for i in range(0, len(scan_ids), chunksize))
+            for batch in batches:
+                yield sample_run_id, hypothesis_sample_match_id, batch
+
+    def run(self):
+        for sample_run_id, hypothesis_sample_match_id in self.sample_matches:
+            hsm = self.session.query(HypothesisSampleMatch).get(hypothesis_sample_match_id)
+            hsm.parameters.update({
+                    "ms1_ppm_tolerance": self.ms1_tolerance,
+                    "ms2_ppm_tolerance": self.ms2_tolerance,
+                    "intensity_threshold": self.intensity_threshold,
+                    "observed_ions_path": self.observed_ions_path
+            })
+            self.session.add(hsm)
+        self.session.commit()
+
+        task_fn = self.instrument_task(self.prepare_task_fn())
+        cntr = 0
+        last = 0
+        try:
+            if self.n_processes > 1:
+                pool = multiprocessing.Pool(self.n_processes)
+                for res in pool.imap_unordered(task_fn, self.stream_tandem_spectra()):
+                    cntr += res
+                    if (cntr - last) > 100:
+                        self.report_progress(cntr, "searches complete")
+                        last = cntr
+                pool.close()
+                pool.join()
+            else:
+                for task in self.stream_tandem_spectra():
+                    cntr += task_fn(task)
+                    if (cntr - last) > 100:
+                        self.report_progress(cntr, "searches complete")
+                        last = cntr
+        finally:
+            # The index of a single process run lives in this process
+            clear_theoretical_index_cache()
+        self.inform("%d Searches Complete over %d samples." % (cntr, len(self.sample_matches)))
+        self.count(items=cntr)
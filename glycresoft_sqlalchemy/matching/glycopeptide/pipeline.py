@@ -1,18 +1,27 @@
+import hashlib
+
 from glycresoft_sqlalchemy.data_model import (
     PipelineModule, MS2GlycopeptideHypothesisSampleMatch,
-    SampleRun, Hypothesis, HypothesisSampleMatch)
-from glycresoft_sqlalchemy.matching.glycopeptide.fragment_matching import SpectrumMatching
+    SampleRun, Hypothesis, HypothesisSampleMatch, HypothesisSampleMatchProteinSummary)
+from glycresoft_sqlalchemy.matching.glycopeptide.fragment_matching import SpectrumMatching, BatchSpectrumMatching
 from glycresoft_sqlalchemy.matching.glycopeptide.spectrum_assignment import SpectrumMatchAnalyzer
 from glycresoft_sqlalchemy.scoring import target_decoy
 
 
 class GlycopeptideFragmentMatchingPipeline(PipelineModule):
+    '''
+    Match the tandem spectra of a sample run against a target and a decoy hypothesis,
+    assign spectra to their best matches and summarize the results.
 
+    With `joint_matching`, target and decoy glycopeptides are matched against each
+    spectrum in a single pass. Otherwise the target and then the decoy hypothesis are
+    searched separately, reading every spectrum twice.
+    '''
     def __init__(self, database_path, observed_ions_path,
                  target_hypothesis_id, decoy_hypothesis_id, hypothesis_sample_match_id=None,
                  sample_run_id=None, scorer=None, ms1_tolerance=1e-5,
                  ms2_tolerance=2e-5, intensity_threshold=150., n_processes=4,
-                 **kwargs):
+                 joint_matching=True, **kwargs):
         if sample_run_id is None:
             sample_run_id = 1
         self.manager = self.manager_type(database_path)
@@ -25,6 +34,7 @@ class GlycopeptideFragmentMatchingPipeline(PipelineModule):
         self.ms2_tolerance = ms2_tolerance
         self.intensity_threshold = intensity_threshold
         self.n_processes = n_processes
+        self.joint_matching = joint_matching
         self.options = kwargs
         self.scorer = scorer
 
@@ -60,6 +70,7 @@ class GlycopeptideFragmentMatchingPipeline(PipelineModule):
                 "ms2_tolerance": self.ms2_tolerance,
                 "intensity_threshold": self.intensity_threshold,
                 "n_processes": self.n_processes,
+                "joint_matching": self.joint_matching,
                 "options": self.options,
             })
         else:
@@ -76,6 +87,7 @@ class GlycopeptideFragmentMatchingPipeline(PipelineModule):
                 "ms2_tolerance": self.ms2_tolerance,
                 "intensity_threshold": self.intensity_threshold,
                 "n_processes": self.n_processes,
+                "joint_matching": self.joint_matching,
                 "options": self.options,
             })
         session.add(hsm)
@@ -111,9 +123,33 @@ class GlycopeptideFragmentMatchingPipeline(PipelineModule):
             )
         task.start()
 
+    def do_joint_matching(self):
+        task = SpectrumMatching(
+            self.database_path,
+            self.target_hypothesis_id,
+            self.observed_ions_path,
+            observed_ions_type='db',
+            sample_run_id=self.sample_run_id,
+            hypothesis_sample_match_id=self.hypothesis_sample_match_id,
+            intensity_threshold=self.intensity_threshold,
+            ms1_tolerance=self.ms1_tolerance,
+            ms2_tolerance=self.ms2_tolerance,
+            n_processes=self.n_processes,
+            decoy_hypothesis_id=self.decoy_hypothesis_id
+            )
+        task.start()
+
     def do_matching(self):
-        self.do_target_matching()
-        self.do_decoy_matching()
+        if self.joint_matching:
+            self.do_joint_matching()
+        else:
+            self.do_target_matching()
+            self.do_decoy_matching()
+
+    def matching_stages(self):
+        if self.joint_matching:
+            return (self.do_joint_matching,)
+        return (self.do_target_matching, self.do_decoy_matching)
 
     def do_spectrum_assignment(self):
         task = SpectrumMatchAnalyzer(
@@ -137,7 +173,115 @@ class GlycopeptideFragmentMatchingPipeline(PipelineModule):
         if not is_loaded:
             hypothesis_sample_match.copy_tandem_sample_run(sample_run)
 
+    def do_summarize_results(self):
+        HypothesisSampleMatchProteinSummary.build(self.manager(), self.hypothesis_sample_match_id)
+
+    def checkpoint_layout(self):
+        # The stages are recorded by index, so a run with a different stage layout
+        # must not read the progress of another
+        return u"target=%s:decoy=%s:joint=%d" % (
+            self.target_hypothesis_id, self.decoy_hypothesis_id, bool(self.joint_matching))
+
+    def checkpoint_key(self):
+        if self.hypothesis_sample_match_id is None:
+            return None
+        return u"%s:hypothesis_sample_match=%d:%s" % (
+            self.__class__.__name__, self.hypothesis_sample_match_id, self.checkpoint_layout())
+
     def run(self):
+        # Passing the hypothesis_sample_match_id of an interrupted run resumes it
         self.prepare_hypothesis_sample_match()
-        self.do_matching()
-        self.do_spectrum_assignment()
+        self.run_stages(*(self.matching_stages() + (
+            self.do_spectrum_assignment,
+            self.do_summarize_results)))
+
+
+class BatchGlycopeptideFragmentMatchingPipeline(GlycopeptideFragmentMatchingPipeline):
+    '''
+    Search one target/decoy hypothesis pair against many sample runs, creating one
+    :class:`MS2GlycopeptideHypothesisSampleMatch` per sample run.
+
+    Spectrum matching for all samples shares a single worker pool and a single load
+    of the hypothesis through :class:`BatchSpectrumMatching`. Spectrum assignment and
+    result summaries are then computed for each sample's match.
+
+    Attributes
+    ----------
+    sample_run_ids: list of int
+    hypothesis_sample_match_ids: list of int
+        Parallel to `sample_run_ids`. Passing the matches of an interrupted run resumes it,
+        otherwise they are created by :meth:`prepare_hypothesis_sample_match`
+    '''
+    def __init__(self, database_path, observed_ions_path,
+                 target_hypothesis_id, decoy_hypothesis_id, sample_run_ids,
+                 hypothesis_sample_match_ids=None, scorer=None, ms1_tolerance=1e-5,
+                 ms2_tolerance=2e-5, intensity_threshold=150., n_processes=4,
+                 joint_matching=True, **kwargs):
+        super(BatchGlycopeptideFragmentMatchingPipeline, self).__init__(
+            database_path, observed_ions_path, target_hypothesis_id, decoy_hypothesis_id,
+            scorer=scorer, ms1_tolerance=ms1_tolerance, ms2_tolerance=ms2_tolerance,
+            intensity_threshold=intensity_threshold, n_processes=n_processes,
+            joint_matching=joint_matching, **kwargs)
+        self.sample_run_ids = list(sample_run_ids)
+        if hypothesis_sample_match_ids is None:
+            hypothesis_sample_match_ids = [None] * len(self.sample_run_ids)
+        elif len(hypothesis_sample_match_ids) != len(self.sample_run_ids):
+            raise ValueError("One hypothesis_sample_match_id is required for each sample run")
+        self.hypothesis_sample_match_ids = list(hypothesis_sample_match_ids)
+
+    def each_sample(self):
+        '''Point the single-sample attributes at each sample run and its match in turn'''
+        for sample_run_id, hypothesis_sample_match_id in zip(
+                self.sample_run_ids, self.hypothesis_sample_match_ids):
+            self.sample_run_id = sample_run_id
+            self.hypothesis_sample_match_id = hypothesis_sample_match_id
+            yield sample_run_id, hypothesis_sample_match_id
+
+    def prepare_hypothesis_sample_match(self):
+        hypothesis_sample_match_ids = []
+        for sample_run_id, hypothesis_sample_match_id in zip(
+                self.sample_run_ids, self.hypothesis_sample_match_ids):
+            self.sample_run_id = sample_run_id
+            self.hypothesis_sample_match_id = hypothesis_sample_match_id
+            super(BatchGlycopeptideFragmentMatchingPipeline, self).prepare_hypothesis_sample_match()
+            hypothesis_sample_match_ids.append(self.hypothesis_sample_match_id)
+        self.hypothesis_sample_match_ids = hypothesis_sample_match_ids
+
+    def checkpoint_key(self):
+        if None in self.hypothesis_sample_match_ids:
+            return None
+        # Cohorts of hundreds of samples would not fit in the key column
+        digest = hashlib.md5(",".join(map(str, self.hypothesis_sample_match_ids))).hexdigest()
+        return u"%s:hypothesis_sample_matches=%s:%s" % (
+            self.__class__.__name__, digest, self.checkpoint_layout())
+
+    def _batch_matching(self, hypothesis_id, decoy_hypothesis_id=None):
+        task = BatchSpectrumMatching(
+            self.database_path,
+            hypothesis_id,
+            self.observed_ions_path,
+            zip(self.sample_run_ids, self.hypothesis_sample_match_ids),
+            intensity_threshold=self.intensity_threshold,
+            ms1_tolerance=self.ms1_tolerance,
+            ms2_tolerance=self.ms2_tolerance,
+            n_processes=self.n_processes,
+            decoy_hypothesis_id=decoy_hypothesis_id
+            )
+        task.start()
+
+    def do_joint_matching(self):
+        self._batch_matching(self.target_hypothesis_id, self.decoy_hypothesis_id)
+
+    def do_target_matching(self):
+        self._batch_matching(self.target_hypothesis_id)
+
+    def do_decoy_matching(self):
+        self._batch_matching(self.decoy_hypothesis_id)
+
+    def do_spectrum_assignment(self):
+        for _ in self.each_sample():
+            super(BatchGlycopeptideFragmentMatchingPipeline, self).do_spectrum_assignment()
+
+    def do_summarize_results(self):
+        for _ in self.each_sample():
+            super(BatchGlycopeptideFragmentMatchingPipeline, self).do_summarize_results()
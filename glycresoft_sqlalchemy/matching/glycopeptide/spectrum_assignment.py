@@ -35,9 +35,13 @@ def score_spectrum_matches(times, database_manager, scorer, score_parameters, hy
             #     GlycopeptideSpectrumMatch.scan_time == time[0]).all()
             best_score = -(float('inf'))
             best_match = []
-            for match in matches:
+            if hasattr(scorer, "score_batch"):
+                scores = scorer.score_batch(matches, **score_parameters)
+            else:
+                scores = [scorer(match.as_match_like(), match.theoretical_glycopeptide, **score_parameters)
+                          for match in matches]
+            for match, score in zip(matches, scores):
                 match.best_match = False
-                score = scorer(match.as_match_like(), match.theoretical_glycopeptide, **score_parameters)
                 scores_collection.append(score)
                 spectrum_match_collection.append(match)
                 if score.value > best_score:
@@ -15,6 +15,7 @@ from ..spectra.bupid_topdown_deconvoluter_sa import BUPIDMSMSYamlParser
 
 from .. import data_model as model
 from ..data_model import PipelineModule, MSMSSqlDB
+from ..structure.fragment import get_ion_identifier
 from ..utils.common_math import ppm_error
 
 
@@ -100,6 +101,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(protonated_mass, query_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": protonated_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -122,6 +124,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "intensity": peak.intensity,
                                       "observed_mass": observed_mass,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -139,6 +142,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -156,6 +160,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -173,6 +178,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
@@ -190,6 +196,7 @@ def batch_match_fragments(theoretical_ids, msmsdb_path, ms1_tolerance, ms2_toler
                         match_error = lppm_error(observed_mass, deprotonated_mass)
                         if lfabs(match_error) <= ms2_tolerance:
                             match = ({'key': theoretical_ion['key'],
+                                      'ion': get_ion_identifier(theoretical_ion),
                                       "observed_mass": observed_mass,
                                       "intensity": peak.intensity,
                                       'ppm_error': match_error, "peak_id": peak.scan_peak_index})
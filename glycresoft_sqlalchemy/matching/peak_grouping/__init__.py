@@ -1,4 +1,4 @@
 from .grouper import Decon2LSPeakGrouper
 from .mass_shift_offset_matching import PeakGroupMatching
 from .classification import ClassifierType, PeakGroupMassShiftJoiningClassifier
-from .pipeline import LCMSPeakClusterSearch
+from .pipeline import LCMSPeakClusterSearch, BatchLCMSPeakClusterSearch
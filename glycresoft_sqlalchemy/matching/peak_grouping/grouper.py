@@ -19,7 +19,7 @@ from sqlalchemy.orm import make_transient
 
 from glycresoft_sqlalchemy.data_model import (
     Decon2LSPeak, Decon2LSPeakGroup, Decon2LSPeakToPeakGroupMap,
-    PipelineModule, MSScan, ScanBase)
+    PipelineModule, PipelineProgress, MSScan, ScanBase)
 
 from glycresoft_sqlalchemy.utils.common_math import ppm_error
 
@@ -88,6 +88,7 @@ class Decon2LSPeakGrouper(PipelineModule):
         conn = session.connection()
         map_items = []
 
+        count = -1
         for count, row in enumerate(session.query(Decon2LSPeak.id, Decon2LSPeak.monoisotopic_mass).join(
                 ScanBase).filter(
                 ScanBase.time.between(self.minimum_scan_id, self.maximum_scan_id),
@@ -138,14 +139,26 @@ class Decon2LSPeakGrouper(PipelineModule):
         map_items = []
         session.commit()
         session.close()
+        self.count(items=count + 1, rows_read=count + 1)
+
+    def checkpoint_key(self):
+        return u"%s:sample_run=%d:tolerance=%r:scans=%r-%r" % (
+            self.__class__.__name__, self.sample_run_id, self.grouping_error_tolerance,
+            self.minimum_scan_id, self.maximum_scan_id)
 
     def stream_group_ids(self):
         '''
-        Session-bounded generator of Decon2LSPeakGroup ids
+        Session-bounded generator of Decon2LSPeakGroup ids, skipping those
+        completed by an interrupted previous run
         '''
+        completed = self.load_checkpoint()
+        if completed:
+            logger.info("Resuming after %d completed groups", len(completed))
         session = self.manager.session()
         try:
             for gid in session.query(Decon2LSPeakGroup.id):
+                if gid[0] in completed:
+                    continue
                 yield gid[0]
         except Exception, e:
             logger.exception("An error occurred while streaming ids, %r", locals(), exc_info=e)
@@ -153,6 +166,14 @@ class Decon2LSPeakGrouper(PipelineModule):
         finally:
             session.close()
 
+    def store_groups(self, session, groups):
+        '''
+        Write the features of completed `groups` and record their progress in one transaction
+        '''
+        session.bulk_update_mappings(Decon2LSPeakGroup, groups)
+        PipelineProgress.record(session, self.checkpoint_key(), [group["id"] for group in groups])
+        session.commit()
+
     def update_groups(self):
         '''
         Once peaks have been completely assigned to clusters, calculate peak group
@@ -163,34 +184,33 @@ class Decon2LSPeakGrouper(PipelineModule):
         task_fn = functools.partial(
             fill_out_group, database_manager=self.manager, minimum_scan_count=self.minimum_scan_count)
         accumulator = []
+        count = 0
         if self.n_processes > 1:
             logger.info("Running concurrently")
             pool = multiprocessing.Pool(self.n_processes)
-            count = 0
             for group in pool.imap_unordered(task_fn, self.stream_group_ids(), chunksize=25):
                 count += 1
                 if group is not None:
                     accumulator.append(group)
                 if count % 10000 == 0:
-                    session.bulk_update_mappings(Decon2LSPeakGroup, accumulator)
-                    session.commit()
+                    self.store_groups(session, accumulator)
                     accumulator = []
                     logger.info("%d groups completed", count)
             pool.terminate()
         else:
-            for count, group_id in enumerate(session.query(Decon2LSPeakGroup.id)):
+            for group_id in self.stream_group_ids():
+                count += 1
                 group = task_fn(group_id)
                 if group is not None:
                     accumulator.append(group)
                 if count % 10000 == 0:
-                    session.bulk_update_mappings(Decon2LSPeakGroup, accumulator)
-                    session.commit()
+                    self.store_groups(session, accumulator)
                     accumulator = []
                     logger.info("%d groups completed", count)
 
-        session.bulk_update_mappings(Decon2LSPeakGroup, accumulator)
-        session.commit()
+        self.store_groups(session, accumulator)
         session.close()
+        self.count(items=count)
 
     def estimate_trends(self):
         '''
@@ -236,9 +256,9 @@ class Decon2LSPeakGrouper(PipelineModule):
         conn.close()
 
     def run(self):
-        self.group_peaks()
-        self.update_groups()
-        self.estimate_trends()
+        # group_peaks clears all prior groups of this sample, so it is only repeated
+        # if it was itself interrupted
+        self.run_stages(self.group_peaks, self.update_groups, self.estimate_trends)
 
 
 def update_fit(group_id, database_manager, cen_alpha, cen_beta, expected_a_alpha, expected_a_beta,
@@ -3,6 +3,9 @@ import logging
 import multiprocessing
 import functools
 import itertools
+
+import numpy as np
+
 try:
     logger = logging.getLogger("peak_grouping")
     logging.basicConfig(level='DEBUG')
@@ -16,7 +19,7 @@ from glycresoft_sqlalchemy.data_model import (
     PipelineModule,
     SampleRun, Decon2LSPeakGroup,
     TheoreticalCompositionMap, MassShift, HypothesisSampleMatch,
-    PeakGroupDatabase, PeakGroupMatch, JointPeakGroupMatch
+    PeakGroupDatabase, PeakGroupMatch, JointPeakGroupMatch, PipelineProgress
 )
 
 from .common import ppm_error
@@ -32,6 +35,61 @@ SCALE = get_scale()
 query_oven = bakery()
 
 
+class TheoreticalMassIndex(object):
+    '''
+    The ids and calculated masses of a hypothesis' theoretical compositions, held
+    in memory in mass order so that many sample runs can be searched against them
+    without querying the hypothesis database for every peak group.
+
+    Instances are plain arrays. Each worker process receives the index once, through
+:func:`install_mass_index`, rather than with every task.
+
+    Attributes
+    ----------
+    ids : np.ndarray
+    masses : np.ndarray
+        Ascending, parallel to `ids`
+    '''
+    def __init__(self, ids, masses):
+        self.ids = np.asarray(ids, dtype=int)
+        self.masses = np.asarray(masses, dtype=float)
+
+    @classmethod
+    def from_hypothesis(cls, session, search_type, hypothesis_id):
+        rows = session.query(search_type.id, search_type.calculated_mass).filter(
+            search_type.from_hypothesis(hypothesis_id)).order_by(search_type.calculated_mass).all()
+        if not rows:
+            return cls([], [])
+        ids, masses = zip(*rows)
+        return cls(ids, masses)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, mass, tolerance):
+        '''
+        The `(id, calculated_mass)` pairs within `tolerance` ppm of `mass`, matching
+        the `ppm_error_tolerance_search` method of the theoretical type
+        '''
+        width = mass * tolerance
+        lower = np.searchsorted(self.masses, mass - width, 'left')
+        upper = np.searchsorted(self.masses, mass + width, 'right')
+        return zip(self.ids[lower:upper].tolist(), self.masses[lower:upper].tolist())
+
+
+_mass_index = None
+
+
+def install_mass_index(mass_index):
+    '''
+    Make `mass_index` the :class:`TheoreticalMassIndex` searched by
+    :func:`batch_match_theoretical_composition` in this process. Used as
+    the initializer of worker pools.
+    '''
+    global _mass_index
+    _mass_index = mass_index
+
+
 def yield_ids(session, theoretical_type, hypothesis_id, chunk_size=100, filter=lambda q: q):
     base_query = filter(session.query(theoretical_type.id).filter(
         theoretical_type.from_hypothesis(hypothesis_id))).all()
@@ -63,8 +121,9 @@ def yield_peak_group_ids(session, group_type, sample_run_id, chunk_size=100, fil
 def batch_match_theoretical_composition(
         peak_group_ids, search_type, database_manager, observed_ions_manager,
         matching_tolerance, mass_shift_map, hypothesis_id,
-        hypothesis_sample_match_id):
+        hypothesis_sample_match_id, use_mass_index=False, checkpoint_key=None):
     session = database_manager()
+    mass_index = _mass_index if use_mass_index else None
     ions_session = observed_ions_manager()
     params = []
     try:
@@ -76,12 +135,17 @@ def batch_match_theoretical_composition(
                 shift = mass_shift.mass
                 for shift_count in range(1, count_range + 1):
                     total_mass = base_mass + (shift * shift_count)
-                    for mass_match in search_type.ppm_error_tolerance_search(
-                            session=session,
-                            mass=total_mass, tolerance=matching_tolerance,
-                            hypothesis_id=hypothesis_id):
-                        mass_error = ppm_error(mass_match.calculated_mass, total_mass)
-                        matches.append((mass_match.id, mass_error, mass_shift, shift_count))
+                    if mass_index is not None:
+                        candidates = mass_index.search(total_mass, matching_tolerance)
+                    else:
+                        candidates = ((mass_match.id, mass_match.calculated_mass)
+                                      for mass_match in search_type.ppm_error_tolerance_search(
+                                          session=session,
+                                          mass=total_mass, tolerance=matching_tolerance,
+                                          hypothesis_id=hypothesis_id))
+                    for mass_match_id, calculated_mass in candidates:
+                        mass_error = ppm_error(calculated_mass, total_mass)
+                        matches.append((mass_match_id, mass_error, mass_shift, shift_count))
 
             for mass_match_id, mass_error, mass_shift, shift_count in matches:
                 case = {
@@ -109,6 +173,9 @@ def batch_match_theoretical_composition(
                 }
                 params.append(case)
         session.bulk_insert_mappings(PeakGroupMatch, params)
+        if checkpoint_key is not None:
+            # Recorded in the same transaction as the matches of these peak groups
+            PipelineProgress.record(session, checkpoint_key, [peak_group_id[0] for peak_group_id in peak_group_ids])
         session.commit()
 
     except Exception, e:
@@ -304,7 +371,7 @@ class PeakGroupMatching(PipelineModule):
                 if res is not None:
                     accumulator.extend(res)
                 if counter % 1000 == 0:
-                    logger.info("%d masses searched", counter)
+                    self.report_progress(counter, "masses searched")
                 if len(accumulator) > 1000:
                     session.bulk_insert_mappings(PeakGroupMatch, accumulator)
                     session.commit()
@@ -316,7 +383,7 @@ class PeakGroupMatching(PipelineModule):
                 if res is not None:
                     accumulator.extend(res)
                 if counter % 1000 == 0:
-                    logger.info("%d masses searched", counter)
+                    self.report_progress(counter, "masses searched")
                 if len(accumulator) > 10000:
                     session.bulk_insert_mappings(PeakGroupMatch, accumulator)
                     session.commit()
@@ -325,6 +392,7 @@ class PeakGroupMatching(PipelineModule):
         session.bulk_insert_mappings(PeakGroupMatch, accumulator)
         session.commit()
         logger.info("Search Complete.")
+        self.count(items=counter)
         toggler.create()
         session.close()
 
@@ -365,7 +433,7 @@ class BatchPeakGroupMatching(PeakGroupMatching):
         last = 0
         step = 1000
 
-        task_fn = self.prepare_task_fn()
+        task_fn = self.instrument_task(self.prepare_task_fn())
         toggler = toggle_indices(session, PeakGroupMatch)
         toggler.drop()
         if self.n_processes > 1:
@@ -374,29 +442,61 @@ class BatchPeakGroupMatching(PeakGroupMatching):
                 counter += res
                 if counter > (last + step):
                     last += step
-                    logger.info("%d masses searched", counter)
+                    self.report_progress(counter, "masses searched")
 
         else:
             for res in itertools.imap(task_fn, self.stream_ids()):
                 counter += res
                 if counter > (last + step):
                     last += step
-                    logger.info("%d masses searched", counter)
+                    self.report_progress(counter, "masses searched")
         logger.info("Search Complete.")
+        self.count(items=counter)
         toggler.create()
         session.close()
 
 
 class BatchPeakGroupMatchingSearchGroups(PeakGroupMatching):
+    '''
+    Match each peak group of a sample run against the theoretical compositions of a
+    hypothesis.
+
+    Progress is recorded by peak group id, so an interrupted run resumes with the
+    peak groups it had not matched. The matches of an interrupted run which recorded
+    no progress are deleted before matching starts again.
+    '''
     def __init__(self, *args, **kwargs):
+        mass_index = kwargs.pop("mass_index", None)
         super(BatchPeakGroupMatchingSearchGroups, self).__init__(*args, **kwargs)
+        self.mass_index = mass_index
+
+    def checkpoint_key(self):
+        return u"%s:hypothesis_sample_match=%d:hypothesis=%d:sample_run=%d" % (
+            self.__class__.__name__, self.hypothesis_sample_match_id, self.hypothesis_id, self.sample_run_id)
+
+    def clear_matches(self):
+        session = self.manager.session()
+        try:
+            session.query(PeakGroupMatch).filter(
+                PeakGroupMatch.hypothesis_sample_match_id == self.hypothesis_sample_match_id,
+                PeakGroupMatch.matched).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
 
     def stream_ids(self, chunk_size=200):
         chunk_size *= SCALE
+        completed = self.load_checkpoint()
+        if completed:
+            logger.info("Resuming after %d matched peak groups", len(completed))
+        else:
+            self.clear_matches()
         session = self.lcms_database()
         try:
             for gids in yield_peak_group_ids(session, Decon2LSPeakGroup, self.sample_run_id, chunk_size=chunk_size):
-                yield gids
+                gids = [gid for gid in gids if gid[0] not in completed]
+                if gids:
+                    yield gids
         except Exception, e:
             logger.info("An exception occurred while streaming ids", exc_info=e)
             raise e
@@ -412,7 +512,9 @@ class BatchPeakGroupMatchingSearchGroups(PeakGroupMatching):
             matching_tolerance=self.match_tolerance,
             mass_shift_map=self.mass_shift_map,
             hypothesis_id=self.hypothesis_id,
-            hypothesis_sample_match_id=self.hypothesis_sample_match_id)
+            hypothesis_sample_match_id=self.hypothesis_sample_match_id,
+            use_mass_index=self.mass_index is not None,
+            checkpoint_key=self.checkpoint_key())
         return fn
 
     def run(self):
@@ -422,24 +524,29 @@ class BatchPeakGroupMatchingSearchGroups(PeakGroupMatching):
         last = 0
         step = 1000
 
-        task_fn = self.prepare_task_fn()
+        task_fn = self.instrument_task(self.prepare_task_fn())
         toggler = toggle_indices(session, PeakGroupMatch)
         toggler.drop()
         if self.n_processes > 1:
-            pool = multiprocessing.Pool(self.n_processes)
+            pool = multiprocessing.Pool(self.n_processes, install_mass_index, (self.mass_index,))
             for res in pool.imap_unordered(task_fn, self.stream_ids()):
                 counter += res
                 if counter > (last + step):
                     last += step
-                    logger.info("%d masses searched", counter)
+                    self.report_progress(counter, "masses searched")
             pool.terminate()
         else:
-            for res in itertools.imap(task_fn, self.stream_ids()):
-                counter += res
-                if counter > (last + step):
-                    last += step
-                    logger.info("%d masses searched", counter)
+            install_mass_index(self.mass_index)
+            try:
+                for res in itertools.imap(task_fn, self.stream_ids()):
+                    counter += res
+                    if counter > (last + step):
+                        last += step
+                        self.report_progress(counter, "masses searched")
+            finally:
+                install_mass_index(None)
         logger.info("Search Complete.")
+        self.count(items=counter)
         toggler.create()
         session.close()
 
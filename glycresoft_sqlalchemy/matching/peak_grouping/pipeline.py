@@ -13,13 +13,14 @@ from glycresoft_sqlalchemy.data_model import (
     PipelineModule, MassShift,
     SampleRun, Hypothesis,
     TheoreticalCompositionMap, HypothesisSampleMatch,
-    PeakGroupMatch, JointPeakGroupMatch)
+    PeakGroupMatch, JointPeakGroupMatch, PeakGroupMatchToJointPeakGroupMatch,
+    HypothesisSampleMatchProteinSummary)
 
 from glycresoft_sqlalchemy.utils.database_utils import get_or_create
 from glycresoft_sqlalchemy.utils import pickle
 
 from .grouper import Decon2LSPeakGrouper
-from .mass_shift_offset_matching import BatchPeakGroupMatching
+from .mass_shift_offset_matching import BatchPeakGroupMatching, TheoreticalMassIndex
 from .classification import PeakGroupMassShiftJoiningClassifier
 
 
@@ -28,6 +29,16 @@ PeakGroupType = JointPeakGroupMatch
 
 
 class LCMSPeakClusterSearch(PipelineModule):
+    '''
+    Group the peaks of a sample run, match the groups against a hypothesis' theoretical
+    compositions, and score the joined matches.
+
+    Passing the `hypothesis_sample_match_id` of an interrupted run resumes it. Grouping,
+    matching, classification and summarizing are checkpointed as stages, and matching
+    also records the peak groups it has matched. Classification is not resumed partway:
+    it rebuilds the shared :class:`TempPeakGroupMatch` table and the joined matches from
+    the peak group matches, so it clears the results of an interrupted attempt and starts over.
+    '''
     def __init__(self, database_path, observed_ions_path, hypothesis_id,
                  sample_run_id=1, grouping_error_tolerance=8e-5,
                  minimum_scan_count=1, hypothesis_sample_match_id=None,
@@ -58,6 +69,7 @@ class LCMSPeakClusterSearch(PipelineModule):
         self.minimum_mass = minimum_mass
         self.maximum_mass = maximum_mass
         self.options = kwargs
+        self.mass_index = None
         session = self.manager.session()
         hypothesis = session.query(Hypothesis).get(self.hypothesis_id)
         self.hypothesis_sample_match_type = HypothesisSampleMatch.hierarchy_root[hypothesis.__class__]
@@ -68,7 +80,7 @@ class LCMSPeakClusterSearch(PipelineModule):
             self.database_path, self.observed_ions_path, self.hypothesis_id,
             self.sample_run_id, self.hypothesis_sample_match_id,
             self.search_type, self.match_tolerance, self.mass_shift_map,
-            self.n_processes)
+            self.n_processes, mass_index=self.mass_index)
 
         if not self.options.get("skip_matching", False):
             matcher.start()
@@ -82,22 +94,18 @@ class LCMSPeakClusterSearch(PipelineModule):
             grouper.start()
         return grouper
 
+    def sample_name(self):
+        session = self.manager_type(self.observed_ions_path).session()
+        try:
+            return session.query(SampleRun).get(self.sample_run_id).name
+        finally:
+            session.close()
+
     def prepare_hypothesis_sample_match(self, session, sample_name):
         hypothesis_sample_match, created = get_or_create(
             session, self.hypothesis_sample_match_type,
             id=self.hypothesis_sample_match_id,
             target_hypothesis_id=self.hypothesis_id)
-        if self.hypothesis_sample_match_id is not None:
-            if not self.options.get("skip_matching", False):
-                hypothesis_sample_match.peak_group_matches.delete(synchronize_session=False)
-                session.commit()
-                logger.info("Cleared? %r", hypothesis_sample_match.peak_group_matches.count())
-            else:
-                hypothesis_sample_match.peak_group_matches.filter(
-                    ~PeakGroupType.matched).delete(synchronize_session=False)
-                session.commit()
-                logger.info("Cleared? %r", hypothesis_sample_match.peak_group_matches.filter(
-                    ~PeakGroupType.matched).count())
         self.options.setdefault("hypothesis_sample_match_name", "{} @ {}_ms1".format(
             session.query(Hypothesis).get(self.hypothesis_id).name,
             sample_name))
@@ -125,7 +133,29 @@ class LCMSPeakClusterSearch(PipelineModule):
         self.hypothesis_sample_match_id = hypothesis_sample_match.id
         return hypothesis_sample_match
 
+    def clear_classification(self):
+        '''
+        Delete the joined matches and the unmatched peak groups copied into
+        :class:`PeakGroupMatch` by a previous classification of this match
+        '''
+        session = self.manager.session()
+        try:
+            joint_ids = session.query(JointPeakGroupMatch.id).filter(
+                JointPeakGroupMatch.hypothesis_sample_match_id == self.hypothesis_sample_match_id)
+            session.execute(PeakGroupMatchToJointPeakGroupMatch.delete().where(
+                PeakGroupMatchToJointPeakGroupMatch.c.joint_group_id.in_(joint_ids.subquery())))
+            session.query(JointPeakGroupMatch).filter(
+                JointPeakGroupMatch.hypothesis_sample_match_id == self.hypothesis_sample_match_id).delete(
+                synchronize_session=False)
+            session.query(PeakGroupMatch).filter(
+                PeakGroupMatch.hypothesis_sample_match_id == self.hypothesis_sample_match_id,
+                ~PeakGroupMatch.matched).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
     def do_classification(self):
+        self.clear_classification()
         classifier = PeakGroupMassShiftJoiningClassifier(
             self.database_path, self.observed_ions_path,
             hypothesis_sample_match_id=self.hypothesis_sample_match_id,
@@ -133,20 +163,86 @@ class LCMSPeakClusterSearch(PipelineModule):
             n_processes=self.n_processes)
 
         classifier.start()
+
+        session = self.manager.session()
+        hypothesis_sample_match = session.query(HypothesisSampleMatch).get(self.hypothesis_sample_match_id)
+        hypothesis_sample_match.parameters['classifier'] = pickle.dumps(classifier.classifier)
+        session.add(hypothesis_sample_match)
+        session.commit()
+        session.close()
         return classifier
 
+    def do_summarize_results(self):
+        session = self.manager.session()
+        try:
+            HypothesisSampleMatchProteinSummary.build(session, self.hypothesis_sample_match_id)
+        finally:
+            session.close()
+
+    def checkpoint_key(self):
+        if self.hypothesis_sample_match_id is None:
+            return None
+        return u"%s:hypothesis_sample_match=%d:hypothesis=%d:sample_run=%d" % (
+            self.__class__.__name__, self.hypothesis_sample_match_id, self.hypothesis_id, self.sample_run_id)
+
     def run(self):
-        grouper = self.do_grouping()
+        session = self.manager.session()
+        self.prepare_hypothesis_sample_match(session, self.sample_name())
+        session.close()
 
-        database_manager = self.manager
-        session = database_manager.session()
-        sample_name = grouper.manager.session().query(SampleRun).get(self.sample_run_id).name
+        self.run_stages(
+            self.do_grouping,
+            self.do_matching,
+            self.do_classification,
+            self.do_summarize_results)
 
-        hypothesis_sample_match = self.prepare_hypothesis_sample_match(session, sample_name)
 
-        self.do_matching()
+class BatchLCMSPeakClusterSearch(LCMSPeakClusterSearch):
+    '''
+    Run :class:`LCMSPeakClusterSearch` over each of several sample runs against the same
+    hypothesis, creating one :class:`HypothesisSampleMatch` per sample run.
 
-        classifier = self.do_classification()
-        hypothesis_sample_match.parameters['classifier'] = pickle.dumps(classifier.classifier)
-        session.add(hypothesis_sample_match)
-        session.commit()
+    The hypothesis' theoretical masses are loaded once into a :class:`TheoreticalMassIndex`
+    which every sample's peak groups are matched against, instead of querying the
+    hypothesis database for each peak group of each sample.
+
+    Attributes
+    ----------
+    sample_run_ids: list of int
+    hypothesis_sample_match_ids: list of int
+        Parallel to `sample_run_ids` once :meth:`run` has finished
+    '''
+    def __init__(self, database_path, observed_ions_path, hypothesis_id,
+                 sample_run_ids, *args, **kwargs):
+        super(BatchLCMSPeakClusterSearch, self).__init__(
+            database_path, observed_ions_path, hypothesis_id, None, *args, **kwargs)
+        self.sample_run_ids = list(sample_run_ids)
+        self.hypothesis_sample_match_ids = []
+
+    def checkpoint_key(self):
+        # Each run creates new matches, so there is nothing to resume
+        return None
+
+    def load_mass_index(self):
+        session = self.manager.session()
+        try:
+            self.mass_index = TheoreticalMassIndex.from_hypothesis(session, self.search_type, self.hypothesis_id)
+        finally:
+            session.close()
+        logger.info("Loaded %d theoretical masses", len(self.mass_index))
+        return self.mass_index
+
+    def run(self):
+        self.load_mass_index()
+        name = self.options.pop("hypothesis_sample_match_name", None)
+        self.hypothesis_sample_match_ids = []
+        for sample_run_id in self.sample_run_ids:
+            self.sample_run_id = sample_run_id
+            self.hypothesis_sample_match_id = None
+            # The default name is derived from each sample's name
+            if name is not None:
+                self.options["hypothesis_sample_match_name"] = name
+            else:
+                self.options.pop("hypothesis_sample_match_name", None)
+            super(BatchLCMSPeakClusterSearch, self).run()
+            self.hypothesis_sample_match_ids.append(self.hypothesis_sample_match_id)
@@ -2,7 +2,7 @@ import re
 import logging
 
 from pyteomics import mzid
-from sqlalchemy import func
+from sqlalchemy import func, select, literal, and_, Float
 from glycresoft_sqlalchemy.data_model import (
     DatabaseManager, Protein, InformedPeptide, ExactMS1GlycopeptideHypothesis)
 from glycresoft_sqlalchemy.structure import sequence, modification, residue
@@ -23,9 +23,12 @@ PROTEOMICS_SCORE = ["PEAKS:peptideScore", "mascot:score", "PEAKS:proteinScore"]
 WHITELIST_GLYCOSITE_PTMS = ["Deamidation"]
 
 
-def protein_names(mzid_path, pattern=r'.*'):
+def protein_names(mzid_path, pattern=r'.*', streaming=False):
     pattern = re.compile(pattern)
-    parser = Parser(mzid_path, retrieve_refs=True, iterative=False, build_id_cache=True)
+    if streaming:
+        parser = StreamingParser(mzid_path, retrieve_refs=True)
+    else:
+        parser = Parser(mzid_path, retrieve_refs=True, iterative=False, build_id_cache=True)
     for protein in parser.iterfind(
                 "ProteinDetectionHypothesis", retrieve_refs=True, recursive=False, iterative=True):
         name = protein['accession']
@@ -162,6 +165,31 @@ class Parser(MzIdentML):
         return out
 
 
+class StreamingParser(Parser):
+    """
+    A :class:`Parser` which never builds the document tree. The main
+    reader streams elements with `iterparse`, while references are resolved
+    through a second, byte offset indexed reader over the same file so that
+    seeking to a referenced element does not disturb the stream.
+    """
+    def __init__(self, source, **kwargs):
+        kwargs['iterative'] = True
+        kwargs['build_id_cache'] = False
+        kwargs['use_index'] = False
+        super(StreamingParser, self).__init__(source, **kwargs)
+        self._reference_reader = Parser(
+            source, retrieve_refs=True, iterative=True, build_id_cache=False, use_index=True)
+
+    def iterfind(self, path, **kwargs):
+        iterator = super(StreamingParser, self).iterfind(path, **kwargs)
+        # The iterator is lazy, so rewind the stream it will read from
+        self._source.seek(0)
+        return iterator
+
+    def get_by_id(self, elem_id, **kwargs):
+        return self._reference_reader.get_by_id(elem_id, **kwargs)
+
+
 def remove_peptide_sequence_alterations(base_sequence, insert_sites, delete_sites):
     """
     Remove all the sequence insertions and deletions in order to reconstruct the
@@ -200,45 +228,38 @@ def remove_peptide_sequence_alterations(base_sequence, insert_sites, delete_site
     return sequence_copy
 
 
-def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None, **kwargs):
+def parse_peptide_sequence_dict(sequence_dict, **kwargs):
     """
-    Convert a dictionary extracted from mzIdentML for a SpectrumIdentificationItem
-    into one (or more) InformedPeptide objects.
+    Interpret the sequence, substitutions and modifications of a dictionary
+    extracted from mzIdentML for a SpectrumIdentificationItem.
 
     Parameters
     ----------
     sequence_dict : dict
         Sequence identification information as a series of nested dictionaries
         and lists.
-    session : sqlalchemy.orm.Session
-        An active database session used to look up parent Proteins
-        and insert newly created InformedPeptides
-    hypothesis_id : int
-        The id value of the Hypothesis to perform all operatons in the context
-        of.
-    enzyme : str, optional
-        The enzyme to use for determining mis-cleavages.
     **kwargs
-        Description
+        May contain `constant_modifications` and `modification_translation_table`
+
+    Returns
+    -------
+    tuple or None
+        A tuple of (:class:`Sequence`, modification count, insertion sites, deletion sites)
+        or None if the peptide sequence contains an unknown amino acid.
 
     Raises
     ------
     KeyError
         When a Modification cannot be properly interpretted, a KeyError
         is raised.
-    ValueError
-        When the identified peptide cannot be found in the parent Protein's
-        sequence.
     """
-    base_sequence = sequence_dict["PeptideSequence"]
     try:
         peptide_sequence = Sequence(sequence_dict["PeptideSequence"])
     except residue.UnknownAminoAcidException:
-        return 0
+        return None
 
     insert_sites = []
     deleteion_sites = []
-    counter = 0
 
     # Keep a count of the number of variable modifications.
     # It may be desirable to threshold sequences for inclusion
@@ -311,9 +332,69 @@ def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None,
 
     insert_sites.sort()
     deleteion_sites.sort()
+    return peptide_sequence, modification_counter, insert_sites, deleteion_sites
 
-    alteration_sites = insert_sites + deleteion_sites
-    alteration_sites.sort()
+
+def peptide_glycosylation_sites(base_sequence, peptide_sequence, protein, start, end):
+    """
+    Collect the glycosylation sites of a peptide, both from its own sequence
+    and from the sequons of its parent protein which it spans.
+
+    Parameters
+    ----------
+    base_sequence : str
+    peptide_sequence : Sequence
+    protein : Protein
+    start : int
+    end : int
+
+    Returns
+    -------
+    list
+    """
+    sites = set(sequence.find_n_glycosylation_sequons(base_sequence))
+    sites |= set(site - start for site in protein.n_glycan_sequon_sites if start <= site < end)
+    sites |= set(sequence.find_n_glycosylation_sequons(peptide_sequence, WHITELIST_GLYCOSITE_PTMS))
+    return list(sites)
+
+
+def iter_peptide_evidence_records(sequence_dict, resolve_protein, hypothesis_id, enzyme=None, **kwargs):
+    """
+    Convert a dictionary extracted from mzIdentML for a SpectrumIdentificationItem
+    into one (or more) column mappings for :class:`InformedPeptide`, one for each
+    peptide evidence whose parent protein can be resolved.
+
+    Parameters
+    ----------
+    sequence_dict : dict
+        Sequence identification information as a series of nested dictionaries
+        and lists.
+    resolve_protein : callable
+        Maps a protein accession to a :class:`Protein`, or None if it is not
+        part of the hypothesis.
+    hypothesis_id : int
+        The id value of the Hypothesis to perform all operatons in the context
+        of.
+    enzyme : str, optional
+        The enzyme to use for determining mis-cleavages.
+    **kwargs
+        Passed to :func:`parse_peptide_sequence_dict`
+
+    Yields
+    ------
+    tuple of (Protein, dict)
+
+    Raises
+    ------
+    ValueError
+        When the identified peptide cannot be found in the parent Protein's
+        sequence.
+    """
+    parsed = parse_peptide_sequence_dict(sequence_dict, **kwargs)
+    if parsed is None:
+        return
+    peptide_sequence, modification_counter, insert_sites, deleteion_sites = parsed
+    base_sequence = sequence_dict["PeptideSequence"]
 
     evidence_list = sequence_dict["PeptideEvidenceRef"]
     # Flatten the evidence list if it has extra nesting because of alternative
@@ -327,12 +408,18 @@ def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None,
             score = v
             break
 
+    if enzyme is not None:
+        missed_cleavages = len(enzyme.findall(base_sequence))
+    else:
+        missed_cleavages = None
+
+    other = {k: v for k, v in sequence_dict.items() if k not in
+             exclude_keys_from_sequence_dict}
+
     for evidence in evidence_list:
         if "skip" in evidence:
             continue
-        parent_protein = session.query(Protein).filter(
-            Protein.name == evidence['accession'],
-            Protein.hypothesis_id == hypothesis_id).first()
+        parent_protein = resolve_protein(evidence['accession'])
         if parent_protein is None:
             continue
         start = evidence["start"] - 1
@@ -351,17 +438,15 @@ def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None,
             start = found
             end = start + len(base_sequence)
         try:
-            if enzyme is not None:
-                missed_cleavages = len(enzyme.findall(base_sequence))
-            else:
-                missed_cleavages = None
             if "X" in str(peptide_sequence):
                 continue
-            match = InformedPeptide(
+            glycosites = peptide_glycosylation_sites(
+                base_sequence, peptide_sequence, parent_protein, start, end)
+            record = dict(
                 calculated_mass=peptide_sequence.mass,
                 base_peptide_sequence=base_sequence,
                 modified_peptide_sequence=str(peptide_sequence),
-                count_glycosylation_sites=None,
+                count_glycosylation_sites=len(glycosites),
                 count_missed_cleavages=missed_cleavages,
                 count_variable_modifications=modification_counter,
                 start_position=start,
@@ -371,33 +456,128 @@ def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None,
                 sequence_length=end - start,
                 protein_id=parent_protein.id,
                 hypothesis_id=hypothesis_id,
-                glycosylation_sites=None,
-                other={k: v for k, v in sequence_dict.items() if k not in
-                       exclude_keys_from_sequence_dict})
-            match.protein = parent_protein
-            assert match.hypothesis_id is not None
-            glycosites = set(match.n_glycan_sequon_sites) | set(sequence.find_n_glycosylation_sequons(
-                peptide_sequence, WHITELIST_GLYCOSITE_PTMS))
-            match.count_glycosylation_sites = len(glycosites)
-            match.glycosylation_sites = list(glycosites)
-            session.add(match)
-            counter += 1
+                glycosylation_sites=glycosites,
+                other=other)
         except residue.UnknownAminoAcidException:
             continue
         except:
             print(evidence)
             raise
+        yield parent_protein, record
+
+
+def convert_dict_to_sequence(sequence_dict, session, hypothesis_id, enzyme=None, **kwargs):
+    """
+    Convert a dictionary extracted from mzIdentML for a SpectrumIdentificationItem
+    into one (or more) InformedPeptide objects.
+
+    Parameters
+    ----------
+    sequence_dict : dict
+        Sequence identification information as a series of nested dictionaries
+        and lists.
+    session : sqlalchemy.orm.Session
+        An active database session used to look up parent Proteins
+        and insert newly created InformedPeptides
+    hypothesis_id : int
+        The id value of the Hypothesis to perform all operatons in the context
+        of.
+    enzyme : str, optional
+        The enzyme to use for determining mis-cleavages.
+    **kwargs
+        Description
+
+    Raises
+    ------
+    KeyError
+        When a Modification cannot be properly interpretted, a KeyError
+        is raised.
+    ValueError
+        When the identified peptide cannot be found in the parent Protein's
+        sequence.
+    """
+    def resolve_protein(accession):
+        return session.query(Protein).filter(
+            Protein.name == accession,
+            Protein.hypothesis_id == hypothesis_id).first()
+
+    counter = 0
+    for parent_protein, record in iter_peptide_evidence_records(
+            sequence_dict, resolve_protein, hypothesis_id, enzyme=enzyme, **kwargs):
+        match = InformedPeptide(**record)
+        match.protein = parent_protein
+        assert match.hypothesis_id is not None
+        session.add(match)
+        counter += 1
     return counter
+
+
+def convert_dict_to_peptide_records(sequence_dict, protein_map, hypothesis_id, enzyme=None, **kwargs):
+    """
+    Like :func:`convert_dict_to_sequence`, but resolves parent proteins from
+    an in-memory mapping and yields plain column mappings suitable for
+    :meth:`Session.bulk_insert_mappings` instead of adding ORM objects to a session.
+
+    Parameters
+    ----------
+    sequence_dict : dict
+        Sequence identification information as a series of nested dictionaries
+        and lists.
+    protein_map : dict
+        Maps protein accession to :class:`Protein`
+    hypothesis_id : int
+    enzyme : str, optional
+
+    Yields
+    ------
+    dict
+    """
+    for parent_protein, record in iter_peptide_evidence_records(
+            sequence_dict, protein_map.get, hypothesis_id, enzyme=enzyme, **kwargs):
+        yield record
 exclude_keys_from_sequence_dict = set(("PeptideEvidenceRef",))
 
 
+def remove_duplicate_peptides(session, hypothesis_id):
+    """
+    Delete all but the best scoring :class:`InformedPeptide` of each (modified sequence,
+    protein) pair in `hypothesis_id`, keeping the first inserted of equally scored
+    peptides. Peptides without a score rank below all others.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    hypothesis_id : int
+
+    Returns
+    -------
+    int
+        The number of peptides deleted
+    """
+    table = InformedPeptide.__table__
+    score = func.coalesce(table.c.peptide_score, literal(float('-inf'), Float))
+    best = select([
+        table.c.modified_peptide_sequence, table.c.protein_id, func.max(score).label("score")]).where(
+        table.c.hypothesis_id == hypothesis_id).group_by(
+        table.c.modified_peptide_sequence, table.c.protein_id).alias("best")
+    keepers = select([func.min(table.c.id)]).select_from(table.join(best, and_(
+        table.c.modified_peptide_sequence == best.c.modified_peptide_sequence,
+        table.c.protein_id == best.c.protein_id,
+        score == best.c.score))).where(table.c.hypothesis_id == hypothesis_id).group_by(
+        table.c.modified_peptide_sequence, table.c.protein_id)
+    result = session.execute(table.delete().where(and_(
+        table.c.hypothesis_id == hypothesis_id, ~table.c.id.in_(keepers))))
+    session.commit()
+    return result.rowcount
+
+
 class Proteome(object):
     def __init__(self, database_path, mzid_path, hypothesis_id=None, hypothesis_type=ExactMS1GlycopeptideHypothesis):
         self.manager = DatabaseManager(database_path)
         self.manager.initialize()
         self.mzid_path = mzid_path
         self.hypothesis_id = hypothesis_id
-        self.parser = Parser(mzid_path, retrieve_refs=True, iterative=False, build_id_cache=True)
+        self.parser = self._make_parser(mzid_path)
         self.hypothesis_type = hypothesis_type
         self.enzymes = []
         self.constant_modifications = []
@@ -405,6 +585,9 @@ class Proteome(object):
 
         self._load()
 
+    def _make_parser(self, mzid_path):
+        return Parser(mzid_path, retrieve_refs=True, iterative=False, build_id_cache=True)
+
     def _load(self):
         self._load_enzyme()
         self._load_modifications()
@@ -446,7 +629,8 @@ class Proteome(object):
                 "SpectrumIdentificationItem", retrieve_refs=True, iterative=True):
             counter += convert_dict_to_sequence(
                 spectrum_identification, session, self.hypothesis_id, enzyme=enzyme,
-                constant_modifications=self.constant_modifications)
+                constant_modifications=self.constant_modifications,
+                modification_translation_table=self.modification_translation_table)
             i += 1
             if i % 1000 == 0:
                 logger.info("%d spectrum matches processed.", i)
@@ -487,7 +671,7 @@ class Proteome(object):
                     try:
                         Modification(name)
                     except ModificationNameResolutionError:
-                        self.modification_conversion_map[name] = modification.AnonymousModificationRule(
+                        self.modification_translation_table[name] = modification.AnonymousModificationRule(
                             name, mod['massDelta'])
 
                 residues = mod['residues']
@@ -497,6 +681,106 @@ class Proteome(object):
         self.constant_modifications = constant_modifications
 
 
+class StreamingProteome(Proteome):
+    """
+    A :class:`Proteome` which reads the mzIdentML file incrementally with a
+    :class:`StreamingParser` instead of building the whole document tree in memory.
+
+    Parent proteins are resolved through an in-memory accession map, and both
+    proteins and peptides are written with bulk inserts of `chunk_size` rows.
+    Peptide evidence is deduplicated by (modified sequence, protein) within each
+    batch, and duplicates which span batches are removed with :func:`remove_duplicate_peptides`
+    once the file has been read, so only one batch is ever held in memory.
+    """
+    def __init__(self, database_path, mzid_path, hypothesis_id=None,
+                 hypothesis_type=ExactMS1GlycopeptideHypothesis, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self.protein_map = {}
+        super(StreamingProteome, self).__init__(
+            database_path, mzid_path, hypothesis_id=hypothesis_id, hypothesis_type=hypothesis_type)
+
+    def _make_parser(self, mzid_path):
+        return StreamingParser(mzid_path, retrieve_refs=True)
+
+    def _load_proteins(self):
+        session = self.manager.session()
+        hypothesis, created = get_or_create(session, self.hypothesis_type, id=self.hypothesis_id)
+        session.add(hypothesis)
+        session.commit()
+        self.hypothesis_id = hypothesis.id
+
+        seen = set()
+        accumulator = []
+        for protein in self.parser.iterfind(
+                "ProteinDetectionHypothesis", retrieve_refs=True, recursive=False, iterative=True):
+            name = protein.pop('accession')
+            if name in seen:
+                continue
+            seen.add(name)
+            accumulator.append(dict(
+                name=name,
+                protein_sequence=protein.pop('Seq'),
+                other=protein,
+                hypothesis_id=self.hypothesis_id))
+            if len(accumulator) >= self.chunk_size:
+                session.bulk_insert_mappings(Protein, accumulator)
+                session.commit()
+                accumulator = []
+        session.bulk_insert_mappings(Protein, accumulator)
+        session.commit()
+
+        self.protein_map = {
+            name: Protein(id=id, name=name, protein_sequence=protein_sequence, hypothesis_id=self.hypothesis_id)
+            for id, name, protein_sequence in session.query(
+                Protein.id, Protein.name, Protein.protein_sequence).filter(
+                Protein.hypothesis_id == self.hypothesis_id)
+        }
+        session.close()
+
+    def _flush_peptides(self, session, accumulator):
+        session.bulk_insert_mappings(InformedPeptide, accumulator.values())
+        session.commit()
+        n = len(accumulator)
+        accumulator.clear()
+        return n
+
+    def _load_spectrum_matches(self):
+        session = self.manager.session()
+        counter = 0
+        last = 0
+        i = 0
+        try:
+            enzyme = re.compile(expasy_rules.get(self.enzymes[0]))
+        except Exception, e:
+            logger.exception("Enzyme not found.", exc_info=e)
+            enzyme = None
+
+        accumulator = {}
+        for spectrum_identification in self.parser.iterfind(
+                "SpectrumIdentificationItem", retrieve_refs=True, iterative=True):
+            for record in convert_dict_to_peptide_records(
+                    spectrum_identification, self.protein_map, self.hypothesis_id, enzyme=enzyme,
+                    constant_modifications=self.constant_modifications,
+                    modification_translation_table=self.modification_translation_table):
+                key = record['modified_peptide_sequence'], record['protein_id']
+                if key in accumulator and not record['peptide_score'] > accumulator[key]['peptide_score']:
+                    continue
+                accumulator[key] = record
+            i += 1
+            if i % 1000 == 0:
+                logger.info("%d spectrum matches processed.", i)
+            if len(accumulator) >= self.chunk_size:
+                counter += self._flush_peptides(session, accumulator)
+                if (counter - last) > 1000:
+                    last = counter
+                    logger.info("%d peptides saved.", counter)
+        counter += self._flush_peptides(session, accumulator)
+        logger.info("%d peptides saved.", counter)
+        removed = remove_duplicate_peptides(session, self.hypothesis_id)
+        logger.info("%d duplicate peptides removed.", removed)
+        session.close()
+
+
 def protein_names_taskmain():
     import argparse
     app = argparse.ArgumentParser()
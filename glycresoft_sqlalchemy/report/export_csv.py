@@ -1,126 +1,336 @@
 import os
 import csv
+import gzip
 import argparse
+from itertools import islice
+
+import numpy as np
+from sqlalchemy import and_
+
 from glycresoft_sqlalchemy.data_model import (DatabaseManager, Hypothesis, Protein, TheoreticalGlycanComposition,
                                               GlycopeptideMatch, PipelineModule, HypothesisSampleMatch,
-                                              TheoreticalGlycopeptideComposition)
+                                              TheoreticalGlycopeptideComposition, JointPeakGroupMatch,
+                                              PeakGroupMatch, PeakGroupMatchToJointPeakGroupMatch, MassShift)
 
 from glypy.composition.glycan_composition import FrozenGlycanComposition
 
 
-def export_glycopeptide_ms2_matches(glycopeptides, output_path, session=None):
-    with open(output_path, 'wb') as fh:
-        writer = csv.writer(fh)
-        header = [
-            "id", "ms1_score", "ms2_score", "q_value", "observed_mass", "volume", "ppm_error",
-            "scan_id_range", "glycopeptide_sequence", "sequence_length", "mean_coverage", "mean_hexnac_coverage",
-            "stub_ion_count", "bare_b_ion_coverage", "bare_y_ion_coverage", "glycosylated_b_ion_coverage",
-            "glycosylated_y_ion_coverage", "protein_name", "b_ions", "y_ions", 'stub_ions', 'oxonium_ions',
-            "start_position", "end_position"
-        ]
-        writer.writerow(header)
-        for gpm in glycopeptides.yield_per(1000):
-            row = [
-                gpm.id, gpm.ms1_score, gpm.ms2_score, gpm.q_value, gpm.observed_mass, gpm.volume, gpm.ppm_error,
-                ';'.join(map(str, gpm.scan_id_range)), gpm.glycopeptide_sequence, gpm.sequence_length,
-                gpm.mean_coverage, gpm.mean_hexnac_coverage,
-                len(gpm.stub_ions),
-                len(gpm.bare_b_ions),
-                len(gpm.bare_y_ions),
-                len(gpm.glycosylated_b_ions),
-                len(gpm.glycosylated_y_ions),
-                gpm.protein.name,
-                ";".join([ion['key'] for series in [gpm.bare_b_ions, gpm.glycosylated_b_ions]
-                          for ion in series]),
-                ";".join([ion['key'] for series in [gpm.bare_y_ions, gpm.glycosylated_y_ions]
-                          for ion in series]),
-                ";".join([ion['key'] for ion in gpm.stub_ions]),
-                ";".join([ion['key'] for ion in gpm.oxonium_ions]),
-                gpm.start_position, gpm.end_position
-
-            ]
-            writer.writerow(row)
-    return output_path
+# SQLite refuses statements with more than 999 bound parameters, so
+# IN-clauses over a batch of ids are issued in pieces of this size
+MAX_IN_CLAUSE = 500
 
 
-def export_glycopeptide_ms1_matches_legacy(peak_group_matches, monosaccharide_identities, output_path, session=None):
-    with open(output_path, 'wb') as fh:
-        writer = csv.writer(fh)
-        headers = [
-            "Score", "MassSpec MW", "Compound Key", "PeptideSequence", "PPM Error",
-            "#ofAdduct", "#ofCharges", "#ofScans", "ScanDensity", "Avg A:A+2 Error",
-            "A:A+2 Ratio", "Total Volume", "Signal to Noise Ratio", "Centroid Scan Error",
-            "Centroid Scan", "MinScanNumber", "MaxScanNumber", "Hypothesis MW",
-        ] + monosaccharide_identities + [
-            "Adduct/Replacement", "PeptideModification", "PeptideMissedCleavage#", "#ofGlycanAttachmentToPeptide",
-            "StartAA", "EndAA", "ProteinID"
-        ]
-        writer.writerow(headers)
-        for pgm in peak_group_matches.yield_per(1000):
-            theoretical_match = pgm.theoretical_match
-            if theoretical_match is not None:
-                glycan_composition = theoretical_match.glycan_composition_str[1:-1].split(';')
-            else:
-                glycan_composition = ['' for g in monosaccharide_identities]
-            row = [
-                pgm.ms1_score, pgm.weighted_monoisotopic_mass,
-                theoretical_match.glycan_composition_str if pgm.matched else "",
-                theoretical_match.modified_peptide_sequence if pgm.matched else "",
-                pgm.ppm_error if pgm.matched else "",
-                "", pgm.charge_state_count, pgm.scan_count, pgm.scan_density,
-                pgm.a_peak_intensity_error, pgm.average_a_to_a_plus_2_ratio,
-                pgm.total_volume, pgm.average_signal_to_noise, pgm.centroid_scan_error,
-                pgm.centroid_scan_error, pgm.first_scan_id, pgm.last_scan_id,
-                theoretical_match.calculated_mass if pgm.matched else ""
-            ] + glycan_composition + [
-                "/", theoretical_match.peptide_modifications if pgm.matched else "",
-                theoretical_match.count_missed_cleavages if pgm.matched else "",
-                theoretical_match.count_glycosylation_sites if pgm.matched else "",
-                theoretical_match.start_position if pgm.matched else "",
-                theoretical_match.end_position if pgm.matched else "",
-                theoretical_match.protein.name if pgm.matched else "",
-            ]
-            writer.writerow(row)
-        return output_path
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            break
+        yield batch
 
 
-def export_glycan_ms1_matches_legacy(peak_group_matches, monosaccharide_identities, output_path, session=None):
-    with open(output_path, 'wb') as fh:
-        writer = csv.writer(fh)
-        headers = [
-            "Score", "MassSpec MW", "Compound Key", "PPM Error",
-            "#ofAdduct", "#ofCharges", "#ofScans", "ScanDensity", "Avg A:A+2 Error",
-            "A:A+2 Ratio", "Total Volume", "Signal to Noise Ratio", "Centroid Scan Error",
-            "Centroid Scan", "MinScanNumber", "MaxScanNumber", "Hypothesis MW"
-        ] + monosaccharide_identities + ["Adduct/Replacement", "ID"]
-        writer.writerow(headers)
+class TableWriter(object):
+    '''Base class for the sinks export rows are streamed into one batch at a time.
 
-        def adduct_label(x):
-            if x.mass_shift_type:
-                return "%s:%d" % (x.mass_shift.name, x.mass_shift_count)
-            return 'No Shift'
-        i = 0
-        for pgm in peak_group_matches.yield_per(1000):
-            theoretical_match = pgm.theoretical_match
-            if theoretical_match is not None:
-                glycan_composition = [theoretical_match.glycan_composition[g] for g in monosaccharide_identities]
+    Attributes
+    ----------
+    output_path : str
+    header : list of str
+    '''
+    extension = None
+
+    def __init__(self, output_path, header):
+        self.output_path = output_path
+        self.header = list(header)
+
+    def write_batch(self, rows):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CSVTableWriter(TableWriter):
+    extension = ".csv"
+
+    def __init__(self, output_path, header, compress=False):
+        super(CSVTableWriter, self).__init__(output_path, header)
+        if compress:
+            self.handle = gzip.open(output_path, 'wb')
+        else:
+            self.handle = open(output_path, 'wb')
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(self.header)
+
+    def write_batch(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.handle.close()
+
+
+def column_array(values):
+    try:
+        return np.array([np.nan if v is None or v == "" else v for v in values], dtype=float)
+    except (TypeError, ValueError):
+        return np.array([u"" if v is None else unicode(v) for v in values])
+
+
+class NpzTableWriter(TableWriter):
+    '''Accumulates each column and saves it as its own array in a compressed
+    NumPy archive keyed by the column's header. Numeric columns are stored as
+    floats with missing values as NaN, all others as unicode strings. The
+    column order is stored under "__columns__".
+    '''
+    extension = ".npz"
+
+    def __init__(self, output_path, header):
+        super(NpzTableWriter, self).__init__(output_path, header)
+        self.columns = [[] for name in self.header]
+
+    def write_batch(self, rows):
+        for column, values in zip(self.columns, zip(*rows)):
+            column.extend(values)
+
+    def close(self):
+        arrays = {name: column_array(values) for name, values in zip(self.header, self.columns)}
+        arrays["__columns__"] = np.array(self.header)
+        with open(self.output_path, 'wb') as fh:
+            np.savez_compressed(fh, **arrays)
+
+
+output_formats = {
+    "csv": CSVTableWriter,
+    "npz": NpzTableWriter
+}
+
+
+def output_extension(output_format="csv", compress=False):
+    extension = output_formats[output_format].extension
+    if compress and output_format == "csv":
+        extension += ".gz"
+    return extension
+
+
+def open_table_writer(output_path, header, output_format="csv", compress=False):
+    if output_format == "csv":
+        return CSVTableWriter(output_path, header, compress=compress)
+    return output_formats[output_format](output_path, header)
+
+
+def ion_keys(*series):
+    return ";".join([ion['key'] for ions in series if ions for ion in ions])
+
+
+def peak_group_adduct_labels(session, joint_group_ids):
+    '''Build the "Adduct/Replacement" label of each JointPeakGroupMatch in `joint_group_ids`
+    with one query per :data:`MAX_IN_CLAUSE` ids instead of one per group.
+    '''
+    link = PeakGroupMatchToJointPeakGroupMatch.c
+    labels = {i: [] for i in joint_group_ids}
+    for chunk in batches(joint_group_ids, MAX_IN_CLAUSE):
+        q = session.query(
+            link.joint_group_id, PeakGroupMatch.mass_shift_type, MassShift.name,
+            PeakGroupMatch.mass_shift_count).join(
+            PeakGroupMatch, PeakGroupMatch.id == link.peak_group_id).outerjoin(
+            MassShift, MassShift.id == PeakGroupMatch.mass_shift_type).filter(
+            link.joint_group_id.in_(chunk)).order_by(PeakGroupMatch.id)
+        for joint_group_id, mass_shift_type, name, count in q:
+            if mass_shift_type:
+                labels[joint_group_id].append("%s:%d" % (name, count))
             else:
-                glycan_composition = ['' for g in monosaccharide_identities]
-            row = [
-                pgm.ms1_score, pgm.weighted_monoisotopic_mass,
-                theoretical_match.composition if pgm.matched else "",
-                pgm.ppm_error if pgm.matched else "",
-                pgm.modification_state_count, pgm.charge_state_count, pgm.scan_count, pgm.scan_density,
-                pgm.a_peak_intensity_error, pgm.average_a_to_a_plus_2_ratio,
-                pgm.total_volume, pgm.average_signal_to_noise, pgm.centroid_scan_error,
-                pgm.centroid_scan_error, pgm.first_scan_id, pgm.last_scan_id,
-                theoretical_match.calculated_mass if pgm.matched else ""
-            ] + glycan_composition + [",".join(adduct_label(g) for g in pgm.subgroups), pgm.id]
-            writer.writerow(row)
-            i += 1
-            if i % 1e5 == 0:
-                session.expunge_all()
-        return output_path
+                labels[joint_group_id].append('No Shift')
+    return {k: ",".join(v) for k, v in labels.items()}
+
+
+def glycan_composition_counts(session, model, ids, monosaccharide_identities):
+    '''Read the monosaccharide counts of each `model` instance in `ids` straight from its
+    GlycanCompositionAssociation table, returning a list of counts ordered by
+    `monosaccharide_identities` for each id.
+    '''
+    association = model.GlycanCompositionAssociation
+    index = {name: i for i, name in enumerate(monosaccharide_identities)}
+    counts = {i: [0] * len(monosaccharide_identities) for i in ids}
+    for chunk in batches(ids, MAX_IN_CLAUSE):
+        q = session.query(association.referent, association.base_type, association.count).filter(
+            association.referent.in_(chunk))
+        for referent, base_type, count in q:
+            try:
+                counts[referent][index[base_type]] = count
+            except KeyError:
+                pass
+    return counts
+
+
+def export_glycopeptide_ms2_matches(glycopeptides, output_path, session=None, output_format="csv",
+                                    compress=False, batch_size=1000):
+    '''Write one row per GlycopeptideMatch in `glycopeptides`.
+
+    Only the exported columns are selected, joined to the matching Protein's
+    name, and rows are streamed from the database and written `batch_size` at a time
+    so that neither ORM instances nor their lazy relationships are ever loaded.
+    '''
+    header = [
+        "id", "ms1_score", "ms2_score", "q_value", "observed_mass", "volume", "ppm_error",
+        "scan_id_range", "glycopeptide_sequence", "sequence_length", "mean_coverage", "mean_hexnac_coverage",
+        "stub_ion_count", "bare_b_ion_coverage", "bare_y_ion_coverage", "glycosylated_b_ion_coverage",
+        "glycosylated_y_ion_coverage", "protein_name", "b_ions", "y_ions", 'stub_ions', 'oxonium_ions',
+        "start_position", "end_position"
+    ]
+    query = glycopeptides.with_entities(
+        GlycopeptideMatch.id, GlycopeptideMatch.ms1_score, GlycopeptideMatch.ms2_score,
+        GlycopeptideMatch.q_value, GlycopeptideMatch.observed_mass, GlycopeptideMatch.volume,
+        GlycopeptideMatch.ppm_error, GlycopeptideMatch.scan_id_range, GlycopeptideMatch.glycopeptide_sequence,
+        GlycopeptideMatch.sequence_length, GlycopeptideMatch.mean_coverage, GlycopeptideMatch.mean_hexnac_coverage,
+        GlycopeptideMatch.stub_ions, GlycopeptideMatch.bare_b_ions, GlycopeptideMatch.bare_y_ions,
+        GlycopeptideMatch.glycosylated_b_ions, GlycopeptideMatch.glycosylated_y_ions,
+        GlycopeptideMatch.oxonium_ions, Protein.name, GlycopeptideMatch.start_position,
+        GlycopeptideMatch.end_position).filter(GlycopeptideMatch.protein_id == Protein.id)
+
+    with open_table_writer(output_path, header, output_format, compress) as writer:
+        for batch in batches(query.yield_per(batch_size), batch_size):
+            rows = []
+            for (id, ms1_score, ms2_score, q_value, observed_mass, volume, ppm_error, scan_id_range,
+                 glycopeptide_sequence, sequence_length, mean_coverage, mean_hexnac_coverage,
+                 stub_ions, bare_b_ions, bare_y_ions, glycosylated_b_ions, glycosylated_y_ions,
+                 oxonium_ions, protein_name, start_position, end_position) in batch:
+                rows.append([
+                    id, ms1_score, ms2_score, q_value, observed_mass, volume, ppm_error,
+                    ';'.join(map(str, scan_id_range or ())), glycopeptide_sequence, sequence_length,
+                    mean_coverage, mean_hexnac_coverage,
+                    len(stub_ions or ()), len(bare_b_ions or ()), len(bare_y_ions or ()),
+                    len(glycosylated_b_ions or ()), len(glycosylated_y_ions or ()),
+                    protein_name,
+                    ion_keys(bare_b_ions, glycosylated_b_ions),
+                    ion_keys(bare_y_ions, glycosylated_y_ions),
+                    ion_keys(stub_ions),
+                    ion_keys(oxonium_ions),
+                    start_position, end_position
+                ])
+            writer.write_batch(rows)
+    return output_path
+
+
+def export_glycopeptide_ms1_matches_legacy(peak_group_matches, monosaccharide_identities, output_path,
+                                           session=None, output_format="csv", compress=False, batch_size=1000):
+    headers = [
+        "Score", "MassSpec MW", "Compound Key", "PeptideSequence", "PPM Error",
+        "#ofAdduct", "#ofCharges", "#ofScans", "ScanDensity", "Avg A:A+2 Error",
+        "A:A+2 Ratio", "Total Volume", "Signal to Noise Ratio", "Centroid Scan Error",
+        "Centroid Scan", "MinScanNumber", "MaxScanNumber", "Hypothesis MW",
+    ] + monosaccharide_identities + [
+        "Adduct/Replacement", "PeptideModification", "PeptideMissedCleavage#", "#ofGlycanAttachmentToPeptide",
+        "StartAA", "EndAA", "ProteinID"
+    ]
+    theoretical = TheoreticalGlycopeptideComposition
+    query = peak_group_matches.with_entities(
+        JointPeakGroupMatch.ms1_score, JointPeakGroupMatch.weighted_monoisotopic_mass,
+        JointPeakGroupMatch.matched, JointPeakGroupMatch.ppm_error, JointPeakGroupMatch.charge_state_count,
+        JointPeakGroupMatch.scan_count, JointPeakGroupMatch.scan_density,
+        JointPeakGroupMatch.a_peak_intensity_error, JointPeakGroupMatch.average_a_to_a_plus_2_ratio,
+        JointPeakGroupMatch.total_volume, JointPeakGroupMatch.average_signal_to_noise,
+        JointPeakGroupMatch.centroid_scan_error, JointPeakGroupMatch.first_scan_id,
+        JointPeakGroupMatch.last_scan_id, theoretical.id, theoretical.glycan_composition_str,
+        theoretical.modified_peptide_sequence, theoretical.calculated_mass, theoretical.peptide_modifications,
+        theoretical.count_missed_cleavages, theoretical.count_glycosylation_sites, theoretical.start_position,
+        theoretical.end_position, Protein.name).outerjoin(
+        theoretical, and_(JointPeakGroupMatch.theoretical_match_id == theoretical.id,
+                          JointPeakGroupMatch.theoretical_match_type == u"TheoreticalGlycopeptideComposition")
+        ).outerjoin(Protein, theoretical.protein_id == Protein.id)
+
+    blank_composition = ['' for g in monosaccharide_identities]
+    with open_table_writer(output_path, headers, output_format, compress) as writer:
+        for batch in batches(query.yield_per(batch_size), batch_size):
+            rows = []
+            for (ms1_score, weighted_monoisotopic_mass, matched, ppm_error, charge_state_count, scan_count,
+                 scan_density, a_peak_intensity_error, average_a_to_a_plus_2_ratio, total_volume,
+                 average_signal_to_noise, centroid_scan_error, first_scan_id, last_scan_id, theoretical_id,
+                 glycan_composition_str, modified_peptide_sequence, calculated_mass, peptide_modifications,
+                 count_missed_cleavages, count_glycosylation_sites, start_position, end_position,
+                 protein_name) in batch:
+                if theoretical_id is not None:
+                    glycan_composition = glycan_composition_str[1:-1].split(';')
+                else:
+                    glycan_composition = blank_composition
+                rows.append([
+                    ms1_score, weighted_monoisotopic_mass,
+                    glycan_composition_str if matched else "",
+                    modified_peptide_sequence if matched else "",
+                    ppm_error if matched else "",
+                    "", charge_state_count, scan_count, scan_density,
+                    a_peak_intensity_error, average_a_to_a_plus_2_ratio,
+                    total_volume, average_signal_to_noise, centroid_scan_error,
+                    centroid_scan_error, first_scan_id, last_scan_id,
+                    calculated_mass if matched else ""
+                ] + glycan_composition + [
+                    "/", peptide_modifications if matched else "",
+                    count_missed_cleavages if matched else "",
+                    count_glycosylation_sites if matched else "",
+                    start_position if matched else "",
+                    end_position if matched else "",
+                    protein_name if matched else "",
+                ])
+            writer.write_batch(rows)
+    return output_path
+
+
+def export_glycan_ms1_matches_legacy(peak_group_matches, monosaccharide_identities, output_path, session=None,
+                                     output_format="csv", compress=False, batch_size=1000):
+    headers = [
+        "Score", "MassSpec MW", "Compound Key", "PPM Error",
+        "#ofAdduct", "#ofCharges", "#ofScans", "ScanDensity", "Avg A:A+2 Error",
+        "A:A+2 Ratio", "Total Volume", "Signal to Noise Ratio", "Centroid Scan Error",
+        "Centroid Scan", "MinScanNumber", "MaxScanNumber", "Hypothesis MW"
+    ] + monosaccharide_identities + ["Adduct/Replacement", "ID"]
+    if session is None:
+        session = peak_group_matches.session
+    theoretical = TheoreticalGlycanComposition
+    query = peak_group_matches.with_entities(
+        JointPeakGroupMatch.id, JointPeakGroupMatch.ms1_score, JointPeakGroupMatch.weighted_monoisotopic_mass,
+        JointPeakGroupMatch.matched, JointPeakGroupMatch.ppm_error, JointPeakGroupMatch.modification_state_count,
+        JointPeakGroupMatch.charge_state_count, JointPeakGroupMatch.scan_count, JointPeakGroupMatch.scan_density,
+        JointPeakGroupMatch.a_peak_intensity_error, JointPeakGroupMatch.average_a_to_a_plus_2_ratio,
+        JointPeakGroupMatch.total_volume, JointPeakGroupMatch.average_signal_to_noise,
+        JointPeakGroupMatch.centroid_scan_error, JointPeakGroupMatch.first_scan_id,
+        JointPeakGroupMatch.last_scan_id, theoretical.id, theoretical.composition,
+        theoretical.calculated_mass).outerjoin(
+        theoretical, and_(JointPeakGroupMatch.theoretical_match_id == theoretical.id,
+                          JointPeakGroupMatch.theoretical_match_type == u"TheoreticalGlycanComposition"))
+
+    blank_composition = ['' for g in monosaccharide_identities]
+    with open_table_writer(output_path, headers, output_format, compress) as writer:
+        for batch in batches(query.yield_per(batch_size), batch_size):
+            adduct_labels = peak_group_adduct_labels(session, [row[0] for row in batch])
+            compositions = glycan_composition_counts(
+                session, theoretical, list({row[16] for row in batch if row[16] is not None}),
+                monosaccharide_identities)
+            rows = []
+            for (id, ms1_score, weighted_monoisotopic_mass, matched, ppm_error, modification_state_count,
+                 charge_state_count, scan_count, scan_density, a_peak_intensity_error,
+                 average_a_to_a_plus_2_ratio, total_volume, average_signal_to_noise, centroid_scan_error,
+                 first_scan_id, last_scan_id, theoretical_id, composition, calculated_mass) in batch:
+                if theoretical_id is not None:
+                    glycan_composition = compositions[theoretical_id]
+                else:
+                    glycan_composition = blank_composition
+                rows.append([
+                    ms1_score, weighted_monoisotopic_mass,
+                    composition if matched else "",
+                    ppm_error if matched else "",
+                    modification_state_count, charge_state_count, scan_count, scan_density,
+                    a_peak_intensity_error, average_a_to_a_plus_2_ratio,
+                    total_volume, average_signal_to_noise, centroid_scan_error,
+                    centroid_scan_error, first_scan_id, last_scan_id,
+                    calculated_mass if matched else ""
+                ] + glycan_composition + [adduct_labels[id], id])
+            writer.write_batch(rows)
+    return output_path
 
 
 def export_glycan_ms1_matches_legacy_ungrouping(peak_group_matches, monosaccharide_identities, output_path, session=None):
@@ -196,7 +406,8 @@ def export_theoretical_glycopeptide_hypothesis(glycopeptides, monosaccharide_ide
 
 class CSVExportDriver(PipelineModule):
     def __init__(self, database_path, hypothesis_ids=None, hypothesis_sample_match_ids=None,
-                 output_path=None, filterfunc=lambda q: q):
+                 output_path=None, filterfunc=lambda q: q, output_format="csv", compress=False,
+                 batch_size=1000):
         self.manager = self.manager_type(database_path)
         self.session = self.manager.session()
 
@@ -222,6 +433,14 @@ class CSVExportDriver(PipelineModule):
             output_path = os.path.splitext(database_path)[0]
         self.output_path = output_path
         self.filterfunc = filterfunc
+        self.output_format = output_format
+        self.compress = compress
+        self.batch_size = batch_size
+        self.extension = output_extension(output_format, compress)
+
+    @property
+    def writer_options(self):
+        return dict(output_format=self.output_format, compress=self.compress, batch_size=self.batch_size)
 
     def dispatch_export_hypothesis_sample_match(self, hypothesis_sample_match_id):
         session = self.session
@@ -237,21 +456,23 @@ class CSVExportDriver(PipelineModule):
                 return str(hsm.target_hypothesis.name) + "_on_" + str(hsm.sample_run_name)
         for res_type, query in hsm.results():
             if res_type == GlycopeptideMatch:
-                output_path = self.output_path + '.{}.glycopeptide_matches.csv'.format(getname(hsm))
+                output_path = self.output_path + '.{}.glycopeptide_matches{}'.format(getname(hsm), self.extension)
                 outputs.append(output_path)
                 # Only export target hypothesis
                 export_glycopeptide_ms2_matches(filterfunc(query.filter(
                     GlycopeptideMatch.protein_id == Protein.id,
-                    Protein.hypothesis_id == hsm.target_hypothesis_id)), output_path, session)
+                    Protein.hypothesis_id == hsm.target_hypothesis_id)), output_path, session,
+                    **self.writer_options)
             elif (res_type == TheoreticalGlycopeptideComposition):
-                output_path = self.output_path + '.{}.glycopeptide_compositions.csv'.format(getname(hsm))
+                output_path = self.output_path + '.{}.glycopeptide_compositions{}'.format(
+                    getname(hsm), self.extension)
                 outputs.append(output_path)
                 export_glycopeptide_ms1_matches_legacy(
                     filterfunc(query),
                     hsm.target_hypothesis.parameters['monosaccharide_identities'],
-                    output_path, session)
+                    output_path, session, **self.writer_options)
             elif (res_type == TheoreticalGlycanComposition):
-                output_path = self.output_path + ".{}.glycan_compositions.csv".format(getname(hsm))
+                output_path = self.output_path + ".{}.glycan_compositions{}".format(getname(hsm), self.extension)
                 outputs.append(output_path)
                 base_types = session.query(
                     TheoreticalGlycanComposition.GlycanCompositionAssociation.base_type.distinct()).join(
@@ -261,7 +482,7 @@ class CSVExportDriver(PipelineModule):
                 export_glycan_ms1_matches_legacy(
                     filterfunc(query),
                     monosaccharide_identities,
-                    output_path, session)
+                    output_path, session, **self.writer_options)
             else:
                 pass
         return outputs
@@ -315,17 +536,22 @@ app.add_argument("-d", "--hypothesis-id", action="append", type=int, help="The h
 app.add_argument("-e", "--hypothesis-sample-match-id", action="append", type=int,
                  help="The hypothesis sample match to export.")
 app.add_argument("-o", "--out", default=None, help="Where to save the result")
+app.add_argument("-f", "--format", default="csv", choices=sorted(output_formats),
+                 help="Write search results as CSV or as a columnar NumPy .npz archive")
+app.add_argument("-z", "--gzip", action="store_true", default=False, help="Compress CSV search results with gzip")
 
 
-def main(database_path, hypothesis_ids, hypothesis_sample_match_ids, out):
+def main(database_path, hypothesis_ids, hypothesis_sample_match_ids, out, output_format="csv", compress=False):
     return CSVExportDriver(
         database_path, hypothesis_ids=hypothesis_ids,
-        hypothesis_sample_match_ids=hypothesis_sample_match_ids, output_path=out).start()
+        hypothesis_sample_match_ids=hypothesis_sample_match_ids, output_path=out,
+        output_format=output_format, compress=compress).start()
 
 
 def taskmain():
     args = app.parse_args()
-    main(args.database_path, args.hypothesis_id, args.hypothesis_sample_match_id, args.out)
+    main(args.database_path, args.hypothesis_id, args.hypothesis_sample_match_id, args.out,
+         args.format, args.gzip)
 
 
 if __name__ == '__main__':
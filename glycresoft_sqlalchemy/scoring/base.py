@@ -41,6 +41,18 @@ class GlycopeptideSpectrumMatchScorer(ScorerBase):
             value = getattr(args[0], self.attr_name)
         return GlycopeptideSpectrumMatchScore(name=self.score_name, value=value, spectrum_match_id=args[0].id)
 
+    def score_batch(self, spectrum_matches, **kwargs):
+        """
+        Score every :class:`GlycopeptideSpectrumMatch` to one scan. Scorers which share
+        work between the matches of a scan override this.
+
+        Returns
+        -------
+        list of GlycopeptideSpectrumMatchScore
+        """
+        return [self(match.as_match_like(), match.theoretical_glycopeptide, **kwargs)
+                for match in spectrum_matches]
+
 
 class ScoreReweighter(ScorerBase):
     def __init__(self, reweighter, scorer, prefix=""):
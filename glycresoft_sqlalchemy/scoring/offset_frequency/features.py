@@ -4,7 +4,7 @@ from glycresoft_sqlalchemy.structure import composition
 from glycresoft_sqlalchemy.structure import modification
 from .peak_relations import (
     MassOffsetFeature, search_features_on_spectrum,
-    feature_function_estimator, FittedFeature)
+    estimate_feature_functions, FittedFeature)
 from .utils import chain_iterable
 from collections import defaultdict
 from glypy import MonosaccharideResidue, monosaccharides
@@ -33,16 +33,15 @@ def get_link_features(database_path, hypothesis_id, score_threshold=0.7):
 
 
 def fit_features(training_set, features, kinds=('b', 'y')):
-    fitted_features = []
-    for feat in features:
-        logger.info("Fitting %r", feat)
-        for kind in kinds:
-            logger.info("for %s", kind)
-            u, v, rels = feature_function_estimator(training_set, feat, kind)
+    fitted = {}
+    for kind in kinds:
+        logger.info("Fitting %d features for %s", len(features), kind)
+        estimates = estimate_feature_functions(training_set, features, kind)
+        for feat, (u, v, rels) in zip(features, estimates):
             fit_feat = FittedFeature(feat, kind, u, v, rels)
             logger.info("fit: %r", fit_feat)
-            fitted_features.append(fit_feat)
-    return fitted_features
+            fitted[feat, kind] = fit_feat
+    return [fitted[feat, kind] for feat in features for kind in kinds]
 
 
 def specialize_features(fitted_features):
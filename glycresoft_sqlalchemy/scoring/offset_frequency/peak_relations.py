@@ -7,7 +7,7 @@ from .utils import (
     Sequence, MatchedSpectrum,
     chain_iterable, ppm_error, MassOffsetFeature,
     DPeak, intensity_ratio_function,
-    intensity_rank, search_spectrum)
+    intensity_rank)
 
 
 from glycresoft_sqlalchemy.utils.memoize import memoize
@@ -67,6 +67,102 @@ def _delta_series(sequence, mass_shift=0.0, step=1):
         yield frag_dri
 
 
+def sorted_masses(peaks):
+    '''
+    Sort the neutral masses of `peaks`.
+
+    Returns
+    -------
+    order: np.ndarray
+        Indices into `peaks` in mass order
+    masses: np.ndarray
+        The sorted neutral masses
+    '''
+    masses = np.array([peak.neutral_mass for peak in peaks], dtype=float)
+    order = np.argsort(masses, kind='mergesort')
+    return order, masses[order]
+
+
+def match_masses(queries, masses, tolerance=2e-5):
+    '''
+    Find every pair of a query mass and a sorted mass within `tolerance` of one another,
+    using one searchsorted pass over `masses` instead of comparing all pairs.
+
+    A pair matches when ``abs(ppm_error(query, mass)) <= tolerance``, the criterion of
+    :class:`MassOffsetFeature`.
+
+    Parameters
+    ----------
+    queries: array-like
+    masses: np.ndarray
+        Sorted masses
+    tolerance: float
+
+    Returns
+    -------
+    query_index: np.ndarray
+    mass_index: np.ndarray
+        Parallel arrays of matching indices, ordered by query then by mass
+    '''
+    queries = np.asarray(queries, dtype=float)
+    # |q - m| <= tolerance * m bounds m to [q / (1 + tolerance), q / (1 - tolerance)]. The
+    # window is widened so rounding cannot drop a pair, then the exact test is applied
+    lo = np.searchsorted(masses, queries / (1 + 2 * tolerance), 'left')
+    hi = np.searchsorted(masses, queries / (1 - 2 * tolerance), 'right')
+    counts = hi - lo
+    query_index = np.repeat(np.arange(len(queries)), counts)
+    starts = np.cumsum(counts) - counts
+    mass_index = np.arange(counts.sum()) - np.repeat(starts - lo, counts)
+    matched = masses[mass_index]
+    keep = np.abs((queries[query_index] - matched) / matched) <= tolerance
+    return query_index[keep], mass_index[keep]
+
+
+def _feature_window(feature):
+    # Fitted features wrap the MassOffsetFeature which carries the offset
+    feature = getattr(feature, "feature", feature)
+    return feature.offset, feature.tolerance
+
+
+def relate_peaks(peaks, features, index=None):
+    '''
+    Find the pairs of peaks related by each feature in `features`.
+
+    Candidate pairs are found for each feature's offset with :func:`match_masses` over
+    the sorted neutral masses, and only those are tested against the feature, rather than
+    calling each feature on every pair of peaks.
+
+    Parameters
+    ----------
+    peaks: list
+    features: list
+    index: tuple, optional
+        The result of :func:`sorted_masses` for `peaks`, if already computed
+
+    Returns
+    -------
+    list of list of (int, int)
+        For each feature, the indices into `peaks` of each related `(from_peak, to_peak)`
+        pair, ordered by `from_peak` then `to_peak`
+    '''
+    if index is None:
+        index = sorted_masses(peaks)
+    order, masses = index
+    # Query masses in the original peak order, so pairs come out in that order
+    from_masses = np.empty_like(masses)
+    from_masses[order] = masses
+    relations = []
+    for feature in features:
+        offset, tolerance = _feature_window(feature)
+        from_index, mass_index = match_masses(from_masses + offset, masses, tolerance)
+        to_index = order[mass_index]
+        sort = np.lexsort((to_index, from_index))
+        relations.append([
+            (i, j) for i, j in zip(from_index[sort].tolist(), to_index[sort].tolist())
+            if feature(peaks[i], peaks[j])])
+    return relations
+
+
 def delta_finder(gsms, delta, step=1):
     total_sites = 0
     total_explained = 0
@@ -78,11 +174,10 @@ def delta_finder(gsms, delta, step=1):
         fragments = list(collectiontools.flatten(_delta_series(gsm.glycopeptide_sequence, delta, step)))
         n_frag_sites = len(fragments)
         peak_list = list(gsm)
-        match_count = 0
-        for fragment in fragments:
-            for peak in gsm:
-                if abs(ppm_error(fragment.mass - proton, peak.neutral_mass)) <= 2e-5:
-                    match_count += 1
+        masses = sorted_masses(peak_list)[1]
+        query_index, mass_index = match_masses(
+            [fragment.mass - proton for fragment in fragments], masses, 2e-5)
+        match_count = len(query_index)
 
         total_explained += match_count
         total_sites += n_frag_sites
@@ -244,39 +339,61 @@ class PeakRelation(object):
 
 
 def feature_function_estimator(gsms, feature_function, kind='b'):
-    total_on_kind_satisfied = 0.
-    total_off_kind_satisfied = 0.
+    return estimate_feature_functions(gsms, [feature_function], kind)[0]
+
+
+def estimate_feature_functions(gsms, feature_functions, kind='b'):
+    '''
+    Estimate the rate at which each feature relates peaks of `kind` and noise peaks
+    to other peaks, preparing each spectrum once and evaluating every feature over it
+    with :func:`relate_peaks`.
+
+    Parameters
+    ----------
+    gsms: iterable of MatchedSpectrum
+    feature_functions: list of MassOffsetFeature
+    kind: str
+
+    Returns
+    -------
+    list of (float, float, list)
+        For each feature, the normalized on-kind and off-kind satisfaction rates and the
+        `(gsm, [PeakRelation])` pairs of each spectrum with a relation
+    '''
+    n = len(feature_functions)
+    total_on_kind_satisfied = [0.] * n
+    total_off_kind_satisfied = [0.] * n
     total_on_kind = 0.
     total_off_kind = 0.
-    peak_relations = []
+    peak_relations = [[] for i in range(n)]
     for gsm in gsms:
         peaks = list(map(DPeak, gsm))
         intensity_rank(peaks)
         peaks = [p for p in peaks if p.rank > 0]
-        related = []
-        for peak in peaks:
-            is_on_kind = any(k[0] == kind for k in gsm.peak_explained_by(peak.id))
-            matches = search_spectrum(peak, peaks, feature_function)
-            for match in matches:
+        is_on_kind = [any(k[0] == kind for k in gsm.peak_explained_by(peak.id)) for peak in peaks]
+        n_on_kind = sum(is_on_kind)
+        total_on_kind += n_on_kind
+        total_off_kind += len(peaks) - n_on_kind
+        for f, pairs in enumerate(relate_peaks(peaks, feature_functions)):
+            feature_function = feature_functions[f]
+            related = []
+            for i, j in pairs:
+                peak = peaks[i]
+                match = peaks[j]
                 pr = PeakRelation(peak, match, feature_function, intensity_ratio_function(peak, match))
                 related.append(pr)
-                if is_on_kind:
-                    total_on_kind_satisfied += 1
+                if is_on_kind[i]:
+                    total_on_kind_satisfied[f] += 1
                     pr.kind = kind
                 else:
-                    total_off_kind_satisfied += 1
+                    total_off_kind_satisfied[f] += 1
                     pr.kind = "Noise"
-            if is_on_kind:
-                total_on_kind += 1
-            else:
-                total_off_kind += 1
-        if len(related) > 0:
-            peak_relations.append((gsm, related))
-
-    total_on_kind_satisfied_normalized = total_on_kind_satisfied / max(total_on_kind, 1)
-    total_off_kind_satisfied_normalized = total_off_kind_satisfied / max(total_off_kind, 1)
+            if len(related) > 0:
+                peak_relations[f].append((gsm, related))
 
-    return total_on_kind_satisfied_normalized, total_off_kind_satisfied_normalized, peak_relations
+    return [(total_on_kind_satisfied[f] / max(total_on_kind, 1),
+             total_off_kind_satisfied[f] / max(total_off_kind, 1),
+             peak_relations[f]) for f in range(n)]
 
 
 def search_features_on_spectrum(peak, peak_list, features):
@@ -291,10 +408,19 @@ def search_features_on_spectrum(peak, peak_list, features):
 
 
 def search_features(peak_list, features):
+    peak_list = list(peak_list)
+    related = []
+    for f, pairs in enumerate(relate_peaks(peak_list, features)):
+        related.extend((i, j, f) for i, j in pairs)
+    # Each peak's relations are listed by query peak, then by feature
+    related.sort()
     peak_match_map = {}
-    for peak in peak_list:
-        r = search_features_on_spectrum(peak, peak_list, features)
-        peak_match_map.update(r)
+    for i, j, f in related:
+        peak = peak_list[i]
+        query_peak = peak_list[j]
+        feature = features[f]
+        pr = PeakRelation(peak, query_peak, feature, intensity_ratio_function(peak, query_peak), feature.kind)
+        peak_match_map.setdefault(peak.id, []).append(pr)
     return peak_match_map
 
 
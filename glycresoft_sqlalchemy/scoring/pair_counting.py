@@ -5,8 +5,10 @@ import operator
 import pickle
 import numpy as np
 
-from glycresoft_sqlalchemy.structure import sequence
+from glycresoft_sqlalchemy.structure import sequence, constants as structure_constants
 from glycresoft_sqlalchemy.utils.collectiontools import flatten
+from glycresoft_sqlalchemy.utils.memoize import memoize
+from glycresoft_sqlalchemy.data_model import GlycopeptideMatch, GlycopeptideSpectrumMatch
 
 from glycresoft_sqlalchemy.scoring import simple_scoring_algorithm
 
@@ -24,6 +26,165 @@ def make_fragment_map(glycopeptide_sequence, fragment_series="by"):
     return fragment_map
 
 
+def hexnac_units(modifications):
+    # Each N-glycan core may be broken down to either of its two HexNAc
+    units = 0
+    for mod in modifications:
+        if mod.name == "N-Glycosylation":
+            units += 2
+        elif mod.name == "HexNAc":
+            units += 1
+    return units
+
+
+def _site_names(series, position, units):
+    base = "%s%d" % (series, position)
+    names = [base]
+    if units >= 1:
+        names.append(base + "+HexNAc")
+    for count in range(2, units + 1):
+        names.append("%s+%dHexNAc" % (base, count))
+    return names
+
+
+class FragmentSites(object):
+    '''
+    The fragmentation sites of a glycopeptide sequence, describing the fragments
+    :func:`make_fragment_map` would produce without constructing them.
+
+    With partial HexNAc loss, each site yields one fragment for each number of HexNAc
+    units on its side of the bond, so sites and fragment names are derived from the
+    residues and their modifications alone.
+
+    Attributes
+    ----------
+    n_terms: list of Residue
+        The residue N-terminal of the bond at each site
+    c_terms: list of Residue
+        The residue C-terminal of the bond at each site
+    multiplicity: np.ndarray
+        The number of fragments at each site
+    positions: np.ndarray
+        The ion series position of each site
+    key_sites: dict
+        Maps each fragment name to its site
+    '''
+    def __init__(self, glycopeptide_sequence, series="by"):
+        self.n_terms = []
+        self.c_terms = []
+        multiplicity = []
+        positions = []
+        self.key_sites = {}
+        seq = sequence.Sequence(glycopeptide_sequence)
+        if structure_constants.PARTIAL_HEXNAC_LOSS:
+            residues = [position[0] for position in seq]
+            units = np.cumsum([hexnac_units(position[1]) for position in seq])
+            n_bonds = len(residues) - 1
+            for kind in series:
+                for bond in range(n_bonds):
+                    if kind in "abc":
+                        idx = bond
+                        site_units = units[bond]
+                    else:
+                        idx = n_bonds - 1 - bond
+                        site_units = units[-1] - units[bond]
+                    pair = [residues[bond], residues[bond + 1]]
+                    if kind in "xz":
+                        # Only y ions list their flanking residues in sequence order
+                        pair = pair[::-1]
+                    names = _site_names(kind, idx + structure_constants.FRAG_OFFSET, site_units)
+                    self._add_site(pair, idx + structure_constants.FRAG_OFFSET, names)
+                    multiplicity.append(len(names))
+                    positions.append(idx + structure_constants.FRAG_OFFSET)
+        else:
+            for kind in series:
+                for fragment in flatten(seq.get_fragments(kind)):
+                    self._add_site(fragment.flanking_amino_acids, fragment.position, [fragment.name])
+                    multiplicity.append(1)
+                    positions.append(fragment.position)
+        self.multiplicity = np.array(multiplicity, dtype=float)
+        self.positions = np.array(positions, dtype=int)
+
+    def _add_site(self, flanking_amino_acids, position, names):
+        site = len(self.n_terms)
+        n_term, c_term = flanking_amino_acids
+        self.n_terms.append(n_term)
+        self.c_terms.append(c_term)
+        for name in names:
+            self.key_sites[name] = site
+
+    def __len__(self):
+        return len(self.n_terms)
+
+
+@memoize(2000)
+def fragment_sites(glycopeptide_sequence, series="by"):
+    return FragmentSites(glycopeptide_sequence, series)
+
+
+def matched_fragment_records(session, filter_fn=lambda q: q):
+    '''
+    Query the sequence and peak match map of every spectrum match of the
+    :class:`GlycopeptideMatch` rows selected by `filter_fn` in one pass.
+
+    Returns
+    -------
+    Query
+        Of `(glycopeptide_sequence, peak_match_map)` rows
+    '''
+    q = session.query(GlycopeptideMatch.glycopeptide_sequence, GlycopeptideSpectrumMatch.peak_match_map).join(
+        GlycopeptideSpectrumMatch, GlycopeptideSpectrumMatch.glycopeptide_match_id == GlycopeptideMatch.id)
+    return filter_fn(q)
+
+
+class ResidueIndex(object):
+    '''
+    Assigns each distinct residue an integer, so that counts keyed by residue and
+    residue pair can be tallied in arrays.
+    '''
+    def __init__(self):
+        self.residues = []
+        self.index = {}
+
+    def __getitem__(self, residue):
+        try:
+            return self.index[residue.name]
+        except KeyError:
+            i = self.index[residue.name] = len(self.residues)
+            self.residues.append(residue)
+            return i
+
+    def indices(self, residues):
+        return np.array([self[residue] for residue in residues], dtype=int)
+
+    def __len__(self):
+        return len(self.residues)
+
+    def tally(self, n_index, c_index, weights):
+        '''
+        Sum `weights` by residue pair, N-terminal residue and C-terminal residue.
+
+        Returns
+        -------
+        pairs, n_term, c_term: Counter
+            The non-zero totals
+        '''
+        size = len(self)
+        totals = np.bincount(n_index * size + c_index, weights=weights, minlength=size * size).reshape(size, size)
+        pairs = Counter()
+        n_term = Counter()
+        c_term = Counter()
+        for i, j in zip(*np.nonzero(totals)):
+            pairs[self.residues[i], self.residues[j]] = int(totals[i, j])
+        for i, count in enumerate(totals.sum(axis=1)):
+            if count:
+                n_term[self.residues[i]] = int(count)
+        for j, count in enumerate(totals.sum(axis=0)):
+            if count:
+                c_term[self.residues[j]] = int(count)
+        return pairs, n_term, c_term
+
+
 class FrequencyCounter(object):
     def __init__(self):
         self.observed_pairs = Counter()
@@ -47,37 +208,73 @@ class FrequencyCounter(object):
         self.observed_c_term[c_term] += 1
 
     def total_possible_outcomes(self):
-        possible_pairs = Counter()
-        possible_n_term = Counter()
-        possible_c_term = Counter()
+        residue_index = ResidueIndex()
+        n_index = []
+        c_index = []
+        weights = []
         for seq, count in self.observed_sequences.items():
-            seq = sequence.Sequence(seq)
-            for series in self.series:
-                for fragment in flatten(seq.get_fragments(series)):
-                    n_term, c_term = fragment.flanking_amino_acids
-                    possible_pairs[n_term, c_term] += count
-                    possible_n_term[n_term] += count
-                    possible_c_term[c_term] += count
-
-        self.possible_pairs = possible_pairs
-        self.possible_n_term = possible_n_term
-        self.possible_c_term = possible_c_term
+            sites = fragment_sites(seq, self.series)
+            n_index.append(residue_index.indices(sites.n_terms))
+            c_index.append(residue_index.indices(sites.c_terms))
+            weights.append(sites.multiplicity * count)
+        if not weights:
+            self.possible_pairs, self.possible_n_term, self.possible_c_term = Counter(), Counter(), Counter()
+            return
+        self.possible_pairs, self.possible_n_term, self.possible_c_term = residue_index.tally(
+            np.concatenate(n_index), np.concatenate(c_index), np.concatenate(weights))
 
     def process_match(self, glycopeptide_match):
-        key_seq = (glycopeptide_match.glycopeptide_sequence)
-        fragment_map = make_fragment_map(key_seq, self.series)
-
-        for spectrum_match in glycopeptide_match.spectrum_matches:
+        self.process_records(
+            (glycopeptide_match.glycopeptide_sequence, spectrum_match.peak_match_map)
+            for spectrum_match in glycopeptide_match.spectrum_matches)
+
+    def process_records(self, records, minimum_intensity=250):
+        '''
+        Count the fragments observed in each `(glycopeptide_sequence, peak_match_map)`
+        record, collecting the matched sites of every record before tallying them by
+        residue pair at once.
+
+        Parameters
+        ----------
+        records: iterable
+            Such as the rows of :func:`matched_fragment_records`
+        minimum_intensity: float
+            Matches to peaks less intense than this are not counted
+        '''
+        residue_index = ResidueIndex()
+        site_offsets = {}
+        n_index = []
+        c_index = []
+        observed_sites = []
+        n_sites = 0
+        for key_seq, peak_match_map in records:
+            try:
+                offset, sites = site_offsets[key_seq]
+            except KeyError:
+                sites = fragment_sites(key_seq, self.series)
+                offset = n_sites
+                site_offsets[key_seq] = offset, sites
+                n_index.append(residue_index.indices(sites.n_terms))
+                c_index.append(residue_index.indices(sites.c_terms))
+                n_sites += len(sites)
             observed = set()
-            for case in itertools.chain.from_iterable(spectrum_match.peak_match_map.values()):
+            for case in itertools.chain.from_iterable(peak_match_map.values()):
                 fkey = case['key']
-                if case['intensity'] < 250:
+                if case['intensity'] < minimum_intensity:
                     continue
-                if fkey in fragment_map and fkey not in observed:
+                site = sites.key_sites.get(fkey)
+                if site is not None and fkey not in observed:
                     observed.add(fkey)
-                    f = fragment_map[fkey]
-                    self.add_fragment(f)
+                    observed_sites.append(offset + site)
             self.add_sequence(key_seq)
+        if not observed_sites:
+            return
+        pairs, n_term, c_term = residue_index.tally(
+            np.concatenate(n_index), np.concatenate(c_index),
+            np.bincount(observed_sites, minlength=n_sites))
+        self.observed_pairs.update(pairs)
+        self.observed_n_term.update(n_term)
+        self.observed_c_term.update(c_term)
 
     def n_term_probability(self, residue=None):
         if residue is not None:
@@ -136,9 +333,72 @@ class FrequencyCounter(object):
         return inst
 
     def train(self, matches):
-        map(self.process_match, matches)
+        self.process_records(
+            (glycopeptide_match.glycopeptide_sequence, spectrum_match.peak_match_map)
+            for glycopeptide_match in matches
+            for spectrum_match in glycopeptide_match.spectrum_matches)
         self.total_possible_outcomes()
 
+    def train_from_database(self, session, filter_fn=lambda q: q):
+        self.process_records(matched_fragment_records(session, filter_fn))
+        self.total_possible_outcomes()
+
+    def lookup_tables(self):
+        return FrequencyTable(self)
+
+
+class FrequencyTable(object):
+    '''
+    The residue probabilities of a trained :class:`FrequencyCounter` as arrays indexed by
+    residue, so that every site of a sequence can be scored with array lookups.
+
+    Residues which were never possible in training have probability 0.
+
+    Attributes
+    ----------
+    residue_index: ResidueIndex
+    n_term: np.ndarray
+    c_term: np.ndarray
+    pairs: np.ndarray
+        Indexed by the N-terminal then the C-terminal residue
+    '''
+    def __init__(self, frequency_counter):
+        self.residue_index = residue_index = ResidueIndex()
+        for residue in itertools.chain(frequency_counter.possible_n_term, frequency_counter.possible_c_term):
+            residue_index[residue]
+        # The last entry stands in for any residue not seen in training
+        size = len(residue_index) + 1
+        self.n_term = np.zeros(size)
+        self.c_term = np.zeros(size)
+        self.pairs = np.zeros((size, size))
+        for residue, count in frequency_counter.possible_n_term.items():
+            if count:
+                self.n_term[residue_index[residue]] = frequency_counter.observed_n_term[residue] / float(count)
+        for residue, count in frequency_counter.possible_c_term.items():
+            if count:
+                self.c_term[residue_index[residue]] = frequency_counter.observed_c_term[residue] / float(count)
+        for (n_term, c_term), count in frequency_counter.possible_pairs.items():
+            if count:
+                self.pairs[residue_index[n_term], residue_index[c_term]] = frequency_counter.observed_pairs[
+                    n_term, c_term] / float(count)
+        self.unknown = size - 1
+
+    def indices(self, residues):
+        index = self.residue_index.index
+        return np.array([index.get(residue.name, self.unknown) for residue in residues], dtype=int)
+
+    def site_scores(self, sites, use_interaction=False):
+        '''
+        Score each site of a :class:`FragmentSites`, by the probability of its residue
+        pair if `use_interaction`, otherwise by the product of its N- and C-terminal
+        residue probabilities.
+        '''
+        n_index = self.indices(sites.n_terms)
+        c_index = self.indices(sites.c_terms)
+        if use_interaction:
+            return self.pairs[n_index, c_index]
+        return self.n_term[n_index] * self.c_term[c_index]
+
 
 def extract_matched_fragments(match):
     keys = set()
@@ -169,6 +429,7 @@ class FrequencyScorer(GlycopeptideSpectrumMatchScorer):
         super(FrequencyScorer, self).__init__("pair_counting_ms2_score", "ms2_score")
         self.use_interaction = use_interaction
         self.frequency_counter = frequency_counter
+        self.table = frequency_counter.lookup_tables()
 
     def evaluate(self, matched, theoretical, **parameters):
         matched.mean_coverage = simple_scoring_algorithm.mean_coverage2(matched)
@@ -177,23 +438,21 @@ class FrequencyScorer(GlycopeptideSpectrumMatchScorer):
         return ms2_score
 
     def backbone_score(self, matched, **parameters):
-        fragment_map = make_fragment_map(matched.glycopeptide_sequence)
-        total = self._maximum_score(fragment_map)
+        sites = fragment_sites(matched.glycopeptide_sequence)
+        site_scores = self.table.site_scores(sites, self.use_interaction)
+        total = self._maximum_score(sites, site_scores)
         observed = 0
         if self.use_interaction:
             for frag in extract_matched_fragments(matched):
-                observed += self.frequency_counter.pair_probability(fragment_map[frag['key']].flanking_amino_acids)
+                observed += site_scores[sites.key_sites[frag['key']]]
         else:
             track_site = set()
             for frag in extract_matched_fragments(matched):
-                f = fragment_map[frag['key']]
-                position = f.position
-                n_term, c_term = f.flanking_amino_acids
-                score = self.frequency_counter.n_term_probability(
-                    n_term) * self.frequency_counter.c_term_probability(c_term)
+                site = sites.key_sites[frag['key']]
+                position = sites.positions[site]
                 weight = 0.6 if position not in track_site else 0.4
                 track_site.add(position)
-                observed += score * weight
+                observed += site_scores[site] * weight
 
         return observed / total
 
@@ -203,17 +462,9 @@ class FrequencyScorer(GlycopeptideSpectrumMatchScorer):
         backbone_weight = 1 - stub_weight
         return (backbone_weight * backbone_score) + (stub_weight * stub_ion_score)
 
-    def _maximum_score(self, fragment_map):
-        total = 0
-        frags = fragment_map.values()
-        if self.use_interaction:
-            for frag in frags:
-                total += self.frequency_counter.pair_probability(frag.flanking_amino_acids)
-        else:
-            for frag in frags:
-                n_term, c_term = fragment_map[frag.name].flanking_amino_acids
-                score = self.frequency_counter.n_term_probability(
-                    n_term) * self.frequency_counter.c_term_probability(c_term)
-                total += score * 0.5
-
+    def _maximum_score(self, sites, site_scores):
+        # Every fragment at a site shares its score
+        total = site_scores.dot(sites.multiplicity)
+        if not self.use_interaction:
+            total *= 0.5
         return total
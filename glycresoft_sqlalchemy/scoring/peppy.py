@@ -1,18 +1,117 @@
 import numpy as np
-from scipy.misc import comb
+from scipy.special import betainc, betaln
+
+from glycresoft_sqlalchemy.data_model import GlycopeptideSpectrumMatchScore
+
+from .base import GlycopeptideSpectrumMatchScorer
+
+
+def _incomplete_beta_continued_fraction(a, b, x, tolerance=1e-15, max_iterations=10000):
+    '''
+    Evaluate the continued fraction of the incomplete beta function by the modified
+    Lentz method, element-wise. Converges quickly where ``x < (a + 1) / (a + b + 2)``.
+    '''
+    tiny = 1e-300
+
+    def clamp(value):
+        return np.where(np.abs(value) < tiny, tiny, value)
+
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = np.ones_like(x)
+    d = 1. / clamp(1 - qab * x / qap)
+    h = d.copy()
+    active = np.ones(x.shape, dtype=bool)
+    for m in range(1, max_iterations):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1. / clamp(1 + aa * d)
+        c = clamp(1 + aa / c)
+        even = d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1. / clamp(1 + aa * d)
+        c = clamp(1 + aa / c)
+        odd = d * c
+        h = np.where(active, h * even * odd, h)
+        active &= np.abs(odd - 1) > tolerance
+        if not active.any():
+            break
+    return h
+
+
+def log_regularized_incomplete_beta(a, b, x):
+    '''
+    The log of the regularized incomplete beta function ``I_x(a, b)``, which stays
+    finite where ``I_x(a, b)`` itself is too small to represent as a float.
+
+    Where the function is small, it is evaluated as its leading factor,
+    ``x ** a * (1 - x) ** b / (a * B(a, b))``, formed in log space with :func:`betaln`,
+    times a continued fraction. Elsewhere it is :func:`betainc` directly.
+    '''
+    a, b, x = np.broadcast_arrays(
+        np.asarray(a, dtype=float), np.asarray(b, dtype=float), np.asarray(x, dtype=float))
+    result = np.empty(a.shape)
+    direct = x >= (a + 1) / (a + b + 2)
+    fraction = ~direct
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[direct] = np.log(betainc(a[direct], b[direct], x[direct]))
+        a, b, x = a[fraction], b[fraction], x[fraction]
+        result[fraction] = (a * np.log(x) + b * np.log1p(-x) - np.log(a) - betaln(a, b) +
+                            np.log(_incomplete_beta_continued_fraction(a, b, x)))
+    return result
+
+
+def log_binomial_tail_probability(n, k, p):
+    '''
+    The log probability that a binomial variable with `n` trials and success probability
+    `p` takes a value from `k` up to, but not including, `n`.
+
+    The survival function ``P(X >= k) = I_p(k, n - k + 1)`` is computed in log space
+    by :func:`log_regularized_incomplete_beta`, and the ``X == n`` term is subtracted
+    from it in log space, so tails too small to represent as a float do not underflow.
+    Accepts arrays, broadcasting them against each other.
+
+    Parameters
+    ----------
+    n: int or array-like
+    k: int or array-like
+    p: float or array-like
+
+    Returns
+    -------
+    float or np.ndarray
+    '''
+    n, k, p = np.broadcast_arrays(
+        np.asarray(n, dtype=float), np.asarray(k, dtype=float), np.asarray(p, dtype=float))
+    result = np.full(n.shape, -np.inf)
+    # The sum stops short of X == n
+    everything = (k <= 0) & (n > 0)
+    result[everything] = np.log1p(-p[everything] ** n[everything])
+    tail = (k >= 1) & (k < n)
+    n, k, p = n[tail], k[tail], p[tail]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_survival = log_regularized_incomplete_beta(k, n - k + 1, p)
+        log_last_term = n * np.log(p)
+        result[tail] = np.where(
+            np.isneginf(log_last_term), log_survival,
+            log_survival + np.log1p(-np.exp(log_last_term - log_survival)))
+    if result.ndim == 0:
+        return float(result)
+    return result
 
 
 def binomial_tail_probability(n, k, p):
-    total = 0
-    for i in range(k, n):
-        total += comb(n, i) * (p ** i) * (1 - p) ** (n - i)
-    return total
+    return np.exp(log_binomial_tail_probability(n, k, p))
+
+
+def fragment_match_probability(count_product_ion_matches, ion_tolerance, precursor_mass):
+    return 2 * ion_tolerance * np.asarray(count_product_ion_matches, dtype=float) / precursor_mass
 
 
 def peppy_binomial_fragments_matched(total_product_ion_count, count_product_ion_matches, ion_tolerance,
                                      precursor_mass):
-    p = np.exp((np.log(ion_tolerance) + np.log(2)) +
-               np.log(count_product_ion_matches) - np.log(precursor_mass))
+    p = fragment_match_probability(count_product_ion_matches, ion_tolerance, precursor_mass)
     return binomial_tail_probability(total_product_ion_count, count_product_ion_matches, p)
 
 
@@ -26,58 +125,120 @@ def count_theoretical_product_ions(theoretical):
     return total
 
 
-def medians(array):
-    m1 = np.median(array)
-    m2 = np.median(array[array > m1])
-    m3 = np.median(array[array > m2])
-    m4 = np.median(array[array > m3])
-    return m1, m2, m3, m4
+def medians(array, depth=4):
+    '''
+    Compute the median of `array`, then the median of the values above it, and so on
+    `depth` times, sorting `array` once.
+
+    Returns
+    -------
+    tuple of float
+        `nan` for each level with no values above the previous median
+    '''
+    ordered = np.sort(np.asarray(array, dtype=float))
+    thresholds = []
+    start = 0
+    for i in range(depth):
+        above = ordered[start:]
+        size = len(above)
+        if size == 0:
+            median = np.nan
+        else:
+            median = (above[(size - 1) // 2] + above[size // 2]) / 2.
+        thresholds.append(median)
+        # nan sorts after every value, leaving nothing above it
+        start = np.searchsorted(ordered, median, 'right')
+    return tuple(thresholds)
+
+
+def _matched_intensities(matched_peaks):
+    return np.array([match['intensity'] for p, matches in matched_peaks.items() for match in matches],
+                    dtype=float)
+
+
+def log_peppy_binomial_intensity(thresholds, matched_intensities, total_product_ion_count):
+    '''
+    The log of the intensity component of the score, given the nested median
+    `thresholds` of the spectrum.
+    '''
+    ordered = np.sort(matched_intensities)
+    counts = len(ordered) - np.searchsorted(ordered, thresholds, 'right')
+    last_counts = np.concatenate(([total_product_ion_count], counts[:-1]))
+    return log_binomial_tail_probability(last_counts, counts, 0.5).sum()
 
 
 def peppy_binomial_intensity(peak_list, matched_peaks, total_product_ion_count):
-    intensity_list = np.array([p.intensity for p in peak_list])
-    m1, m2, m3, m4 = medians(intensity_list)
-
-    matched_intensities = np.array(
-        [match['intensity'] for p, matches in matched_peaks.items() for match in matches])
-    counts = dict()
-    last_count = total_product_ion_count
-    next_count = (matched_intensities > m1).sum()
-    counts[1] = binomial_tail_probability(last_count, next_count, 0.5)
-    last_count = next_count
-
-    next_count = (matched_intensities > m2).sum()
-    counts[2] = binomial_tail_probability(last_count, next_count, 0.5)
-    last_count = next_count
-
-    next_count = (matched_intensities > m3).sum()
-    counts[3] = binomial_tail_probability(last_count, next_count, 0.5)
-    last_count = next_count
-
-    next_count = (matched_intensities > m4).sum()
-    counts[4] = binomial_tail_probability(last_count, next_count, 0.5)
-
-    prod = 0
-    for v in counts.values():
-        prod += np.log(v)
-    return np.exp(prod)
+    thresholds = medians([p.intensity for p in peak_list])
+    return np.exp(log_peppy_binomial_intensity(
+        thresholds, _matched_intensities(matched_peaks), total_product_ion_count))
+
+
+def peptide_backbone_mass(theoretical):
+    glycan_mass = getattr(theoretical, "glycan_mass", None)
+    if glycan_mass is None:
+        glycan_mass = theoretical.glycan_composition.mass()
+    return theoretical.calculated_mass - glycan_mass
+
+
+def peppy_scores(spectrum, spectrum_matches, match_tolerance):
+    '''
+    Score every match to one spectrum, sorting the spectrum's intensities once for
+    the thresholds shared by all of them and evaluating the binomial tails of all
+    matches together.
+
+    Parameters
+    ----------
+    spectrum: iterable of peaks
+    spectrum_matches: list
+        Objects with `theoretical_glycopeptide` and `peak_match_map` attributes
+    match_tolerance: float
+
+    Returns
+    -------
+    np.ndarray
+        The score of each match, as :func:`peppy_score`
+    '''
+    thresholds = medians([p.intensity for p in spectrum])
+    n = len(spectrum_matches)
+    total_product_ions = np.zeros(n)
+    match_counts = np.zeros(n)
+    precursor_masses = np.zeros(n)
+    log_intensity_components = np.zeros(n)
+    for i, spectrum_match in enumerate(spectrum_matches):
+        theoretical = spectrum_match.theoretical_glycopeptide
+        total_product_ions[i] = count_theoretical_product_ions(theoretical)
+        match_counts[i] = len(spectrum_match.peak_match_map)
+        precursor_masses[i] = peptide_backbone_mass(theoretical)
+        log_intensity_components[i] = log_peppy_binomial_intensity(
+            thresholds, _matched_intensities(spectrum_match.peak_match_map), total_product_ions[i])
+    log_fragment_match_components = log_binomial_tail_probability(
+        total_product_ions, match_counts,
+        fragment_match_probability(match_counts, match_tolerance, precursor_masses))
+    return -(log_intensity_components + log_fragment_match_components) / np.log(10)
 
 
 def peppy_score(spectrum, spectrum_match, match_tolerance):
-    theoretical = spectrum_match.theoretical_glycopeptide
-    total_theoretical_product_ions = count_theoretical_product_ions(
-        theoretical)
-    precursor_mass = theoretical.calculated_mass - \
-        theoretical.glycan_composition.mass()
-    fragment_match_component = peppy_binomial_fragments_matched(
-        total_theoretical_product_ions,
-        len(spectrum_match.peak_match_map),
-        match_tolerance,
-        precursor_mass
-    )
-
-    intensity_component = peppy_binomial_intensity(
-        spectrum,
-        spectrum_match.peak_match_map,
-        total_theoretical_product_ions)
-    return -np.log10(intensity_component * fragment_match_component)
+    return peppy_scores(spectrum, [spectrum_match], match_tolerance)[0]
+
+
+class PeppySpectrumScorer(GlycopeptideSpectrumMatchScorer):
+    '''
+    Scores :class:`GlycopeptideSpectrumMatch` records with :func:`peppy_scores`,
+    scoring all of the matches to a scan at once through :meth:`score_batch`.
+    '''
+    def __init__(self, match_tolerance=2e-5):
+        super(PeppySpectrumScorer, self).__init__("peppy_ms2_score", "ms2_score")
+        self.match_tolerance = match_tolerance
+
+    def evaluate(self, spectrum_match, *args, **kwargs):
+        return self.score_values([spectrum_match])[0]
+
+    def score_values(self, spectrum_matches):
+        return peppy_scores(spectrum_matches[0].spectrum, spectrum_matches, self.match_tolerance)
+
+    def score_batch(self, spectrum_matches, **kwargs):
+        if not spectrum_matches:
+            return []
+        return [GlycopeptideSpectrumMatchScore(name=self.score_name, value=float(value),
+                                               spectrum_match_id=spectrum_match.id)
+                for spectrum_match, value in zip(spectrum_matches, self.score_values(spectrum_matches))]
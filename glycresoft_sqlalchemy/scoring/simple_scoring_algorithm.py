@@ -3,9 +3,13 @@ import itertools
 import operator
 import math
 
+import numpy as np
+
 from ..utils import collectiontools
+from ..utils.memoize import memoize
 
 from ..structure.sequence import Sequence
+from ..structure.fragment import get_ion_identifier, ion_series_codes
 
 from .base import ScorerBase, GlycopeptideSpectrumMatchScorer
 
@@ -20,6 +24,13 @@ _expected_stub_ion_count = 3
 bare_ion_pattern = re.compile(r"[czby](\d+)")
 glycosylated_ion_pattern = re.compile(r"[czby](\d+)\+(.+)")
 
+# Maps (series, glycosylated) of an ion's identifier to its :func:`split_ion_list` bin
+_ion_bins = {(ion_series_codes["oxonium_ion"], False): "oxonium_ions"}
+_ion_bins[ion_series_codes["stub_glycopeptide"], False] = "stub_ions"
+for _series in "bcyz":
+    _ion_bins[ion_series_codes[_series], False] = "bare_%s_ions" % _series
+    _ion_bins[ion_series_codes[_series], True] = "glycosylated_%s_ions" % _series
+
 
 def split_ion_list(ion_list):
     """
@@ -47,23 +58,8 @@ def split_ion_list(ion_list):
         "glycosylated_z_ions": []
     }
     for ion in ion_list:
-        key = ion['key']
-        # Pseudoswitch
-        if 'pep' == key[:3]:
-            ion_store['stub_ions'].append(ion)
-            continue
-        match = glycosylated_ion_pattern.match(key)
-        if match:
-            ion_store['glycosylated_%s_ions' % key[0]].append(ion)
-            continue
-
-        match = bare_ion_pattern.match(key)
-        if match:
-            ion_store['bare_%s_ions' % key[0]].append(ion)
-            continue
-
-        # Finally
-        ion_store['oxonium_ions'].append(ion)
+        identifier = get_ion_identifier(ion)
+        ion_store[_ion_bins.get((identifier.series, identifier.glycosylated), "oxonium_ions")].append(ion)
     return ion_store
 
 
@@ -165,6 +161,45 @@ def stream_backbone_coordinate(iterable):
     return set(imap(int, chain.from_iterable(imap(bare_ion_pattern.findall, imap(key_getter, iterable)))))
 
 
+def backbone_positions(ions):
+    """
+    The distinct backbone positions of `ions`, read from their identifiers
+
+    Parameters
+    ----------
+    ions : Iterable of dict
+
+    Returns
+    -------
+    np.ndarray
+        Sorted array of unique positions
+    """
+    return np.unique(np.fromiter((get_ion_identifier(ion).position for ion in ions), dtype=np.int64))
+
+
+@memoize(10000)
+def sequence_length(glycopeptide_sequence):
+    return len(Sequence(glycopeptide_sequence))
+
+
+def _spread_n_terminal(positions, length):
+    # Equivalent to calling incvec_spread(vector, p) for each p in `positions`
+    counts = np.bincount(positions[positions > 1], minlength=length + 1)
+    return np.cumsum(counts[::-1])[::-1][1:length + 1].astype(float)
+
+
+def _spread_c_terminal(positions, length):
+    # Equivalent to calling incvec_spread(vector, length - p, length) for each p in `positions`
+    counts = np.bincount(positions, minlength=length + 2)
+    return np.cumsum(counts[::-1])[::-1][2:length + 2][::-1].astype(float)
+
+
+def _spot(indices, length):
+    vector = np.zeros(length)
+    vector[indices] = 1.
+    return vector
+
+
 def incvec_spread(vector, p, s=1):
     for i in range(s - 1, p, 1 if p > s else -1):
         vector[i] += 1
@@ -231,68 +266,54 @@ def vsum(a, b):
 
 
 def compute_backbone_vectors(matched, incvec=incvec_spread):
-    sequence = Sequence(matched.glycopeptide_sequence)
-    sequence_length = len(sequence)
-
-    b_ions = [0.] * sequence_length
-    for b_ion in stream_backbone_coordinate(matched.bare_b_ions):
-        incvec(b_ions, b_ion)
-
-    glycosylated_b_ions = [0.] * sequence_length
-    for b_ion in stream_backbone_coordinate(matched.glycosylated_b_ions):
-        incvec(glycosylated_b_ions, b_ion)
-
-    y_ions = [0.] * sequence_length
-    for y_ion in stream_backbone_coordinate(matched.bare_y_ions):
-        incvec(y_ions, sequence_length - y_ion, sequence_length)
-
-    glycosylated_y_ions = [0.] * sequence_length
-    for y_ion in stream_backbone_coordinate(matched.glycosylated_y_ions):
-        incvec(glycosylated_y_ions, sequence_length - y_ion, sequence_length)
-
-    return b_ions, glycosylated_b_ions, y_ions, glycosylated_y_ions
+    length = sequence_length(matched.glycopeptide_sequence)
+    b_ions = backbone_positions(matched.bare_b_ions)
+    glycosylated_b_ions = backbone_positions(matched.glycosylated_b_ions)
+    y_ions = backbone_positions(matched.bare_y_ions)
+    glycosylated_y_ions = backbone_positions(matched.glycosylated_y_ions)
+
+    if incvec is incvec_spread:
+        return (_spread_n_terminal(b_ions, length), _spread_n_terminal(glycosylated_b_ions, length),
+                _spread_c_terminal(y_ions, length), _spread_c_terminal(glycosylated_y_ions, length))
+    elif incvec is incvec_spot:
+        return (_spot(b_ions, length), _spot(glycosylated_b_ions, length),
+                _spot(length - y_ions, length), _spot(length - glycosylated_y_ions, length))
+
+    vectors = []
+    for positions, c_terminal in ((b_ions, False), (glycosylated_b_ions, False),
+                                  (y_ions, True), (glycosylated_y_ions, True)):
+        vector = [0.] * length
+        for position in positions:
+            if c_terminal:
+                incvec(vector, length - position, length)
+            else:
+                incvec(vector, position)
+        vectors.append(np.array(vector, dtype=float))
+    return vectors
+
+
+def _backbone_coverage(matched, incvec):
+    b_ions, glycosylated_b_ions, y_ions, glycosylated_y_ions = compute_backbone_vectors(matched, incvec)
+    return np.maximum(b_ions, glycosylated_b_ions) + np.maximum(y_ions, glycosylated_y_ions)
 
 
 def mean_coverage(matched):
-    sequence = Sequence(matched.glycopeptide_sequence)
-    sequence_length = len(sequence)
-
-    b_ions = [0.] * sequence_length
-    for b_ion in stream_backbone_coordinate(matched.bare_b_ions):
-        incvec_spread(b_ions, b_ion)
-
-    glycosylated_b_ions = [0.] * sequence_length
-    for b_ion in stream_backbone_coordinate(matched.glycosylated_b_ions):
-        incvec_spread(glycosylated_b_ions, b_ion)
-
-    y_ions = [0.] * sequence_length
-    for y_ion in stream_backbone_coordinate(matched.bare_y_ions):
-        incvec_spread(y_ions, sequence_length - y_ion, sequence_length)
-
-    glycosylated_y_ions = [0.] * sequence_length
-    for y_ion in stream_backbone_coordinate(matched.glycosylated_y_ions):
-        incvec_spread(glycosylated_y_ions, sequence_length - y_ion, sequence_length)
-
-    coverage = mean(vsum(bitwise_or(b_ions, glycosylated_b_ions), bitwise_or(y_ions, glycosylated_y_ions)))
-    coverage /= 1. * sequence_length
-
-    return coverage
+    coverage = _backbone_coverage(matched, incvec_spread)
+    return coverage.mean() / (1. * len(coverage))
 
 
 def mean_coverage2(matched):
-    b_ions, glycosylated_b_ions, y_ions, glycosylated_y_ions = compute_backbone_vectors(matched, incvec_spot)
-    coverage = vsum(bitwise_or(b_ions, glycosylated_b_ions), bitwise_or(y_ions, glycosylated_y_ions))
+    coverage = _backbone_coverage(matched, incvec_spot)
     # This normalization constant log2(3, 2) keeps the sum very close to 1.0 in a perfect case.
-    coverage = sum([math.log(1 + i, 2)/_normalizer for i in coverage]) / (1. * len(coverage))
-    return coverage
+    return (np.log2(1 + coverage) / _normalizer).sum() / (1. * len(coverage))
 
 
 def mean_hexnac_coverage(matched, theoretical):
-    b_observed = (stream_backbone_coordinate(matched.glycosylated_b_ions))
-    y_observed = (stream_backbone_coordinate(matched.glycosylated_y_ions))
+    b_observed = backbone_positions(matched.glycosylated_b_ions)
+    y_observed = backbone_positions(matched.glycosylated_y_ions)
 
-    b_enumerated = (stream_backbone_coordinate(theoretical.glycosylated_b_ions))
-    y_enumerated = (stream_backbone_coordinate(theoretical.glycosylated_y_ions))
+    b_enumerated = backbone_positions(theoretical.glycosylated_b_ions)
+    y_enumerated = backbone_positions(theoretical.glycosylated_y_ions)
     return (len(b_observed) + len(y_observed)) / float(len(b_enumerated) + len(y_enumerated))
 
 
@@ -302,13 +323,8 @@ def observed_vs_enumerated_stub(matched):
 
 
 def compute_percent_uncovered(matched):
-    bs, gbs, ys, gys = compute_backbone_vectors(matched)
-    backbone = vsum(bitwise_or(bs, gbs), bitwise_or(ys, gys))
-    is_zero = 0
-    for i in backbone:
-        if i == 0:
-            is_zero += 1
-    return is_zero / float(len(matched))
+    backbone = _backbone_coverage(matched, incvec_spread)
+    return np.count_nonzero(backbone == 0) / float(len(matched))
 
 
 class SimpleSpectrumScorer(GlycopeptideSpectrumMatchScorer):
@@ -256,8 +256,7 @@ class TargetDecoyAnalyzer(PipelineModule):
         session.close()
 
     def run(self):
-        self.calculate_thresholds()
-        self.q_values()
+        self.run_stages(self.calculate_thresholds, self.q_values)
 
 
 class TargetDecoySpectrumMatchAnalyzer(TargetDecoyAnalyzer):
@@ -441,8 +440,7 @@ class TargetDecoySpectrumMatchAnalyzer(TargetDecoyAnalyzer):
         session.close()
 
     def run(self):
-        self.calculate_thresholds()
-        self.q_values()
+        self.run_stages(self.calculate_thresholds, self.q_values)
 
 
 class InMemoryTargetDecoyAnalyzer(object):
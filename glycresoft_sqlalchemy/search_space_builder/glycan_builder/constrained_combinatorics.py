@@ -8,6 +8,7 @@ from glycresoft_sqlalchemy.search_space_builder.glycan_builder import registry
 from glycresoft_sqlalchemy.search_space_builder.glycan_builder.composition_source import make_motif_lookup_index
 
 import logging
+import multiprocessing
 from itertools import product
 
 logger = logging.getLogger("glycan_composition_constrained_combinatorics")
@@ -53,7 +54,7 @@ class ConstrainedCombinatoricsGlycanHypothesisBuilder(PipelineModule):
 
     def __init__(self, database_path, rules_file=None, hypothesis_id=None,
                  rules_table=None, constraints_list=None, derivatization=None,
-                 reduction=None, *args, **kwargs):
+                 reduction=None, maximum_mass=None, n_processes=1, *args, **kwargs):
         self.manager = self.manager_type(database_path)
         self.rules_file = rules_file
         self.rules_table = rules_table
@@ -61,6 +62,8 @@ class ConstrainedCombinatoricsGlycanHypothesisBuilder(PipelineModule):
         self.hypothesis_id = hypothesis_id
         self.derivatization = derivatization
         self.reduction = reduction
+        self.maximum_mass = maximum_mass
+        self.n_processes = n_processes
         self.options = kwargs
 
     def run(self):
@@ -82,18 +85,28 @@ class ConstrainedCombinatoricsGlycanHypothesisBuilder(PipelineModule):
         hypothesis.parameters = hypothesis.parameters or {}
         hypothesis.parameters['rules_table'] = self.rules_table
         hypothesis.parameters['constraints'] = self.constraints_list
+        hypothesis.parameters['maximum_mass'] = self.maximum_mass
         session.add(hypothesis)
         session.commit()
 
         hypothesis_id = self.hypothesis_id = hypothesis.id
 
         generator = CombinatoricCompositionGenerator(
-            rules_table=self.rules_table, constraints=self.constraints_list)
+            rules_table=self.rules_table, constraints=self.constraints_list,
+            maximum_mass=self.maximum_mass)
+
+        if self.n_processes > 1:
+            pool = multiprocessing.Pool(self.n_processes)
+            compositions = (
+                composition for part in pool.imap(
+                    generate_serialized, generator.split(self.n_processes * 4))
+                for composition in part)
+        else:
+            pool = None
+            compositions = generate_serialized(generator)
 
         acc = []
-        for composition, classifications in generator:
-            mass = composition.mass()
-            serialized = composition.serialize()
+        for serialized, mass, classifications in compositions:
             matched_motifs = []
             if classifications:
                 for cls in classifications:
@@ -113,10 +126,27 @@ class ConstrainedCombinatoricsGlycanHypothesisBuilder(PipelineModule):
         session.commit()
         acc = []
 
+        if pool is not None:
+            pool.close()
+            pool.join()
         session.close()
         return hypothesis_id
 
 
+def generate_serialized(generator):
+    """
+    Run `generator` to completion, producing picklable records of its compositions
+    so that parts of the space can be generated in worker processes.
+
+    Returns
+    -------
+    list of (str, float, list)
+        Serialized composition, mass and classifications
+    """
+    return [(composition.serialize(), composition.mass(), classifications)
+            for composition, classifications in generator]
+
+
 def descending_combination_counter(counter):
     keys = counter.keys()
     count_ranges = map(lambda lo_hi: range(lo_hi[0], lo_hi[1] + 1), counter.values())
@@ -134,6 +164,8 @@ class CombinatoricCompositionGenerator(object):
         Description
     lower_bound : list
         Description
+    maximum_mass : float
+        If not None, compositions heavier than this are not generated
     residue_list : list
         Description
     rules_table : dict
@@ -150,12 +182,14 @@ class CombinatoricCompositionGenerator(object):
             rules_table[residue] = (lower, upper)
         return rules_table
 
-    def __init__(self, residue_list=None, lower_bound=None, upper_bound=None, constraints=None, rules_table=None):
+    def __init__(self, residue_list=None, lower_bound=None, upper_bound=None, constraints=None, rules_table=None,
+                 maximum_mass=None):
         self.residue_list = residue_list or []
         self.lower_bound = lower_bound or []
         self.upper_bound = upper_bound or []
         self.constraints = constraints or []
         self.rules_table = rules_table
+        self.maximum_mass = maximum_mass
 
         if len(self.constraints) > 0 and not isinstance(self.constraints[0], CompositionConstraint):
             self.constraints = list(map(CompositionConstraint.from_list, self.constraints))
@@ -172,22 +206,124 @@ class CombinatoricCompositionGenerator(object):
         self.rules_table = rules_table
         return rules_table
 
+    def constraint_schedule(self, residues):
+        """
+        Assign each constraint to every position in `residues` holding a symbol it
+        depends on. Before its last symbol is assigned a constraint is evaluated over
+        the :class:`Interval` of the counts still to come, and at its last symbol it is
+        decided exactly.
+
+        Returns
+        -------
+        list of list
+            The constraints to test after assigning each residue
+        """
+        position = {residue: i for i, residue in enumerate(residues)}
+        schedule = [[] for residue in residues]
+        if not residues:
+            return schedule
+        for constraint in self.constraints:
+            depths = set(position.get(symbol, len(residues) - 1) for symbol in constraint_symbols(constraint))
+            for depth in sorted(depths or [0]):
+                schedule[depth].append(constraint)
+        return schedule
+
+    def enumerate_counts(self):
+        """
+        Enumerate the residue counts which satisfy every constraint by branch and bound.
+
+        Residues are assigned one at a time in the order of :attr:`rules_table`. After
+        each assignment, every constraint depending on that residue is evaluated with
+        the residues not yet assigned standing for the :class:`Interval` of their
+        allowed counts, and a branch is abandoned as soon as any of them can no longer
+        be satisfied by the partial assignment. When :attr:`maximum_mass` is set, a branch is also abandoned once
+        its mass, with every later residue at its lowest count, exceeds it.
+
+        Yields
+        ------
+        dict
+            Residue counts, in the same order as the full product of the count ranges
+        """
+        residues = list(self.rules_table.keys())
+        ranges = [self.rules_table[residue] for residue in residues]
+        n = len(residues)
+        context = {residue: Interval(lower, upper) for residue, (lower, upper) in zip(residues, ranges)}
+        solution = Solution(context)
+        if not all(constraint(solution) for constraint in self.constraints):
+            return
+        schedule = self.constraint_schedule(residues)
+
+        maximum_mass = self.maximum_mass
+        if maximum_mass is not None:
+            base_mass = GlycanComposition().mass()
+            residue_masses = [GlycanComposition(**{residue: 1}).mass() - base_mass for residue in residues]
+            # The lightest completion of the residues after each position
+            remaining_mass = [0.] * (n + 1)
+            for i in range(n - 1, -1, -1):
+                remaining_mass[i] = remaining_mass[i + 1] + max(ranges[i][0], 0) * residue_masses[i]
+            if base_mass + remaining_mass[0] > maximum_mass:
+                return
+        else:
+            base_mass = 0.
+
+        def descend(depth, mass):
+            if depth == n:
+                yield dict(context)
+                return
+            residue = residues[depth]
+            lower, upper = ranges[depth]
+            checks = schedule[depth]
+            for count in range(lower, upper + 1):
+                if maximum_mass is not None:
+                    branch_mass = mass + count * residue_masses[depth]
+                    if branch_mass + remaining_mass[depth + 1] > maximum_mass:
+                        break
+                else:
+                    branch_mass = mass
+                context[residue] = count
+                if all(constraint(solution) for constraint in checks):
+                    for counts in descend(depth + 1, branch_mass):
+                        yield counts
+            context[residue] = Interval(lower, upper)
+
+        for counts in descend(0, base_mass):
+            yield counts
+
     def generate(self):
-        for combin in descending_combination_counter(self.rules_table):
-            passed = True
+        for combin in self.enumerate_counts():
             combin = Solution(combin)
-            for constraint in self.constraints:
-                if not constraint(combin):
-                    passed = False
-                    break
             classifications = [classifier.classification for classifier in
                                [is_n_glycan_classifier, is_o_glycan_classifier]
                                if classifier(combin)]
-            if passed:
-                yield GlycanComposition(**combin.context), classifications
+            yield GlycanComposition(**combin.context), classifications
 
     __iter__ = generate
 
+    def split(self, n):
+        """
+        Divide the composition space into at most `n` disjoint parts by partitioning the
+        count range of the residue with the widest range.
+
+        Returns
+        -------
+        list of CombinatoricCompositionGenerator
+        """
+        if not self.rules_table:
+            return [self]
+        residue, (lower, upper) = max(self.rules_table.items(), key=lambda item: item[1][1] - item[1][0])
+        width = upper - lower + 1
+        n = max(min(n, width), 1)
+        parts = []
+        start = lower
+        for i in range(n):
+            stop = start + width // n + (1 if i < width % n else 0)
+            rules_table = dict(self.rules_table)
+            rules_table[residue] = (start, stop - 1)
+            parts.append(CombinatoricCompositionGenerator(
+                rules_table=rules_table, constraints=self.constraints, maximum_mass=self.maximum_mass))
+            start = stop
+        return parts
+
     def __repr__(self):
         return repr(self.rules_table) + '\n' + repr(self.constraints)
 
@@ -578,6 +714,135 @@ class Solution(object):
             return node.evaluate(self)
 
 
+class UndeterminedType(object):
+    """
+    The outcome of a comparison between :class:`Interval` values which may hold for
+    some of the values they contain and not for others. It is truthy, so that a
+    constraint evaluated over intervals is false only when no assignment could satisfy it.
+    """
+    def __nonzero__(self):
+        return True
+
+    def __repr__(self):
+        return "Undetermined"
+
+
+Undetermined = UndeterminedType()
+
+
+def _bounds(value):
+    if isinstance(value, Interval):
+        return value.lower, value.upper
+    return value, value
+
+
+class Interval(object):
+    """
+    The range of values a term may take while some of the residue counts it depends
+    on are not yet assigned. Supports the arithmetic and comparisons used by the
+    :class:`Operator` types, so that constraints can be evaluated on partial solutions.
+
+    Attributes
+    ----------
+    lower : int
+    upper : int
+    """
+    __hash__ = None
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def __add__(self, other):
+        lower, upper = _bounds(other)
+        return Interval(self.lower + lower, self.upper + upper)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        lower, upper = _bounds(other)
+        return Interval(self.lower - upper, self.upper - lower)
+
+    def __rsub__(self, other):
+        lower, upper = _bounds(other)
+        return Interval(lower - self.upper, upper - self.lower)
+
+    def __mul__(self, scale):
+        a = self.lower * scale
+        b = self.upper * scale
+        return Interval(min(a, b), max(a, b))
+
+    __rmul__ = __mul__
+
+    def __lt__(self, other):
+        lower, upper = _bounds(other)
+        if self.upper < lower:
+            return True
+        elif self.lower >= upper:
+            return False
+        return Undetermined
+
+    def __le__(self, other):
+        lower, upper = _bounds(other)
+        if self.upper <= lower:
+            return True
+        elif self.lower > upper:
+            return False
+        return Undetermined
+
+    def __gt__(self, other):
+        lower, upper = _bounds(other)
+        if self.lower > upper:
+            return True
+        elif self.upper <= lower:
+            return False
+        return Undetermined
+
+    def __ge__(self, other):
+        lower, upper = _bounds(other)
+        if self.lower >= upper:
+            return True
+        elif self.upper < lower:
+            return False
+        return Undetermined
+
+    def __eq__(self, other):
+        lower, upper = _bounds(other)
+        if self.upper < lower or self.lower > upper:
+            return False
+        elif self.lower == self.upper == lower == upper:
+            return True
+        return Undetermined
+
+    def __ne__(self, other):
+        equal = self == other
+        if equal is Undetermined:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return "Interval({}, {})".format(self.lower, self.upper)
+
+
+def constraint_symbols(node):
+    """
+    Collect the names of the residues a constraint or expression depends on
+
+    Returns
+    -------
+    set
+    """
+    if isinstance(node, SymbolNode):
+        return {node.symbol} if node.symbol is not None else set()
+    elif isinstance(node, (ExpressionNode, OrCompoundConstraint, AndCompoundConstraint)):
+        return constraint_symbols(node.left) | constraint_symbols(node.right)
+    elif isinstance(node, CompositionConstraint):
+        return constraint_symbols(node.expression)
+    elif isinstance(node, ClassificationConstraint):
+        return constraint_symbols(node.constraint)
+    return set()
+
+
 operator_map = {}
 
 
@@ -14,7 +14,8 @@ from glycresoft_sqlalchemy.data_model import (
     PipelineModule, Protein, make_transient, InformedPeptide,
     ExactMS1GlycopeptideHypothesis, func, _TemplateNumberStore)
 
-from glycresoft_sqlalchemy.proteomics.mzid_sa import Proteome as MzIdentMLProteome
+from glycresoft_sqlalchemy.proteomics.mzid_sa import (
+    Proteome as MzIdentMLProteome, StreamingProteome as StreamingMzIdentMLProteome)
 
 from glycresoft_sqlalchemy.structure.sequence import find_n_glycosylation_sequons
 
@@ -83,7 +84,7 @@ class ProteomeImporter(PipelineModule):
                  hypothesis_id=None, constant_modifications=("Carbamidomethyl (C)",),
                  target_proteins=None,
                  hypothesis_type=ExactMS1GlycopeptideHypothesis, peptide_type=InformedPeptide,
-                 baseline_missed_cleavages=1, include_all_baseline=False):
+                 baseline_missed_cleavages=1, include_all_baseline=False, streaming=False):
         self.manager = self.manager_type(database_path)
         self.mzid_path = mzid_path
         self.hypothesis_id = hypothesis_id
@@ -94,6 +95,7 @@ class ProteomeImporter(PipelineModule):
         self.baseline_missed_cleavages = baseline_missed_cleavages
         self.include_all_baseline = include_all_baseline
         self.target_proteins = target_proteins or {}
+        self.streaming = streaming
 
     def build_baseline_peptides(self, session, protein):
         if len(self.enzymes):
@@ -158,7 +160,10 @@ class ProteomeImporter(PipelineModule):
         return hypothesis
 
     def load_proteome(self, session):
-        mzident_parser = MzIdentMLProteome(self.manager.path, self.mzid_path, self.hypothesis_id)
+        if self.streaming:
+            mzident_parser = StreamingMzIdentMLProteome(self.manager.path, self.mzid_path, self.hypothesis_id)
+        else:
+            mzident_parser = MzIdentMLProteome(self.manager.path, self.mzid_path, self.hypothesis_id)
         self._display_protein_peptide_counts(session)
         self.constant_modifications = mzident_parser.constant_modifications
         self.enzymes = mzident_parser.enzymes
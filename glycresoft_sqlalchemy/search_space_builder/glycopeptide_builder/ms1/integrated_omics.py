@@ -61,6 +61,57 @@ def make_name(mzid_path, glycan_path):
     return "integrated_omics-{}-{}-{}".format(mzid_part, glycan_part, tag)
 
 
+class GlycosylationTemplate(object):
+    """
+    A peptidoform parsed once, from which glycoforms occupying any combination of its
+    glycosylation sites are derived without re-parsing the sequence.
+
+    For each combination of sites the serialized sequence, backbone mass and remaining
+    sequon sites are computed once from a copy of the parsed :class:`Sequence`, so that
+    each glycan composition only adds its mass and appends its composition to the string.
+
+    Attributes
+    ----------
+    sequence : :class:`Sequence`
+        The parsed peptidoform
+    glycosylation_sites : list of int
+    """
+    def __init__(self, modified_peptide_sequence, glycosylation_sites):
+        self.sequence = Sequence(modified_peptide_sequence)
+        self.glycosylation_sites = glycosylation_sites
+        self._occupied = {}
+
+    def occupy(self, sites):
+        """
+        The peptide with its modifications at `sites` replaced by the N-glycan core
+
+        Parameters
+        ----------
+        sites : tuple of int
+
+        Returns
+        -------
+        sequence_string : str
+            The serialized glycopeptide, to be completed by a glycan composition
+        backbone_mass : float
+            The mass of the peptide without the modifications at `sites`
+        sequon_sites : list of int
+            The N-glycosylation sequons of the glycopeptide
+        """
+        try:
+            return self._occupied[sites]
+        except KeyError:
+            target = self.sequence.clone()
+            for site in sites:
+                for mod in list(target[site][1]):
+                    target.drop_modification(site, mod)
+            backbone_mass = target.mass
+            for site in sites:
+                target.add_modification(site, Modification("NGlycanCoreGlycosylation"))
+            result = self._occupied[sites] = (str(target), backbone_mass, list(target.n_glycan_sequon_sites))
+            return result
+
+
 def glycosylate_callback(peptide, glycan_combinator, position_selector, max_sites=2):
     """
     Generate all glycoform combinations of `peptide` with up to `max_sites` glycosylations
@@ -69,45 +120,31 @@ def glycosylate_callback(peptide, glycan_combinator, position_selector, max_site
     ----------
     peptide : :class:`InformedPeptide`
         The peptide sequence to be glycosylated
-    session : :class:`sqlalchemy.Session`
-        An active database connection session to read :class:`TheoreticalGlycanCombination`
-        with.
-    hypothesis_id : int
-        The hypothesis to read :class:`TheoreticalGlycanCombination` from.
+    glycan_combinator : :class:`GlycanCombinationProvider`
+        Callable producing the glycan combinations of a given size
     position_selector : function
         Function to call to use select glycosylation site combinations.
     max_sites : int, optional
         The maximum number of glycosylation sites to occupy.
 
-    Returns
-    -------
-    result: list of :class:`PeptideSequence`
-        Glycosylated product sequences
+    Yields
+    ------
+    glycopeptide_sequence : str
+    mass : float
+    glycans : :class:`TheoreticalGlycanCombination`
+    sequon_sites : list of int
     """
     glycosylation_sites = peptide.glycosylation_sites
     n_sites = len(glycosylation_sites)
-    modified_peptide_sequence = peptide.modified_peptide_sequence
-    result = []
+    template = GlycosylationTemplate(peptide.modified_peptide_sequence, glycosylation_sites)
     for glycan_count in range(1, min(n_sites + 1, max_sites + 1)):
+        site_combinations = [tuple(sites) for sites in position_selector(glycosylation_sites, glycan_count)]
         for glycans in glycan_combinator(glycan_count):
-            if len(result) > 10000:
-                for item in result:
-                    yield item
-                result = []
-            for sites in position_selector(glycosylation_sites, glycan_count):
-                target = Sequence(modified_peptide_sequence)
-                for site in sites:
-                    for mod in target[site][1]:
-                        target.drop_modification(site, mod)
-                mass = target.mass
-                for site in sites:
-                    hexnac = Modification("NGlycanCoreGlycosylation")
-                    target.add_modification(site, hexnac)
-                mass += glycans.dehydrated_mass()
-                result.append((target, mass, glycans))
-
-    for item in result:
-        yield item
+            glycan_mass = glycans.dehydrated_mass()
+            composition = glycans.composition
+            for sites in site_combinations:
+                sequence_string, backbone_mass, sequon_sites = template.occupy(sites)
+                yield sequence_string + composition, backbone_mass + glycan_mass, glycans, sequon_sites
 
 
 def extract_peptides(session, ids):
@@ -166,15 +203,15 @@ def batch_make_theoretical_glycopeptides(peptide_ids, position_selector, databas
             count_missed_cleavages = peptide.count_missed_cleavages
 
             glycoforms = glycosylate_callback(peptide, glycan_combinator, position_selector, max_sites=max_sites)
-            for glycoform, total_mass, glycans in glycoforms:
+            for glycopeptide_sequence, total_mass, glycans, sequon_sites in glycoforms:
                 glycan_ids = glycans.id
                 informed_glycopeptide = dict(
                     protein_id=protein_id,
                     base_peptide_sequence=base_peptide_sequence,
                     modified_peptide_sequence=modified_peptide_sequence,
-                    glycopeptide_sequence=str(glycoform) + (glycans.composition),
+                    glycopeptide_sequence=glycopeptide_sequence,
                     calculated_mass=total_mass,
-                    glycosylation_sites=list(glycoform.n_glycan_sequon_sites),
+                    glycosylation_sites=sequon_sites,
                     start_position=start_position,
                     end_position=end_position,
                     count_glycosylation_sites=count_glycosylation_sites,
@@ -209,12 +246,13 @@ def batch_make_theoretical_glycopeptides(peptide_ids, position_selector, databas
 
 
 def load_proteomics(database_path, mzid_path, hypothesis_id=None, hypothesis_type=ExactMS1GlycopeptideHypothesis,
-                    include_all_baseline=True, target_proteins=None):
+                    include_all_baseline=True, target_proteins=None, streaming=False):
     if target_proteins is None:
         target_proteins = []
     task = ProteomeImporter(
         database_path, mzid_path, hypothesis_id=hypothesis_id, hypothesis_type=hypothesis_type,
-        include_all_baseline=include_all_baseline, target_proteins=target_proteins)
+        include_all_baseline=include_all_baseline, target_proteins=target_proteins,
+        streaming=streaming)
     task.start()
     return task.hypothesis_id
 
@@ -239,6 +277,7 @@ class IntegratedOmicsMS1SearchSpaceBuilder(PipelineModule, MS1GlycanImportManage
         self.n_processes = n_processes
         self.hypothesis_name = hypothesis_name
         self.include_all_baseline = kwargs.get("include_all_baseline", True)
+        self.streaming_proteomics = kwargs.get("streaming_proteomics", False)
         self.options = kwargs
 
     def bootstrap_hypothesis(self):
@@ -300,7 +339,8 @@ class IntegratedOmicsMS1SearchSpaceBuilder(PipelineModule, MS1GlycanImportManage
             hypothesis_id=self.hypothesis_id,
             hypothesis_type=self.hypothesis_type,
             include_all_baseline=self.include_all_baseline,
-            target_proteins=self.protein_ids)
+            target_proteins=self.protein_ids,
+            streaming=self.streaming_proteomics)
 
     def stream_peptides(self, chunk_size=50):
         session = self.manager.session()
@@ -378,7 +418,7 @@ class IntegratedOmicsMS1SearchSpaceBuilder(PipelineModule, MS1GlycanImportManage
         cntr = 0
         if self.n_processes > 1:
             pool = Pool(self.n_processes)
-            async_worker_pool(pool, self.stream_peptides(), task_fn)
+            async_worker_pool(pool, self.stream_peptides(), task_fn, reporter=self.inform)
             pool.terminate()
         else:
             for peptide in self.stream_peptides():
@@ -12,7 +12,7 @@ from glycresoft_sqlalchemy.data_model import (
 
 from .include_glycomics import MS1GlycanImportManager
 
-from ..peptide_utilities import generate_peptidoforms, ProteinFastaFileParser, SiteListFastaFileParser
+from ..peptide_utilities import ProteomeDigestor, ProteinFastaFileParser, SiteListFastaFileParser
 from ..glycan_utilities import get_glycan_combinations, GlycanCombinationProvider
 from ..utils import flatten
 
@@ -143,35 +143,6 @@ def batch_generate_glycopeptide_compositions(peptide_ids, database_manager, hypo
         session.close()
 
 
-def digest_protein(protein, manager, constant_modifications, variable_modifications, enzyme, max_missed_cleavages):
-    session = manager.session()
-    try:
-        peptidoforms = []
-        i = 0
-        logger.info("Digesting %r, %d glycosites", protein, len(protein.glycosylation_sites))
-        for peptidoform in generate_peptidoforms(protein, constant_modifications,
-                                                 variable_modifications, enzyme,
-                                                 max_missed_cleavages):
-            peptidoforms.append(peptidoform)
-            i += 1
-            if len(peptidoforms) > 10000:
-                logger.info("Flushing %d peptidoforms for %r", i, protein)
-                session.bulk_save_objects(peptidoforms)
-                session.commit()
-                session.expire_all()
-                peptidoforms = []
-        session.bulk_save_objects(peptidoforms)
-        session.commit()
-        logger.info("Digested %d peptidoforms for %s", i, protein)
-
-        return 1
-    except Exception, e:
-        logger.exception("An exception occurred in digest_protein", exc_info=e)
-        raise
-    finally:
-        session.close()
-
-
 class NaiveGlycopeptideHypothesisBuilder(PipelineModule, MS1GlycanImportManager):
     HypothesisType = MS1GlycopeptideHypothesis
 
@@ -243,21 +214,15 @@ class NaiveGlycopeptideHypothesisBuilder(PipelineModule, MS1GlycanImportManager)
             last += chunk_size
 
     def digest_proteins(self, session):
-        protein_digest_task = functools.partial(
-            digest_protein,
-            manager=self.manager,
+        session.commit()
+        digestor = ProteomeDigestor(
+            self.database_path, self.hypothesis_id, None,
             constant_modifications=self.constant_modifications,
             variable_modifications=self.variable_modifications,
             enzyme=self.enzyme,
-            max_missed_cleavages=self.max_missed_cleavages)
-        if self.n_processes > 1:
-            pool = multiprocessing.Pool(self.n_processes)
-            async_worker_pool(pool, self.stream_proteins(), protein_digest_task)
-            pool.terminate()
-        else:
-            for protein in self.stream_proteins():
-                protein_digest_task(protein)
-        session.commit()
+            max_missed_cleavages=self.max_missed_cleavages,
+            n_processes=self.n_processes)
+        digestor.start()
         session.expire_all()
         session.query(NaivePeptide).filter(
             NaivePeptide.count_glycosylation_sites == None).delete("fetch")
@@ -320,7 +285,7 @@ class NaiveGlycopeptideHypothesisBuilder(PipelineModule, MS1GlycanImportManager)
         cntr = 0
         if self.n_processes > 1:
             pool = multiprocessing.Pool(self.n_processes)
-            async_worker_pool(pool, work_stream, task_fn)
+            async_worker_pool(pool, work_stream, task_fn, reporter=self.inform)
             pool.terminate()
         else:
             for item in work_stream:
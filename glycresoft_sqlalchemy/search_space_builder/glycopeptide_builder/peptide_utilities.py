@@ -6,13 +6,14 @@ import multiprocessing
 from collections import Counter
 import textwrap
 
-from glycresoft_sqlalchemy.data_model import Protein, NaivePeptide, PeptideBase, object_session
+from glycresoft_sqlalchemy.data_model import Protein, NaivePeptide, PeptideBase, PipelineModule, object_session
 from glycresoft_sqlalchemy.structure import sequence, modification, residue
 from glycresoft_sqlalchemy.proteomics.enzyme import expasy_rules, merge_enzyme_rules
 from glycresoft_sqlalchemy.proteomics.fasta import (
     ProteinFastaFileParser, SiteListFastaFileParser, FastaFileWriter, ProteinFastFileWriter)
 
-from glycresoft_sqlalchemy.utils.collectiontools import SqliteSet, descending_combination_counter
+from glycresoft_sqlalchemy.utils.collectiontools import descending_combination_counter
+from glycresoft_sqlalchemy.utils.worker_utils import async_worker_pool
 
 logger = logging.getLogger("peptide_utilities")
 
@@ -209,98 +210,189 @@ def unpositioned_isoforms(
     (n_term_modifications, c_term_modifications,
      variable_modifications) = split_terminal_modifications(variable_modifications)
 
-    n_term_modifications = [mod for mod in n_term_modifications if mod.find_valid_sites(sequence)]
-    c_term_modifications = [mod for mod in c_term_modifications if mod.find_valid_sites(sequence)]
-
-    n_term_modifications.append(None)
-    c_term_modifications.append(None)
+    # A constant terminal modification leaves no room for a variable one
+    n_term_modifications = [] if has_fixed_n_term else [
+        mod for mod in n_term_modifications if mod.find_valid_sites(sequence)]
+    c_term_modifications = [] if has_fixed_c_term else [
+        mod for mod in c_term_modifications if mod.find_valid_sites(sequence)]
 
     variable_sites = {
         mod.name: set(
             mod.find_valid_sites(sequence)) for mod in variable_modifications}
-    counter = 0
-    kept = 0
+    modification_masses = {name: modification_table[name].mass for name in variable_sites}
+
     strseq = str(sequence)
-    seq_map = {(None, None): sequence}
-    strseq_map = {(None, None): strseq}
+    base_mass = sequence.mass
 
-    for n_term, c_term in itertools.product(n_term_modifications, c_term_modifications):
+    # Every combination of variable terminal modifications, computed once per peptide
+    terminal_variants = []
+    for n_term, c_term in itertools.product(n_term_modifications + [None], c_term_modifications + [None]):
+        if n_term is c_term is None:
+            continue
         seq = sequence.clone()
-        if has_fixed_n_term:
-            n_term = None
-
         if n_term is not None:
             seq.n_term = n_term()
-
-        if has_fixed_c_term:
-            c_term = None
-
         if c_term is not None:
             seq.c_term = c_term()
+        terminal_variants.append((str(seq), seq.mass))
 
-        seq_map[n_term, c_term] = seq
-        strseq_map[n_term, c_term] = str(seq)
-
-    solutions = SqliteSet()
+    previous_sites = []
     for i in range(max_glycosylation_events):
         for sequons_occupied in (combinations(sequons, i + 1)):
-            sequons_occupied = set(sequons_occupied)
-            _sequons_occupied = list(sequons_occupied)
-            yield strseq, {}, sequence.mass, _sequons_occupied
-            for n_term, c_term in itertools.product(n_term_modifications, c_term_modifications):
-                        if n_term is c_term is None:
-                            continue
-                        yield (strseq_map[n_term, c_term], {},
-                               seq_map[n_term, c_term].mass, _sequons_occupied)
-            counter += 1
-            kept += 1
+            occupied = set(sequons_occupied)
+            sequons_occupied = list(occupied)
+            yield strseq, {}, base_mass, sequons_occupied
+            for modseq, mass in terminal_variants:
+                yield modseq, {}, mass, sequons_occupied
             avail_sites = {
-                mod: sites - sequons_occupied
-                for mod, sites in variable_sites.items()}
-            for modifications in all_combinations(avail_sites):
-                if counter % 1000 == 0:
-                    logger.info("%d modification configurations computed, %d unique (%s)", counter, kept, strseq)
-                counter += 1
-                if sum(modifications.values()) > max_modifications:
+                name: sites - occupied
+                for name, sites in variable_sites.items()}
+            for modifications in modification_count_vectors(avail_sites, max_modifications):
+                # Each modification combination is reported once, for the first sequon
+                # occupancy which leaves room for it
+                if any(is_realizable(modifications, sites) for sites in previous_sites):
                     continue
-                hashable = frozenset(modifications.items())
-                if hashable in solutions:
-                    continue
-                else:
-                    solutions.add(hashable)
-                mass = sequence.mass
-
-                modifications = dict(modifications)
-
                 mass_delta = 0
                 for name, count in modifications.items():
-                    mass_delta += modification_table[name].mass * count
-
-                if len(modifications) > 0:
-                    yield strseq, modifications, mass + mass_delta, _sequons_occupied
-                    kept += 1
-
-                    for n_term, c_term in itertools.product(n_term_modifications, c_term_modifications):
-                        if n_term is c_term is None:
-                            continue
-                        yield (strseq_map[n_term, c_term], modifications,
-                               seq_map[n_term, c_term].mass + mass_delta, _sequons_occupied)
-
-
-def generate_peptidoforms(reference_protein, constant_modifications,
-                          variable_modifications, enzyme, missed_cleavages=1,
-                          max_modifications=4, peptide_class=NaivePeptide,
-                          glycosylation_site_finder=n_glycan_sequon_sites, **peptide_kwargs):
-    modtable = modification.RestrictedModificationTable.bootstrap(
-        constant_modifications,
-        variable_modifications, reuse=False)
+                    mass_delta += modification_masses[name] * count
+
+                yield strseq, modifications, base_mass + mass_delta, sequons_occupied
+                for modseq, mass in terminal_variants:
+                    yield modseq, modifications, mass + mass_delta, sequons_occupied
+            previous_sites.append(avail_sites)
+
+
+def is_realizable(modifications, site_assignments):
+    """
+    Whether each modification in `modifications` can be placed its number of times on
+    distinct positions, no position carrying more than one modification.
+
+    This is Hall's condition: every group of modifications needs at least as many
+    distinct candidate positions between them as they have occurrences.
+
+    Parameters
+    ----------
+    modifications : dict
+        Modification name -> count
+    site_assignments : dict
+        Modification name -> set of the positions it may occupy
+
+    Returns
+    -------
+    bool
+    """
+    names = [name for name, count in modifications.items() if count > 0]
+    for size in range(1, len(names) + 1):
+        for group in combinations(names, size):
+            positions = set()
+            for name in group:
+                positions |= site_assignments.get(name, set())
+            if sum(modifications[name] for name in group) > len(positions):
+                return False
+    return True
+
+
+def modification_count_vectors(site_assignments, max_modifications=4):
+    """
+    Enumerate each distinct, non-empty combination of modification counts which can
+    be placed on the positions in `site_assignments`, with at most `max_modifications`
+    modifications in total.
+
+    Counts are assigned one modification at a time. Adding an occurrence of a
+    modification can only make a combination harder to place, so the count of each
+    modification grows only until the combination stops being realizable, and no
+    combination is generated twice.
+
+    Parameters
+    ----------
+    site_assignments : dict
+        Modification name -> set of the positions it may occupy
+    max_modifications : int
+
+    Yields
+    ------
+    dict
+        Modification name -> count, omitting absent modifications
+    """
+    names = sorted(name for name, sites in site_assignments.items() if sites)
+    sites = [set(site_assignments[name]) for name in names]
+    n = len(names)
+    counts = [0] * n
+
+    def realizable(depth):
+        # Only the groups containing the newest count need to be checked
+        for size in range(depth + 1):
+            for group in combinations(range(depth), size):
+                group += (depth,)
+                positions = set()
+                for i in group:
+                    positions |= sites[i]
+                if sum(counts[i] for i in group) > len(positions):
+                    return False
+        return True
+
+    def descend(depth, total):
+        if depth == n:
+            if total > 0:
+                yield {names[i]: counts[i] for i in range(n) if counts[i]}
+            return
+        for count in range(min(len(sites[depth]), max_modifications - total) + 1):
+            counts[depth] = count
+            if count and not realizable(depth):
+                break
+            for combination in descend(depth + 1, total + count):
+                yield combination
+        counts[depth] = 0
+
+    return descend(0, 0)
+
+
+class DigestedPeptide(object):
+    """
+    A peptide cleaved from a protein, carrying the attributes :func:`unpositioned_isoforms`
+    and :func:`n_glycan_sequon_sites` read without creating a mapped instance.
+
+    Attributes
+    ----------
+    base_peptide_sequence : str
+    start_position : int
+    end_position : int
+    protein : Protein
+    """
+    def __init__(self, base_peptide_sequence, start_position, end_position, protein=None):
+        self.base_peptide_sequence = base_peptide_sequence
+        self.start_position = start_position
+        self.end_position = end_position
+        self.protein = protein
+
+    @property
+    def most_detailed_sequence(self):
+        return self.base_peptide_sequence
+
+    def __str__(self):
+        return self.base_peptide_sequence
+
+    def __repr__(self):
+        return "DigestedPeptide(%r, %r, %r)" % (self.base_peptide_sequence, self.start_position, self.end_position)
+
+
+def cleave_protein(protein_sequence, enzyme, missed_cleavages=1, min_length=5):
+    """
+    Digest `protein_sequence`, skipping peptides shorter than `min_length` or
+    containing unknown residues
+
+    Yields
+    ------
+    peptide : str
+    start : int
+    end : int
+    missed : int
+        The number of missed cleavages in `peptide`
+    """
     enzyme = expasy_rules.get(enzyme, enzyme)
-
-    hypothesis_id = reference_protein.hypothesis_id
-
     for peptide, start, end in sequence.cleave(
-            reference_protein.protein_sequence, enzyme, missed_cleavages=missed_cleavages):
-        if len(peptide) < 5:
+            protein_sequence, enzyme, missed_cleavages=missed_cleavages):
+        if len(peptide) < min_length:
             continue
         missed = len(re.findall(enzyme, peptide))
         if missed > missed_cleavages:
@@ -308,24 +400,54 @@ def generate_peptidoforms(reference_protein, constant_modifications,
 
         if "X" in peptide:
             continue
+        yield peptide, start, end, missed
+
+
+def peptidoform_records(reference_protein, constant_modifications, variable_modifications, enzyme,
+                        missed_cleavages=1, max_modifications=4, modification_table=None,
+                        glycosylation_site_finder=n_glycan_sequon_sites, peptide_range=None):
+    """
+    Digest `reference_protein` and enumerate the peptidoforms of each of its peptides as
+    mappings of :class:`PeptideBase` columns, suitable for :meth:`Session.bulk_insert_mappings`
+
+    Parameters
+    ----------
+    reference_protein : Protein
+    constant_modifications : list of str
+    variable_modifications : list of str
+    enzyme : str
+    missed_cleavages : int
+    max_modifications : int
+    modification_table : RestrictedModificationTable, optional
+        Built from the modification lists if not given. Pass one table when digesting
+        many proteins to avoid rebuilding it for each.
+    peptide_range : tuple, optional
+        The (start, stop) indices of the cleavage products to enumerate, so that a
+        large protein can be digested in several parts
+
+    Yields
+    ------
+    dict
+    """
+    if modification_table is None:
+        modification_table = RestrictedModificationTable.bootstrap(
+            constant_modifications, variable_modifications, reuse=False)
+    protein_id = reference_protein.id
+    hypothesis_id = reference_protein.hypothesis_id
 
-        ref_peptide = peptide_class(
-            base_peptide_sequence=peptide,
-            protein=reference_protein,
-            protein_id=reference_protein.id,
-            start_position=start,
-            end_position=end,
-            hypothesis_id=hypothesis_id,
-            **peptide_kwargs)
-        ref_peptide.protein = reference_protein
+    peptides = cleave_protein(reference_protein.protein_sequence, enzyme, missed_cleavages)
+    if peptide_range is not None:
+        peptides = itertools.islice(peptides, *peptide_range)
+    for peptide, start, end, missed in peptides:
+        ref_peptide = DigestedPeptide(peptide, start, end, reference_protein)
         for modseq, modifications, mass, sequons_occupied in unpositioned_isoforms(
                 ref_peptide, constant_modifications, variable_modifications,
-                modtable, glycosylation_site_finder=glycosylation_site_finder):
-            peptidoform = peptide_class(
+                modification_table, max_modifications=max_modifications,
+                glycosylation_site_finder=glycosylation_site_finder):
+            yield dict(
                 base_peptide_sequence=peptide,
                 modified_peptide_sequence=modseq,
-                protein=reference_protein,
-                protein_id=reference_protein.id,
+                protein_id=protein_id,
                 start_position=start,
                 end_position=end,
                 peptide_modifications='|'.join(str(v) + str(k) for k, v in modifications.items()),
@@ -334,19 +456,98 @@ def generate_peptidoforms(reference_protein, constant_modifications,
                 count_glycosylation_sites=len(sequons_occupied),
                 glycosylation_sites=sequons_occupied,
                 sequence_length=len(peptide),
-                hypothesis_id=hypothesis_id,
-                **peptide_kwargs
-            )
-            yield peptidoform
+                hypothesis_id=hypothesis_id)
 
 
-class ProteomeDigestor(object):
+def generate_peptidoforms(reference_protein, constant_modifications,
+                          variable_modifications, enzyme, missed_cleavages=1,
+                          max_modifications=4, peptide_class=NaivePeptide,
+                          glycosylation_site_finder=n_glycan_sequon_sites, modification_table=None,
+                          **peptide_kwargs):
+    for record in peptidoform_records(
+            reference_protein, constant_modifications, variable_modifications, enzyme,
+            missed_cleavages=missed_cleavages, max_modifications=max_modifications,
+            modification_table=modification_table, glycosylation_site_finder=glycosylation_site_finder):
+        record.update(peptide_kwargs)
+        yield peptide_class(protein=reference_protein, **record)
+
+
+def digest_protein_records(protein, constant_modifications, variable_modifications, enzyme,
+                           max_missed_cleavages, max_modifications, modification_table,
+                           peptide_kwargs=None):
+    """
+    Compute the peptidoform records of part of one protein in a worker process.
+
+    Parameters
+    ----------
+    protein : tuple
+        The (id, hypothesis_id, protein_sequence, start, stop) of the protein to digest,
+        where `start` and `stop` bound the cleavage products to enumerate
+
+    Returns
+    -------
+    list of dict
+    """
+    protein_id, hypothesis_id, protein_sequence, start, stop = protein
+    reference_protein = Protein(id=protein_id, hypothesis_id=hypothesis_id, protein_sequence=protein_sequence)
+    records = list(peptidoform_records(
+        reference_protein, constant_modifications, variable_modifications, enzyme,
+        missed_cleavages=max_missed_cleavages, max_modifications=max_modifications,
+        modification_table=modification_table, peptide_range=(start, stop)))
+    if peptide_kwargs:
+        for record in records:
+            record.update(peptide_kwargs)
+    return records
+
+
+class PeptidoformWriter(object):
+    """
+    Accumulates peptidoform records and writes them in bulk, committing every `chunk_size` rows
+
+    Attributes
+    ----------
+    count : int
+        The number of records written
+    """
+    def __init__(self, session, peptide_class=NaivePeptide, chunk_size=5000):
+        self.session = session
+        self.peptide_class = peptide_class
+        self.chunk_size = chunk_size
+        self.accumulator = []
+        self.count = 0
+
+    def add_all(self, records):
+        self.accumulator.extend(records)
+        if len(self.accumulator) >= self.chunk_size:
+            self.flush()
+
+    __call__ = add_all
+
+    def flush(self):
+        if self.accumulator:
+            self.session.bulk_insert_mappings(self.peptide_class, self.accumulator)
+            self.session.commit()
+            self.count += len(self.accumulator)
+            self.accumulator = []
+
+
+class ProteomeDigestor(PipelineModule):
+    """
+    Digest every protein of a hypothesis into peptidoforms.
+
+    The modification table is built once and shared with every task. Each protein is
+    divided into tasks of at most `peptides_per_task` cleavage products, so a worker
+    holds a bounded number of records however large the protein. Tasks are run by a
+    pool of worker processes, and their peptidoforms are written in bulk by the parent
+    process as each task completes.
+    """
     def __init__(self, database_path, hypothesis_id, protein_ids, constant_modifications,
                  variable_modifications, enzyme, max_missed_cleavages, max_modifications=4,
-                 peptide_class=NaivePeptide, peptide_kwargs=None, n_processes=4):
+                 peptide_class=NaivePeptide, peptide_kwargs=None, n_processes=4, chunk_size=5000,
+                 peptides_per_task=50):
         self.manager = self.manager_type(database_path)
-        self.constant_modifications = constant_modifications
-        self.variable_modifications = variable_modifications
+        self.constant_modifications = list(constant_modifications or [])
+        self.variable_modifications = list(variable_modifications or [])
         self.enzyme = enzyme
         self.max_modifications = max_modifications
         self.max_missed_cleavages = max_missed_cleavages
@@ -354,19 +555,58 @@ class ProteomeDigestor(object):
         self.protein_ids = protein_ids
         self.n_processes = n_processes
         self.peptide_class = peptide_class
-        self.peptide_kwargs = peptide_kwargs
+        self.peptide_kwargs = peptide_kwargs or {}
+        self.chunk_size = chunk_size
+        self.peptides_per_task = peptides_per_task
+        self.modification_table = RestrictedModificationTable.bootstrap(
+            self.constant_modifications, self.variable_modifications, reuse=False)
 
     def stream_proteins(self):
-        for i in self.protein_ids:
-            yield i
+        session = self.manager.session()
+        try:
+            query = session.query(Protein.id, Protein.hypothesis_id, Protein.protein_sequence).filter(
+                Protein.hypothesis_id == self.hypothesis_id)
+            # Read every protein up front so that writing does not contend with an open cursor
+            proteins = query.all()
+        finally:
+            session.close()
+        if self.protein_ids is not None:
+            protein_ids = set(self.protein_ids)
+            proteins = [protein for protein in proteins if protein[0] in protein_ids]
+        return proteins
+
+    def stream_tasks(self, proteins):
+        for protein_id, hypothesis_id, protein_sequence in proteins:
+            n_peptides = sum(1 for peptide in cleave_protein(
+                protein_sequence, self.enzyme, self.max_missed_cleavages))
+            for start in range(0, n_peptides, self.peptides_per_task):
+                yield protein_id, hypothesis_id, protein_sequence, start, start + self.peptides_per_task
 
     def prepare_task_fn(self):
         return functools.partial(
-            generate_peptidoforms,
+            digest_protein_records,
             constant_modifications=self.constant_modifications,
             variable_modifications=self.variable_modifications,
             enzyme=self.enzyme,
             max_missed_cleavages=self.max_missed_cleavages,
             max_modifications=self.max_modifications,
-            peptide_class=self.peptide_class,
-            **self.peptide_kwargs)
+            modification_table=self.modification_table,
+            peptide_kwargs=self.peptide_kwargs)
+
+    def run(self):
+        session = self.manager.session()
+        writer = PeptidoformWriter(session, self.peptide_class, self.chunk_size)
+        task_fn = self.prepare_task_fn()
+        proteins = self.stream_proteins()
+        if self.n_processes > 1:
+            pool = multiprocessing.Pool(self.n_processes)
+            async_worker_pool(pool, self.stream_tasks(proteins), task_fn, result_callback=writer,
+                              reporter=self.inform)
+            pool.terminate()
+        else:
+            for task in self.stream_tasks(proteins):
+                writer.add_all(task_fn(task))
+        writer.flush()
+        session.close()
+        self.inform("Digested %d peptidoforms from %d proteins", writer.count, len(proteins))
+        return writer.count
@@ -24,7 +24,7 @@ def oxonium_ions_and_stub_ions(seq, full=False):
         generators = [seq.stub_fragments(), seq.glycan_fragments(True, all_series=False, allow_ambiguous=False)]
 
     def dictify(f):
-        return {"key": f.name, "mass": f.mass}
+        return {"key": f.name, "mass": f.mass, "ion": f.identifier}
 
     g = collectiontools.groupby(itertools.chain.from_iterable(generators), kind_getter, transform_fn=dictify)
 
@@ -80,10 +80,11 @@ def fragments(sequence):
             if re.search(r'b1\+', key) and constants.EXCLUDE_B1:
                 continue
             mass = fm.mass
+            ion = fm.identifier
             if "HexNAc" in key:
-                b_ions_hexnac.append({"key": key, "mass": mass})
+                b_ions_hexnac.append({"key": key, "mass": mass, "ion": ion})
             else:
-                b_ions.append({"key": key, "mass": mass})
+                b_ions.append({"key": key, "mass": mass, "ion": ion})
 
     y_type = fragments[1]
     y_ions = []
@@ -92,10 +93,11 @@ def fragments(sequence):
         for fm in y:
             key = fm.get_fragment_name()
             mass = fm.mass
+            ion = fm.identifier
             if "HexNAc" in key:
-                y_ions_hexnac.append({"key": key, "mass": mass})
+                y_ions_hexnac.append({"key": key, "mass": mass, "ion": ion})
             else:
-                y_ions.append({"key": key, "mass": mass})
+                y_ions.append({"key": key, "mass": mass, "ion": ion})
 
     oxonium_ions, stub_ions = oxonium_ions_and_stub_ions(sequence)
     return (oxonium_ions, b_ions, y_ions,
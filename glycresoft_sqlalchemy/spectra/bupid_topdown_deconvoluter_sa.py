@@ -7,6 +7,7 @@ import uuid
 
 from ..data_model import DatabaseManager, PipelineModule
 from ..data_model.observed_ions import BUPIDDeconvolutedLCMSMSSampleRun, TandemScan, Peak
+from ..matching.glycopeptide.detect_oxonium import SignatureIndexer
 from . import neutral_mass
 from ..utils import sqlitedict
 from .constants import constants as ms_constants
@@ -219,6 +220,7 @@ class StreamingYAMLRenderer(object):
         current_key = None
         current_anchor = None
         session = self.manager.session()
+        signature_indexer = SignatureIndexer(session)
         for event in source:
             # logger.debug("Next event = %r", event)
             if state is BEGIN:
@@ -279,6 +281,9 @@ class StreamingYAMLRenderer(object):
                             intensity=intensity[i], scan_id=scan_id,
                             scan_peak_index=i))
                     session.bulk_insert_mappings(Peak, tandem_peaks)
+                    signature_indexer.add(
+                        scan_id, self.sample_run_id, [peak['neutral_mass'] for peak in tandem_peaks],
+                        [peak['intensity'] for peak in tandem_peaks])
                     mass = []
                     charge = []
                     intensity = []
@@ -314,6 +319,7 @@ class StreamingYAMLRenderer(object):
                     else:
                         raise Exception("Expected an active sequence when recovering anchor")
 
+        signature_indexer.flush()
         session.commit()
         session.close()
 
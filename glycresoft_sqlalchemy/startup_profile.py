@@ -0,0 +1,127 @@
+'''
+Measure how long each module takes to import.
+
+Importing :mod:`glycresoft_sqlalchemy` installs an :class:`ImportProfiler` when
+the command line holds ``--profile-startup`` (or when the environment variable
+``GLYCRESOFT_PROFILE_STARTUP`` is set), and prints its report to stderr when
+the process exits. This is done before the package imports anything else, so
+the report covers every import a command makes, starting with SQLAlchemy.
+
+This module must only import from the standard library.
+'''
+import sys
+import atexit
+import __builtin__
+from time import time
+
+
+PROFILE_FLAG = "--profile-startup"
+PROFILE_ENVIRON = "GLYCRESOFT_PROFILE_STARTUP"
+
+
+class ImportRecord(object):
+    def __init__(self, name, importer, cumulative, own, depth):
+        self.name = name
+        self.importer = importer
+        self.cumulative = cumulative
+        self.own = own
+        self.depth = depth
+
+    def __repr__(self):
+        return "ImportRecord(%r, %r, %0.4f, %0.4f)" % (self.name, self.importer, self.cumulative, self.own)
+
+
+class ImportProfiler(object):
+    '''Wraps :func:`__builtin__.__import__` to time every import statement which
+    loads at least one new module, recording both the cumulative time including
+    nested imports and the time spent in the module itself.
+
+    Attributes
+    ----------
+    records : list of ImportRecord
+    minimum_time : float
+        Import statements which complete faster than this many seconds are
+        not recorded
+    '''
+    def __init__(self, minimum_time=1e-4):
+        self.records = []
+        self.minimum_time = minimum_time
+        self._child_time = []
+        self._original_import = None
+        self._start = None
+
+    def install(self):
+        if self._original_import is not None:
+            return
+        self._start = time()
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is None:
+            return
+        __builtin__.__import__ = self._original_import
+        self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        n_modules = len(sys.modules)
+        self._child_time.append(0.)
+        start = time()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time() - start
+            children = self._child_time.pop()
+            if self._child_time:
+                self._child_time[-1] += elapsed
+            if len(sys.modules) > n_modules and elapsed >= self.minimum_time:
+                importer = None
+                if globals is not None:
+                    importer = globals.get("__name__")
+                self.records.append(ImportRecord(
+                    name, importer, elapsed, elapsed - children, len(self._child_time)))
+
+    def total_time(self):
+        return sum(record.cumulative for record in self.records if record.depth == 0)
+
+    def report(self, stream=None, limit=40):
+        if stream is None:
+            stream = sys.stderr
+        records = sorted(self.records, key=lambda x: x.own, reverse=True)[:limit]
+        stream.write("Import time: %0.3f s across %d import statements\n" % (
+            self.total_time(), len(self.records)))
+        stream.write("%10s %10s  %s\n" % ("self (ms)", "cumul (ms)", "module (imported by)"))
+        for record in records:
+            stream.write("%10.1f %10.1f  %s%s\n" % (
+                record.own * 1000, record.cumulative * 1000, record.name,
+                " (%s)" % record.importer if record.importer else ""))
+        stream.flush()
+
+
+_profiler = None
+
+
+def profile_startup(argv=None, environ=None):
+    '''If requested by `argv` or `environ`, install an :class:`ImportProfiler` whose
+    report is written to stderr at exit. The ``--profile-startup`` flag is removed
+    from `argv` so the command's own argument parser never sees it.
+
+    Returns
+    -------
+    ImportProfiler or None
+    '''
+    global _profiler
+    if argv is None:
+        argv = sys.argv
+    if environ is None:
+        import os
+        environ = os.environ
+    requested = PROFILE_FLAG in argv or bool(environ.get(PROFILE_ENVIRON))
+    while PROFILE_FLAG in argv:
+        argv.remove(PROFILE_FLAG)
+    if not requested or _profiler is not None:
+        return _profiler
+    _profiler = ImportProfiler()
+    _profiler.install()
+    atexit.register(_profiler.report)
+    return _profiler
@@ -1,5 +1,5 @@
 import re
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from .modification import Modification, NGlycanCoreGlycosylation
 from .composition import Composition
@@ -50,6 +50,89 @@ generic_neutral_losses_composition = {
 }
 
 
+class IonIdentifier(namedtuple("IonIdentifier", ("series", "position", "glycosylated", "charge"))):
+    """
+    A compact description of a theoretical or matched ion which lets scoring
+    functions classify ions and locate backbone cleavages without re-parsing
+    the ion's name.
+
+    Attributes
+    ----------
+    series : int
+        One of the codes in :data:`ion_series_codes`
+    position : int
+        The number of residues in a backbone fragment, 0 for non-backbone ions
+    glycosylated : bool
+        Whether a backbone fragment carries (part of) a glycan. Always False for
+        oxonium and stub glycopeptide ions
+    charge : int
+    """
+    __slots__ = ()
+
+oxonium_ion_code = 0
+stub_glycopeptide_code = 1
+
+ion_series_codes = {
+    "oxonium_ion": oxonium_ion_code,
+    "stub_glycopeptide": stub_glycopeptide_code,
+    "a": 2,
+    "b": 3,
+    "c": 4,
+    "x": 5,
+    "y": 6,
+    "z": 7,
+}
+
+ion_series_names = {v: k for k, v in ion_series_codes.items()}
+
+_ion_key_pattern = re.compile(r"([czby])(\d+)(\+)?")
+_ion_identifier_cache = {}
+
+
+def parse_ion_identifier(key):
+    """
+    Build an :class:`IonIdentifier` from an ion's name, for ions stored before
+    identifiers were recorded at fragment generation time. Classification follows
+    the rules :func:`~glycresoft_sqlalchemy.scoring.simple_scoring_algorithm.split_ion_list`
+    historically applied to ion names.
+
+    Parameters
+    ----------
+    key : str
+
+    Returns
+    -------
+    IonIdentifier
+    """
+    try:
+        return _ion_identifier_cache[key]
+    except KeyError:
+        pass
+    if key[:3] == "pep":
+        identifier = IonIdentifier(stub_glycopeptide_code, 0, False, 1)
+    else:
+        match = _ion_key_pattern.match(key)
+        if match is None:
+            identifier = IonIdentifier(oxonium_ion_code, 0, False, 1)
+        else:
+            series, position, glycosylated = match.groups()
+            identifier = IonIdentifier(
+                ion_series_codes[series], int(position), glycosylated is not None, 1)
+    _ion_identifier_cache[key] = identifier
+    return identifier
+
+
+def get_ion_identifier(ion):
+    """
+    Get the :class:`IonIdentifier` of an ion mapping, falling back to parsing
+    its ``key`` when it was created without one.
+    """
+    try:
+        return ion["ion"]
+    except KeyError:
+        return parse_ion_identifier(ion["key"])
+
+
 class NeutralLoss(object):
     def __init__(self, name, composition=None):
         if composition is None:
@@ -235,6 +318,15 @@ class PeptideFragment(FragmentBase):
     def name(self):
         return self.get_fragment_name()
 
+    @property
+    def identifier(self):
+        glycosylated = False
+        for mod_name in self.concerned_mods + ["HexNAc"]:
+            if self.modification_dict.get(mod_name, 0) > 0:
+                glycosylated = True
+                break
+        return IonIdentifier(ion_series_codes[str(self.series)], self.position, glycosylated, 1)
+
     def __repr__(self):
         return ("PeptideFragment(%(type)s %(position)s %(mass)s "
                 "%(modification_dict)s %(flanking_amino_acids)s %(neutral_loss)r)") % {
@@ -273,6 +365,10 @@ class SimpleFragment(FragmentBase):
     def get_series(self):
         return self.kind
 
+    @property
+    def identifier(self):
+        return IonIdentifier(ion_series_codes.get(str(self.kind), oxonium_ion_code), 0, False, 1)
+
 
 class MemoizedIonSeriesMetaclass(type):
     def __call__(self, name=None, *args, **kwargs):
@@ -1,8 +1,12 @@
+import os
 import csv
 import json
+import hashlib
+import logging
+import tempfile
 from copy import deepcopy
 import re
-from pkg_resources import resource_stream
+from pkg_resources import resource_stream, resource_string, resource_filename
 
 from collections import defaultdict
 from collections import Iterable
@@ -12,11 +16,14 @@ from glypy.composition.glycan_composition import (
 from .residue import residue_to_symbol, Residue
 from .composition import composition_to_mass, Composition
 from .parser import prefix_to_postfix_modifications
-from ..utils import Enum
+from ..utils import Enum, pickle
+from ..utils.vendor import appdir
+from ..version import version
 from . import PeptideSequenceBase
 from . import ModificationBase
 from . import ResidueBase
 
+logger = logging.getLogger("modification")
 
 target_string_pattern = re.compile(
     r'(?P<amino_acid>[A-Z]+)?([@ ]?(?P<n_term>[Nn][-_][tT]erm)|(?P<c_term>[Cc][-_][tT]erm))?')
@@ -744,6 +751,270 @@ def load_from_json(stream):
     return modification_definitions
 
 
+def _add_rule_to_store(store, rule):
+    for name in rule.names:
+        try:
+            if store[name] is rule:
+                continue
+            else:
+                store[name] += rule
+        except KeyError:
+            store[name] = rule
+
+
+class ModificationRegistry(object):
+    '''A precompiled, name-indexed collection of :class:`ModificationRule` definitions.
+
+    Each distinct rule is stored pickled, and is only reconstructed the first time
+    one of its names is requested. The default registry built from the package's
+    Unimod and Protein Prospector files is written to a cache file in
+    :attr:`cache_directory` so that later processes load it in one step instead of
+    re-parsing the source files. The cache records the size and modification time of
+    the source files, and they are only hashed to validate it when those have changed.
+
+    Attributes
+    ----------
+    name_index : dict
+        Maps every name of every rule to the index of its entry in `serialized_rules`
+    serialized_rules : list
+        The pickled :class:`ModificationRule` instances
+    source : dict
+        Describes the files the registry was compiled from, for validating a cache
+    '''
+
+    cache_format_version = 2
+    cache_directory = os.getenv("GLYCRESOFT_MODIFICATION_CACHE", appdir.user_cache_dir(
+        "GlycReSoft", "Zaia Lab", "1.0"))
+
+    _default_registries = {}
+
+    @classmethod
+    def set_cache_directory(cls, directory):
+        '''Keep cache files in `directory`, discarding registries loaded from the previous one'''
+        cls.cache_directory = directory
+        cls._default_registries.clear()
+
+    @classmethod
+    def source_files(cls, use_protein_prospector=True):
+        files = ["data/unimod.json"]
+        if use_protein_prospector:
+            files.append("data/ProteinProspectorModifications-for_gly2.csv")
+        return files
+
+    @classmethod
+    def compile(cls, rules):
+        store = {}
+        for rule in rules:
+            if not isinstance(rule, ModificationRule):
+                rule = ModificationRule(**rule)
+            _add_rule_to_store(store, rule)
+
+        name_index = {}
+        serialized_rules = []
+        positions = {}
+        for name, rule in store.items():
+            try:
+                name_index[name] = positions[id(rule)]
+            except KeyError:
+                positions[id(rule)] = name_index[name] = len(serialized_rules)
+                serialized_rules.append(pickle.dumps(rule, pickle.HIGHEST_PROTOCOL))
+        return cls(name_index, serialized_rules)
+
+    @classmethod
+    def version_tag(cls, use_protein_prospector=True):
+        digest = hashlib.md5()
+        digest.update("%d:%s" % (cls.cache_format_version, version))
+        for name in cls.source_files(use_protein_prospector):
+            digest.update(resource_string(__name__, name))
+        return digest.hexdigest()
+
+    @classmethod
+    def source_stat(cls, use_protein_prospector=True):
+        '''The size and modification time of each source file, or None if they
+        are not plain files'''
+        try:
+            return [(stat.st_size, stat.st_mtime) for stat in (
+                os.stat(resource_filename(__name__, name))
+                for name in cls.source_files(use_protein_prospector))]
+        except (IOError, OSError, NotImplementedError):
+            return None
+
+    @classmethod
+    def cache_path(cls, use_protein_prospector=True):
+        return os.path.join(cls.cache_directory, "modifications%s.pkl" % (
+            "" if use_protein_prospector else "-unimod"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            name_index, serialized_rules, source = pickle.load(fh)
+        return cls(name_index, serialized_rules, source)
+
+    def dump(self, path):
+        '''Write the registry to `path` atomically, so concurrent readers
+        never observe a partially written file'''
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump((self.name_index, self.serialized_rules, self.source), fh, pickle.HIGHEST_PROTOCOL)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Another process won the race on a platform which does not
+            # allow renaming over an existing file
+            os.remove(temp_path)
+
+    @classmethod
+    def default(cls, use_protein_prospector=True):
+        '''Get the registry for the package's default definitions, loading it from
+        the cache file if one exists for the current data files, and otherwise
+        compiling it from them and trying to write the cache file.
+
+        A cache whose recorded source file sizes and modification times match is
+        used without reading the source files. Otherwise the source files are hashed,
+        and the cache is used if the hash matches.'''
+        try:
+            return cls._default_registries[use_protein_prospector]
+        except KeyError:
+            pass
+        path = cls.cache_path(use_protein_prospector)
+        stat = cls.source_stat(use_protein_prospector)
+        registry = None
+        if os.path.exists(path):
+            try:
+                registry = cls.load(path)
+            except Exception, e:
+                logger.warning("Could not read modification cache %s: %r", path, e)
+        if registry is not None and registry.source.get("format") != (cls.cache_format_version, version):
+            registry = None
+        rewrite = registry is None
+        if registry is not None and (stat is None or registry.source.get("stat") != stat):
+            if registry.source.get("digest") == cls.version_tag(use_protein_prospector):
+                registry.source["stat"] = stat
+                rewrite = stat is not None
+            else:
+                registry = None
+                rewrite = True
+        if registry is None:
+            defs = []
+            for name in cls.source_files(use_protein_prospector):
+                if name.endswith(".json"):
+                    defs += load_from_json(resource_stream(__name__, name))
+                else:
+                    defs += load_from_csv(resource_stream(__name__, name))
+            registry = cls.compile(defs)
+            registry.source = {
+                "format": (cls.cache_format_version, version),
+                "digest": cls.version_tag(use_protein_prospector),
+                "stat": stat}
+        if rewrite:
+            try:
+                registry.dump(path)
+            except (IOError, OSError), e:
+                logger.warning("Could not write modification cache %s: %r", path, e)
+        cls._default_registries[use_protein_prospector] = registry
+        return registry
+
+    def __init__(self, name_index, serialized_rules, source=None):
+        self.name_index = name_index
+        self.serialized_rules = serialized_rules
+        self.source = source or {}
+        self._materialized = {}
+
+    def __getitem__(self, name):
+        index = self.name_index[name]
+        try:
+            return self._materialized[index]
+        except KeyError:
+            rule = pickle.loads(self.serialized_rules[index])
+            self._materialized[index] = rule
+            return rule
+
+    def __contains__(self, name):
+        return name in self.name_index
+
+    def __len__(self):
+        return len(self.name_index)
+
+    def names(self):
+        return self.name_index.keys()
+
+
+class _LazyRuleStore(dict):
+    '''A name to :class:`ModificationRule` mapping which falls back to a
+    :class:`ModificationRegistry` for names it has not seen yet, copying
+    rules into itself as they are requested.
+
+    Operations which need to see every entry materialize the whole registry
+    first. Operations which remove entries detach the registry so removed
+    names are not silently restored from it.
+    '''
+    def __init__(self, registry):
+        dict.__init__(self)
+        self.registry = registry
+
+    def __missing__(self, key):
+        if self.registry is None:
+            raise KeyError(key)
+        rule = self.registry[key]
+        dict.__setitem__(self, key, rule)
+        return rule
+
+    def materialize(self):
+        if self.registry is not None:
+            for name in self.registry.names():
+                if not dict.__contains__(self, name):
+                    self[name]
+            self.registry = None
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (self.registry is not None and key in self.registry)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        self.materialize()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.materialize()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.materialize()
+        return dict.keys(self)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def copy(self):
+        self.materialize()
+        return dict(self)
+
+    def pop(self, key, *default):
+        self.materialize()
+        return dict.pop(self, key, *default)
+
+    def __delitem__(self, key):
+        self.materialize()
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        dict.clear(self)
+        self.registry = None
+
+
 class ModificationSource(object):
     _table_definition_file = staticmethod(lambda: resource_stream(__name__,
                                                                   "data/ProteinProspectorModifications-for_gly2.csv"))
@@ -781,11 +1052,7 @@ class ModificationSource(object):
     @classmethod
     def load_from_file_default(cls):
         '''Load the rules definitions from the default package files'''
-        defs = []
-        defs += load_from_json(cls._unimod_definitions())
-        if cls.use_protein_prospector:
-            defs += load_from_csv(cls._table_definition_file())
-        return cls(defs)
+        return cls()
 
     bootstrapped = None
 
@@ -1038,13 +1305,11 @@ class ModificationTable(ModificationSource):
 
     def __init__(self, rules=None):
         if rules is None:
-            rules = self._definitions_from_stream_default()
-        self.store = dict()
-
-        for rule in rules:
-            if not isinstance(rule, ModificationRule):
-                rule = ModificationRule(**rule)
-            self.add(rule)
+            self.store = _LazyRuleStore(ModificationRegistry.default(self.use_protein_prospector))
+        else:
+            self.store = dict()
+            for rule in rules:
+                self.add(rule)
 
         self._include_other_rules()
 
@@ -1068,14 +1333,7 @@ class ModificationTable(ModificationSource):
     def add(self, rule):
         if not isinstance(rule, ModificationRule):
             rule = ModificationRule(**rule)
-        for name in rule.names:
-            try:
-                if self.store[name] is rule:
-                    continue
-                else:
-                    self.store[name] += rule
-            except KeyError:
-                self.store[name] = rule
+        _add_rule_to_store(self.store, rule)
 
     def get_modification(self, name):
         return self[name]()
@@ -1092,6 +1350,19 @@ class RestrictedModificationTable(ModificationTable):
         self.variable_modifications = variable_modifications
         self.collect_available_modifications()
 
+    bootstrapped_tables = {}
+
+    @classmethod
+    def bootstrap(cls, constant_modifications=None, variable_modifications=None, reuse=True):
+        '''Instantiate a RestrictedModificationTable from the default package definitions. If `reuse`,
+        return the table already bootstrapped with the same modification lists, if any'''
+        key = (cls, tuple(constant_modifications or ()), tuple(variable_modifications or ()))
+        if reuse and key in cls.bootstrapped_tables:
+            return cls.bootstrapped_tables[key]
+        instance = cls(None, list(key[1]), list(key[2]))
+        cls.bootstrapped_tables[key] = instance
+        return instance
+
     def collect_available_modifications(self):
         '''Clears the rules stored in the core dictionary (on self, but not its data members),
         and copies all information in the data member sub-tables into the core dictionary'''
@@ -0,0 +1,12 @@
+import os
+import shutil
+import tempfile
+
+# The modification registry is compiled and cached when the package is first imported,
+# so its cache directory must be chosen before any test module imports it
+_cache_directory = tempfile.mkdtemp()
+os.environ["GLYCRESOFT_MODIFICATION_CACHE"] = _cache_directory
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_cache_directory, ignore_errors=True)
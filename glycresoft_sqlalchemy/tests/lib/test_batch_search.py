@@ -0,0 +1,299 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, MSMSSqlDB, Hypothesis, HypothesisSampleMatch, Protein,
+    TheoreticalGlycopeptide, TheoreticalGlycanComposition, GlycopeptideSpectrumMatch,
+    SampleRun, TandemScan, Peak, PipelineProgress, PeakGroupDatabase, Decon2LSPeakGroup, PeakGroupMatch)
+from glycresoft_sqlalchemy.structure.sequence import Sequence
+from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.utils import fragments
+from glycresoft_sqlalchemy.matching.glycopeptide import fragment_matching
+from glycresoft_sqlalchemy.matching.peak_grouping.mass_shift_offset_matching import (
+    TheoreticalMassIndex, BatchPeakGroupMatching)
+
+
+glycopeptides = [
+    "YPVLN(NGlycanCoreGlycosylation)VTMPNNGKFDK{Hex:5; HexNAc:2}",
+    "YPVLN(NGlycanCoreGlycosylation)VTMPNNGKFDK{Hex:6; HexNAc:2}",
+    "NGKFDKN(NGlycanCoreGlycosylation)ATR{Hex:5; HexNAc:4; NeuAc:1}",
+]
+
+
+def make_glycopeptide(sequence, protein_id):
+    sequence = Sequence(sequence)
+    oxonium_ions, b_ions, y_ions, b_ions_hexnac, y_ions_hexnac, stub_ions = fragments(sequence)
+    return TheoreticalGlycopeptide(
+        protein_id=protein_id, glycopeptide_sequence=str(sequence), calculated_mass=sequence.mass,
+        sequence_length=len(sequence),
+        oxonium_ions=oxonium_ions, bare_b_ions=b_ions, bare_y_ions=y_ions,
+        glycosylated_b_ions=b_ions_hexnac, glycosylated_y_ions=y_ions_hexnac, stub_ions=stub_ions)
+
+
+class TestBatchSpectrumMatching(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "hypothesis.db"))
+        self.manager.initialize()
+        session = self.session = self.manager.session()
+        hypothesis = Hypothesis(name=u"glycopeptides")
+        session.add(hypothesis)
+        session.flush()
+        self.hypothesis_id = hypothesis.id
+        protein = Protein(name=u"P1", protein_sequence=u"YPVLNVTMPNNGKFDKNATR", hypothesis_id=hypothesis.id)
+        session.add(protein)
+        session.flush()
+        self.theoreticals = [make_glycopeptide(s, protein.id) for s in glycopeptides]
+        session.add_all(self.theoreticals)
+        session.commit()
+
+        self.msmsdb = MSMSSqlDB(os.path.join(self.directory, "ions.db"))
+        self.msmsdb.initialize()
+        ions = self.msmsdb.session()
+        self.sample_run_ids = []
+        # Each sample has spectra of a different subset of the glycopeptides
+        for name, members in ((u"sample-1", [0]), (u"sample-2", [0, 1, 2]), (u"sample-3", [])):
+            sample_run = SampleRun(name=name)
+            ions.add(sample_run)
+            ions.flush()
+            self.sample_run_ids.append(sample_run.id)
+            for time, i in enumerate(members):
+                theoretical = self.theoreticals[i]
+                scan = TandemScan(time=time, precursor_neutral_mass=theoretical.calculated_mass,
+                                  precursor_charge_state=2, sample_run_id=sample_run.id)
+                ions.add(scan)
+                ions.flush()
+                ion_list = theoretical.oxonium_ions + theoretical.bare_b_ions[::2] + theoretical.bare_y_ions[::3]
+                for index, ion in enumerate(ion_list):
+                    ions.add(Peak(neutral_mass=ion["mass"], intensity=100., charge=1,
+                                  scan_peak_index=index, scan_id=scan.id))
+        ions.commit()
+        ions.close()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def make_hypothesis_sample_matches(self, label):
+        hsms = [HypothesisSampleMatch(name=u"%s-%d" % (label, i), target_hypothesis_id=self.hypothesis_id)
+                for i in self.sample_run_ids]
+        self.session.add_all(hsms)
+        self.session.commit()
+        return [hsm.id for hsm in hsms]
+
+    def spectrum_matches(self, hypothesis_sample_match_id):
+        return sorted(
+            (m.theoretical_glycopeptide_id, m.scan_time, m.peaks_explained, m.peaks_unexplained)
+            for m in self.session.query(GlycopeptideSpectrumMatch).filter(
+                GlycopeptideSpectrumMatch.hypothesis_sample_match_id == hypothesis_sample_match_id))
+
+    def test_theoretical_index(self):
+        index = fragment_matching.TheoreticalGlycopeptideIndex.from_hypothesis(
+            self.session, self.hypothesis_id, cache_size=1)
+        self.assertEqual(len(index), 3)
+        for theoretical in self.theoreticals:
+            expected = TheoreticalGlycopeptide.ppm_error_tolerance_search(
+                self.session, theoretical.calculated_mass, 1e-5, self.hypothesis_id).all()
+            found = index.search(self.session, theoretical.calculated_mass, 1e-5)
+            self.assertEqual([t.id for t in found], [t.id for t in expected])
+            self.assertEqual(found[0].bare_b_ions, theoretical.bare_b_ions)
+        self.assertEqual(len(index.cache), 1)
+        misses = index.misses
+        index.search(self.session, self.theoreticals[-1].calculated_mass, 1e-5)
+        self.assertEqual(index.misses, misses)
+
+    def test_theoretical_index_version(self):
+        version = fragment_matching.theoretical_index_version(self.session, self.hypothesis_id)
+        index = fragment_matching.get_theoretical_index(self.manager, self.hypothesis_id, version)
+        try:
+            self.assertIs(fragment_matching.get_theoretical_index(self.manager, self.hypothesis_id, version), index)
+            self.session.add(make_glycopeptide(glycopeptides[0], self.theoreticals[0].protein_id))
+            self.session.commit()
+            changed = fragment_matching.theoretical_index_version(self.session, self.hypothesis_id)
+            self.assertNotEqual(changed, version)
+            rebuilt = fragment_matching.get_theoretical_index(self.manager, self.hypothesis_id, changed)
+            self.assertIsNot(rebuilt, index)
+            self.assertEqual(len(rebuilt), 4)
+        finally:
+            fragment_matching.clear_theoretical_index_cache()
+
+    def test_batch_matches_single_sample_search(self):
+        batch_ids = self.make_hypothesis_sample_matches(u"batch")
+        single_ids = self.make_hypothesis_sample_matches(u"single")
+        task = fragment_matching.BatchSpectrumMatching(
+            self.manager.path, self.hypothesis_id, self.msmsdb.path,
+            zip(self.sample_run_ids, batch_ids), n_processes=1)
+        task.start()
+        self.assertEqual(fragment_matching._theoretical_index_cache, {})
+        for sample_run_id, hypothesis_sample_match_id in zip(self.sample_run_ids, single_ids):
+            fragment_matching.SpectrumMatching(
+                self.manager.path, self.hypothesis_id, self.msmsdb.path, observed_ions_type='db',
+                sample_run_id=sample_run_id, hypothesis_sample_match_id=hypothesis_sample_match_id,
+                n_processes=1).start()
+        self.session.expire_all()
+        counts = []
+        for batch_id, single_id in zip(batch_ids, single_ids):
+            matches = self.spectrum_matches(batch_id)
+            self.assertEqual(matches, self.spectrum_matches(single_id))
+            counts.append(len(matches))
+        self.assertTrue(0 < counts[0] < counts[1])
+        self.assertEqual(counts[2], 0)
+
+    def test_resume_spectrum_matching(self):
+        hypothesis_sample_match_id, = self.make_hypothesis_sample_matches(u"resume")[1:2]
+        sample_run_id = self.sample_run_ids[1]
+        task = fragment_matching.SpectrumMatching(
+            self.manager.path, self.hypothesis_id, self.msmsdb.path, observed_ions_type='db',
+            sample_run_id=sample_run_id, hypothesis_sample_match_id=hypothesis_sample_match_id,
+            n_processes=1)
+        key = task.checkpoint_key()
+        # An interrupted run which completed the first scan
+        ions = self.msmsdb.session()
+        first_scan = ions.query(TandemScan).filter(
+            TandemScan.sample_run_id == sample_run_id, TandemScan.time == 0).one()
+        ions.close()
+        PipelineProgress.record(self.session, key, [first_scan.id])
+        self.session.commit()
+        task.start()
+
+        self.session.expire_all()
+        times = {time for _, time, _, _ in self.spectrum_matches(hypothesis_sample_match_id)}
+        self.assertEqual(times, {1, 2})
+        # Progress is discarded once the task completes
+        self.assertEqual(PipelineProgress.completed_batches(self.session, key), set())
+
+    def make_decoy_hypothesis(self):
+        decoy = Hypothesis(name=u"decoys")
+        self.session.add(decoy)
+        self.session.flush()
+        protein = Protein(name=u"D1", protein_sequence=u"YPVLNVTMPNNGKFDKNATR", hypothesis_id=decoy.id)
+        self.session.add(protein)
+        self.session.flush()
+        self.session.add_all([make_glycopeptide(s, protein.id) for s in glycopeptides[1:]])
+        self.session.commit()
+        return decoy.id
+
+    def labelled_spectrum_matches(self, hypothesis_sample_match_id):
+        return sorted(
+            (m.hypothesis_id, m.theoretical_glycopeptide_id, m.scan_time, m.peaks_explained)
+            for m in self.session.query(GlycopeptideSpectrumMatch).filter(
+                GlycopeptideSpectrumMatch.hypothesis_sample_match_id == hypothesis_sample_match_id))
+
+    def test_joint_target_decoy_matching(self):
+        decoy_hypothesis_id = self.make_decoy_hypothesis()
+        separate_id, single_id, batch_id = self.make_hypothesis_sample_matches(u"joint")
+        sample_run_id = self.sample_run_ids[1]
+        for hypothesis_id in (self.hypothesis_id, decoy_hypothesis_id):
+            fragment_matching.SpectrumMatching(
+                self.manager.path, hypothesis_id, self.msmsdb.path, observed_ions_type='db',
+                sample_run_id=sample_run_id, hypothesis_sample_match_id=separate_id,
+                n_processes=1).start()
+        task = fragment_matching.SpectrumMatching(
+            self.manager.path, self.hypothesis_id, self.msmsdb.path, observed_ions_type='db',
+            sample_run_id=sample_run_id, hypothesis_sample_match_id=single_id,
+            n_processes=1, decoy_hypothesis_id=decoy_hypothesis_id)
+        self.assertNotEqual(task.checkpoint_key(), fragment_matching.spectrum_matching_checkpoint_key(
+            self.hypothesis_id, single_id))
+        task.start()
+        fragment_matching.BatchSpectrumMatching(
+            self.manager.path, self.hypothesis_id, self.msmsdb.path, [(sample_run_id, batch_id)],
+            n_processes=1, decoy_hypothesis_id=decoy_hypothesis_id).start()
+
+        self.session.expire_all()
+        separate = self.labelled_spectrum_matches(separate_id)
+        self.assertEqual(self.labelled_spectrum_matches(single_id), separate)
+        self.assertEqual(self.labelled_spectrum_matches(batch_id), separate)
+        self.assertEqual({hypothesis_id for hypothesis_id, _, _, _ in separate},
+                         {self.hypothesis_id, decoy_hypothesis_id})
+
+
+class TestTheoreticalMassIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "glycans.db"))
+        self.manager.initialize()
+        session = self.session = self.manager.session()
+        hypothesis = Hypothesis(name=u"glycans")
+        other = Hypothesis(name=u"other")
+        session.add_all([hypothesis, other])
+        session.flush()
+        self.hypothesis_id = hypothesis.id
+        for i, mass in enumerate((1500., 1500.01, 1200., 1800.5, 1500.02)):
+            session.add(TheoreticalGlycanComposition(
+                composition=u"{Hex:%d; HexNAc:2}" % (i + 3), calculated_mass=mass, hypothesis_id=hypothesis.id))
+        session.add(TheoreticalGlycanComposition(
+            composition=u"{Hex:3; HexNAc:2}", calculated_mass=1500., hypothesis_id=other.id))
+        session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        index = TheoreticalMassIndex.from_hypothesis(self.session, TheoreticalGlycanComposition, self.hypothesis_id)
+        self.assertEqual(len(index), 5)
+        for mass in (1500., 1500.015, 1200.001, 1000.):
+            expected = sorted(
+                (c.id, c.calculated_mass) for c in TheoreticalGlycanComposition.ppm_error_tolerance_search(
+                    self.session, mass, 1e-5, self.hypothesis_id))
+            self.assertEqual(sorted(index.search(mass, 1e-5)), expected)
+        self.assertEqual(len(TheoreticalMassIndex.from_hypothesis(
+            self.session, TheoreticalGlycanComposition, -1)), 0)
+
+    def make_peak_groups(self):
+        lcms_database = PeakGroupDatabase(os.path.join(self.directory, "groups.db"))
+        lcms_database.initialize()
+        ions = lcms_database.session()
+        sample_run = SampleRun(name=u"sample")
+        ions.add(sample_run)
+        ions.flush()
+        groups = [Decon2LSPeakGroup(sample_run_id=sample_run.id, weighted_monoisotopic_mass=mass, scan_count=1)
+                  for mass in (1500., 1200., 1800.5)]
+        ions.add_all(groups)
+        ions.commit()
+        sample_run_id = sample_run.id
+        group_ids = [group.id for group in groups]
+        ions.close()
+        return lcms_database.path, sample_run_id, group_ids
+
+    def peak_group_matches(self, hypothesis_sample_match_id):
+        return sorted(
+            (m.peak_group_id, m.theoretical_match_id) for m in self.session.query(PeakGroupMatch).filter(
+                PeakGroupMatch.hypothesis_sample_match_id == hypothesis_sample_match_id))
+
+    def test_resume_peak_group_matching(self):
+        observed_ions_path, sample_run_id, group_ids = self.make_peak_groups()
+        hsm = HypothesisSampleMatch(name=u"resume", target_hypothesis_id=self.hypothesis_id)
+        self.session.add(hsm)
+        self.session.commit()
+
+        def make_task():
+            return BatchPeakGroupMatching(
+                self.manager.path, observed_ions_path, self.hypothesis_id, sample_run_id,
+                hsm.id, n_processes=1)
+
+        make_task().start()
+        self.session.expire_all()
+        expected = self.peak_group_matches(hsm.id)
+        self.assertEqual({group_id for group_id, _ in expected}, set(group_ids))
+
+        # An interrupted run which matched only the first peak group
+        self.session.query(PeakGroupMatch).filter(PeakGroupMatch.peak_group_id != group_ids[0]).delete()
+        self.session.commit()
+        task = make_task()
+        PipelineProgress.record(self.session, task.checkpoint_key(), group_ids[:1])
+        self.session.commit()
+        task.start()
+        self.session.expire_all()
+        self.assertEqual(self.peak_group_matches(hsm.id), expected)
+        self.assertEqual(PipelineProgress.completed_batches(self.session, task.checkpoint_key()), set())
+
+        # Without recorded progress the matches of the previous run are replaced
+        make_task().start()
+        self.session.expire_all()
+        self.assertEqual(self.peak_group_matches(hsm.id), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.structure.sequence import Sequence
+from glycresoft_sqlalchemy.benchmarks import synthetic, select_benchmarks, run_benchmarks, compare_results
+
+
+class TestSyntheticData(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_deterministic(self):
+        self.assertEqual(synthetic.synthetic_proteins(3, synthetic.random_state(1)),
+                         synthetic.synthetic_proteins(3, synthetic.random_state(1)))
+        self.assertNotEqual(synthetic.synthetic_proteins(3, synthetic.random_state(1)),
+                            synthetic.synthetic_proteins(3, synthetic.random_state(2)))
+
+    def test_glycopeptides(self):
+        rng = synthetic.random_state()
+        glycans = synthetic.synthetic_glycan_compositions(10, rng)
+        self.assertEqual(len(set(glycans)), 10)
+        sequences = synthetic.synthetic_glycopeptides(5, glycans, rng, glycoforms=2)
+        self.assertEqual(len(sequences), 10)
+        for sequence in sequences:
+            self.assertEqual(len(Sequence(sequence).n_glycan_sequon_sites), 1)
+
+    def test_isos(self):
+        path = os.path.join(self.directory, "sample_isos.csv")
+        n_rows = synthetic.write_decon2ls_isos(path, [1800., 2500.], 100, synthetic.random_state(), n_noise=50)
+        rows = list(csv.DictReader(open(path)))
+        self.assertEqual(len(rows), n_rows)
+        scans = [int(row["scan_num"]) for row in rows]
+        self.assertEqual(scans, sorted(scans))
+        self.assertTrue(any(abs(float(row["monoisotopic_mw"]) - 1800.) < 0.01 for row in rows))
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_select_benchmarks(self):
+        self.assertEqual([b.name for b in select_benchmarks(["decoy_generation"])],
+                         ["fragment_generation", "decoy_generation"])
+        self.assertRaises(KeyError, select_benchmarks, ["unknown"])
+
+    def test_run_benchmarks(self):
+        report = run_benchmarks(size=0.1, names=["spectrum_fdr"])
+        self.assertEqual([result["name"] for result in report["benchmarks"]], [
+            "fragment_generation", "decoy_generation", "ms2_matching", "spectrum_scoring", "spectrum_fdr"])
+        self.assertTrue(all(result["items"] > 0 for result in report["benchmarks"]))
+
+    def test_compare_results(self):
+        baseline = {"size": 1., "benchmarks": [
+            {"name": "a", "wall_time": 1.}, {"name": "b", "wall_time": 1.}, {"name": "c", "wall_time": 0.01}]}
+        current = {"size": 1., "benchmarks": [
+            {"name": "a", "wall_time": 1.1}, {"name": "b", "wall_time": 2.}, {"name": "c", "wall_time": 0.1}]}
+        comparisons = compare_results(baseline, current)
+        self.assertEqual([c["name"] for c in comparisons if c["regressed"]], ["b"])
+        self.assertRaises(ValueError, compare_results, baseline, dict(current, size=2.))
+
+
+if __name__ == '__main__':
+    unittest.main()
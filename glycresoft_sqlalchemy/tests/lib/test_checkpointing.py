@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.data_model import DatabaseManager, PipelineModule, Pipeline, PipelineProgress
+
+
+class StagedTask(PipelineModule):
+    def __init__(self, database_path, fail_at=None):
+        self.manager = self.manager_type(database_path)
+        self.fail_at = fail_at
+        self.calls = []
+
+    def checkpoint_key(self):
+        return u"StagedTask"
+
+    def stage(self, i):
+        def stage():
+            if i == self.fail_at:
+                raise ValueError(i)
+            self.calls.append(i)
+        stage.__name__ = "stage_%d" % i
+        return stage
+
+    def run(self):
+        self.run_stages(*map(self.stage, range(3)))
+
+
+class TestCheckpointing(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "progress.db")
+        DatabaseManager(self.path).initialize()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_stages(self):
+        task = StagedTask(self.path, fail_at=1)
+        self.assertRaises(ValueError, task.start)
+        self.assertEqual(task.calls, [0])
+        self.assertEqual(task.load_checkpoint(u"StagedTask:stages"), {0})
+
+        task = StagedTask(self.path)
+        task.start()
+        self.assertEqual(task.calls, [1, 2])
+        self.assertEqual(task.load_checkpoint(u"StagedTask:stages"), set())
+
+        task = StagedTask(self.path)
+        task.start()
+        self.assertEqual(task.calls, [0, 1, 2])
+
+    def test_progress_table_created_on_demand(self):
+        manager = DatabaseManager(self.path)
+        PipelineProgress.__table__.drop(manager.connect())
+        session = manager.session()
+        PipelineProgress.record(session, u"task", [1, 2])
+        session.commit()
+        self.assertEqual(PipelineProgress.completed_batches(session, u"task"), {1, 2})
+        self.assertEqual(PipelineProgress.completed_batches(session, u"other"), set())
+        session.close()
+
+    def test_pipeline_restarts_at_failed_step(self):
+        steps = [StagedTask(self.path, fail_at=i) for i in (None, 0, None)]
+        for step in steps:
+            step.checkpoint_key = lambda: None
+        pipeline = Pipeline(steps)
+        self.assertRaises(ValueError, pipeline.start)
+        self.assertEqual(pipeline.index, 1)
+        steps[1].fail_at = None
+        pipeline.start()
+        self.assertEqual(pipeline.index, 3)
+        self.assertEqual([len(step.calls) for step in steps], [3, 3, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import ast
+import sys
+import inspect
+import unittest
+import subprocess
+from importlib import import_module
+
+from glycresoft_sqlalchemy.app import run_search, build_database, reporting
+from glycresoft_sqlalchemy.startup_profile import PROFILE_ENVIRON
+
+
+def deferred_imports(module):
+    '''The (module, name) pairs imported inside the functions of `module`'''
+    tree = ast.parse(inspect.getsource(module))
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for statement in ast.walk(node):
+            if isinstance(statement, ast.ImportFrom):
+                for alias in statement.names:
+                    yield statement.module, alias.name
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_deferred_imports_resolve(self):
+        for module in (run_search, build_database):
+            imports = list(deferred_imports(module))
+            self.assertTrue(imports)
+            for module_name, name in imports:
+                imported = import_module(module_name)
+                if not hasattr(imported, name):
+                    import_module("%s.%s" % (module_name, name))
+
+    def test_subcommands_resolve(self):
+        for app in (run_search.app, build_database.app):
+            subparsers = app._subparsers._group_actions[0].choices
+            self.assertTrue(subparsers)
+            for name, parser in subparsers.items():
+                self.assertTrue(callable(parser.get_default("task")), name)
+        for name, spec in reporting.task_map.items():
+            if name == "web":
+                continue
+            self.assertTrue(callable(reporting.resolve_task(spec)), name)
+
+    def test_tolerance_defaults(self):
+        args = run_search.app.parse_args(["ms2-glycoproteomics", "database.db", "-a", "1"])
+        self.assertIsNone(args.ms1_tolerance)
+        self.assertIsNone(args.ms2_tolerance)
+
+    def test_profile_startup(self):
+        # In a new interpreter, as the profiler must be installed before the package is imported
+        environ = dict(os.environ)
+        environ[PROFILE_ENVIRON] = "1"
+        script = (
+            "import glycresoft_sqlalchemy\n"
+            "from glycresoft_sqlalchemy.startup_profile import _profiler\n"
+            "print([(r.name, r.importer) for r in _profiler.records if r.depth == 0])\n")
+        process = subprocess.Popen(
+            [sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environ)
+        out, err = process.communicate()
+        self.assertEqual(process.returncode, 0, err)
+        self.assertIn("('sqlalchemy', 'glycresoft_sqlalchemy')", out)
+        self.assertIn("Import time:", err)
+
+
+if __name__ == '__main__':
+    unittest.main()
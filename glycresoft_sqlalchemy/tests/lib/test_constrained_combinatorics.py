@@ -1,4 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
+
+from glypy import GlycanComposition
+
+from glycresoft_sqlalchemy.data_model import DatabaseManager, TheoreticalGlycanComposition
 from glycresoft_sqlalchemy.search_space_builder.glycan_builder import constrained_combinatorics
 
 
@@ -23,6 +30,96 @@ class TestConstrainedCombinatorics(unittest.TestCase):
             self.assertTrue(composit['Fuc'] < composit['HexNAc'])
             self.assertTrue(composit['NeuAc'] < (composit['HexNAc'] - 1))
 
+    def brute_force(self, rules_table, constraints):
+        constraints = [constrained_combinatorics.CompositionConstraint.from_list(c) for c in constraints]
+        return [combin for combin in constrained_combinatorics.descending_combination_counter(rules_table)
+                if all(constraint(constrained_combinatorics.Solution(combin)) for constraint in constraints)]
+
+    def test_pruning_matches_exhaustive_search(self):
+        rules_table = {
+            "Hex": (3, 9),
+            "HexNAc": (2, 7),
+            "Fuc": (0, 3),
+            "NeuAc": (0, 4),
+            "NeuGc": (0, 2)
+        }
+        constraints_list = [
+            ["Fuc", "<", "HexNAc"],
+            ["NeuAc + NeuGc", "<", "HexNAc - 1"],
+            ["Hex + Hex", ">=", "HexNAc + 3"],
+            ["(NeuAc = 0) or (NeuGc = 0)"]
+        ]
+        generator = constrained_combinatorics.CombinatoricCompositionGenerator(
+            rules_table=rules_table, constraints=constraints_list)
+        expected = self.brute_force(rules_table, constraints_list)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(list(generator.enumerate_counts()), expected)
+
+        generator.maximum_mass = 2000.
+        light = [combin for combin in expected if GlycanComposition(**combin).mass() <= 2000.]
+        self.assertTrue(0 < len(light) < len(expected))
+        self.assertEqual(list(generator.enumerate_counts()), light)
+
+        parts = generator.split(4)
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(
+            sorted(sorted(combin.items()) for part in parts for combin in part.enumerate_counts()),
+            sorted(sorted(combin.items()) for combin in light))
+
+    def test_constraint_schedule(self):
+        generator = constrained_combinatorics.CombinatoricCompositionGenerator(
+            rules_table={"Hex": (3, 9), "HexNAc": (2, 7), "Fuc": (0, 3)},
+            constraints=[["Fuc", "<", "HexNAc"], ["Hex", ">", "2"]])
+        fucose, hex_ = generator.constraints
+        residues = ["HexNAc", "Hex", "Fuc"]
+        # A constraint is tested over the partial assignment at each of its symbols
+        self.assertEqual(generator.constraint_schedule(residues), [[fucose], [hex_], [fucose]])
+
+    def test_unsatisfiable(self):
+        generator = constrained_combinatorics.CombinatoricCompositionGenerator(
+            rules_table={"Hex": (3, 10), "HexNAc": (2, 4)}, constraints=[["Hex", "<", "HexNAc - 2"]])
+        self.assertEqual(list(generator), [])
+
+    def test_interval(self):
+        Interval = constrained_combinatorics.Interval
+        Undetermined = constrained_combinatorics.Undetermined
+        self.assertIs(Interval(0, 2) < 3, True)
+        self.assertIs(Interval(3, 5) < 3, False)
+        self.assertIs(Interval(0, 4) < 3, Undetermined)
+        self.assertIs(1 > Interval(2, 4) - 3, Undetermined)
+        self.assertIs(Interval(2, 4) + Interval(1, 1) >= 3, True)
+        self.assertIs(Interval(2, 2) == 2, True)
+        self.assertIs(Interval(0, 1) == 2, False)
+
+
+class TestConstrainedCombinatoricsBuilder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, name, n_processes):
+        path = os.path.join(self.directory, name)
+        hypothesis_id = constrained_combinatorics.ConstrainedCombinatoricsGlycanHypothesisBuilder(
+            path, rules_table={"Hex": (3, 8), "HexNAc": (2, 6), "Fuc": (0, 2), "NeuAc": (0, 3)},
+            constraints_list=[["Fuc", "<", "HexNAc"], ["NeuAc", "<", "HexNAc - 1"]],
+            maximum_mass=2500., n_processes=n_processes).start()
+        session = DatabaseManager(path).session()
+        compositions = set(
+            (composition.composition, round(composition.calculated_mass, 6),
+             tuple(sorted(motif.name for motif in composition.motifs)))
+            for composition in session.query(TheoreticalGlycanComposition).filter(
+                TheoreticalGlycanComposition.hypothesis_id == hypothesis_id))
+        session.close()
+        return compositions
+
+    def test_multiprocessing_matches_serial(self):
+        serial = self.build("serial.db", 1)
+        self.assertTrue(len(serial) > 0)
+        # Parts are generated out of order, so only the set of compositions is compared
+        self.assertEqual(self.build("parallel.db", 2), serial)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.data_model import (
+    MSMSSqlDB, SampleRun, BUPIDDeconvolutedLCMSMSSampleRun, TandemScan, ScanBase, Peak)
+from glycresoft_sqlalchemy.utils.data_migrator import Migrator, KeyMapping
+
+
+def add_sample_run(session, name, n_scans=5, n_peaks=4):
+    sample_run = BUPIDDeconvolutedLCMSMSSampleRun(name=name, uuid=name)
+    session.add(sample_run)
+    session.flush()
+    for i in range(n_scans):
+        scan = TandemScan(sample_run_id=sample_run.id, time=i, precursor_neutral_mass=1000. + i)
+        session.add(scan)
+        session.flush()
+        session.bulk_insert_mappings(Peak, [
+            {"scan_id": scan.id, "neutral_mass": 100. * i + j, "intensity": 10. * j, "charge": 1,
+             "scan_peak_index": j} for j in range(n_peaks)])
+    session.commit()
+    return sample_run.id
+
+
+def describe(session, sample_run_id):
+    return sorted(
+        (scan.time, scan.precursor_neutral_mass, peak.neutral_mass, peak.intensity, peak.scan_peak_index)
+        for scan, peak in session.query(TandemScan, Peak).join(Peak, Peak.scan_id == TandemScan.id).filter(
+            TandemScan.sample_run_id == sample_run_id))
+
+
+class TestMigrator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_manager = MSMSSqlDB(os.path.join(self.directory, "source.db"))
+        self.source_manager.initialize()
+        self.target_manager = MSMSSqlDB(os.path.join(self.directory, "target.db"))
+        self.target_manager.initialize()
+        self.source = self.source_manager.session()
+        self.target = self.target_manager.session()
+
+    def tearDown(self):
+        self.source.close()
+        self.target.close()
+        shutil.rmtree(self.directory)
+
+    def test_key_mapping(self):
+        mapping = KeyMapping()
+        mapping.add([3, 5, 9], 100)
+        mapping.add([4], 200)
+        self.assertEqual(mapping.translate([9, None, 3, 4, 5]), [102, None, 100, 200, 101])
+        self.assertRaises(ValueError, mapping.translate, [6])
+
+    def test_copy_sample_run(self):
+        add_sample_run(self.source, u"other", n_scans=3)
+        sid = add_sample_run(self.source, u"copied")
+        # Rows already in the target push the copies onto new keys
+        add_sample_run(self.target, u"existing", n_scans=2)
+
+        migrator = Migrator(self.source, self.target)
+        self.assertEqual(migrator.copy_model(SampleRun, lambda q: q.filter(SampleRun.id == sid)), 1)
+        self.assertEqual(migrator.copy_model(TandemScan, lambda q: q.filter(TandemScan.sample_run_id == sid)), 5)
+        self.assertEqual(migrator.copy_model(
+            Peak, lambda q: q.join(ScanBase).filter(ScanBase.sample_run_id == sid), batch_size=3), 20)
+
+        copied = self.target.query(SampleRun).filter(SampleRun.name == u"copied").one()
+        self.assertIsInstance(copied, BUPIDDeconvolutedLCMSMSSampleRun)
+        # The subclass's own table is copied along with the base table
+        self.assertEqual(self.target.query(BUPIDDeconvolutedLCMSMSSampleRun.__table__.c.id).filter(
+            BUPIDDeconvolutedLCMSMSSampleRun.__table__.c.id == copied.id).count(), 1)
+        self.assertEqual(copied.id, migrator.key_mappings["SampleRun"][sid])
+        self.assertEqual(describe(self.target, copied.id), describe(self.source, sid))
+        self.assertEqual(self.target.query(Peak).count(), 28)
+
+    def test_uncopied_reference(self):
+        sid = add_sample_run(self.source, u"copied")
+        migrator = Migrator(self.source, self.target)
+        with self.assertRaises(ValueError):
+            migrator.copy_model(TandemScan, lambda q: q.filter(TandemScan.sample_run_id == sid))
+
+    def test_failed_copy_is_rolled_back(self):
+        sid = add_sample_run(self.source, u"copied")
+        scan = self.source.query(TandemScan).filter(TandemScan.sample_run_id == sid).first()
+        scan.precursor_id = self.source.query(Peak.id).filter(Peak.scan_id == scan.id).first()[0]
+        self.source.commit()
+
+        migrator = Migrator(self.source, self.target)
+        migrator.copy_model(SampleRun, lambda q: q.filter(SampleRun.id == sid))
+        # The ScanBase rows insert, but the TandemScan rows refer to peaks not yet copied
+        with self.assertRaises(ValueError):
+            migrator.copy_model(TandemScan, lambda q: q.filter(TandemScan.sample_run_id == sid))
+        self.assertEqual(self.target.query(ScanBase.id).count(), 0)
+        self.assertNotIn("ScanBase", migrator.key_mappings)
+        self.assertNotIn("TandemScan", migrator.key_mappings)
+
+
+if __name__ == '__main__':
+    unittest.main()
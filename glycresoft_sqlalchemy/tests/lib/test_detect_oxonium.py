@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from glycresoft_sqlalchemy.data_model import MSMSSqlDB, SampleRun, TandemScan, TandemScanSignature, Peak
+from glycresoft_sqlalchemy.matching.glycopeptide import detect_oxonium
+
+
+hexnac = detect_oxonium.oxonium_ion_masses[0]
+fucose = detect_oxonium.oxonium_ion_masses[2]
+
+
+class TestSignatureIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = MSMSSqlDB(os.path.join(self.directory, "scans.db"))
+        self.manager.initialize()
+        self.session = self.manager.session()
+        sample_run = SampleRun(name=u"sample", uuid=u"sample")
+        self.session.add(sample_run)
+        self.session.flush()
+        self.sample_run_id = sample_run.id
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def add_scan(self, peaks):
+        scan = TandemScan(sample_run_id=self.sample_run_id, precursor_neutral_mass=2000.)
+        self.session.add(scan)
+        self.session.flush()
+        self.session.bulk_insert_mappings(Peak, [
+            {"scan_id": scan.id, "neutral_mass": mass, "intensity": intensity, "charge": 1,
+             "scan_peak_index": i} for i, (mass, intensity) in enumerate(peaks)])
+        return scan.id
+
+    def scan_ids(self, query):
+        return sorted(scan.id for scan in query)
+
+    def test_scan_signature(self):
+        self.assertEqual(detect_oxonium.scan_signature([], []), 0)
+        self.assertEqual(detect_oxonium.scan_signature([hexnac, 500.], [5000, 10]), 1)
+        # The oxonium ion is too weak
+        self.assertEqual(detect_oxonium.scan_signature([hexnac], [10]), 0)
+        # A fucose loss needs only the heavier peak to be intense
+        signature = detect_oxonium.scan_signature([900., 900. + fucose], [10, 5000])
+        self.assertEqual(signature, 1 << (len(detect_oxonium.oxonium_ions) + 2))
+        self.assertEqual(detect_oxonium.scan_signature([900., 900. + fucose], [5000, 10]), 0)
+
+    def test_index_agrees_with_join(self):
+        oxonium = self.add_scan([(hexnac, 5000.), (800., 100.)])
+        loss = self.add_scan([(900. + fucose, 5000.), (900., 100.)])
+        self.add_scan([(hexnac, 10.), (700., 5000.)])
+        self.add_scan([])
+        rng = np.random.RandomState(1)
+        for i in range(20):
+            self.add_scan(zip(rng.uniform(150, 2000, 40), rng.lognormal(7, 1, 40)))
+        self.session.commit()
+
+        self.assertEqual(self.scan_ids(detect_oxonium.detect_oxonium_ions(self.session)),
+                         self.scan_ids(detect_oxonium.detect_oxonium_ions_join(self.session)))
+        self.assertEqual(self.scan_ids(detect_oxonium.detect_monosaccharide_losses(self.session)),
+                         self.scan_ids(detect_oxonium.detect_monosaccharide_losses_join(self.session)))
+        self.assertIn(oxonium, self.scan_ids(detect_oxonium.detect_oxonium_ions(self.session)))
+        self.assertIn(loss, self.scan_ids(detect_oxonium.detect_monosaccharide_losses(
+            self.session, sample_run_id=self.sample_run_id)))
+        self.assertEqual(self.session.query(TandemScanSignature).count(), 24)
+
+        # Other parameters get their own signatures
+        self.assertEqual(self.scan_ids(detect_oxonium.detect_oxonium_ions(self.session, minimum_intensity=1)),
+                         self.scan_ids(detect_oxonium.detect_oxonium_ions_join(self.session, minimum_intensity=1)))
+        self.assertEqual(self.session.query(TandemScanSignature).count(), 48)
+        self.assertEqual(detect_oxonium.build_signature_index(self.session), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, Hypothesis, HypothesisSampleMatch, Protein, GlycopeptideMatch,
+    TheoreticalGlycanComposition, JointPeakGroupMatch, PeakGroupMatch, MassShift)
+from glycresoft_sqlalchemy.report import export_csv
+
+
+def ion(key):
+    return {"key": key, "mass": 0.}
+
+
+class TestStreamingExport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "export.db"))
+        self.manager.initialize()
+        session = self.session = self.manager.session()
+
+        hypothesis = Hypothesis(name=u"test")
+        session.add(hypothesis)
+        session.flush()
+        hsm = HypothesisSampleMatch(name=u"test-match", target_hypothesis_id=hypothesis.id)
+        session.add(hsm)
+        protein = Protein(name=u"P1", protein_sequence=u"PEPTIDE", hypothesis_id=hypothesis.id)
+        session.add(protein)
+        session.flush()
+        self.hsm = hsm
+
+        for i in range(5):
+            session.add(GlycopeptideMatch(
+                hypothesis_sample_match_id=hsm.id, protein_id=protein.id, ms1_score=0.5, ms2_score=i / 10.,
+                glycopeptide_sequence=u"PEPN(HexNAc)TIDE", sequence_length=8, scan_id_range=[i, i + 1],
+                bare_b_ions=[ion("B2"), ion("B3")], glycosylated_b_ions=[ion("B4+HexNAc")],
+                bare_y_ions=[ion("Y2")], glycosylated_y_ions=[], stub_ions=[ion("peptide+203")],
+                oxonium_ions=[ion("HexNAc")], start_position=1, end_position=8))
+
+        na = MassShift(name=u"Na", mass=21.98)
+        session.add(na)
+        glycans = []
+        for hexose in range(3, 6):
+            glycan = TheoreticalGlycanComposition(
+                hypothesis_id=hypothesis.id, calculated_mass=1000. + hexose,
+                composition=u"{Hex:%d; HexNAc:2}" % hexose)
+            session.add(glycan)
+            glycans.append(glycan)
+        session.flush()
+        for i, glycan in enumerate(glycans + [None]):
+            group = JointPeakGroupMatch(
+                hypothesis_sample_match_id=hsm.id, ms1_score=0.1 * i, matched=glycan is not None,
+                weighted_monoisotopic_mass=1000. + i, modification_state_count=2,
+                theoretical_match_type=u"TheoreticalGlycanComposition" if glycan else None,
+                theoretical_match_id=glycan.id if glycan else None,
+                peak_data={"scan_times": [], "intensities": []})
+            session.add(group)
+            group.subgroups.append(PeakGroupMatch(mass_shift_type=None))
+            group.subgroups.append(PeakGroupMatch(mass_shift=na, mass_shift_count=i + 1))
+        session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_glycopeptide_ms2_matches(self):
+        query = self.session.query(GlycopeptideMatch).order_by(GlycopeptideMatch.id)
+        export_csv.export_glycopeptide_ms2_matches(query, self.path("ms2.csv"), batch_size=2)
+        with open(self.path("ms2.csv"), 'rb') as fh:
+            rows = list(csv.DictReader(fh))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[3]["scan_id_range"], "3;4")
+        self.assertEqual(rows[3]["protein_name"], "P1")
+        self.assertEqual(rows[3]["b_ions"], "B2;B3;B4+HexNAc")
+        self.assertEqual(rows[3]["bare_b_ion_coverage"], "2")
+        self.assertEqual(rows[3]["glycosylated_y_ion_coverage"], "0")
+
+        export_csv.export_glycopeptide_ms2_matches(query, self.path("ms2.csv.gz"), compress=True)
+        with gzip.open(self.path("ms2.csv.gz"), 'rb') as fh:
+            self.assertEqual(list(csv.DictReader(fh)), rows)
+
+    def test_glycan_ms1_matches(self):
+        monosaccharides = ["Hex", "HexNAc", "Fuc"]
+        query = self.hsm.peak_group_matches.order_by(JointPeakGroupMatch.id)
+        export_csv.export_glycan_ms1_matches_legacy(
+            query, monosaccharides, self.path("ms1.csv"), self.session, batch_size=3)
+        with open(self.path("ms1.csv"), 'rb') as fh:
+            rows = list(csv.reader(fh))[1:]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][2], "{Hex:4; HexNAc:2}")
+        self.assertEqual(rows[1][17:20], ["4", "2", "0"])
+        self.assertEqual(rows[1][20], "No Shift,Na:2")
+        self.assertEqual(rows[3][2], "")
+        self.assertEqual(rows[3][17:20], ["", "", ""])
+
+        export_csv.export_glycan_ms1_matches_legacy(
+            query, monosaccharides, self.path("ms1.npz"), self.session, output_format="npz")
+        archive = np.load(self.path("ms1.npz"))
+        self.assertEqual(list(archive["__columns__"][:2]), ["Score", "MassSpec MW"])
+        self.assertTrue(np.allclose(archive["MassSpec MW"], [1000., 1001., 1002., 1003.]))
+        self.assertTrue(np.isnan(archive["Hex"][3]))
+        self.assertEqual(archive["Compound Key"][0], u"{Hex:3; HexNAc:2}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import glypy
+
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, MSMSSqlDB, MS2GlycanHypothesis, MS2GlycanHypothesisSampleMatch,
+    TheoreticalGlycanStructure, GlycanStructureMatch, GlycanSpectrumMatch,
+    SampleRun, TandemScan, Peak)
+from glycresoft_sqlalchemy.matching.glycan import fragment_matching
+
+
+def make_structure(name, hypothesis_id):
+    structure = glypy.motifs[name]
+    return TheoreticalGlycanStructure(
+        hypothesis_id=hypothesis_id, glycoct=structure.serialize(), calculated_mass=structure.mass(),
+        _fragments={f.name: f for f in structure.fragments(kind="BY", max_cleavages=1)})
+
+
+class TestGlycanFragmentMatching(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "glycans.db"))
+        self.manager.initialize()
+        session = self.session = self.manager.session()
+        hypothesis = MS2GlycanHypothesis(name=u"glycans")
+        session.add(hypothesis)
+        session.flush()
+        self.hypothesis_id = hypothesis.id
+        hsm = MS2GlycanHypothesisSampleMatch(name=u"glycan-match", target_hypothesis_id=hypothesis.id)
+        session.add(hsm)
+        # Two records of the same structure share their precursor spectra
+        self.structures = [make_structure(name, hypothesis.id) for name in (
+            "N-Glycan core basic 1", "N-Glycan core basic 1", "N-Glycan high mannose 2")]
+        session.add_all(self.structures)
+        session.commit()
+        self.hsm_id = hsm.id
+
+        self.msmsdb = MSMSSqlDB(os.path.join(self.directory, "ions.db"))
+        self.msmsdb.initialize()
+        ions = self.msmsdb.session()
+        sample_run = SampleRun(name=u"sample")
+        ions.add(sample_run)
+        ions.flush()
+        self.sample_run_id = sample_run.id
+        core = self.structures[0]
+        fragments = sorted(core.fragments("BY"), key=lambda f: f.mass)
+        self.expected = []
+        for time, offset in enumerate((0., 1e-6, 5e-3)):
+            scan = TandemScan(time=time, precursor_neutral_mass=core.calculated_mass, sample_run_id=sample_run.id)
+            ions.add(scan)
+            ions.flush()
+            masses = [f.mass * (1 + offset) for f in fragments[::2]]
+            for mass in masses:
+                ions.add(Peak(neutral_mass=mass, intensity=100., charge=1, scan_id=scan.id))
+            # Exhaustive comparison of every fragment with every peak
+            self.expected.append(sorted(
+                (f.name, mass) for f in fragments for mass in masses
+                if abs((mass - f.mass) / f.mass) <= 2e-5))
+            ions.add(Peak(neutral_mass=50., intensity=10., charge=1, scan_id=scan.id))
+        ions.commit()
+        ions.close()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def test_match_structures(self):
+        task = fragment_matching.IonMatching(
+            self.manager.path, self.hypothesis_id, self.msmsdb, observed_ions_type="db",
+            sample_run_id=self.sample_run_id, hypothesis_sample_match_id=self.hsm_id,
+            n_processes=1, batch_size=2)
+        task.start()
+
+        session = self.manager.session()
+        structure_matches = session.query(GlycanStructureMatch).order_by(
+            GlycanStructureMatch.theoretical_reference_id).all()
+        self.assertEqual([m.theoretical_reference_id for m in structure_matches],
+                         [s.id for s in self.structures[:2]])
+        for structure_match in structure_matches:
+            # The spectrum shifted by 5000 ppm explains no fragments
+            self.assertEqual(structure_match.scan_id_range, [0, 1])
+            self.assertEqual(
+                sorted((m["key"], m["observed_mass"]) for m in structure_match.fragment_matches),
+                sorted(self.expected[0] + self.expected[1]))
+            spectrum_matches = structure_match.spectrum_matches.order_by(GlycanSpectrumMatch.scan_time).all()
+            self.assertEqual([m.scan_time for m in spectrum_matches], [0, 1])
+            self.assertEqual([m.peaks_explained for m in spectrum_matches],
+                             [len({mass for name, mass in expected}) for expected in self.expected[:2]])
+            self.assertEqual([m.peaks_unexplained for m in spectrum_matches], [1, 1])
+            self.assertEqual(spectrum_matches[0].hypothesis_sample_match_id, self.hsm_id)
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
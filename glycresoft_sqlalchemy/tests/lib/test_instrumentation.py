@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.data_model import DatabaseManager, PipelineModule, StageMetric
+from glycresoft_sqlalchemy.data_model.pipeline_module import JobState
+from glycresoft_sqlalchemy.utils.instrumentation import Measurement
+
+
+class CountingTask(PipelineModule):
+    instrument = True
+
+    def __init__(self, database_path, profile_directory=None):
+        self.manager = self.manager_type(database_path)
+        self.profile_directory = profile_directory
+
+    def insert(self):
+        session = self.manager.session()
+        session.bulk_insert_mappings(JobState, [{"name": u"job-%d" % i, "state": u"done"} for i in range(5)])
+        session.commit()
+        session.close()
+        self.count(items=5)
+
+    def read(self):
+        self.count(items=2, rows_read=7)
+
+    def run(self):
+        self.run_stages(self.insert, self.read)
+        task_fn = self.instrument_task(len)
+        map(task_fn, ["ab", "cde"])
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "metrics.db")
+        DatabaseManager(self.path).initialize()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_measurement_counts_rows_written(self):
+        manager = DatabaseManager(self.path)
+        manager.connection_manager.instrumented = True
+        session = manager.session()
+        with Measurement("outer") as outer:
+            session.bulk_insert_mappings(JobState, [{"name": u"a"}, {"name": u"b"}])
+            with Measurement("inner") as inner:
+                session.query(JobState).update({"state": u"done"})
+            session.commit()
+        session.close()
+        self.assertEqual(inner.rows_written, 2)
+        self.assertEqual(outer.rows_written, 4)
+        self.assertTrue(outer.wall_time >= inner.wall_time > 0)
+
+    def test_uninstrumented_engines_are_not_counted(self):
+        session = DatabaseManager(self.path).session()
+        with Measurement("outer") as outer:
+            session.bulk_insert_mappings(JobState, [{"name": u"a"}, {"name": u"b"}])
+            session.commit()
+        session.close()
+        self.assertEqual(outer.rows_written, 0)
+
+    def test_instrumentation_is_opt_in(self):
+        class QuietTask(CountingTask):
+            instrument = False
+
+        task = QuietTask(self.path)
+        self.assertIs(task.instrument_task(len), len)
+        task.start()
+        self.assertFalse(task.manager.connection_manager.instrumented)
+        self.assertEqual(json.loads(task.metrics()), [])
+
+    def test_stage_metrics(self):
+        task = CountingTask(self.path)
+        task.start()
+        metrics = {m["stage"]: m for m in json.loads(task.metrics(include_batches=False))}
+        self.assertEqual(sorted(metrics), ["insert", "read", "run"])
+        self.assertEqual(metrics["insert"]["rows_written"], 5)
+        self.assertEqual(metrics["read"]["rows_read"], 7)
+        # Counts of each stage roll up into the enclosing run
+        self.assertEqual(metrics["run"]["items"], 7)
+        self.assertEqual(metrics["run"]["rows_read"], 7)
+
+        batches = json.loads(task.metrics())
+        self.assertEqual(sorted(m["items"] for m in batches if m["is_batch"]), [2, 3])
+
+        session = task.manager.session()
+        self.assertEqual(session.query(StageMetric).filter(StageMetric.run_id == task.run_id).count(), 5)
+        session.close()
+
+    def test_profile_directory(self):
+        task = CountingTask(self.path, profile_directory=self.directory)
+        task.start()
+        paths = [m["profile_path"] for m in json.loads(task.metrics(include_batches=False))]
+        self.assertEqual(len(paths), 3)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import itertools
+import unittest
+
+from glycresoft_sqlalchemy.structure.sequence import Sequence
+from glycresoft_sqlalchemy.structure.modification import Modification
+from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.ms1 import integrated_omics
+
+
+class GlycanCombination(object):
+    def __init__(self, id, composition, mass):
+        self.id = id
+        self.composition = composition
+        self.calculated_mass = mass
+
+    def dehydrated_mass(self):
+        return self.calculated_mass - integrated_omics.water
+
+
+class Peptide(object):
+    def __init__(self, sequence):
+        self.modified_peptide_sequence = sequence
+        self.glycosylation_sites = Sequence(sequence).n_glycan_sequon_sites
+
+
+glycans = {
+    1: [GlycanCombination(1, "[1;3;4;0]", 1500.5), GlycanCombination(2, "[0;5;2;0]", 1216.4)],
+    2: [GlycanCombination(3, "[1;8;8;0]", 3001.)],
+}
+
+
+def reparsing_glycosylate(peptide, max_sites=2):
+    # Parses the peptide once for every glycoform
+    sites_available = peptide.glycosylation_sites
+    for glycan_count in range(1, min(len(sites_available) + 1, max_sites + 1)):
+        for combination in glycans[glycan_count]:
+            for sites in itertools.combinations(sites_available, glycan_count):
+                target = Sequence(peptide.modified_peptide_sequence)
+                for site in sites:
+                    for mod in list(target[site][1]):
+                        target.drop_modification(site, mod)
+                mass = target.mass
+                for site in sites:
+                    target.add_modification(site, Modification("NGlycanCoreGlycosylation"))
+                yield (str(target) + combination.composition, mass + combination.dehydrated_mass(),
+                       combination, list(target.n_glycan_sequon_sites))
+
+
+class TestGlycosylateCallback(unittest.TestCase):
+    def test_matches_reparsing(self):
+        for sequence in ["PEPNGTIDE", "NVTSC(Carbamidomethyl)ANKSTM(Oxidation)PNGS", "PEPTIDE"]:
+            peptide = Peptide(sequence)
+            observed = list(integrated_omics.glycosylate_callback(
+                peptide, glycans.__getitem__, itertools.combinations))
+            expected = list(reparsing_glycosylate(peptide))
+            self.assertEqual(len(observed), len(expected))
+            for (sequence_string, mass, combination, sites), reference in zip(observed, expected):
+                self.assertEqual(sequence_string, reference[0])
+                self.assertAlmostEqual(mass, reference[1], 6)
+                self.assertIs(combination, reference[2])
+                self.assertEqual(sites, reference[3])
+
+    def test_template_is_reused(self):
+        template = integrated_omics.GlycosylationTemplate("NVTSANKST", [0, 5])
+        first = template.occupy((0,))
+        self.assertIs(template.occupy((0,)), first)
+        self.assertEqual(first[0], "N(N-Glycosylation)VTSANKST")
+        self.assertAlmostEqual(first[1], template.sequence.mass, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
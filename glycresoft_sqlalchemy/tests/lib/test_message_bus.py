@@ -0,0 +1,113 @@
+import time
+import unittest
+from threading import Thread
+
+from glycresoft_sqlalchemy.web_app.utils.message_bus import MessageBus
+from glycresoft_sqlalchemy.web_app.task.task_process import Message, WorkerPipe
+from glycresoft_sqlalchemy.web_app.services.server_sent_events import message_queue_stream
+
+
+class ListQueue(list):
+    put = list.append
+
+
+def progress(source, value):
+    return Message(value, "progress", source=source)
+
+
+class TestMessageBus(unittest.TestCase):
+    def test_every_subscriber_sees_every_message(self):
+        bus = MessageBus()
+        first = bus.subscribe()
+        bus.publish(Message("a"))
+        second = bus.subscribe()
+        bus.publish(Message("b"))
+        self.assertEqual([m.message for i, m in first.get(0)], ["a", "b"])
+        self.assertEqual([m.message for i, m in second.get(0)], ["b"])
+        self.assertEqual(first.get(0), [])
+
+    def test_resume_from_cursor(self):
+        bus = MessageBus()
+        for i in range(5):
+            bus.publish(Message(i))
+        self.assertEqual([m.message for i, m in bus.subscribe(3).get(0)], [3, 4])
+        # A cursor ahead of the bus starts from the present
+        self.assertEqual(bus.subscribe(10).cursor, 5)
+
+    def test_bounded_history(self):
+        bus = MessageBus(history_size=3)
+        subscription = bus.subscribe()
+        for i in range(5):
+            bus.publish(Message(i))
+        self.assertEqual([m.message for i, m in subscription.get(0)], [2, 3, 4])
+
+    def test_coalesce_progress(self):
+        bus = MessageBus()
+        subscription = bus.subscribe()
+        bus.publish(progress("a", 1))
+        bus.publish(progress("b", 1))
+        bus.publish(Message("note"))
+        bus.publish(progress("a", 2))
+        self.assertEqual([(m.source, m.type, m.message) for i, m in subscription.get(0)],
+                         [("b", "progress", 1), (None, "info", "note"), ("a", "progress", 2)])
+
+    def test_worker_pipe_stamps_source(self):
+        queue = ListQueue()
+        pipes = [WorkerPipe("a", queue), WorkerPipe("b", queue)]
+        for i in range(3):
+            for pipe in pipes:
+                pipe.send(Message(i, "progress"))
+        bus = MessageBus()
+        subscription = bus.subscribe()
+        for event, task_id, message in queue:
+            self.assertEqual(message.source, task_id)
+            bus.publish(message)
+        self.assertEqual([(m.source, m.message) for i, m in subscription.get(0)], [("a", 2), ("b", 2)])
+
+    def test_blocking_wait(self):
+        bus = MessageBus()
+        subscription = bus.subscribe()
+        publisher = Thread(target=lambda: (time.sleep(0.2), bus.publish(Message("late"))))
+        publisher.start()
+        start = time.time()
+        events = subscription.get(10)
+        publisher.join()
+        self.assertEqual([m.message for i, m in events], ["late"])
+        self.assertTrue(time.time() - start < 5)
+        start = time.time()
+        self.assertEqual(subscription.get(0.1), [])
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_close_wakes_subscribers(self):
+        bus = MessageBus()
+        subscription = bus.subscribe()
+        closer = Thread(target=lambda: (time.sleep(0.1), bus.close()))
+        closer.start()
+        self.assertEqual(list(subscription), [])
+        closer.join()
+        self.assertTrue(subscription.closed)
+
+
+class StreamingManager(object):
+    def __init__(self):
+        self.messages = MessageBus()
+        self.halting = False
+
+
+class TestMessageQueueStream(unittest.TestCase):
+    def test_clients_do_not_steal_messages(self):
+        manager = StreamingManager()
+        streams = [message_queue_stream(manager, keepalive=0.01, linger=0) for i in range(2)]
+        for stream in streams:
+            next(stream)
+            next(stream)
+        manager.messages.publish(Message("hello", "update"))
+        for stream in streams:
+            self.assertEqual(next(stream), 'id: 1\nevent: update\ndata: "hello"\n\n')
+        self.assertIn("event: tick", next(streams[0]))
+        manager.messages.close()
+        self.assertEqual(list(streams[1]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from glycresoft_sqlalchemy.structure import sequence, modification, residue
@@ -14,6 +17,83 @@ class TestModifcationTarget(unittest.TestCase):
         sites = deamidated.find_valid_sites(peptide)
         self.assertEqual(sites, [0, 3, 5, 7])
 
+    def test_bootstrap_reuse(self):
+        table = modification.RestrictedModificationTable.bootstrap(["Carbamidomethyl (C)"], ["Deamidated (N)"])
+        self.assertTrue(modification.RestrictedModificationTable.bootstrap(
+            ["Carbamidomethyl (C)"], ["Deamidated (N)"]) is table)
+        fresh = modification.RestrictedModificationTable.bootstrap(
+            ["Carbamidomethyl (C)"], ["Deamidated (N)"], reuse=False)
+        self.assertFalse(fresh is table)
+        self.assertEqual(sorted(fresh.store), sorted(table.store))
+        self.assertFalse(modification.RestrictedModificationTable.bootstrap(["Carbamidomethyl (C)"], []) is table)
+
+
+class TestModificationRegistry(unittest.TestCase):
+    def test_registry_matches_eager_table(self):
+        eager = modification.ModificationTable(
+            modification.ModificationSource._definitions_from_stream_default())
+        lazy = modification.ModificationTable()
+        for name in ("Deamidated", "Carbamidomethyl", "Pyro-glu from Q", "HexNAc"):
+            self.assertEqual(lazy[name].mass, eager[name].mass)
+            self.assertEqual(lazy[name].targets, eager[name].targets)
+        self.assertEqual(sorted(lazy.store.keys()), sorted(eager.store.keys()))
+
+    def test_registry_cache_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            registry = modification.ModificationRegistry.compile(
+                modification.load_from_json(modification.ModificationSource._unimod_definitions()))
+            path = os.path.join(directory, "modifications.pkl")
+            registry.dump(path)
+            loaded = modification.ModificationRegistry.load(path)
+            self.assertEqual(len(loaded), len(registry))
+            self.assertEqual(loaded["Deamidated"].mass, registry["Deamidated"].mass)
+            self.assertTrue(loaded["Deamidated"] is loaded["Deamidation"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_default_cache(self):
+        Registry = modification.ModificationRegistry
+        directory = tempfile.mkdtemp()
+        previous = Registry.cache_directory
+        version_tag = Registry.__dict__["version_tag"]
+        hashed = []
+
+        def counting_version_tag(cls, use_protein_prospector=True):
+            hashed.append(use_protein_prospector)
+            return version_tag.__func__(cls, use_protein_prospector)
+
+        Registry.version_tag = classmethod(counting_version_tag)
+        try:
+            Registry.set_cache_directory(directory)
+            compiled = Registry.default()
+            path = Registry.cache_path()
+            self.assertTrue(os.path.exists(path))
+
+            # Unchanged source files are not hashed again
+            del hashed[:]
+            Registry._default_registries.clear()
+            loaded = Registry.default()
+            self.assertEqual(hashed, [])
+            self.assertEqual(sorted(loaded.names()), sorted(compiled.names()))
+
+            # Touched source files are hashed, and the cache is kept if their contents match
+            loaded.source["stat"] = [(0, 0.)]
+            loaded.dump(path)
+            Registry._default_registries.clear()
+            self.assertEqual(len(Registry.default()), len(compiled))
+            self.assertEqual(hashed, [True])
+            self.assertEqual(Registry.load(path).source["stat"], Registry.source_stat())
+
+            loaded.source["digest"] = "stale"
+            loaded.dump(path)
+            Registry._default_registries.clear()
+            self.assertEqual(Registry.default().source["digest"], Registry.version_tag())
+        finally:
+            Registry.version_tag = version_tag
+            Registry.set_cache_directory(previous)
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
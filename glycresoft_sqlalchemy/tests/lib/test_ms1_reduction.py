@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from glycresoft_sqlalchemy.data_model import DatabaseManager, SampleRun, TandemScan, Decon2LSPeakGroup
+from glycresoft_sqlalchemy.matching.common.ms1_reduction import MS1Reduction, merge_mass_windows
+
+
+def brute_force(precursor_masses, masses, tolerance):
+    return [mass for mass in masses if any(
+        abs(mass - precursor) <= precursor * tolerance for precursor in precursor_masses)]
+
+
+class TestMS1Reduction(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_merge_mass_windows(self):
+        rng = np.random.RandomState(3)
+        precursors = sorted(rng.uniform(1000, 3000, 50))
+        masses = sorted(list(rng.uniform(1000, 3000, 200)) + [
+            p + p * offset for p in precursors[::5] for offset in (-2.1e-5, -0.9e-5, 0, 1.9e-5, 3e-5)])
+        for tolerance in (1e-5, 2e-5, 1e-3):
+            self.assertEqual(
+                list(merge_mass_windows(precursors, masses, tolerance, key=float)),
+                brute_force(precursors, masses, tolerance))
+        self.assertEqual(list(merge_mass_windows([], masses, 1e-5, key=float)), [])
+        self.assertEqual(list(merge_mass_windows(precursors, [], 1e-5, key=float)), [])
+
+    def test_reduction(self):
+        rng = np.random.RandomState(5)
+        ms1 = DatabaseManager(self.path("ms1.db"))
+        ms1.initialize()
+        session = ms1.session()
+        sample_run = SampleRun(name=u"sample", uuid=u"sample")
+        session.add(sample_run)
+        session.flush()
+        group_masses = rng.uniform(1000, 3000, 300)
+        session.bulk_insert_mappings(Decon2LSPeakGroup, [
+            {"sample_run_id": sample_run.id, "weighted_monoisotopic_mass": mass, "total_volume": i,
+             "peak_data": {"scan_times": [i]}}
+            for i, mass in enumerate(group_masses)])
+        session.commit()
+
+        ms2 = DatabaseManager(self.path("ms2.db"))
+        ms2.initialize()
+        session = ms2.session()
+        precursor_masses = [mass * (1 + rng.uniform(-1.5e-5, 1.5e-5)) for mass in group_masses[:40]]
+        precursor_masses += list(rng.uniform(1000, 3000, 40))
+        session.add_all([TandemScan(precursor_neutral_mass=mass) for mass in precursor_masses])
+        session.commit()
+
+        job = MS1Reduction(self.path("ms1.db"), self.path("ms2.db"), self.path("out.db"), chunk_size=7)
+        job.start()
+        out = DatabaseManager(self.path("out.db")).session()
+        reduced = out.query(Decon2LSPeakGroup).order_by(Decon2LSPeakGroup.weighted_monoisotopic_mass).all()
+        expected = brute_force(precursor_masses, sorted(group_masses), 2e-5)
+        self.assertTrue(len(expected) >= 40)
+        self.assertEqual(len(reduced), len(expected))
+        for group, mass in zip(reduced, expected):
+            self.assertAlmostEqual(group.weighted_monoisotopic_mass, mass, 5)
+            self.assertEqual(group.peak_data, {"scan_times": [int(group.total_volume)]})
+            self.assertAlmostEqual(group_masses[int(group.total_volume)], mass, 5)
+        self.assertEqual(out.query(SampleRun).one().name, u"sample")
+        out.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from glycresoft_sqlalchemy.data_model import DatabaseManager, Protein, InformedPeptide
+from glycresoft_sqlalchemy.proteomics import mzid_sa
+from glycresoft_sqlalchemy.proteomics.enrich_peptides import remove_duplicates
+
+
+proteins = {"P1": "MSPEPTIDENKTWQKNGTAVLKHEPTIDER", "P2": "GGNFTRPEPTIDENKTWQKLLNDSGR"}
+
+peptides = {
+    "PEP1": ("PEPTIDENK", None),
+    "PEP2": ("TWQKNGTAVLK", None),
+    "PEP3": ("TWQKNGTAVLK", 5),
+    "PEP4": ("NGTAVLK", None),
+}
+
+evidence = {
+    "PE1_P1": ("PEP1", "P1", 3, 11),
+    "PE1_P2": ("PEP1", "P2", 7, 15),
+    "PE2_P1": ("PEP2", "P1", 12, 22),
+    "PE3_P1": ("PEP3", "P1", 12, 22),
+    "PE4_P1": ("PEP4", "P1", 16, 22),
+}
+
+# The same peptides are identified repeatedly, with better, equal and worse scores
+# arriving before and after one another
+identifications = [
+    (["PE1_P1", "PE1_P2"], 30.), (["PE2_P1"], 12.), (["PE1_P1"], 45.), (["PE3_P1"], 20.),
+    (["PE2_P1"], 12.), (["PE4_P1"], 8.), (["PE1_P2"], 10.), (["PE2_P1"], 50.), (["PE3_P1"], 20.),
+]
+
+
+def make_mzid(path):
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<MzIdentML id="test" version="1.1.0" xmlns="http://psidev.info/psi/pi/mzIdentML/1.1">',
+        '<SequenceCollection>']
+    for accession, seq in sorted(proteins.items()):
+        parts.append('<DBSequence id="DBSeq_%s" accession="%s" searchDatabase_ref="DB"><Seq>%s</Seq></DBSequence>' % (
+            accession, accession, seq))
+    for peptide_id, (seq, deamidated) in sorted(peptides.items()):
+        parts.append('<Peptide id="%s"><PeptideSequence>%s</PeptideSequence>' % (peptide_id, seq))
+        if deamidated is not None:
+            parts.append(
+                '<Modification location="%d" residues="N" monoisotopicMassDelta="0.984016">'
+                '<cvParam cvRef="UNIMOD" accession="UNIMOD:7" name="Deamidated"/></Modification>' % deamidated)
+        parts.append('</Peptide>')
+    for evidence_id, (peptide_id, accession, start, end) in sorted(evidence.items()):
+        parts.append('<PeptideEvidence id="%s" peptide_ref="%s" dBSequence_ref="DBSeq_%s" start="%d" end="%d"'
+                     ' isDecoy="false"/>' % (evidence_id, peptide_id, accession, start, end))
+    parts.append('</SequenceCollection>')
+    parts.append('<AnalysisProtocolCollection><SpectrumIdentificationProtocol id="SIP">'
+                 '<Enzymes><Enzyme id="ENZ"><EnzymeName><cvParam cvRef="PSI-MS" accession="MS:1001251"'
+                 ' name="Trypsin"/></EnzymeName></Enzyme></Enzymes>'
+                 '</SpectrumIdentificationProtocol></AnalysisProtocolCollection>')
+    parts.append('<DataCollection><Inputs><SearchDatabase id="DB" location="proteins.fasta"/>'
+                 '<SpectraData id="SD" location="spectra.mgf"/></Inputs>')
+    parts.append('<AnalysisData><SpectrumIdentificationList id="SIL">')
+    for i, (evidence_ids, score) in enumerate(identifications):
+        peptide_id = evidence[evidence_ids[0]][0]
+        parts.append('<SpectrumIdentificationResult id="SIR_%d" spectrumID="index=%d" spectraData_ref="SD">' % (i, i))
+        parts.append('<SpectrumIdentificationItem id="SII_%d" rank="1" chargeState="2" peptide_ref="%s"'
+                     ' passThreshold="true">' % (i, peptide_id))
+        for evidence_id in evidence_ids:
+            parts.append('<PeptideEvidenceRef peptideEvidence_ref="%s"/>' % evidence_id)
+        parts.append('<cvParam cvRef="PSI-MS" accession="MS:1001171" name="mascot:score" value="%f"/>' % score)
+        parts.append('</SpectrumIdentificationItem></SpectrumIdentificationResult>')
+    parts.append('</SpectrumIdentificationList><ProteinDetectionList id="PDL">')
+    for accession in sorted(proteins):
+        parts.append('<ProteinAmbiguityGroup id="PAG_%s"><ProteinDetectionHypothesis id="PDH_%s"'
+                     ' dBSequence_ref="DBSeq_%s" passThreshold="true"/></ProteinAmbiguityGroup>' % (
+                         accession, accession, accession))
+    parts.append('</ProteinDetectionList></AnalysisData></DataCollection></MzIdentML>')
+    with open(path, 'w') as handle:
+        handle.write('\n'.join(parts))
+
+
+def describe_peptides(session, hypothesis_id):
+    return sorted(
+        (name, p.modified_peptide_sequence, p.start_position, p.end_position, p.peptide_score,
+         p.count_glycosylation_sites, sorted(p.glycosylation_sites), p.count_missed_cleavages)
+        for p, name in session.query(InformedPeptide, Protein.name).join(
+            Protein, InformedPeptide.protein_id == Protein.id).filter(Protein.hypothesis_id == hypothesis_id))
+
+
+class TestMzIdentMLImport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mzid_path = os.path.join(self.directory, "test.mzid")
+        make_mzid(self.mzid_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_streaming_matches_eager(self):
+        eager_path = os.path.join(self.directory, "eager.db")
+        eager = mzid_sa.Proteome(eager_path, self.mzid_path)
+        session = DatabaseManager(eager_path).session()
+        remove_duplicates(session, eager.hypothesis_id)
+        expected = describe_peptides(session, eager.hypothesis_id)
+        session.close()
+        self.assertEqual(len(expected), 5)
+
+        # Flushing after every identification puts duplicates in separate batches
+        for chunk_size in (1, 3, 5000):
+            streaming_path = os.path.join(self.directory, "streaming-%d.db" % chunk_size)
+            streaming = mzid_sa.StreamingProteome(streaming_path, self.mzid_path, chunk_size=chunk_size)
+            self.assertEqual(streaming.enzymes, eager.enzymes)
+            session = DatabaseManager(streaming_path).session()
+            self.assertEqual(describe_peptides(session, streaming.hypothesis_id), expected)
+            self.assertEqual(
+                sorted(session.query(Protein.name, Protein.protein_sequence).filter(
+                    Protein.hypothesis_id == streaming.hypothesis_id)),
+                sorted(proteins.items()))
+            session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, Hypothesis, HypothesisSampleMatch, GlycopeptideMatch, GlycopeptideSpectrumMatch)
+from glycresoft_sqlalchemy.scoring import pair_counting
+
+
+sequences = [
+    "PEPN(N-Glycosylation)TIDEK{Hex:5; HexNAc:2}",
+    "S(HexNAc)T(HexNAc)AN(N-Glycosylation)GSR{Hex:5; HexNAc:4}",
+    "LLDN(N-Glycosylation)QTC(Carbamidomethyl)K{Hex:5; HexNAc:2}",
+    "PEPTIDE",
+]
+
+
+class Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_matches(rng):
+    matches = []
+    for seq in sequences:
+        names = sorted(pair_counting.make_fragment_map(seq))
+        spectrum_matches = []
+        for i in range(3):
+            chosen = rng.choice(len(names), len(names) // 2, replace=False)
+            peak_match_map = {}
+            for j, k in enumerate(chosen):
+                peak_match_map[j] = [{"key": names[k], "intensity": float(rng.choice([100., 1000.]))}]
+            # Unrelated and repeated keys are not counted twice
+            peak_match_map[len(chosen)] = [{"key": "peptide+203", "intensity": 1000.},
+                                           {"key": names[chosen[0]], "intensity": 1000.}]
+            spectrum_matches.append(Record(peak_match_map=peak_match_map))
+        matches.append(Record(glycopeptide_sequence=seq, spectrum_matches=spectrum_matches))
+    return matches
+
+
+def enumerated_counts(matches):
+    observed = Counter()
+    possible = Counter()
+    for match in matches:
+        fragment_map = pair_counting.make_fragment_map(match.glycopeptide_sequence)
+        for spectrum_match in match.spectrum_matches:
+            seen = set()
+            for case in itertools.chain.from_iterable(spectrum_match.peak_match_map.values()):
+                key = case['key']
+                if case['intensity'] >= 250 and key in fragment_map and key not in seen:
+                    seen.add(key)
+                    observed[tuple(fragment_map[key].flanking_amino_acids)] += 1
+            for fragment in fragment_map.values():
+                possible[tuple(fragment.flanking_amino_acids)] += 1
+    return observed, possible
+
+
+def enumerated_backbone_score(counter, matched, use_interaction):
+    fragment_map = pair_counting.make_fragment_map(matched.glycopeptide_sequence)
+
+    def score(fragment):
+        if use_interaction:
+            return counter.pair_probability(fragment.flanking_amino_acids)
+        n_term, c_term = fragment.flanking_amino_acids
+        return counter.n_term_probability(n_term) * counter.c_term_probability(c_term)
+
+    total = sum(score(fragment) for fragment in fragment_map.values())
+    if not use_interaction:
+        total *= 0.5
+    observed = 0
+    track_site = set()
+    for frag in pair_counting.extract_matched_fragments(matched):
+        fragment = fragment_map[frag['key']]
+        if use_interaction:
+            observed += score(fragment)
+        else:
+            observed += score(fragment) * (0.6 if fragment.position not in track_site else 0.4)
+            track_site.add(fragment.position)
+    return observed / total
+
+
+class TestPairCounting(unittest.TestCase):
+    def test_fragment_sites(self):
+        for seq in sequences:
+            sites = pair_counting.FragmentSites(seq)
+            fragment_map = pair_counting.make_fragment_map(seq)
+            self.assertEqual(set(sites.key_sites), set(fragment_map))
+            self.assertEqual(sites.multiplicity.sum(), len(fragment_map))
+            for key, fragment in fragment_map.items():
+                site = sites.key_sites[key]
+                self.assertEqual((sites.n_terms[site], sites.c_terms[site]), tuple(fragment.flanking_amino_acids))
+                self.assertEqual(sites.positions[site], fragment.position)
+
+    def test_train(self):
+        matches = make_matches(np.random.RandomState(5))
+        counter = pair_counting.FrequencyCounter()
+        counter.train(matches)
+        observed, possible = enumerated_counts(matches)
+        self.assertEqual(counter.observed_pairs, observed)
+        self.assertEqual(counter.possible_pairs, possible)
+        for counts, n_term, c_term in ((observed, counter.observed_n_term, counter.observed_c_term),
+                                       (possible, counter.possible_n_term, counter.possible_c_term)):
+            expected_n = Counter()
+            expected_c = Counter()
+            for (n, c), count in counts.items():
+                expected_n[n] += count
+                expected_c[c] += count
+            self.assertEqual(n_term, expected_n)
+            self.assertEqual(c_term, expected_c)
+
+    def test_scorer(self):
+        matches = make_matches(np.random.RandomState(5))
+        counter = pair_counting.FrequencyCounter()
+        counter.train(matches)
+        for use_interaction in (False, True):
+            scorer = pair_counting.FrequencyScorer(counter, use_interaction)
+            for match in matches:
+                fragment_map = pair_counting.make_fragment_map(match.glycopeptide_sequence)
+                keys = sorted(fragment_map)
+                matched = Record(
+                    glycopeptide_sequence=match.glycopeptide_sequence,
+                    bare_b_ions=[{"key": k} for k in keys if k.startswith("b")][::2],
+                    bare_y_ions=[{"key": k} for k in keys if k.startswith("y")][1::2],
+                    glycosylated_b_ions=[{"key": k} for k in keys if k.startswith("b") and "HexNAc" in k],
+                    glycosylated_y_ions=[])
+                self.assertAlmostEqual(
+                    scorer.backbone_score(matched),
+                    enumerated_backbone_score(counter, matched, use_interaction))
+
+
+class TestTrainFromDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "matches.db"))
+        self.manager.initialize()
+        self.session = self.manager.session()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def test_train_from_database(self):
+        matches = make_matches(np.random.RandomState(9))
+        session = self.session
+        hypothesis = Hypothesis(name=u"test")
+        session.add(hypothesis)
+        session.flush()
+        hsm = HypothesisSampleMatch(name=u"test-match", target_hypothesis_id=hypothesis.id)
+        session.add(hsm)
+        session.flush()
+        for match in matches:
+            record = GlycopeptideMatch(
+                hypothesis_sample_match_id=hsm.id, glycopeptide_sequence=unicode(match.glycopeptide_sequence),
+                ms2_score=0.5)
+            session.add(record)
+            session.flush()
+            for spectrum_match in match.spectrum_matches:
+                session.add(GlycopeptideSpectrumMatch(
+                    glycopeptide_match_id=record.id, peak_match_map=spectrum_match.peak_match_map))
+        session.commit()
+
+        counter = pair_counting.FrequencyCounter()
+        counter.train_from_database(session)
+        expected = pair_counting.FrequencyCounter()
+        expected.train(matches)
+        self.assertEqual(counter.observed_pairs, expected.observed_pairs)
+        self.assertEqual(counter.possible_pairs, expected.possible_pairs)
+        self.assertEqual(counter.observed_sequences, expected.observed_sequences)
+
+
+if __name__ == '__main__':
+    unittest.main()
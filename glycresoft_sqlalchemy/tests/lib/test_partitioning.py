@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+
+from glycresoft_sqlalchemy.utils.partitioning import window_counts, cost_balanced_batches
+
+
+class TestPartitioning(unittest.TestCase):
+    def test_window_counts(self):
+        masses = np.array([1000., 1000.005, 1000.02, 2000.])
+        self.assertEqual(list(window_counts(masses, [1000., 1500., 2000.01], 1e-5)), [2, 0, 1])
+        self.assertEqual(list(window_counts(masses, [1000., 2000.], 1e-5, [1., 2., 4., 8.])), [3., 8.])
+
+    def test_cost_balanced_batches(self):
+        rng = np.random.RandomState(7)
+        costs = np.concatenate((rng.exponential(1., 2000), [400., 300.]))
+        items = range(len(costs))
+        batches = list(cost_balanced_batches(items, costs, n_workers=4, max_batch_size=100))
+
+        self.assertEqual(sorted(sum(batches, [])), items)
+        self.assertTrue(all(len(batch) <= 100 for batch in batches))
+        # The most expensive items are dispatched first, on their own
+        self.assertEqual(batches[0], [2000])
+        self.assertEqual(batches[1], [2001])
+        batch_costs = [costs[batch].sum() for batch in batches]
+        # Batches shrink towards the end of the run
+        self.assertTrue(batch_costs[-1] < batch_costs[2])
+        self.assertEqual(list(cost_balanced_batches([], [], 4)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
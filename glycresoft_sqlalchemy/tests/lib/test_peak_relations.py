@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from glycresoft_sqlalchemy.scoring.offset_frequency import peak_relations
+from glycresoft_sqlalchemy.scoring.offset_frequency.peak_relations import MassOffsetFeature
+from glycresoft_sqlalchemy.scoring.offset_frequency.features import shifts
+
+
+class FakePeak(object):
+    def __init__(self, id, neutral_mass, intensity, charge):
+        self.id = id
+        self.neutral_mass = neutral_mass
+        self.intensity = intensity
+        self.charge = charge
+        self.scan_peak_index = id
+
+
+class FakeSpectrum(object):
+    def __init__(self, id, peaks, explained):
+        self.id = id
+        self.peaks = peaks
+        self.explained = explained
+
+    def __iter__(self):
+        return iter(self.peaks)
+
+    def peak_explained_by(self, peak_id):
+        return self.explained.get(peak_id, set())
+
+
+def make_spectrum(rng, id, n=60):
+    masses = list(rng.uniform(200., 2000., n))
+    # Plant pairs related by each shift, some just inside and some just outside tolerance
+    for feature in shifts:
+        base = rng.choice(masses)
+        target = base + feature.offset
+        masses.append(target * (1 + 1.9e-5))
+        masses.append(target * (1 - 2.1e-5))
+    peaks = [FakePeak(i, mass, float(rng.uniform(500., 1e5)), int(rng.randint(1, 3)))
+             for i, mass in enumerate(masses)]
+    explained = {peak.id: set(["b%d" % i]) for i, peak in enumerate(peaks) if i % 3 == 0}
+    return FakeSpectrum(id, peaks, explained)
+
+
+def brute_force_pairs(peaks, feature):
+    return [(i, j) for i, peak in enumerate(peaks) for j, match in enumerate(peaks) if feature(peak, match)]
+
+
+class TestPeakRelations(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.spectra = [make_spectrum(rng, i) for i in range(4)]
+
+    def test_match_masses(self):
+        masses = np.array([100., 100.0015, 100.0035, 250., 500.])
+        query_index, mass_index = peak_relations.match_masses([100.001, 499.99, 600.], masses, 2e-5)
+        self.assertEqual(query_index.tolist(), [0, 0, 1])
+        self.assertEqual(mass_index.tolist(), [0, 1, 4])
+
+    def test_relate_peaks(self):
+        features = shifts + [MassOffsetFeature(0., 2e-5)]
+        for spectrum in self.spectra:
+            relations = peak_relations.relate_peaks(spectrum.peaks, features)
+            for feature, pairs in zip(features, relations):
+                self.assertEqual(pairs, brute_force_pairs(spectrum.peaks, feature))
+            self.assertTrue(any(relations[:len(shifts)]))
+
+    def test_estimate_feature_functions(self):
+        estimates = peak_relations.estimate_feature_functions(self.spectra, shifts, 'b')
+        for feature, (u, v, relations) in zip(shifts, estimates):
+            single = peak_relations.feature_function_estimator(self.spectra, feature, 'b')
+            self.assertEqual((u, v), single[:2])
+            pairs = [(pr.from_peak.id, pr.to_peak.id, pr.kind) for gsm, related in relations for pr in related]
+            expected = []
+            for spectrum in self.spectra:
+                peaks = [peak for peak in spectrum.peaks if peak.intensity >= 100.]
+                for i, j in brute_force_pairs(peaks, feature):
+                    expected.append((peaks[i].id, peaks[j].id, 'b' if peaks[i].id in spectrum.explained else "Noise"))
+            self.assertEqual(pairs, expected)
+
+    def test_search_features(self):
+        class KindFeature(MassOffsetFeature):
+            kind = 'b'
+
+        features = [KindFeature(feature.offset, feature.tolerance, name=feature.name) for feature in shifts]
+        peaks = self.spectra[0].peaks
+        peak_match_map = peak_relations.search_features(peaks, features)
+        expected = {}
+        for peak in peaks:
+            for query_peak in peaks:
+                for feature in features:
+                    if feature(peak, query_peak):
+                        expected.setdefault(peak.id, []).append((query_peak.id, feature.name))
+        self.assertEqual(
+            {key: [(pr.to_peak.id, pr.feature.name) for pr in value] for key, value in peak_match_map.items()},
+            expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
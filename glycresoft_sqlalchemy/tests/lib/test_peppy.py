@@ -0,0 +1,126 @@
+import math
+import unittest
+from fractions import Fraction
+
+import numpy as np
+from scipy.special import comb
+
+from glycresoft_sqlalchemy.scoring import peppy
+
+
+def summed_binomial_tail_probability(n, k, p):
+    total = 0
+    for i in range(k, n):
+        total += comb(n, i) * (p ** i) * (1 - p) ** (n - i)
+    return total
+
+
+def exact_log_binomial_tail_probability(n, k, p):
+    p = Fraction(p)
+    total = sum(comb(n, i, exact=True) * p ** i * (1 - p) ** (n - i) for i in range(max(k, 0), n))
+    return math.log(total.numerator) - math.log(total.denominator)
+
+
+def summed_peppy_score(spectrum, spectrum_match, match_tolerance):
+    theoretical = spectrum_match.theoretical_glycopeptide
+    total = peppy.count_theoretical_product_ions(theoretical)
+    precursor_mass = theoretical.calculated_mass - theoretical.glycan_composition.mass()
+    match_count = len(spectrum_match.peak_match_map)
+    fragment_component = summed_binomial_tail_probability(
+        total, match_count, 2 * match_tolerance * match_count / precursor_mass)
+    intensities = np.array([p.intensity for p in spectrum])
+    m1 = np.median(intensities)
+    m2 = np.median(intensities[intensities > m1])
+    m3 = np.median(intensities[intensities > m2])
+    m4 = np.median(intensities[intensities > m3])
+    matched = np.array([match['intensity'] for matches in spectrum_match.peak_match_map.values()
+                        for match in matches])
+    intensity_component = 1.
+    last_count = total
+    for m in (m1, m2, m3, m4):
+        next_count = (matched > m).sum()
+        intensity_component *= summed_binomial_tail_probability(last_count, next_count, 0.5)
+        last_count = next_count
+    return -np.log10(intensity_component * fragment_component)
+
+
+class Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_match(rng, spectrum, n_ions, n_matched):
+    theoretical = Record(
+        bare_b_ions=[0] * n_ions, bare_y_ions=[0] * n_ions, glycosylated_b_ions=[0] * 2,
+        glycosylated_y_ions=[0] * 2, stub_ions=[0] * 5, oxonium_ions=[0] * 4,
+        calculated_mass=3500., glycan_composition=Record(mass=lambda: 1200.))
+    chosen = rng.choice(len(spectrum), n_matched, replace=False)
+    peak_match_map = {int(i): [{"intensity": spectrum[i].intensity}] for i in chosen}
+    return Record(theoretical_glycopeptide=theoretical, peak_match_map=peak_match_map)
+
+
+class TestPeppy(unittest.TestCase):
+    def test_binomial_tail_probability(self):
+        for n in (0, 1, 5, 40):
+            for k in range(0, n + 2):
+                for p in (0., 1e-4, 0.3, 0.5, 0.9):
+                    self.assertAlmostEqual(
+                        peppy.binomial_tail_probability(n, k, p), summed_binomial_tail_probability(n, k, p),
+                        places=12)
+
+    def test_deep_tail(self):
+        # Tails far below the smallest float, and tails dominated by the excluded X == n term.
+        # Powers of two keep the exact sums small.
+        for n, k, p in ((200, 150, 2. ** -10), (400, 390, 2. ** -4), (40, 39, 1 - 2. ** -10),
+                        (60, 1, 1 - 2. ** -14), (300, 2, 2. ** -20)):
+            expected = exact_log_binomial_tail_probability(n, k, p)
+            observed = peppy.log_binomial_tail_probability(n, k, p)
+            self.assertTrue(np.isfinite(observed))
+            self.assertLess(abs(observed - expected), 1e-9 * abs(expected))
+
+    def test_medians(self):
+        rng = np.random.RandomState(3)
+        for size in (1, 2, 7, 50, 51):
+            values = rng.uniform(0, 100, size)
+            expected = [np.median(values)]
+            for i in range(3):
+                above = values[values > expected[-1]]
+                expected.append(np.median(above) if len(above) else np.nan)
+            np.testing.assert_allclose(peppy.medians(values), expected)
+
+    def test_peppy_scores(self):
+        rng = np.random.RandomState(11)
+        spectrum = [Record(intensity=i) for i in rng.lognormal(8, 1.5, 120)]
+        matches = [make_match(rng, spectrum, 20, n) for n in (0, 1, 6, 15, 30)]
+        scores = peppy.peppy_scores(spectrum, matches, 2e-5)
+        for match, score in zip(matches, scores):
+            expected = summed_peppy_score(spectrum, match, 2e-5)
+            self.assertAlmostEqual(score, expected, places=8)
+            self.assertAlmostEqual(peppy.peppy_score(spectrum, match, 2e-5), score)
+
+    def test_score_batch(self):
+        rng = np.random.RandomState(13)
+        peaks = [Record(intensity=i) for i in rng.lognormal(8, 1.5, 60)]
+        iterations = []
+
+        class Spectrum(object):
+            def __iter__(self):
+                iterations.append(1)
+                return iter(peaks)
+
+        spectrum = Spectrum()
+        matches = [make_match(rng, peaks, 15, n) for n in (2, 9, 20)]
+        for i, match in enumerate(matches):
+            match.id = i + 1
+            match.spectrum = spectrum
+        scores = peppy.PeppySpectrumScorer().score_batch(matches)
+        # The spectrum is read once for every match to it
+        self.assertEqual(len(iterations), 1)
+        self.assertEqual([score.spectrum_match_id for score in scores], [1, 2, 3])
+        for match, score in zip(matches, scores):
+            self.assertEqual(score.name, "peppy_ms2_score")
+            self.assertAlmostEqual(score.value, summed_peppy_score(peaks, match, 2e-5), places=8)
+
+
+if __name__ == '__main__':
+    unittest.main()
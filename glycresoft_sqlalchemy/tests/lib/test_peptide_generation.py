@@ -1,6 +1,10 @@
+import os
+import shutil
+import tempfile
+import itertools
 import unittest
 
-from glycresoft_sqlalchemy.data_model import NaivePeptide, Protein
+from glycresoft_sqlalchemy.data_model import NaivePeptide, Protein, Hypothesis, DatabaseManager
 from glycresoft_sqlalchemy.structure import sequence, modification, residue
 from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder import peptide_utilities
 
@@ -66,6 +70,107 @@ class TestPeptidoformBuilder(unittest.TestCase):
 
         self.assertEqual(sorted(solutions), sorted(solution_2))
 
+    def test_modification_count_vectors(self):
+        site_assignments = {"Deamidated": {0, 3, 5}, "Phospho": {2, 3, 7}, "Oxidation": {3}, "Methyl": set()}
+        vectors = list(peptide_utilities.modification_count_vectors(site_assignments, 4))
+        keys = [frozenset(v.items()) for v in vectors]
+        self.assertEqual(len(keys), len(set(keys)))
+        # Every way of placing at most four modifications on distinct positions
+        expected = set()
+        positions = sorted(set().union(*site_assignments.values()))
+        for assignment in itertools.product(*[
+                [None] + [name for name, sites in site_assignments.items() if position in sites]
+                for position in positions]):
+            counts = {}
+            for name in assignment:
+                if name is not None:
+                    counts[name] = counts.get(name, 0) + 1
+            if counts and sum(counts.values()) <= 4:
+                expected.add(frozenset(counts.items()))
+        self.assertEqual(set(keys), expected)
+        self.assertTrue(peptide_utilities.is_realizable({"Deamidated": 2, "Oxidation": 1}, site_assignments))
+        self.assertFalse(peptide_utilities.is_realizable({"Deamidated": 1, "Oxidation": 1, "Phospho": 3},
+                                                         site_assignments))
+
+
+small_protein_sequence = "MKQNGTCRENKT"
+
+# Modifications are recorded by count, and only the occupied sequons are positioned
+small_protein_peptidoforms = [
+    (0, 'MKQNGTC(Carbamidomethyl)R', '', 993.4484, (3,)),
+    (2, '(Gln->pyro-Glu)-QNGTC(Carbamidomethyl)R', '', 716.2786, (1,)),
+    (2, '(Gln->pyro-Glu)-QNGTC(Carbamidomethyl)RENK', '', 1087.4591, (1,)),
+    (2, '(Gln->pyro-Glu)-QNGTC(Carbamidomethyl)RENK', '', 1087.4591, (7,)),
+    (2, '(Gln->pyro-Glu)-QNGTC(Carbamidomethyl)RENK', '1Deamidated', 1088.4431, (1,)),
+    (2, 'QNGTC(Carbamidomethyl)R', '', 734.313, (1,)),
+    (2, 'QNGTC(Carbamidomethyl)RENK', '', 1105.4935, (1,)),
+    (2, 'QNGTC(Carbamidomethyl)RENK', '', 1105.4935, (7,)),
+    (2, 'QNGTC(Carbamidomethyl)RENK', '1Deamidated', 1106.4775, (1,)),
+]
+
+
+class TestProteomeDigestor(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "digest.db")
+        manager = DatabaseManager(self.path)
+        manager.initialize()
+        session = manager.session()
+        hypothesis = Hypothesis(name=u"digest")
+        session.add(hypothesis)
+        session.flush()
+        self.hypothesis_id = hypothesis.id
+        for i in range(3):
+            session.add(Protein(name=u"protein-%d" % i, protein_sequence=protein_sequence[i * 20:],
+                                hypothesis_id=hypothesis.id))
+        session.commit()
+        self.session = session
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def peptidoforms(self):
+        return sorted(
+            (p.protein_id, p.start_position, p.modified_peptide_sequence, p.peptide_modifications,
+             round(p.calculated_mass, 4), tuple(p.glycosylation_sites))
+            for p in self.session.query(NaivePeptide))
+
+    def test_digest_small_protein(self):
+        hypothesis = Hypothesis(name=u"small")
+        self.session.add(hypothesis)
+        self.session.flush()
+        self.session.add(Protein(name=u"small", protein_sequence=small_protein_sequence,
+                                 hypothesis_id=hypothesis.id))
+        self.session.commit()
+        for peptides_per_task in (1, 50):
+            peptide_utilities.ProteomeDigestor(
+                self.path, hypothesis.id, None, constant_modifications,
+                ["Deamidated (N)", "Pyro-glu from Q (Q@N-term)"], "trypsin", 1, n_processes=1,
+                peptides_per_task=peptides_per_task).start()
+            self.assertEqual([record[1:] for record in self.peptidoforms()], small_protein_peptidoforms)
+            self.session.query(NaivePeptide).delete()
+            self.session.commit()
+
+    def test_digest(self):
+        variable = ["Deamidated (N)", "Pyro-glu from Q (Q@N-term)"]
+        expected = sorted(
+            (p.protein_id, p.start_position, p.modified_peptide_sequence, p.peptide_modifications,
+             round(p.calculated_mass, 4), tuple(p.glycosylation_sites))
+            for protein in self.session.query(Protein)
+            for p in peptide_utilities.generate_peptidoforms(
+                protein, constant_modifications, variable, "trypsin", 1))
+        self.session.expunge_all()
+        self.assertTrue(len(expected) > 10)
+        for n_processes in (1, 2):
+            count = peptide_utilities.ProteomeDigestor(
+                self.path, self.hypothesis_id, None, constant_modifications, variable, "trypsin", 1,
+                n_processes=n_processes, chunk_size=7, peptides_per_task=3).start()
+            self.assertEqual(count, len(expected))
+            self.assertEqual(self.peptidoforms(), expected)
+            self.session.query(NaivePeptide).delete()
+            self.session.commit()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event, inspect
+
+from glycresoft_sqlalchemy.data_model import (
+    DatabaseManager, Hypothesis, HypothesisSampleMatch, Protein, GlycopeptideMatch,
+    TheoreticalGlycopeptide, HypothesisSampleMatchProteinSummary)
+from glycresoft_sqlalchemy.data_model.search_result_model.summary import sequence_coverage
+from glycresoft_sqlalchemy.web_app.utils.pagination import KeysetPagination, KeysetCursors, QueryPagination
+
+
+class TestResultSummary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = DatabaseManager(os.path.join(self.directory, "summary.db"))
+        self.manager.initialize()
+        session = self.session = self.manager.session()
+
+        hypothesis = Hypothesis(name=u"test")
+        session.add(hypothesis)
+        session.flush()
+        hsm = HypothesisSampleMatch(name=u"test-match", target_hypothesis_id=hypothesis.id)
+        session.add(hsm)
+        matched = Protein(name=u"P1", protein_sequence=u"A" * 20, hypothesis_id=hypothesis.id)
+        unmatched = Protein(name=u"P2", protein_sequence=u"A" * 10, hypothesis_id=hypothesis.id)
+        session.add_all([matched, unmatched])
+        session.flush()
+        self.hsm, self.matched, self.unmatched = hsm, matched, unmatched
+
+        for protein, n in ((matched, 6), (unmatched, 3)):
+            for i in range(n):
+                session.add(TheoreticalGlycopeptide(protein_id=protein.id, start_position=1, end_position=5))
+        # Scores repeat so that pages must break ties by id
+        for i in range(23):
+            start = 1 if i % 2 else 11
+            session.add(GlycopeptideMatch(
+                hypothesis_sample_match_id=hsm.id, protein_id=matched.id, ms2_score=(i % 4) / 4.,
+                start_position=start, end_position=start + 4))
+        session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def test_sequence_coverage(self):
+        self.assertAlmostEqual(sequence_coverage([(1, 5), (3, 8), (11, 12)], 20), 0.5)
+        self.assertEqual(sequence_coverage([], 0), 0.)
+
+    def test_build_summary(self):
+        summaries = {
+            s.protein_id: s for s in HypothesisSampleMatchProteinSummary.for_hypothesis_sample_match(
+                self.session, self.hsm.id)}
+        self.assertEqual(len(summaries), 2)
+        matched = summaries[self.matched.id]
+        self.assertEqual(matched.theoretical_count, 6)
+        self.assertEqual(matched.match_count, 23)
+        self.assertAlmostEqual(matched.best_score, 0.75)
+        self.assertAlmostEqual(matched.coverage, 0.5)
+        unmatched = summaries[self.unmatched.id]
+        self.assertEqual(unmatched.match_count, 0)
+        self.assertIsNone(unmatched.best_score)
+
+        HypothesisSampleMatchProteinSummary.build(self.session, self.hsm.id)
+        self.assertEqual(self.session.query(HypothesisSampleMatchProteinSummary).count(), 2)
+
+    def test_empty_summary_is_built_once(self):
+        hypothesis = Hypothesis(name=u"empty")
+        self.session.add(hypothesis)
+        self.session.flush()
+        hsm = HypothesisSampleMatch(name=u"empty-match", target_hypothesis_id=hypothesis.id)
+        self.session.add(hsm)
+        self.session.commit()
+        builds = []
+        build = HypothesisSampleMatchProteinSummary.build.__func__
+
+        def counting_build(cls, session, hypothesis_sample_match_id):
+            builds.append(hypothesis_sample_match_id)
+            return build(cls, session, hypothesis_sample_match_id)
+
+        HypothesisSampleMatchProteinSummary.build = classmethod(counting_build)
+        try:
+            for i in range(2):
+                self.assertEqual(HypothesisSampleMatchProteinSummary.for_hypothesis_sample_match(
+                    self.session, hsm.id).count(), 0)
+        finally:
+            HypothesisSampleMatchProteinSummary.build = classmethod(build)
+        self.assertEqual(builds, [hsm.id])
+
+    def test_keyset_pagination(self):
+        query = self.session.query(GlycopeptideMatch).filter(GlycopeptideMatch.ms2_score >= 0.25)
+        offset_pages = [
+            [gpm.id for gpm in QueryPagination.paginate(
+                query.order_by(GlycopeptideMatch.ms2_score.desc(), GlycopeptideMatch.id.desc()),
+                page, 5, error_out=False).items]
+            for page in range(1, 5)]
+
+        cursors = KeysetCursors()
+        for page in (1, 2, 4, 3, 2):
+            paginator = KeysetPagination.paginate(
+                query, page, 5, GlycopeptideMatch.ms2_score, GlycopeptideMatch.id, cursors)
+            self.assertEqual([gpm.id for gpm in paginator.items], offset_pages[page - 1])
+            self.assertEqual(paginator.total, 17)
+            self.assertEqual(paginator.pages, 4)
+        self.assertEqual([gpm.id for gpm in paginator.next().items], offset_pages[2])
+
+        # An unvisited page seeks from the nearest visited page before it
+        cursors = KeysetCursors()
+        paginator = KeysetPagination.paginate(
+            query, 3, 5, GlycopeptideMatch.ms2_score, GlycopeptideMatch.id, cursors)
+        self.assertEqual([gpm.id for gpm in paginator.items], offset_pages[2])
+
+    def test_keyset_pagination_null_scores(self):
+        for i in range(4):
+            self.session.add(GlycopeptideMatch(
+                hypothesis_sample_match_id=self.hsm.id, protein_id=self.matched.id, ms2_score=None))
+        self.session.commit()
+        query = self.session.query(GlycopeptideMatch)
+        expected = [gpm.id for gpm in sorted(
+            query, key=lambda gpm: (gpm.ms2_score if gpm.ms2_score is not None else float('-inf'), gpm.id),
+            reverse=True)]
+        cursors = KeysetCursors()
+        pages = []
+        for page in range(1, 7):
+            paginator = KeysetPagination.paginate(
+                query, page, 5, GlycopeptideMatch.ms2_score, GlycopeptideMatch.id, cursors, error_out=False)
+            self.assertEqual(paginator.total, 27)
+            pages.extend(gpm.id for gpm in paginator.items)
+        self.assertEqual(pages, expected)
+        self.assertIsNone(self.session.query(GlycopeptideMatch).get(pages[-1]).ms2_score)
+
+    def test_keyset_pagination_counts_once(self):
+        counts = []
+
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            if "count(" in statement.lower():
+                counts.append(statement)
+
+        engine = self.session.get_bind()
+        event.listen(engine, "before_cursor_execute", count_statements)
+        try:
+            query = self.session.query(GlycopeptideMatch)
+            cursors = KeysetCursors()
+            for page in (1, 2, 3, 2, 1):
+                paginator = KeysetPagination.paginate(
+                    query, page, 5, GlycopeptideMatch.ms2_score, GlycopeptideMatch.id, cursors)
+                self.assertEqual(paginator.total, 23)
+            self.assertEqual(len(counts), 1)
+
+            # The last page fixes the total without counting, even after rows are added
+            self.session.add(GlycopeptideMatch(
+                hypothesis_sample_match_id=self.hsm.id, protein_id=self.matched.id, ms2_score=0.))
+            self.session.commit()
+            paginator = KeysetPagination.paginate(
+                query, 5, 5, GlycopeptideMatch.ms2_score, GlycopeptideMatch.id, cursors)
+            self.assertEqual(paginator.total, 24)
+            self.assertEqual(len(counts), 1)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statements)
+
+    def test_score_seek_indices(self):
+        index_name = "ix_GlycopeptideMatch_score_seek"
+
+        def index_columns():
+            return {index['name']: index['column_names'] for index in inspect(
+                self.session.connection()).get_indexes("GlycopeptideMatch")}
+
+        self.assertEqual(index_columns()[index_name], ["hypothesis_sample_match_id", "ms2_score", "id"])
+        self.session.execute('DROP INDEX "%s"' % index_name)
+        self.session.commit()
+        self.assertNotIn(index_name, index_columns())
+        # Summarizing a result made before the index existed creates it
+        HypothesisSampleMatchProteinSummary.build(self.session, self.hsm.id)
+        self.assertIn(index_name, index_columns())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import pickle
+import unittest
+
+from glycresoft_sqlalchemy.structure.sequence import Sequence
+from glycresoft_sqlalchemy.structure.fragment import (
+    IonIdentifier, parse_ion_identifier, get_ion_identifier, ion_series_codes)
+from glycresoft_sqlalchemy.search_space_builder.glycopeptide_builder.utils import fragments
+from glycresoft_sqlalchemy.scoring import simple_scoring_algorithm
+
+
+glycopeptide = "YPVLN(NGlycanCoreGlycosylation)VTMPN(Deamidation)NGKFDK{Hex:9; HexNAc:2}"
+series_names = ["oxonium_ions", "bare_b_ions", "bare_y_ions",
+                "glycosylated_b_ions", "glycosylated_y_ions", "stub_ions"]
+
+
+class Match(object):
+    def __init__(self, sequence, ions):
+        self.glycopeptide_sequence = sequence
+        for name, series in zip(series_names, ions):
+            setattr(self, name, series)
+
+    def __len__(self):
+        return len(Sequence(self.glycopeptide_sequence))
+
+
+def strip_identifiers(ions):
+    return [{"key": ion["key"], "mass": ion["mass"]} for ion in ions]
+
+
+class TestIonIdentifiers(unittest.TestCase):
+    def setUp(self):
+        self.ions = fragments(Sequence(glycopeptide))
+
+    def test_parse_ion_identifier(self):
+        self.assertEqual(parse_ion_identifier("b5+HexNAc"), IonIdentifier(ion_series_codes["b"], 5, True, 1))
+        self.assertEqual(parse_ion_identifier("y12-NH3"), IonIdentifier(ion_series_codes["y"], 12, False, 1))
+        self.assertEqual(parse_ion_identifier("peptide+{Hex:3; HexNAc:2}").series,
+                         ion_series_codes["stub_glycopeptide"])
+        self.assertEqual(parse_ion_identifier("HexNAc").series, ion_series_codes["oxonium_ion"])
+
+    def test_fragment_identifiers_match_names(self):
+        for series in self.ions:
+            for ion in series:
+                self.assertEqual(ion["ion"], parse_ion_identifier(ion["key"]), ion["key"])
+                self.assertEqual(pickle.loads(pickle.dumps(ion["ion"])), ion["ion"])
+                self.assertEqual(get_ion_identifier(strip_identifiers([ion])[0]), ion["ion"])
+
+    def test_split_ion_list(self):
+        split = simple_scoring_algorithm.split_ion_list(sum(self.ions, []))
+        for name, series in zip(series_names, self.ions):
+            self.assertEqual(split[name], series)
+
+    def test_scores_without_identifiers(self):
+        matched = Match(glycopeptide, [series[::2] for series in self.ions])
+        legacy = Match(glycopeptide, [strip_identifiers(series[::2]) for series in self.ions])
+        theoretical = Match(glycopeptide, self.ions)
+        for scorer in (simple_scoring_algorithm.mean_coverage, simple_scoring_algorithm.mean_coverage2,
+                       simple_scoring_algorithm.compute_percent_uncovered):
+            self.assertAlmostEqual(scorer(matched), scorer(legacy))
+        self.assertAlmostEqual(
+            simple_scoring_algorithm.mean_hexnac_coverage(matched, theoretical),
+            simple_scoring_algorithm.mean_hexnac_coverage(legacy, theoretical))
+
+    def test_backbone_vectors(self):
+        length = len(Sequence(glycopeptide))
+        matched = Match(glycopeptide, [[], [{"key": "b3"}, {"key": "b1"}], [{"key": "y2"}], [], [], []])
+        b_ions, _, y_ions, _ = simple_scoring_algorithm.compute_backbone_vectors(matched)
+        self.assertEqual(list(b_ions), [1., 1., 1.] + [0.] * (length - 3))
+        self.assertEqual(list(y_ions), [0.] * (length - 1) + [1.])
+        b_ions, _, y_ions, _ = simple_scoring_algorithm.compute_backbone_vectors(
+            matched, simple_scoring_algorithm.incvec_spot)
+        self.assertEqual(list(b_ions.nonzero()[0]), [1, 3])
+        self.assertEqual(list(y_ions.nonzero()[0]), [length - 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
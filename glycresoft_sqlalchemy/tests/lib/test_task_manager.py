@@ -0,0 +1,168 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from multiprocessing import Manager
+
+from glycresoft_sqlalchemy.data_model import PipelineModule
+from glycresoft_sqlalchemy.web_app.task.task_process import (
+    TaskManager, Task, Message, NEW, RUNNING, ERROR, FINISHED, INTERACTIVE, BATCH)
+
+
+def report_pid(comm):
+    comm.send(Message(os.getpid(), "pid"))
+
+
+def wait_then_report(event, comm):
+    event.wait(30)
+    comm.send(Message(os.getpid(), "pid"))
+
+
+class CountingModule(PipelineModule):
+    def __init__(self, release):
+        self.release = release
+
+    def run(self):
+        for i in range(1, 4):
+            self.report_progress(i)
+        self.release.wait(30)
+        for i in range(4, 6):
+            self.report_progress(i)
+
+
+def count_progress(release, comm):
+    CountingModule(release).start(verbose=False)
+
+
+def fail(comm):
+    raise ValueError("Expected failure")
+
+
+def die(comm):
+    os._exit(3)
+
+
+class ManualTaskManager(TaskManager):
+    # Ticks are driven by the tests
+    interval = 3600
+
+
+class TestTaskManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = ManualTaskManager(self.directory, max_running=1, max_interactive=1, preload=())
+        self.subscription = self.manager.messages.subscribe()
+
+    def tearDown(self):
+        self.manager.terminate()
+        shutil.rmtree(self.directory)
+
+    def drain(self):
+        return [message for i, message in self.subscription.get(0)]
+
+    def run_until_done(self, tasks, timeout=30):
+        start = time.time()
+        messages = []
+        while any(task.state in (NEW, RUNNING) for task in tasks):
+            if time.time() - start > timeout:
+                raise AssertionError("Tasks did not finish: %r" % tasks)
+            self.manager.tick()
+            messages.extend(self.drain())
+            time.sleep(0.05)
+        messages.extend(self.drain())
+        return messages
+
+    def test_workers_are_reused(self):
+        tasks = [Task(report_pid, ()) for i in range(3)]
+        for task in tasks:
+            self.manager.add_task(task)
+        messages = self.run_until_done(tasks)
+        self.assertTrue(all(task.state == FINISHED for task in tasks))
+        pids = set(message.message for message in messages if message.type == "pid")
+        self.assertEqual(len([message for message in messages if message.type == "pid"]), 3)
+        self.assertEqual(len(pids), 1)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(len([message for message in messages if message.type == "task-complete"]), 3)
+
+    def test_interactive_tasks_are_not_blocked_by_batch_tasks(self):
+        sync = Manager()
+        release = sync.Event()
+        try:
+            # The batch tasks hold their worker until they are released
+            batch = [Task(wait_then_report, (release,), priority=BATCH) for i in range(2)]
+            interactive = Task(report_pid, (), priority=INTERACTIVE)
+            for task in batch + [interactive]:
+                self.manager.add_task(task)
+            self.run_until_done([interactive])
+            self.assertEqual(interactive.state, FINISHED)
+            self.assertEqual(sorted(task.state for task in batch), [NEW, RUNNING])
+            release.set()
+            self.run_until_done(batch)
+        finally:
+            release.set()
+            sync.shutdown()
+        self.assertTrue(all(task.state == FINISHED for task in batch + [interactive]))
+
+    def test_progress_from_concurrent_tasks(self):
+        sync = Manager()
+        release = sync.Event()
+        try:
+            tasks = [Task(count_progress, (release,), priority=BATCH),
+                     Task(count_progress, (release,), priority=INTERACTIVE)]
+            late = self.manager.messages.subscribe()
+            for task in tasks:
+                self.manager.add_task(task)
+            # Both tasks report progress while the other is still running
+            start = time.time()
+            seen = set()
+            while seen != set(task.id for task in tasks):
+                self.assertTrue(time.time() - start < 30)
+                self.manager.tick()
+                seen.update(message.source for message in self.drain() if message.type == "progress")
+                time.sleep(0.05)
+            self.assertTrue(all(task.state == RUNNING for task in tasks))
+            release.set()
+            self.run_until_done(tasks)
+        finally:
+            release.set()
+            sync.shutdown()
+        # Progress is attributed to the task which sent it and only the latest of each
+        # task is delivered in a batch
+        progress = [message for i, message in late.get(0) if message.type == "progress"]
+        self.assertEqual(sorted(message.source for message in progress), sorted(task.id for task in tasks))
+        for message in progress:
+            self.assertEqual(message.message["id"], message.source)
+            self.assertEqual(message.message["completed"], 5)
+            self.assertEqual(message.message["task"], "CountingModule")
+
+    def test_errors(self):
+        failing = Task(fail, ())
+        dying = Task(die, ())
+        self.manager.add_task(failing)
+        self.manager.add_task(dying)
+        messages = self.run_until_done([failing, dying])
+        self.assertEqual(failing.state, ERROR)
+        self.assertEqual(dying.state, ERROR)
+        self.assertTrue(any("Expected failure" in message.message for message in messages
+                            if message.type == "error"))
+        self.assertEqual(len([message for message in messages if message.type == "task-error"]), 2)
+        # The worker which died is replaced
+        after = Task(report_pid, ())
+        self.manager.add_task(after)
+        self.run_until_done([after])
+        self.assertEqual(after.state, FINISHED)
+
+    def test_unpicklable_tasks_run_in_their_own_process(self):
+        task = Task(report_pid, ())
+        task.task_fn = lambda comm: report_pid(comm)
+        self.manager.add_task(task)
+        messages = self.run_until_done([task])
+        self.assertEqual(task.state, FINISHED)
+        self.assertIsNotNone(task.process)
+        self.assertEqual([message.message for message in messages if message.type == "pid"],
+                         [task.process.pid])
+
+
+if __name__ == '__main__':
+    unittest.main()
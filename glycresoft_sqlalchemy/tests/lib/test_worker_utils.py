@@ -0,0 +1,56 @@
+import multiprocessing
+import unittest
+
+from glycresoft_sqlalchemy.utils.worker_utils import (
+    async_worker_pool, ResultCounter, WorkerPoolStatistics)
+
+
+class TestAsyncWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = multiprocessing.Pool(2)
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def test_collects_all_results(self):
+        counter = ResultCounter()
+        messages = []
+        statistics = async_worker_pool(
+            self.pool, (str(i) for i in range(2000)), int, counter,
+            reporter=lambda *args: messages.append(args), initial_load=50, maxload=200)
+        self.assertEqual(counter.n, sum(range(2000)))
+        self.assertEqual(statistics.completed, 2000)
+        self.assertEqual(statistics.failed, 0)
+        self.assertTrue(statistics.chunks < 2000)
+        self.assertEqual(len(messages), 1)
+
+    def test_failed_tasks_are_skipped(self):
+        results = []
+        statistics = async_worker_pool(self.pool, ["1", "x", "3"], int, results.append, reporter=lambda *a: None)
+        self.assertEqual(sorted(results), [1, 3])
+        self.assertEqual(statistics.completed, 2)
+        self.assertEqual(statistics.failed, 1)
+
+    def test_initial_chunks(self):
+        # Every item is dispatched before the first chunk completes, four chunks per worker
+        statistics = async_worker_pool(self.pool, range(40), abs, reporter=lambda *a: None)
+        self.assertEqual(statistics.completed, 40)
+        self.assertEqual(statistics.chunks, 8)
+        statistics = async_worker_pool(self.pool, range(40), abs, reporter=lambda *a: None, initial_chunk_size=20)
+        self.assertEqual(statistics.chunks, 2)
+
+    def test_chunk_size(self):
+        statistics = WorkerPoolStatistics()
+        self.assertEqual(statistics.chunk_size(0.5, 100), 1)
+        statistics.record(10, 0.1, 0.2)
+        self.assertEqual(statistics.chunk_size(0.5, 100), 50)
+        self.assertEqual(statistics.chunk_size(0.5, 20), 20)
+        statistics.record(1, 5., 5.)
+        self.assertEqual(statistics.chunk_size(0.5, 100), 1)
+        statistics.record(4, 1., 1., n_failed=3)
+        self.assertEqual((statistics.completed, statistics.failed), (12, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
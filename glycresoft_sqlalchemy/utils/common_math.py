@@ -35,6 +35,7 @@ except ImportError, e:
             self.id = peak.id
             self.charge = peak.charge
             self.intensity = peak.intensity
+            self.scan_peak_index = peak.scan_peak_index
             self.rank = 0
             self.peak_relations = []
 
@@ -1,69 +1,183 @@
-from sqlalchemy.orm import make_transient
-from .vendor import sqlitedict
+import numpy as np
 
-Incomplete = object()
+from sqlalchemy import func, select
+
+
+class KeyMapping(object):
+    '''
+    Maps the primary keys of rows copied from a source table to the keys they were
+    given in the target table.
+
+    Rows are copied in key order and given consecutive keys starting after the
+    largest key in the target, so each copy is stored as a sorted array of source keys
+    and the first target key, and a source key is translated by its rank.
+    '''
+    def __init__(self):
+        self.old_ids = []
+        self.bases = []
+
+    def add(self, old_ids, base):
+        self.old_ids.append(np.asarray(old_ids, dtype=np.int64))
+        self.bases.append(base)
+
+    def __len__(self):
+        return sum(map(len, self.old_ids))
+
+    def translate(self, values):
+        '''
+        Translate a sequence of source keys, passing `None` through.
+
+        Raises
+        ------
+        ValueError
+            If a key does not belong to a copied row
+        '''
+        values = list(values)
+        present = np.array([value is not None for value in values], dtype=bool)
+        keys = np.array([value if value is not None else -1 for value in values], dtype=np.int64)
+        result = np.full(len(keys), -1, dtype=np.int64)
+        found = ~present
+        for old_ids, base in zip(self.old_ids, self.bases):
+            if len(old_ids) == 0:
+                continue
+            rank = np.searchsorted(old_ids, keys)
+            hit = (rank < len(old_ids)) & (old_ids[np.minimum(rank, len(old_ids) - 1)] == keys) & present & ~found
+            result[hit] = base + rank[hit]
+            found |= hit
+        if not found.all():
+            raise ValueError("Relation not yet copied", [v for v, f in zip(values, found) if not f][:10])
+        return [int(new_id) if is_present else None for new_id, is_present in zip(result, present)]
+
+    def __getitem__(self, value):
+        return self.translate([value])[0]
 
 
 class Migrator(object):
+    '''
+    Copies rows of mapped classes between two sessions in bulk, rewriting primary and
+    foreign keys so the copies refer to one another in the target.
+
+    Each call to :meth:`copy_model` selects the keys of the rows to copy, assigns them
+    target keys by offset, and then streams each of the model's tables with
+    `fetchmany`, inserting each batch with a single executemany. Foreign keys are
+    translated through the :class:`KeyMapping` of the table they reference, so the
+    tables they reference must be copied first.
+
+    Attributes
+    ----------
+    key_mappings: dict
+        Maps table name to :class:`KeyMapping`
+    '''
     def __init__(self, source, target):
         self.source = source
         self.target = target
-        self.copy_register = sqlitedict.open()
+        self.key_mappings = {}
 
-    def find_foreign_keys(self, model):
-        fks = []
-        inherited_tables = set()
+    def inherited_tables(self, model):
+        tables = []
         for layer in model.mro():
             if not hasattr(layer, "__table__"):
                 break
-            inherited_tables.add(layer.__table__.name)
-            for fk in layer.__table__.foreign_keys:
-                fks.append(fk)
-        fks = [fk for fk in fks if fk.column.table.name not in inherited_tables]
-        return fks
-
-    def look_up_reference(self, fk, value):
-        if value is None:
-            return None
-        new_id = self.copy_register.get(str((fk.column.table.name, value)), Incomplete)
-        if new_id is Incomplete:
-            raise ValueError("Relation not yet copied", fk, value)
-        return new_id
-
-    def look_up_reference_for_instance(self, instance):
-        for klass in instance.__class__.mro():
-            if not hasattr(klass, "__tablename__"):
-                continue
-            new_id = self.copy_register.get(str((instance.__tablename__, instance.id)), Incomplete)
-            if new_id is Incomplete:
-                continue
-            return new_id
-        raise ValueError("Relation not yet copied", instance)
+            if layer.__table__ not in tables:
+                tables.append(layer.__table__)
+        return tables[::-1]
 
-    def set_reference(self, model, old_value, new_value):
-        for layer in model.mro():
-            if not hasattr(layer, "__table__"):
-                break
-            self.copy_register[str((layer.__table__.name, old_value))] = new_value
+    def descendant_tables(self, model):
+        # Rows selected as `model` may be instances of subclasses with their own tables
+        inherited = set(self.inherited_tables(model))
+        tables = []
+        for mapper in model.__mapper__.self_and_descendants:
+            table = mapper.local_table
+            if table not in inherited and table not in tables:
+                tables.append(table)
+        return tables
+
+    def _table_foreign_keys(self, table, local_tables):
+        return [fk for fk in table.foreign_keys if fk.column.table.name not in local_tables]
+
+    def _next_id(self, table):
+        max_id = self.target.execute(select([func.max(table.c.id)])).scalar()
+        return (max_id or 0) + 1
 
     def copy_model(self, model, filterfunc=lambda q: q, batch_size=10000):
-        fks = self.find_foreign_keys(model)
-        i = 0
-        with self.source.no_autoflush:
-            for ref in filterfunc(self.source.query(model)).yield_per(1000):
-                make_transient(ref)
+        '''
+        Copy the rows of `model` selected by `filterfunc` into the target session.
+
+        The model's tables are committed together, and their keys are added to
+        :attr:`key_mappings` only once every table has been inserted. If any table
+        fails, the target is rolled back and no mapping is recorded.
+
+        Parameters
+        ----------
+        model: type
+            A mapped class with an integer primary key `id`
+        filterfunc: callable
+            Applied to a :class:`Query` of `model` to select the rows to copy
+        batch_size: int
+            The number of rows read and inserted at a time
+
+        Returns
+        -------
+        int
+            The number of rows copied
+        '''
+        tables = self.inherited_tables(model)
+        root = tables[0]
+        selection = filterfunc(self.source.query(model)).with_entities(model.id)
+        old_ids = np.unique(np.fromiter((row[0] for row in selection.yield_per(batch_size)), dtype=np.int64))
+        if len(old_ids) == 0:
+            return 0
+
+        base = self._next_id(root)
+        mapping = KeyMapping()
+        mapping.add(old_ids, base)
+        tables = tables + self.descendant_tables(model)
+        try:
+            self._copy_tables(tables, selection, mapping, batch_size)
+        except Exception:
+            self.target.rollback()
+            raise
+        self.target.commit()
+        for table in tables:
+            self.key_mappings.setdefault(table.name, KeyMapping()).add(old_ids, base)
+        self._advance_sequence(root)
+        return len(old_ids)
+
+    def _copy_tables(self, tables, selection, mapping, batch_size):
+        local_tables = set(table.name for table in tables)
+        for table in tables:
+            fks = self._table_foreign_keys(table, local_tables)
+            results = self.source.execute(
+                table.select().where(table.c.id.in_(selection.statement)).order_by(table.c.id))
+            while True:
+                bunch = results.fetchmany(batch_size)
+                if len(bunch) == 0:
+                    break
+                rows = [dict(row) for row in bunch]
+                new_ids = mapping.translate([row["id"] for row in rows])
+                columns = {}
                 for fk in fks:
-                    value = getattr(ref, fk.parent.name)
-                    setattr(ref, fk.parent.name, self.look_up_reference(fk, value))
-                old_id = ref.id
-                ref.id = None
-                self.target.add(ref)
-                self.target.flush()
-                assert ref.id is not None
-                self.set_reference(model, old_id, ref.id)
-                i += 1
-                if i % batch_size == 0:
-                    self.target.commit()
+                    name = fk.parent.name
+                    values = [row[name] for row in rows]
+                    if any(value is not None for value in values):
+                        try:
+                            reference = self.key_mappings[fk.column.table.name]
+                        except KeyError:
+                            raise ValueError("Relation not yet copied", fk, values[0])
+                        columns[name] = reference.translate(values)
+                for i, row in enumerate(rows):
+                    row["id"] = new_ids[i]
+                    for name, values in columns.items():
+                        row[name] = values[i]
+                self.target.execute(table.insert(), rows)
+
+    def _advance_sequence(self, table):
+        # Keys were given explicitly, so a PostgreSQL serial sequence has not moved
+        if self.target.connection().dialect.name != "postgresql":
+            return
+        self.target.execute(
+            "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), (SELECT MAX(id) FROM \"%s\"))" % (
+                table.name, table.name))
         self.target.commit()
 
 
@@ -81,3 +195,4 @@ class MigrationPipeline(object):
         migrator = Migrator(self.source, self.target)
         for model, filterfunc in self.order:
             migrator.copy_model(model, filterfunc, self.batch_size)
+        return migrator
@@ -0,0 +1,161 @@
+'''
+Measure the resources used by a unit of pipeline work: wall and CPU time, peak
+resident memory, database rows written and read, and items processed.
+
+Rows written are counted automatically from the statements executed on engines
+passed to :func:`instrument_engine` in the measuring process while a
+:class:`Measurement` is active. Rows read cannot be observed without consuming query results, so they are
+reported by the code doing the reading through :meth:`Measurement.add`.
+'''
+import os
+import time
+import logging
+import cProfile
+
+from sqlalchemy import event
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger("instrumentation")
+
+
+_active_measurements = []
+
+
+def _count_rows_written(conn, cursor, statement, parameters, context, executemany):
+    if not _active_measurements or cursor.rowcount is None or cursor.rowcount < 0:
+        return
+    if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+        for measurement in _active_measurements:
+            measurement.rows_written += cursor.rowcount
+
+
+def instrument_engine(engine):
+    '''
+    Count the rows written through `engine` towards the active :class:`Measurement` objects
+    '''
+    if not event.contains(engine, "after_cursor_execute", _count_rows_written):
+        event.listen(engine, "after_cursor_execute", _count_rows_written)
+    return engine
+
+
+def resource_usage():
+    '''
+    Returns
+    -------
+    cpu_time: float
+        User and system time of this process, in seconds
+    child_cpu_time: float
+        User and system time of terminated child processes, such as the
+        workers of a closed :class:`multiprocessing.Pool`
+    peak_rss: int
+        The largest resident set size of this process so far, in kilobytes
+    '''
+    if resource is None:
+        return time.clock(), 0., 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (usage.ru_utime + usage.ru_stime, children.ru_utime + children.ru_stime,
+            usage.ru_maxrss)
+
+
+class Measurement(object):
+    '''
+    A context manager measuring the resources used by the block it wraps.
+
+    Attributes
+    ----------
+    name: str
+    wall_time: float
+    cpu_time: float
+        CPU time of this process spent in the block
+    child_cpu_time: float
+        CPU time of child processes which terminated during the block
+    peak_rss: int
+        High-water mark of this process' resident set size when the block ended,
+        in kilobytes
+    rows_read: int
+    rows_written: int
+    items: int
+        Number of work items processed, as reported by :meth:`add`
+    profile_path: str or None
+        Where :mod:`cProfile` statistics were written, if a profile directory was given
+    '''
+    def __init__(self, name, profile_directory=None):
+        self.name = name
+        self.profile_directory = profile_directory
+        self.profile_path = None
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.child_cpu_time = 0.
+        self.peak_rss = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.items = 0
+        self.started = None
+        self._profiler = None
+
+    def add(self, items=0, rows_read=0, rows_written=0):
+        self.items += items
+        self.rows_read += rows_read
+        self.rows_written += rows_written
+
+    @property
+    def items_per_second(self):
+        if self.wall_time == 0:
+            return 0.
+        return self.items / self.wall_time
+
+    def __enter__(self):
+        self.started = time.time()
+        self._start_usage = resource_usage()
+        _active_measurements.append(self)
+        if self.profile_directory is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile_path = os.path.join(self.profile_directory, "%s-%d.prof" % (
+                self.name, int(self.started * 1000)))
+            try:
+                self._profiler.dump_stats(self.profile_path)
+            except IOError, e:
+                logger.exception("Could not write profile of %s", self.name, exc_info=e)
+                self.profile_path = None
+            self._profiler = None
+        _active_measurements.remove(self)
+        cpu_time, child_cpu_time, peak_rss = resource_usage()
+        start_cpu_time, start_child_cpu_time, _ = self._start_usage
+        self.wall_time = time.time() - self.started
+        self.cpu_time = cpu_time - start_cpu_time
+        self.child_cpu_time = child_cpu_time - start_child_cpu_time
+        self.peak_rss = peak_rss
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "child_cpu_time": self.child_cpu_time,
+            "peak_rss": self.peak_rss,
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "items": self.items,
+            "items_per_second": self.items_per_second,
+            "profile_path": self.profile_path,
+        }
+
+    def __str__(self):
+        return ("%s: %0.2fs wall, %0.2fs CPU (%0.2fs in workers), peak RSS %dkB, "
+                "%d rows read, %d rows written, %d items at %0.2f/s") % (
+            self.name, self.wall_time, self.cpu_time, self.child_cpu_time, self.peak_rss,
+            self.rows_read, self.rows_written, self.items, self.items_per_second)
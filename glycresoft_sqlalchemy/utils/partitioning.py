@@ -0,0 +1,90 @@
+'''
+Group work items into batches of similar estimated cost so that a pool of
+workers pulling batches from a shared queue finishes at about the same time.
+'''
+import numpy as np
+
+
+def window_counts(sorted_masses, query_masses, tolerance, weights=None):
+    '''
+    For each of `query_masses`, count the entries of `sorted_masses` within
+    `tolerance` ppm of it, or sum their `weights` if given.
+
+    Parameters
+    ----------
+    sorted_masses : np.ndarray
+        Ascending masses to count
+    query_masses : np.ndarray
+    tolerance : float
+    weights : np.ndarray, optional
+        Parallel to `sorted_masses`
+
+    Returns
+    -------
+    np.ndarray
+    '''
+    sorted_masses = np.asarray(sorted_masses, dtype=float)
+    query_masses = np.asarray(query_masses, dtype=float)
+    width = query_masses * tolerance
+    lower = np.searchsorted(sorted_masses, query_masses - width, 'left')
+    upper = np.searchsorted(sorted_masses, query_masses + width, 'right')
+    if weights is None:
+        return upper - lower
+    cumulative = np.concatenate(([0.], np.cumsum(weights, dtype=float)))
+    return cumulative[upper] - cumulative[lower]
+
+
+def cost_balanced_batches(items, costs, n_workers, max_batch_size=500, granularity=4, minimum_cost=None):
+    '''
+    Partition `items` into batches using guided self-scheduling over items in
+    descending order of cost.
+
+    Each batch is filled up to a target cost of the remaining cost divided by
+    ``granularity * n_workers``, so early batches are large and the batches near
+    the end are small. A worker which finishes early takes the next small batch
+    instead of waiting on a straggler. Expensive items are handed out first, so
+    no expensive item is left for the end of the run.
+
+    Parameters
+    ----------
+    items : Sequence
+    costs : Sequence of float
+        Estimated cost of each item, parallel to `items`
+    n_workers : int
+    max_batch_size : int
+        No batch holds more items than this
+    granularity : int
+        Batches per worker over the remaining work. Higher values give smaller,
+        better balanced batches at the price of more dispatch overhead
+    minimum_cost : float, optional
+        Batches are never targeted below this cost. Defaults to the mean item cost
+
+    Yields
+    ------
+    list
+        A batch of `items`
+    '''
+    costs = np.asarray(costs, dtype=float)
+    if len(costs) == 0:
+        return
+    order = np.argsort(-costs, kind='mergesort')
+    remaining = costs.sum()
+    if minimum_cost is None:
+        minimum_cost = remaining / len(costs)
+    divisor = float(max(1, granularity * n_workers))
+
+    batch = []
+    batch_cost = 0.
+    target = max(minimum_cost, remaining / divisor)
+    for index in order:
+        cost = costs[index]
+        if batch and (batch_cost + cost > target or len(batch) >= max_batch_size):
+            yield batch
+            remaining -= batch_cost
+            batch = []
+            batch_cost = 0.
+            target = max(minimum_cost, remaining / divisor)
+        batch.append(items[index])
+        batch_cost += cost
+    if batch:
+        yield batch
@@ -1,7 +1,10 @@
 import os
 import uuid
 import time
+import Queue
 import logging
+import itertools
+import traceback
 try:
     logger = logging.getLogger("worker_utils")
 except:
@@ -25,57 +28,221 @@ except:
 IS_PROFILE = True
 
 
+class TaskFailure(object):
+    '''
+    Stands in for the result of a task which raised an exception in a worker
+    process, carrying the formatted traceback back to the parent process.
+    '''
+    def __init__(self, item, error, formatted_traceback):
+        self.item = item
+        self.error = error
+        self.formatted_traceback = formatted_traceback
+
+    def __repr__(self):
+        return "TaskFailure(%r, %s)" % (self.item, self.error)
+
+
+class ChunkRunner(object):
+    '''
+    Applies `task_fn` to every item of a chunk inside a worker process, timing
+    the whole chunk so the dispatcher can adjust its chunk size.
+    '''
+    def __init__(self, task_fn):
+        self.task_fn = task_fn
+
+    def __call__(self, chunk, token):
+        start = time.time()
+        results = []
+        for item in chunk:
+            try:
+                results.append(self.task_fn(item))
+            except Exception, e:
+                results.append(TaskFailure(repr(item)[:200], repr(e), traceback.format_exc()))
+        return results, time.time() - start, token
+
+
+class WorkerPoolStatistics(object):
+    '''
+    Running throughput and latency measurements of :func:`async_worker_pool`.
+
+    Attributes
+    ----------
+    completed : int
+        Number of tasks whose results have been collected, not counting failures
+    failed : int
+        Number of tasks which raised an exception
+    task_time : float
+        Exponentially weighted mean of the time a worker spends on one task
+    latency : float
+        Exponentially weighted mean of the time from submitting a chunk to
+        collecting its results
+    '''
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.start_time = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.chunks = 0
+        self.task_time = None
+        self.latency = None
+        self.max_latency = 0.
+
+    def _smooth(self, current, value):
+        if current is None:
+            return value
+        return (1 - self.smoothing) * current + self.smoothing * value
+
+    def record(self, n_tasks, elapsed, latency, n_failed=0):
+        self.chunks += 1
+        self.completed += n_tasks - n_failed
+        self.failed += n_failed
+        if n_tasks:
+            self.task_time = self._smooth(self.task_time, elapsed / n_tasks)
+        self.latency = self._smooth(self.latency, latency)
+        self.max_latency = max(self.max_latency, latency)
+
+    def throughput(self):
+        elapsed = time.time() - self.start_time
+        if elapsed == 0:
+            return 0.
+        return self.completed / elapsed
+
+    def chunk_size(self, target_chunk_time, max_chunk_size):
+        '''
+        The number of tasks expected to take about `target_chunk_time` seconds
+        '''
+        if not self.task_time:
+            return max_chunk_size if self.task_time == 0 else 1
+        return int(max(1, min(max_chunk_size, target_chunk_time / self.task_time)))
+
+    def __str__(self):
+        return ("%d tasks completed (%d failed) in %d chunks, %0.2f tasks/s, "
+                "mean task time %0.4fs, mean latency %0.2fs, max latency %0.2fs") % (
+            self.completed, self.failed, self.chunks, self.throughput(),
+            self.task_time or 0., self.latency or 0., self.max_latency)
+
+
 def async_worker_pool(worker_pool, work_stream, task_fn, result_callback=None,
                       logger=logger, update_window=30, initial_load=1500,
-                      maxload=10000):
+                      maxload=10000, reporter=None, target_chunk_time=0.5,
+                      max_chunk_size=100, initial_chunk_size=None):
+    '''
+    Apply `task_fn` to every item of `work_stream` on `worker_pool`, passing each
+    result to `result_callback` in the parent process in the order tasks complete.
+
+    Items are sent to the workers in chunks. Until the first chunk completes, the
+    first `initial_load` items are divided evenly into four chunks per worker, as
+    :meth:`multiprocessing.pool.Pool.map` does. After that, chunks are sized so each
+    takes about `target_chunk_time` seconds, as measured on completed chunks. At most `maxload` items are in flight at once. Completed
+    chunks are delivered through :meth:`multiprocessing.pool.Pool.apply_async`
+    callbacks, so the dispatcher sleeps until any chunk finishes rather than
+    polling tasks in submission order.
 
+    Parameters
+    ----------
+    worker_pool : multiprocessing.Pool
+    work_stream : Iterable
+    task_fn : callable
+        Must be picklable
+    result_callback : callable, optional
+        Defaults to a :class:`ResultCounter`
+    logger : logging.Logger
+    update_window : float
+        Report progress at least this often, in seconds
+    initial_load : int
+        Number of items to dispatch before the first result is collected
+    maxload : int
+        Upper bound on the number of items in flight
+    reporter : callable, optional
+        Receives progress and statistics messages as `logging`-style arguments,
+        for example :meth:`PipelineModule.inform`. Defaults to `logger.info`
+    target_chunk_time : float
+    max_chunk_size : int
+    initial_chunk_size : int, optional
+        The size of the chunks sent before any have completed
+
+    Returns
+    -------
+    WorkerPoolStatistics
+    '''
     if result_callback is None:
         result_callback = ResultCounter()
+    if reporter is None:
+        reporter = logger.info
     logger.info("async_worker_pool starting")
-    work_queue = []
-    work_loader = (work_queue.append(worker_pool.apply_async(task_fn, [item])) for item in work_stream)
+
+    runner = ChunkRunner(task_fn)
+    completed = Queue.Queue()
+    # Chunks awaiting results, keyed by a submission counter
+    pending = {}
+    counter = itertools.count()
+    statistics = WorkerPoolStatistics()
+    load = min(initial_load, maxload)
+    work_stream = iter(work_stream)
+    if initial_chunk_size is None:
+        initial_items = list(itertools.islice(work_stream, load))
+        work_stream = itertools.chain(initial_items, work_stream)
+        n_workers = getattr(worker_pool, "_processes", 1)
+        initial_chunk_size = min(max_chunk_size, len(initial_items) // (4 * n_workers))
+    chunk_size = max(1, initial_chunk_size)
     work_left = True
-    for i in range(initial_load):
+    in_flight = 0
+    timer = time.time()
+
+    while True:
+        while work_left and in_flight < load:
+            chunk = list(itertools.islice(work_stream, min(chunk_size, load - in_flight)))
+            if not chunk:
+                work_left = False
+                break
+            token = next(counter)
+            pending[token] = (worker_pool.apply_async(
+                runner, (chunk, token), callback=completed.put), len(chunk), time.time())
+            in_flight += len(chunk)
+        load = maxload
+
+        if in_flight == 0:
+            break
+
         try:
-            work_loader.next()
-        except StopIteration:
-            work_left = False
-
-    last_length = len(work_queue)
-    begin_time = timer = time.time()
-    elapsed = False
-
-    job_completion_counter = 0
-
-    while len(work_queue) > 0 or work_left:
-        next_round = []
-        for i in range(len(work_queue)):
-            task = work_queue[i]
-            task.wait(0.1)
-            if task.ready():
-                try:
-                    if task.ready():
-                        result_callback(task.get())
-                        job_completion_counter += 1
-                except Exception, e:
-                    logger.exception("An error occurred", exc_info=e)
-            else:
-                next_round.append(task)
-        work_queue = next_round
-        elapsed = (time.time() - timer) > update_window
-        if last_length != len(work_queue) or elapsed:
-            last_length = len(work_queue)
-            logger.info("%d tasks remaining (%d completed)", last_length, job_completion_counter)
+            results, elapsed, token = completed.get(timeout=min(update_window, 1.))
+        except Queue.Empty:
+            # A chunk which failed outside of its tasks, for instance because its
+            # arguments could not be pickled, never invokes its callback
+            for token, (async_result, n_tasks, submitted_at) in pending.items():
+                if async_result.ready() and not async_result.successful():
+                    try:
+                        async_result.get()
+                    except Exception, e:
+                        logger.exception("An error occurred", exc_info=e)
+                    del pending[token]
+                    in_flight -= n_tasks
+                    statistics.failed += n_tasks
+            if (time.time() - timer) > update_window:
+                reporter("%d tasks in flight. %s", in_flight, statistics)
+                timer = time.time()
+            continue
+
+        async_result, n_tasks, submitted_at = pending.pop(token)
+        in_flight -= n_tasks
+        n_failed = sum(1 for result in results if isinstance(result, TaskFailure))
+        statistics.record(n_tasks, elapsed, time.time() - submitted_at, n_failed)
+        for result in results:
+            if isinstance(result, TaskFailure):
+                logger.error("An error occurred processing %s\n%s", result.item, result.formatted_traceback)
+                continue
+            try:
+                result_callback(result)
+            except Exception, e:
+                logger.exception("An error occurred", exc_info=e)
+        chunk_size = statistics.chunk_size(target_chunk_time, max_chunk_size)
+
+        if (time.time() - timer) > update_window:
+            reporter("%d tasks in flight. %s", in_flight, statistics)
             timer = time.time()
-        if len(work_queue) < maxload:
-            for i in range(initial_load):
-                try:
-                    work_loader.next()
-                except StopIteration:
-                    work_left = False
-
-    end_time = time.time()
-    logger.info("Time elapsed: %0.2fs", (end_time - begin_time))
+
+    reporter("async_worker_pool finished. %s", statistics)
+    return statistics
 
 
 class ResultCounter(object):
@@ -132,7 +132,7 @@ def branch_ms1_ms2():
 @app.route('/internal/shutdown', methods=['POST'])
 def shutdown():
     g.manager.halting = True
-    g.manager.stoploop()
+    g.manager.terminate()
     SERVER.shutdown_server()
     return Response("Should be dead")
 
@@ -1,24 +1,24 @@
 import json
-import random
 import logging
 
 from flask import Response, Blueprint, g, request
 
-from glycresoft_sqlalchemy.web_app.task.task_process import QueueEmptyException, Message
+from glycresoft_sqlalchemy.web_app.task.task_process import Message
 
 
 server_sent_events = Blueprint("server_sent_events", __name__)
 
 
-def message_queue_stream(manager):
+def message_queue_stream(manager, cursor=None, keepalive=5., linger=0.2):
     """Implement a simple Server Side Event (SSE) stream based on the
-    stream of events emit from the :attr:`TaskManager.messages` queue of `manager`.
+    stream of events published on the :attr:`TaskManager.messages` bus of `manager`.
 
     These messages are handled on the client side.
 
-    At the moment, messages are not "addressed" to a particular recipient. If multiple users
-    are connected at once, who receives which message is undefined. A solution to this would
-    be to create labeled queues, but this requires a user identification system.
+    Each stream reads the bus through its own subscription, so every connected client
+    receives every message. Event ids are bus sequence numbers, so a client reconnecting
+    with a `Last-Event-ID` resumes where it left off. Bursts of progress messages are
+    collected for `linger` seconds and only the latest of each is sent.
 
     Yields
     ------
@@ -29,32 +29,35 @@ def message_queue_stream(manager):
     [1] - http://stackoverflow.com/questions/12232304/how-to-implement-server-push-in-flask-framework
     """
     payload = 'id: {id}\nevent: {event_name}\ndata: {data}\n\n'
-    i = 0
-    yield payload.format(id=i, event_name='begin-stream', data=json.dumps('Starting Stream'))
-    yield payload.format(id=i - 1, event_name='update', data=json.dumps('Initialized'))
-    i += 1
-    while not manager.halting:
+    subscription = manager.messages.subscribe(cursor)
+    yield payload.format(id=subscription.cursor, event_name='begin-stream', data=json.dumps('Starting Stream'))
+    yield payload.format(id=subscription.cursor, event_name='update', data=json.dumps('Initialized'))
+    while not manager.halting and not subscription.closed:
         try:
-            message = manager.messages.get(True, 1)
-            event = payload.format(
-                id=i, event_name=message.type,
-                data=json.dumps(message.message))
-            i += 1
-            print message, event
-            yield event
+            events = subscription.get(keepalive, linger)
+            if not events:
+                # Send a comment to keep the connection alive
+                yield payload.format(id=subscription.cursor, event_name='tick', data=json.dumps('Tick'))
+            for i, message in events:
+                yield payload.format(
+                    id=i, event_name=message.type,
+                    data=json.dumps(message.message))
         except KeyboardInterrupt:
             break
-        except QueueEmptyException, e:
-            # Send a comment to keep the connection alive
-            if random.random() > 0.7:
-                yield payload.format(id=i, event_name='tick', data=json.dumps('Tick'))
         except Exception, e:
             logging.exception("An error occurred in message_queue_stream", exc_info=e)
 
 
+def last_event_id():
+    try:
+        return int(request.headers.get("Last-Event-ID"))
+    except (TypeError, ValueError):
+        return None
+
+
 @server_sent_events.route('/stream')
 def message_stream():
-    return Response(message_queue_stream(g.manager),
+    return Response(message_queue_stream(g.manager, last_event_id()),
                     mimetype="text/event-stream")
 
 
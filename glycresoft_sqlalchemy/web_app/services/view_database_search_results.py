@@ -2,16 +2,15 @@ from flask import request, g, render_template, Response, Blueprint, jsonify
 
 from glycresoft_sqlalchemy.data_model import (
     HypothesisSampleMatch, GlycopeptideMatch, PeakGroupMatchType, Protein,
-    MS1GlycopeptideHypothesisSampleMatch, TheoreticalGlycopeptide,
+    MS1GlycopeptideHypothesisSampleMatch, HypothesisSampleMatchProteinSummary,
     MS1GlycanHypothesisSampleMatch, TheoreticalGlycopeptideComposition, func)
 
 from glycresoft_sqlalchemy.report import analysis_comparison
 from glycresoft_sqlalchemy.report import microheterogeneity
-from glycresoft_sqlalchemy.web_app.utils.pagination import paginate
+from glycresoft_sqlalchemy.web_app.utils.pagination import KeysetPagination, KeysetCursors
 from glycresoft_sqlalchemy.web_app.report import svg_plot
 from glycresoft_sqlalchemy.web_app.utils.state_transfer import request_arguments_and_context, MonosaccharideFilterSet
 from glycresoft_sqlalchemy.web_app.utils.cache import CachablePartialFunction, ApplicationDataCache
-from glycresoft_sqlalchemy.web_app.services import peptide_match_table
 
 view_database_search_results = Blueprint("view_database_search_results", __name__)
 
@@ -19,6 +18,16 @@ app = view_database_search_results
 
 microheterogeneity_summary_cache = ApplicationDataCache()
 protein_table_cache = ApplicationDataCache(1000)
+pagination_cursor_cache = ApplicationDataCache(500)
+
+
+def pagination_cursors(key):
+    try:
+        return pagination_cursor_cache[key]
+    except KeyError:
+        cursors = KeysetCursors()
+        pagination_cursor_cache[key] = cursors
+        return cursors
 
 
 @app.route("/view_database_search_results/<int:id>", methods=["POST"])
@@ -49,37 +58,38 @@ def view_tandem_glycopeptide_protein_results_filter_context(
             GlycopeptideMatch.ms2_score > minimum_score), monosaccharide_filters)
 
 
-def protein_table_data_composer_ms2(session, hypothesis_id, hypothesis_sample_match_id, filter_context=lambda q: q):
+def protein_table_from_summary(session, hypothesis_sample_match_id, filtered_match_counts):
+    """Combine the precomputed per-protein summary of a search with the match
+    counts that pass the current filters.
+    """
     table = dict()
+    summaries = HypothesisSampleMatchProteinSummary.for_hypothesis_sample_match(
+        session, hypothesis_sample_match_id)
+    for summary, protein in summaries.join(Protein).add_entity(Protein):
+        table[protein.id] = {
+            "protein": protein,
+            "theoretical_count": summary.theoretical_count,
+            "match_count": 0,
+            "best_score": summary.best_score,
+            "coverage": summary.coverage
+        }
+
+    for protein_id, match_count in filtered_match_counts:
+        if protein_id in table:
+            table[protein_id]['match_count'] = match_count
 
+    return sorted(table.values(), key=lambda x: x['theoretical_count'], reverse=True)
+
+
+def protein_table_data_composer_ms2(session, hypothesis_id, hypothesis_sample_match_id, filter_context=lambda q: q):
     q = session.query(
-        Protein, func.count(GlycopeptideMatch.id)).join(
+        Protein.id, func.count(GlycopeptideMatch.id)).join(
         GlycopeptideMatch).filter(
         GlycopeptideMatch.hypothesis_sample_match_id == hypothesis_sample_match_id,
         Protein.hypothesis_id == hypothesis_id).group_by(
         Protein.id)
 
-    glycopeptide_match_counts = filter_context(q).all()
-
-    theoretical_sequence_counts = session.query(
-        Protein, func.count(TheoreticalGlycopeptide.id)).join(
-        TheoreticalGlycopeptide).filter(
-        Protein.hypothesis_id == hypothesis_id).group_by(
-        Protein.id).all()
-
-    for protein, theoretical_count in theoretical_sequence_counts:
-        if theoretical_count == 0:
-            continue
-        table[protein.id] = {
-            "protein": protein,
-            "theoretical_count": theoretical_count,
-            "match_count": 0
-        }
-
-    for protein, match_count in glycopeptide_match_counts:
-        table[protein.id]['match_count'] = match_count
-
-    return sorted(table.values(), key=lambda x: x['theoretical_count'], reverse=True)
+    return protein_table_from_summary(session, hypothesis_sample_match_id, filter_context(q))
 
 
 def view_tandem_glycopeptide_database_search_results(id):
@@ -166,10 +176,10 @@ def view_glycopeptide_table_partial(protein_id, page):
         monosaccharide_filters=monosaccharide_filters
         )
 
-    paginator = paginate(
-        filter_context(
-            protein.glycopeptide_matches).order_by(
-            GlycopeptideMatch.ms2_score.desc()), page, 50)
+    paginator = KeysetPagination.paginate(
+        filter_context(protein.glycopeptide_matches), page, 50,
+        GlycopeptideMatch.ms2_score, GlycopeptideMatch.id,
+        pagination_cursors(("glycopeptide_match_table", protein_id, filter_context)))
 
     return render_template(
         "tandem_glycopeptide_search/components/glycopeptide_match_table.templ",
@@ -270,32 +280,27 @@ def view_composition_database_search_results(id):
 # ----------------------------------------------------------------------
 
 
-def render_glycopeptide_composition_database_search_results(hsm, hypothesis_sample_match_id):
-    print "Begin render_glycopeptide_composition_database_search_results", hsm, hypothesis_sample_match_id
-    arguments, context = request_arguments_and_context(request)
-
-    monosaccharide_filters = context.monosaccharide_filters
-    minimum_score = context.minimum_ms1_score
+def view_composition_glycopeptide_results_filter_context(
+        q, hypothesis_sample_match_id, minimum_score, monosaccharide_filters):
+    q = TheoreticalGlycopeptideComposition.glycan_composition_filters(q, monosaccharide_filters)
+    return q.filter(
+        PeakGroupMatchType.hypothesis_sample_match_id == hypothesis_sample_match_id,
+        PeakGroupMatchType.ms1_score > minimum_score)
 
-    results_type = hsm.results_type
-    theoretical_type, generator = hsm.results().next()
 
-    print "Filter Context", minimum_score, hypothesis_sample_match_id, monosaccharide_filters
+def render_glycopeptide_composition_database_search_results(hsm, hypothesis_sample_match_id):
+    arguments, context = request_arguments_and_context(request)
 
-    def filter_context(q):
-        q = theoretical_type.glycan_composition_filters(q, monosaccharide_filters)
-        return q.filter(
-            results_type.hypothesis_sample_match_id == hypothesis_sample_match_id,
-            results_type.ms1_score > minimum_score)
+    filter_context = CachablePartialFunction(
+        view_composition_glycopeptide_results_filter_context,
+        hypothesis_sample_match_id=hypothesis_sample_match_id,
+        minimum_score=float(context.minimum_ms1_score),
+        monosaccharide_filters=context.monosaccharide_filters
+        )
 
-    print "Begin Table Building"
-    # protein_table = protein_table_data_composer_ms1(g.db, hsm.target_hypothesis_id, hsm.id, filter_context)
-    protein_table = peptide_match_table.GlycopeptideCompositionProteinAssociationTable(
-        g.db, hsm.target_hypothesis_id, hsm.id, filter_context)
+    protein_table = protein_table_data_composer_ms1(g.db, hsm.target_hypothesis_id, hsm.id, filter_context)
     protein_table_cache[hypothesis_sample_match_id] = protein_table
 
-    print(protein_table.as_table())
-
     return render_template(
         "glycopeptide_peak_group_search/view_database_search_results.templ",
         hsm=hsm,
@@ -304,10 +309,8 @@ def render_glycopeptide_composition_database_search_results(hsm, hypothesis_samp
 
 
 def protein_table_data_composer_ms1(session, hypothesis_id, hypothesis_sample_match_id, filter_context=lambda q: q):
-    table = dict()
-
     q = session.query(
-        Protein, func.count(PeakGroupMatchType.id)).join(
+        Protein.id, func.count(PeakGroupMatchType.id)).join(
         TheoreticalGlycopeptideComposition).join(
         PeakGroupMatchType,
         PeakGroupMatchType.theoretical_match_id == TheoreticalGlycopeptideComposition.id).filter(
@@ -315,27 +318,7 @@ def protein_table_data_composer_ms1(session, hypothesis_id, hypothesis_sample_ma
         Protein.hypothesis_id == hypothesis_id).group_by(
         Protein.id)
 
-    glycopeptide_match_counts = filter_context(q).all()
-
-    theoretical_sequence_counts = session.query(
-        Protein, func.count(TheoreticalGlycopeptideComposition.id)).join(
-        TheoreticalGlycopeptideComposition).filter(
-        Protein.hypothesis_id == hypothesis_id).group_by(
-        Protein.id).all()
-
-    for protein, theoretical_count in theoretical_sequence_counts:
-        if theoretical_count == 0:
-            continue
-        table[protein.id] = {
-            "protein": protein,
-            "theoretical_count": theoretical_count,
-            "match_count": 0
-        }
-
-    for protein, match_count in glycopeptide_match_counts:
-        table[protein.id]['match_count'] = match_count
-
-    return sorted(table.values(), key=lambda x: x['theoretical_count'], reverse=True)
+    return protein_table_from_summary(session, hypothesis_sample_match_id, filter_context(q))
 
 
 @app.route("/view_database_search_results/protein_composition_view/<int:id>", methods=["POST"])
@@ -354,23 +337,22 @@ def view_composition_glycopeptide_table_partial(protein_id, page):
     arguments, context = request_arguments_and_context(request)
     hypothesis_sample_match_id = context.hypothesis_sample_match_id
 
-    print("view_composition_glycopeptide_table_partial", page, protein_id)
-    # hsm = g.db.query(HypothesisSampleMatch).get(hypothesis_sample_match_id)
-
-    # monosaccharide_filters = context.monosaccharide_filters
-    # minimum_score = context.minimum_ms1_score
+    filter_context = CachablePartialFunction(
+        view_composition_glycopeptide_results_filter_context,
+        hypothesis_sample_match_id=hypothesis_sample_match_id,
+        minimum_score=float(context.minimum_ms1_score),
+        monosaccharide_filters=context.monosaccharide_filters
+        )
 
-    # def filter_context(q):
-    #     results_type = hsm.results_type
-    #     theoretical_type, generator = hsm.results().next()
-    #     q = theoretical_type.glycan_composition_filters(q, monosaccharide_filters)
-    #     return q.filter(
-    #         results_type.hypothesis_sample_match_id == hypothesis_sample_match_id,
-    #         results_type.ms1_score > minimum_score)
+    query = filter_context(g.db.query(PeakGroupMatchType).join(
+        TheoreticalGlycopeptideComposition,
+        PeakGroupMatchType.theoretical_match_id == TheoreticalGlycopeptideComposition.id).filter(
+        PeakGroupMatchType.theoretical_match_type == u"TheoreticalGlycopeptideComposition",
+        TheoreticalGlycopeptideComposition.protein_id == protein_id))
 
-    table = protein_table_cache[hypothesis_sample_match_id]
-    table.proxy(g.db)
-    paginator = table.paginate(protein_id, page, per_page=50)
+    paginator = KeysetPagination.paginate(
+        query, page, 50, PeakGroupMatchType.ms1_score, PeakGroupMatchType.id,
+        pagination_cursors(("glycopeptide_composition_match_table", protein_id, filter_context)))
 
     return render_template(
         "glycopeptide_peak_group_search/components/glycopeptide_match_table.templ",
@@ -436,10 +418,9 @@ def view_composition_glycan_table_partial(page):
     hsm = g.db.query(HypothesisSampleMatch).get(hypothesis_sample_match_id)
 
     parameters = request.get_json()
-    print parameters
-    print page
 
-    monosaccharide_filters = parameters['settings'].get("monosaccharide_filters", {})
+    monosaccharide_filters = MonosaccharideFilterSet.fromdict(
+        parameters['settings'].get("monosaccharide_filters", {}))
     minimum_score = float(parameters['settings'].get("minimum_ms1_score", 0.2))
 
     def filter_context(q):
@@ -451,10 +432,12 @@ def view_composition_glycan_table_partial(page):
             results_type.hypothesis_sample_match_id == hypothesis_sample_match_id,
             results_type.ms1_score > minimum_score)
 
-    paginator = paginate(
-        filter_context(
-            hsm.peak_group_matches).order_by(
-            PeakGroupMatchType.ms1_score.desc()), page, 50)
+    paginator = KeysetPagination.paginate(
+        filter_context(hsm.peak_group_matches), page, 50,
+        PeakGroupMatchType.ms1_score, PeakGroupMatchType.id,
+        pagination_cursors((
+            "glycan_composition_match_table", hypothesis_sample_match_id, minimum_score,
+            monosaccharide_filters)))
 
     return render_template(
         "view_glycan_peak_group_search_results/components/glycan_composition_match_table.templ",
@@ -1,10 +1,14 @@
 from glycresoft_sqlalchemy.data_model import session, HypothesisSampleMatch
 from glycresoft_sqlalchemy.report import export_csv
 
-from .task_process import NullPipe, Message, Task
+from .task_process import NullPipe, Message, Task, INTERACTIVE
 
 
-def taskmain(database_path, hypothesis_sample_match_id, filterfunc=lambda q: q,
+def identity(q):
+    return q
+
+
+def taskmain(database_path, hypothesis_sample_match_id, filterfunc=identity,
              tempdir=None, comm=NullPipe(), **kwargs):
     comm.send(Message("Begin CSV export", type='info'))
     job = export_csv.CSVExportDriver(
@@ -18,7 +22,9 @@ def taskmain(database_path, hypothesis_sample_match_id, filterfunc=lambda q: q,
 
 
 class ExportCSVTask(Task):
-    def __init__(self, database_path, hypothesis_sample_match_id, filterfunc=lambda q: q,
+    priority = INTERACTIVE
+
+    def __init__(self, database_path, hypothesis_sample_match_id, filterfunc=identity,
                  tempdir=None, **kwargs):
         args = (database_path, hypothesis_sample_match_id, filterfunc, tempdir)
         hsm_name = session(database_path).query(HypothesisSampleMatch).get(hypothesis_sample_match_id).name
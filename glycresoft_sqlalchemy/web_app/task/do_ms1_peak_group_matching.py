@@ -1,12 +1,11 @@
 from glycresoft_sqlalchemy.data_model import (
     DatabaseManager, Hypothesis, Protein, TheoreticalGlycopeptideComposition,
-    MS1GlycopeptideHypothesisSampleMatch, SampleRun, make_transient, MassShift)
+    MS1GlycopeptideHypothesisSampleMatch, make_transient, MassShift)
 
 from glycresoft_sqlalchemy.matching.peak_grouping import (
     LCMSPeakClusterSearch)
 
 import os
-import pickle
 
 from .task_process import NullPipe, Message, Task
 
@@ -39,28 +38,28 @@ class CommunicativeLCMSPeakClusterSearch(LCMSPeakClusterSearch):
             maximum_mass=maximum_mass, skip_grouping=skip_grouping, **kwargs)
         self.comm = comm
 
-    def run(self):
+    def do_grouping(self):
         self.comm.send(Message("Begin grouping peaks", "update"))
-        grouper = self.do_grouping()
-
-        database_manager = self.manager
-        session = database_manager.session()
-        sample_name = grouper.manager.session().query(SampleRun).get(self.sample_run_id).name
-
-        hypothesis_sample_match = self.prepare_hypothesis_sample_match(session, sample_name)
+        return super(CommunicativeLCMSPeakClusterSearch, self).do_grouping()
 
+    def do_matching(self):
         self.comm.send(Message("Begin matching masses", "update"))
-        self.do_matching()
+        return super(CommunicativeLCMSPeakClusterSearch, self).do_matching()
 
+    def do_classification(self):
         self.comm.send(Message("Begin peak group scoring", "update"))
-        classifier = self.do_classification()
-        hypothesis_sample_match.parameters['classifier'] = pickle.dumps(classifier.classifier)
-        session.add(hypothesis_sample_match)
-        session.commit()
+        return super(CommunicativeLCMSPeakClusterSearch, self).do_classification()
+
+    def run(self):
+        super(CommunicativeLCMSPeakClusterSearch, self).run()
 
         self.comm.send(Message("Peak Cluster Search Complete", "update"))
 
+        session = self.manager.session()
+        hypothesis_sample_match = session.query(MS1GlycopeptideHypothesisSampleMatch).get(
+            self.hypothesis_sample_match_id)
         self.comm.send(Message(hypothesis_sample_match.to_json(), "new-hypothesis-sample-match"))
+        session.close()
 
 
 def taskmain(*args, **kwargs):
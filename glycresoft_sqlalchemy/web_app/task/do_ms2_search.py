@@ -39,6 +39,12 @@ class CommunicativeGlycopeptideFragmentMatchingPipeline(pipeline.GlycopeptideFra
             Message("Begin Matching for decoy %d" % self.decoy_hypothesis_id, "update"))
         super(CommunicativeGlycopeptideFragmentMatchingPipeline, self).do_decoy_matching()
 
+    def do_joint_matching(self):
+        self.comm.send(
+            Message("Begin Matching for target %d and decoy %d" % (
+                self.target_hypothesis_id, self.decoy_hypothesis_id), "update"))
+        super(CommunicativeGlycopeptideFragmentMatchingPipeline, self).do_joint_matching()
+
     def do_target_decoy_fdr_estimation(self):
         self.comm.send(Message("Begin TDA", "update"))
         super(CommunicativeGlycopeptideFragmentMatchingPipeline, self).do_target_decoy_fdr_estimation()
@@ -1,4 +1,4 @@
-from .task_process import Task, Message
+from .task_process import Task, Message, INTERACTIVE
 import time
 
 
@@ -8,5 +8,7 @@ def echo(*args, **kwargs):
 
 
 class DummyTask(Task):
+    priority = INTERACTIVE
+
     def __init__(self, *args, **kwargs):
         Task.__init__(self, echo, args, **kwargs)
@@ -1,11 +1,22 @@
+import atexit
 import logging
 import traceback
 from os import path
 from uuid import uuid4
-from multiprocessing import Process, Pipe
+from importlib import import_module
+from multiprocessing import Process, Pipe, Queue as ProcessQueue
 from threading import Event, Thread, RLock
 from Queue import Queue, Empty as QueueEmptyException
 
+from glycresoft_sqlalchemy.data_model.pipeline_module import progress_listener
+
+from ..utils.message_bus import MessageBus
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
 
 logger = logging.getLogger("task_process")
 logger.setLevel("ERROR")
@@ -15,6 +26,13 @@ RUNNING = intern('running')
 ERROR = intern('error')
 FINISHED = intern('finished')
 
+# Priority classes. Interactive tasks are launched before batch tasks and have
+# their own limit on concurrent execution, so that short jobs requested from the
+# interface do not wait behind long searches.
+INTERACTIVE = intern('interactive')
+BATCH = intern('batch')
+PRIORITIES = (INTERACTIVE, BATCH)
+
 
 def noop():
     pass
@@ -24,9 +42,7 @@ def printop(*args, **kwargs):
     print(args, kwargs)
 
 
-def configure_log(log_file_path, callable, args):
-    import logging
-    logger = logging.getLogger()
+def task_log_handler(log_file_path):
     handler = logging.FileHandler(log_file_path)
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s:%(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
@@ -35,14 +51,44 @@ def configure_log(log_file_path, callable, args):
     logging.captureWarnings(True)
     warner = logging.getLogger('py.warnings')
     warner.setLevel("CRITICAL")
+    return handler
 
+
+def configure_log(log_file_path, callable, args):
+    logger = logging.getLogger()
     logger.handlers = []
-    logger.addHandler(handler)
+    logger.addHandler(task_log_handler(log_file_path))
     logger.setLevel("DEBUG")
     logger.propagate = False
     return callable(*args)
 
 
+def run_task_process(task_id, log_file_path, callable, args):
+    """The target of the process of a :class:`Task` run outside the worker pool.
+    The last of `args` is the pipe to the main process, which receives the task's progress.
+    """
+    with progress_listener(ProgressForwarder(task_id, args[-1])):
+        return configure_log(log_file_path, callable, args)
+
+
+def call_with_log(log_file_path, callable, args):
+    """Like :func:`configure_log`, but restores the process' log handlers afterwards
+    so that the next task run in the same process logs to its own file.
+    """
+    logger = logging.getLogger()
+    handlers = logger.handlers
+    level = logger.level
+    handler = task_log_handler(log_file_path)
+    logger.handlers = [handler]
+    logger.setLevel("DEBUG")
+    try:
+        return callable(*args)
+    finally:
+        handler.close()
+        logger.handlers = handlers
+        logger.setLevel(level)
+
+
 class CallInterval(object):
     """Call a function every `interval` seconds from
     a separate thread.
@@ -106,12 +152,19 @@ class Task(object):
         be displayed to the user. Defaults to :attr:`id`.
     process : multiprocessing.Process
         The actual Process object doing the work
+    priority : str
+        The priority class the task is scheduled in, :data:`INTERACTIVE` or :data:`BATCH`
     state : str
         One of several constants describing whether task is new, has started,
         has finished with an error, or has completed successfully
     task_fn : callable
         The function to call in the "task" process
+    worker : TaskWorker
+        The persistent worker process running this task, if it is not running in
+        a process of its own
     """
+    priority = BATCH
+
     def __init__(self, task_fn, args, callback=printop, **kwargs):
         self.id = str(uuid4())
         self.task_fn = task_fn
@@ -123,21 +176,24 @@ class Task(object):
         self.callback = callback
         self.log_file_path = kwargs.get("log_file_path", "%s.log" % self.id)
         self.name = kwargs.get('name', self.id)
+        self.priority = kwargs.get('priority', self.priority)
         self.message_buffer = []
+        self.worker = None
 
     def start(self):
-        self.process = Process(target=configure_log, args=(self.log_file_path, self.task_fn, self.args))
+        self.process = Process(target=run_task_process, args=(
+            self.id, self.log_file_path, self.task_fn, self.args))
         self.state = RUNNING
         self.process.start()
 
     def get_message(self):
         if len(self.message_buffer) > 0:
             message = self.message_buffer.pop(0)
-            message.source = self
+            message.source = self.id
             return message
         if self.pipe.poll():
             message = self.pipe.recv()
-            message.source = self
+            message.source = self.id
             return message
         return None
 
@@ -158,7 +214,14 @@ class Task(object):
                     self.state = ERROR
             return result
 
-        return False
+        # A task run by a TaskWorker has its state set by the TaskWorkerPool
+        return self.state == RUNNING
+
+    def submission(self):
+        """The task's function and arguments, without the pipe to the main process,
+        to be pickled to a :class:`TaskWorker`
+        """
+        return (self.id, self.task_fn, self.args[:-1], self.log_file_path)
 
     def __getstate__(self):
         return {
@@ -166,7 +229,8 @@ class Task(object):
             "state": self.state,
             "task_fn": self.task_fn,
             "args": self.args[:-1],
-            "callback": self.callback
+            "callback": self.callback,
+            "priority": self.priority
         }
 
     def __setstate__(self, state):
@@ -175,9 +239,12 @@ class Task(object):
         self.state = state['state']
         self.args = state['args']
         self.callback = state['callback']
+        self.priority = state.get('priority', BATCH)
         self.pipe, child_conn = Pipe(True)
         self.args.append(child_conn)
         self.process = None
+        self.worker = None
+        self.message_buffer = []
 
     def to_json(self):
         return dict(id=self.id, name=self.name, status=self.state)
@@ -217,8 +284,8 @@ class Message(object):
     ----------
     message : object
         Anything, but preveriably something JSON serializeable
-    source : object
-        Description
+    source : str
+        The id of the :class:`Task` which sent the message, if it came from a task
     type : str
         A constant similar to logging levels. Options in use include
         ("info", "error", "update")
@@ -236,31 +303,255 @@ class Message(object):
         return cls(traceback.format_exc(), "error")
 
 
+class WorkerPipe(object):
+    """
+    Stands in for the task end of a :class:`Task`'s pipe inside a :class:`TaskWorker`,
+    forwarding messages to the main process through the pool's shared queue.
+    """
+    def __init__(self, task_id, queue):
+        self.task_id = task_id
+        self.queue = queue
+
+    def send(self, message):
+        message.source = self.task_id
+        self.queue.put((MESSAGE, self.task_id, message))
+
+    def recv(self):
+        return ""
+
+    def poll(self, timeout=None):
+        return False
+
+
+class ProgressForwarder(object):
+    """
+    A :func:`~glycresoft_sqlalchemy.data_model.pipeline_module.progress_listener` which
+    sends the progress of the pipeline modules a task runs to the main process as
+    "progress" messages. The task's id is included so clients can tell concurrent
+    tasks' progress apart.
+    """
+    def __init__(self, task_id, pipe):
+        self.task_id = task_id
+        self.pipe = pipe
+
+    def __call__(self, progress):
+        progress = dict(progress, id=self.task_id)
+        self.pipe.send(Message(progress, "progress", source=self.task_id))
+
+
+# Events sent from TaskWorker processes to the TaskWorkerPool
+MESSAGE = intern('message')
+STARTED = intern('started')
+
+
+def worker_loop(inbox, outbox, preload, max_tasks):
+    """The main loop of a :class:`TaskWorker` process. Runs tasks from `inbox` one at a
+    time until it receives `None` or has run `max_tasks` tasks.
+    """
+    for module_name in preload:
+        try:
+            import_module(module_name)
+        except Exception, e:
+            logger.exception("Could not preload %s", module_name, exc_info=e)
+    completed = 0
+    while max_tasks is None or completed < max_tasks:
+        job = inbox.get()
+        if job is None:
+            break
+        task_id, task_fn, args, log_file_path = job
+        outbox.put((STARTED, task_id, None))
+        pipe = WorkerPipe(task_id, outbox)
+        try:
+            with progress_listener(ProgressForwarder(task_id, pipe)):
+                call_with_log(log_file_path, task_fn, list(args) + [pipe])
+        except Exception:
+            outbox.put((MESSAGE, task_id, Message.traceback()))
+            outbox.put((ERROR, task_id, None))
+        else:
+            outbox.put((FINISHED, task_id, None))
+        completed += 1
+
+
+class TaskWorker(object):
+    """
+    A persistent process which runs :class:`Task` functions sent to it, so that each
+    task does not pay for interpreter startup and imports.
+
+    Worker processes are not daemonic, so the tasks they run may start their own
+    :class:`multiprocessing.Pool`.
+
+    Attributes
+    ----------
+    process : multiprocessing.Process
+    inbox : multiprocessing.Queue
+        Carries task submissions to the process
+    task_id : str
+        The id of the task the worker is running, or `None` if it is idle
+    tasks_run : int
+    """
+    def __init__(self, outbox, preload=(), max_tasks=None):
+        self.inbox = ProcessQueue()
+        self.task_id = None
+        self.tasks_run = 0
+        self.max_tasks = max_tasks
+        self.process = Process(target=worker_loop, args=(self.inbox, outbox, preload, max_tasks))
+        self.process.start()
+
+    @property
+    def retiring(self):
+        return self.max_tasks is not None and self.tasks_run >= self.max_tasks
+
+    def submit(self, task):
+        self.task_id = task.id
+        self.tasks_run += 1
+        self.inbox.put(task.submission())
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self, timeout=5):
+        if self.is_alive():
+            self.inbox.put(None)
+            self.process.join(timeout)
+        if self.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def __repr__(self):
+        return "<TaskWorker {} {}>".format(self.process.pid, self.task_id)
+
+
+class TaskWorkerPool(object):
+    """
+    A fixed number of warm :class:`TaskWorker` processes. Workers which die, or retire
+    after running `max_tasks_per_worker` tasks to bound memory growth, are replaced.
+
+    Attributes
+    ----------
+    n_workers : int
+    workers : list of TaskWorker
+    outbox : multiprocessing.Queue
+        Carries task events from every worker to the main process
+    preload : list of str
+        Modules imported by each worker when it starts
+    """
+    def __init__(self, n_workers, preload=(), max_tasks_per_worker=None):
+        self.n_workers = n_workers
+        self.preload = list(preload)
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.outbox = ProcessQueue()
+        self.workers = []
+        self.lock = RLock()
+        self.closed = False
+        self.replenish()
+        atexit.register(self.shutdown)
+
+    def replenish(self):
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive() or worker.task_id is not None]
+            while len(self.workers) < self.n_workers and not self.closed:
+                self.workers.append(TaskWorker(self.outbox, self.preload, self.max_tasks_per_worker))
+
+    def idle_workers(self):
+        return [worker for worker in self.workers
+                if worker.task_id is None and not worker.retiring and worker.is_alive()]
+
+    def submit(self, task):
+        """Send `task` to an idle worker
+
+        Returns
+        -------
+        bool
+            Whether a worker was available to run `task`
+        """
+        with self.lock:
+            idle = self.idle_workers()
+            if not idle:
+                return False
+            worker = idle[0]
+            worker.submit(task)
+            task.worker = worker
+            task.state = RUNNING
+            return True
+
+    def poll(self, tasks):
+        """Apply the events sent by the workers to `tasks`, a task id -> :class:`Task`
+        mapping, and mark the task of any worker which died while running it as failed.
+        """
+        with self.lock:
+            # Check for dead workers before draining the queue. A worker flushes its
+            # events before it exits, so any task which is still running after the
+            # queue is drained really was lost with its worker
+            dead = [worker for worker in self.workers if not worker.is_alive()]
+            while True:
+                try:
+                    event, task_id, payload = self.outbox.get(False)
+                except QueueEmptyException:
+                    break
+                task = tasks.get(task_id)
+                if task is None:
+                    continue
+                if event == MESSAGE:
+                    task.add_message(payload)
+                elif event in (FINISHED, ERROR):
+                    task.state = event
+                    if task.worker is not None:
+                        task.worker.task_id = None
+            for worker in dead:
+                if worker.task_id is not None:
+                    task = tasks.get(worker.task_id)
+                    if task is not None and task.state == RUNNING:
+                        task.add_message(Message(
+                            "Worker process exited with code %r" % worker.process.exitcode, "error"))
+                        task.state = ERROR
+                    worker.task_id = None
+            self.replenish()
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+
+
 class TaskManager(object):
     """Track and schedule `Task` objects and associated processes.
 
+    Tasks are run by a pool of persistent :class:`TaskWorker` processes so that
+    each task does not pay to start a new interpreter and import the scientific
+    stack. Tasks whose function or arguments cannot be pickled to a worker are
+    run in a process of their own.
+
     Attributes
     ----------
     task_dir: str
         file system directory path for writing task-specific information
     tasks: dict
         A task id -> `Task` object mapping for all tasks, running or otherwise
-    task_queue: Queue.Queue
-        A `Queue.Queue` for holding `Task` objects currently waiting to be ran
+    task_queue: dict
+        A priority class -> `Queue.Queue` mapping for holding `Task` objects currently
+        waiting to be ran
     currently_running: dict
         A task id -> `Task` object mapping for all tasks currently running
     n_running: int
         The number of tasks currently running
     max_running: int
-        The maximum number of tasks allowed to run at once
+        The maximum number of :data:`BATCH` tasks allowed to run at once
+    max_interactive: int
+        The maximum number of :data:`INTERACTIVE` tasks allowed to run at once
+    workers: TaskWorkerPool
+        The warm worker processes, one for each task which may run at once
     timer: CallInterval
         A `CallInterval` object who schedules :meth:`TaskManager.tick`
-    messages: Queue
-        A `Queue` for holding task messages to be read by clients
+    messages: MessageBus
+        The channel task messages are published on, read by each client through
+        its own :class:`Subscription`
     """
     interval = 5
 
-    def __init__(self, task_dir=None, max_running=1):
+    def __init__(self, task_dir=None, max_running=1, max_interactive=2, max_tasks_per_worker=20,
+                 preload=("glycresoft_sqlalchemy.data_model",)):
         if task_dir is None:
             task_dir = "./"
         self.task_dir = task_dir
@@ -268,12 +559,14 @@ class TaskManager(object):
         # self.read_tasks()
         self.n_running = 0
         self.max_running = max_running
-        self.task_queue = Queue()
+        self.max_interactive = max_interactive
+        self.task_queue = {priority: Queue() for priority in PRIORITIES}
         self.currently_running = {}
         self.completed_tasks = set()
+        self.workers = TaskWorkerPool(max_running + max_interactive, preload, max_tasks_per_worker)
         self.timer = CallInterval(self.interval, self.tick)
         self.timer.start()
-        self.messages = Queue()
+        self.messages = MessageBus()
         self.running_lock = RLock()
         self.halting = False
 
@@ -289,7 +582,7 @@ class TaskManager(object):
             The task to be scheduled
         """
         self.tasks[task.id] = task
-        self.messages.put(Message({"id": task.id, "name": task.name}, "task-queued"))
+        self.messages.publish(Message({"id": task.id, "name": task.name}, "task-queued"))
 
     def get_task_log_path(self, task):
         return path.join(getattr(self, "task_dir", ""), task.id + '.log')
@@ -302,7 +595,8 @@ class TaskManager(object):
 
     def terminate(self):
         self.stoploop()
-        # Clean up here
+        self.workers.shutdown()
+        self.messages.close()
 
     def tick(self):
         """Check each managed task for status updates, schedule new tasks
@@ -322,28 +616,29 @@ class TaskManager(object):
         logger.debug(
             "Checking task manager state:\n %d tasks running\nRunning: %r\n%r",
             self.n_running, self.currently_running, self.tasks)
+        self.workers.poll(self.tasks)
         for task_id, task in list(self.tasks.items()):
             running = task.update()
             logger.debug("Checking %r", task)
             for message in task.messages():
-                self.messages.put(message)
+                self.messages.publish(message)
 
             if task.state == NEW:
-                self.task_queue.put(task)
+                self.task_queue[task.priority].put(task)
             elif task.state == FINISHED:
                 if self.running_lock.acquire(0):
                     self.currently_running.pop(task.id)
                     self.tasks.pop(task.id)
                     self.n_running -= 1
                     task.callback()
-                    self.messages.put(Message({"id": task.id, "name": task.name}, "task-complete"))
+                    self.messages.publish(Message({"id": task.id, "name": task.name}, "task-complete"))
                     self.running_lock.release()
                     self.completed_tasks.add(task.id)
             elif task.state == ERROR:
                 if task.id in self.currently_running:
                     if self.running_lock.acquire(0):
                         self.currently_running.pop(task.id)
-                        self.messages.put(Message({"id": task.id, "name": task.name}, "task-error"))
+                        self.messages.publish(Message({"id": task.id, "name": task.name}, "task-error"))
                         self.tasks.pop(task.id)
                         self.n_running -= 1
                         self.running_lock.release()
@@ -372,33 +667,68 @@ class TaskManager(object):
         #     elif not running:
         #         print task.id, "not running", task.state
 
+    def running_limit(self, priority):
+        if priority == INTERACTIVE:
+            return self.max_interactive
+        return self.max_running
+
+    def count_running(self, priority):
+        return sum(1 for task in self.currently_running.values() if task.priority == priority)
+
     def launch_new_tasks(self):
-        while((self.n_running < self.max_running) and (self.task_queue.qsize() > 0)):
-            try:
-                task = self.task_queue.get(False)
-                if task.state != NEW or task.id in self.completed_tasks:
-                    continue
-                self.run_task(task)
-            except QueueEmptyException:
-                break
+        for priority in PRIORITIES:
+            queue = self.task_queue[priority]
+            limit = self.running_limit(priority)
+            while (self.count_running(priority) < limit) and (queue.qsize() > 0):
+                try:
+                    task = queue.get(False)
+                    if task.state != NEW or task.id in self.completed_tasks:
+                        continue
+                    if not self.run_task(task):
+                        # The task stays NEW and is queued again by the next `check_state`
+                        break
+                except QueueEmptyException:
+                    break
 
     def run_task(self, task):
         """Start running a task if space is available
 
+        The task is sent to an idle :class:`TaskWorker` if it can be pickled,
+        otherwise it is started in a process of its own.
+
         Parameters
         ----------
         task : Task
+
+        Returns
+        -------
+        bool
+            Whether the task was started
         """
         if self.running_lock.acquire(0):
-            self.currently_running[task.id] = task
-            self.running_lock.release()
             task.log_file_path = self.get_task_log_path(task)
+            try:
+                pickle.dumps((task.task_fn, task.args[:-1]), pickle.HIGHEST_PROTOCOL)
+                picklable = True
+            except Exception, e:
+                logger.info("%r cannot be sent to a worker (%r), starting a new process", task, e)
+                picklable = False
+            if picklable:
+                if not self.workers.submit(task):
+                    # Every worker is busy or being replaced
+                    self.running_lock.release()
+                    return False
+            else:
+                task.start()
+            self.currently_running[task.id] = task
             self.n_running += 1
-            task.start()
+            self.running_lock.release()
             self.add_message(Message({"id": task.id, "name": task.name}, 'task-start'))
+            return True
+        return False
 
     def add_message(self, message):
-        self.messages.put(message)
+        self.messages.publish(message)
 
     def task_list(self):
         tasks = []
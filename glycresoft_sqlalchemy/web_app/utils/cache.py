@@ -36,8 +36,8 @@ class LRUDict(dict):
         order = sorted(self.counts.items(), key=operator.itemgetter(1))
         i = 0
         while size <= total_items:
-            self.popitem(order[i][0])
-            self.counts.popitem(order[i][0])
+            self.pop(order[i][0])
+            self.counts.pop(order[i][0])
             i += 1
             total_items -= 1
 
@@ -0,0 +1,145 @@
+from collections import deque
+from threading import Condition
+from time import sleep
+
+
+class MessageBus(object):
+    """
+    An in-memory publish/subscribe channel. Every published message is given an
+    increasing sequence number and kept in a bounded history, and each
+    :class:`Subscription` reads the history from its own cursor, so that every
+    subscriber sees every message instead of competing for them as consumers of a
+    :class:`Queue.Queue` do.
+
+    Subscribers block on a condition variable until a message is published rather
+    than polling. A subscriber which falls more than `history_size` messages behind
+    misses the oldest of them.
+
+    Attributes
+    ----------
+    history: deque
+        The most recent (sequence, message) pairs
+    sequence: int
+        The sequence number of the last message published
+    coalesce: set
+        Message types of which only the latest from each source is delivered in a batch,
+        such as high-frequency progress updates
+    closed: bool
+    """
+    def __init__(self, history_size=1000, coalesce=("progress",)):
+        self.history = deque(maxlen=history_size)
+        self.sequence = 0
+        self.coalesce = set(coalesce)
+        self.condition = Condition()
+        self.closed = False
+
+    def publish(self, message):
+        with self.condition:
+            self.sequence += 1
+            self.history.append((self.sequence, message))
+            self.condition.notify_all()
+        return self.sequence
+
+    # Allow the bus to stand in for the :class:`Queue.Queue` it replaces
+    put = publish
+
+    def since(self, cursor):
+        with self.condition:
+            return [(sequence, message) for sequence, message in self.history if sequence > cursor]
+
+    def wait(self, cursor, timeout=None):
+        """Block until a message after `cursor` is published, the bus is closed,
+        or `timeout` seconds pass.
+
+        Returns
+        -------
+        list of (int, object)
+        """
+        with self.condition:
+            if self.sequence <= cursor and not self.closed:
+                self.condition.wait(timeout)
+            return self.since(cursor)
+
+    def subscribe(self, cursor=None):
+        """Create a :class:`Subscription` receiving messages published after `cursor`,
+        by default only those published from now on.
+        """
+        if cursor is None or cursor > self.sequence:
+            # A cursor from before a restart of the bus would never be passed
+            cursor = self.sequence
+        return Subscription(self, cursor)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.history)
+
+
+def source_key(message):
+    source = getattr(message, "source", None)
+    return getattr(source, "id", source)
+
+
+class Subscription(object):
+    """
+    A cursor into a :class:`MessageBus`.
+
+    Attributes
+    ----------
+    bus: MessageBus
+    cursor: int
+        The sequence number of the last message delivered
+    """
+    def __init__(self, bus, cursor=0):
+        self.bus = bus
+        self.cursor = cursor
+
+    @property
+    def closed(self):
+        return self.bus.closed
+
+    def get(self, timeout=None, linger=0.):
+        """Wait for the messages published since the last call.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for a message before returning an empty list
+        linger: float
+            Seconds to keep collecting once the first message arrives, so that bursts
+            of progress updates are delivered together and coalesced
+
+        Returns
+        -------
+        list of (int, object)
+            Sequence number and message pairs
+        """
+        events = self.bus.wait(self.cursor, timeout)
+        if events and linger > 0:
+            sleep(linger)
+            events = self.bus.since(self.cursor)
+        if not events:
+            return events
+        self.cursor = events[-1][0]
+        return self.coalesce(events)
+
+    def coalesce(self, events):
+        coalesce = self.bus.coalesce
+        latest = {}
+        for i, (sequence, message) in enumerate(events):
+            kind = getattr(message, "type", None)
+            if kind in coalesce:
+                latest[kind, source_key(message)] = i
+        if not latest:
+            return events
+        keep = set(latest.values())
+        return [event for i, event in enumerate(events)
+                if i in keep or getattr(event[1], "type", None) not in coalesce]
+
+    def __iter__(self):
+        while not self.closed:
+            for event in self.get():
+                yield event
@@ -149,6 +149,110 @@ class QueryPagination(PaginationBase):
         return cls(query, page, per_page, total, items)
 
 
+class KeysetCursors(object):
+    """The keys of the last row of each page visited of one query, and its total
+    row count, kept between requests by :class:`KeysetPagination`.
+    """
+    def __init__(self, per_page=None):
+        self.reset(per_page)
+
+    def reset(self, per_page):
+        """Forget all pages, which were cut `self.per_page` rows long"""
+        self.per_page = per_page
+        self.last_keys = {}
+        self.total = None
+
+    def nearest(self, page):
+        """The closest page before `page` whose last key is known, and that key"""
+        known = [p for p in self.last_keys if p < page]
+        if not known:
+            return 0, None
+        best = max(known)
+        return best, self.last_keys[best]
+
+
+class KeysetPagination(PaginationBase):
+    """Pages through a query in descending (`score`, `id`) order by seeking past the
+    last row of the previous page instead of counting through all preceding rows
+    with OFFSET. Because `id` breaks ties, the ordering is total and the seek
+    predicate is a range of the (hypothesis_sample_match_id, score, id) index.
+    Rows without a score sort last, and are paged through by `id` alone once the
+    scored rows are exhausted.
+
+    The last key of every page served is remembered in a :class:`KeysetCursors`,
+    so moving to the next or previous page, or revisiting one, costs a single
+    range scan. Jumping to a page which has not been visited seeks from the nearest
+    visited page before it and skips only the pages in between.
+
+    The query is counted once per :class:`KeysetCursors`. A short page fixes the
+    total exactly, and a full page past the remembered total counts again, so
+    rows added under the same cursors are picked up when they are reached.
+    """
+
+    def __init__(self, source, page, per_page, total, items, score=None, id=None, cursors=None):
+        super(KeysetPagination, self).__init__(source, page, per_page, total, items)
+        self.score = score
+        self.id = id
+        self.cursors = cursors
+
+    def prev(self, error_out=False):
+        return self.paginate(
+            self.source, self.page - 1, self.per_page, self.score, self.id, self.cursors, error_out)
+
+    def next(self, error_out=False):
+        return self.paginate(
+            self.source, self.page + 1, self.per_page, self.score, self.id, self.cursors, error_out)
+
+    @classmethod
+    def paginate(cls, query, page, per_page, score, id, cursors=None, error_out=True, total=None):
+        """Returns `per_page` items from page `page` of `query` ordered by
+        descending `score` then `id`, which must be columns of the first entity
+        in `query`. Pass the same `cursors` for successive pages of the same
+        query to avoid re-scanning earlier pages and re-counting the query.
+        """
+        if page is None:
+            page = 1
+        if error_out and page < 1:
+            abort(404)
+        if cursors is None:
+            cursors = KeysetCursors(per_page)
+        elif cursors.per_page != per_page:
+            # Reset in place, so that callers holding `cursors` between requests keep them
+            cursors.reset(per_page)
+
+        start_page, key = cursors.nearest(page)
+        ordered = query.order_by(score.desc().nullslast(), id.desc())
+        if key is not None:
+            last_score, last_id = key
+            if last_score is not None:
+                ordered = ordered.filter(
+                    (score < last_score) | ((score == last_score) & (id < last_id)) | score.is_(None))
+            else:
+                ordered = ordered.filter(score.is_(None) & (id < last_id))
+        skip = (page - start_page - 1) * per_page
+        if skip:
+            ordered = ordered.offset(skip)
+        items = ordered.limit(per_page).all()
+
+        if not items and page != 1 and error_out:
+            abort(404)
+
+        if items:
+            last = items[-1]
+            cursors.last_keys[page] = (getattr(last, score.key), getattr(last, id.key))
+
+        if total is None:
+            if (items and len(items) < per_page) or (page == 1 and not items):
+                total = (page - 1) * per_page + len(items)
+            elif cursors.total is None or cursors.total < page * per_page:
+                total = query.order_by(None).count()
+            else:
+                total = cursors.total
+        cursors.total = total
+
+        return cls(query, page, per_page, total, items, score, id, cursors)
+
+
 Pagination = QueryPagination
 
 paginate = QueryPagination.paginate
@@ -136,7 +136,8 @@ def run_setup(include_cext=True):
                 'console_scripts': [
                     "glycresoft-build-database = glycresoft_sqlalchemy.app.build_database:main",
                     "glycresoft-database-search = glycresoft_sqlalchemy.app.run_search:main",
-                    "glycresoft-report = glycresoft_sqlalchemy.app.reporting:taskmain"
+                    "glycresoft-report = glycresoft_sqlalchemy.app.reporting:taskmain",
+                    "glycresoft-benchmark = glycresoft_sqlalchemy.app.benchmark:main"
                 ],
             },
       cmdclass=cmdclass,